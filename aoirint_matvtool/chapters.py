@@ -0,0 +1,519 @@
+"""
+find_imageの出力からのチャプターの書き込み（matvtool chapters）
+
+MatroskaファイルのChapters・Tracks（オーディオトラックの名前）・Tagsを、
+ファイル全体を書き直さずにその場で書き換える（matroska.py）
+その場で書き換えられないファイル（MP4など）は、FFmpegでストリームをコピーして書き直す
+"""
+
+import os
+import re
+import secrets
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image_batch import ffprobe_duration
+from .inputs import ffmpeg_get_input
+from .matroska import (
+    CHAPTERS_ID,
+    DURATION_ID,
+    INFO_ID,
+    TAGS_ID,
+    TIMESTAMP_SCALE_ID,
+    TRACKS_ID,
+    MatroskaEditError,
+    decode_float,
+    decode_uint,
+    encode_children,
+    encode_element,
+    encode_string_element,
+    encode_uint_element,
+    is_matroska_file,
+    read_children,
+    read_segment_child_data,
+    replace_segment_child,
+    without_crc32,
+)
+from .util import parse_ffmpeg_time_unit_syntax_to_microseconds
+
+EDITION_ENTRY_ID = 0x45B9
+EDITION_UID_ID = 0x45BC
+CHAPTER_ATOM_ID = 0xB6
+CHAPTER_UID_ID = 0x73C4
+CHAPTER_TIME_START_ID = 0x91
+CHAPTER_TIME_END_ID = 0x92
+CHAPTER_DISPLAY_ID = 0x80
+CHAP_STRING_ID = 0x85
+CHAP_LANGUAGE_ID = 0x437C
+TRACK_ENTRY_ID = 0xAE
+TRACK_UID_ID = 0x73C5
+TRACK_NAME_ID = 0x536E
+TAG_ID = 0x7373
+TARGETS_ID = 0x63C0
+TAG_TRACK_UID_ID = 0x63C5
+SIMPLE_TAG_ID = 0x67C8
+TAG_NAME_ID = 0x45A3
+TAG_STRING_ID = 0x4487
+
+FIND_IMAGE_OUTPUT_TIME_PATTERN = re.compile(
+    r"^Output \| Time (\S+),.*?(?: \| File (.+))?$"
+)
+FIND_IMAGE_OUTPUT_INTERVAL_PATTERN = re.compile(
+    r"^Output \| Interval (\S+) - (\S+),.*?(?: \| File (.+))?$"
+)
+
+
+class Chapter(BaseModel):
+    start_microseconds: int
+    end_microseconds: Optional[int]
+    """Noneのときは、次のチャプターの開始（最後のチャプターは動画の終わり）"""
+    title: str
+
+
+def parse_find_image_output_chapters(
+    lines: Iterable[str],
+    input_video_path: Optional[Path] = None,
+) -> List[Chapter]:
+    """
+    find_imageの出力（Output | Time、--intervalのOutput | Interval）の行を、チャプターにする
+
+    複数の動画の検索結果（| File）は、input_video_pathの行だけを使う
+    チャプターの名前は、時刻順の番号（Chapter 1, Chapter 2, ...）
+    """
+    times: List[Tuple[int, Optional[int]]] = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        file_path: Optional[str] = None
+        time: Tuple[int, Optional[int]]
+        match = FIND_IMAGE_OUTPUT_INTERVAL_PATTERN.match(line)
+        if match:
+            start_time, end_time, file_path = match.groups()
+            time = (
+                parse_ffmpeg_time_unit_syntax_to_microseconds(start_time),
+                parse_ffmpeg_time_unit_syntax_to_microseconds(end_time),
+            )
+        else:
+            match = FIND_IMAGE_OUTPUT_TIME_PATTERN.match(line)
+            if not match:
+                continue
+
+            start_time, file_path = match.groups()
+            time = (parse_ffmpeg_time_unit_syntax_to_microseconds(start_time), None)
+
+        if (
+            file_path is not None
+            and input_video_path is not None
+            and Path(file_path) != input_video_path
+        ):
+            continue
+
+        times.append(time)
+
+    return [
+        Chapter(
+            start_microseconds=start_microseconds,
+            end_microseconds=end_microseconds,
+            title=f"Chapter {number}",
+        )
+        for number, (start_microseconds, end_microseconds) in enumerate(
+            sorted(set(times)), start=1
+        )
+    ]
+
+
+def get_chapter_end_microseconds(
+    chapters: List[Chapter],
+    duration_microseconds: Optional[int],
+) -> List[Optional[int]]:
+    """
+    チャプターの終わり（指定がなければ次のチャプターの開始、最後は動画の終わり）
+    """
+    return [
+        (
+            chapter.end_microseconds
+            if chapter.end_microseconds is not None
+            else (
+                chapters[index + 1].start_microseconds
+                if index + 1 < len(chapters)
+                else duration_microseconds
+            )
+        )
+        for index, chapter in enumerate(chapters)
+    ]
+
+
+def generate_uid() -> int:
+    """0以外の64ビットのUID"""
+    return secrets.randbits(64) or 1
+
+
+def encode_matroska_chapters(
+    chapters: List[Chapter],
+    duration_microseconds: Optional[int],
+) -> bytes:
+    """
+    Chaptersの中身（1つのEditionEntry）
+    """
+    chapter_atoms = b""
+    for chapter, end_microseconds in zip(
+        chapters,
+        get_chapter_end_microseconds(
+            chapters=chapters, duration_microseconds=duration_microseconds
+        ),
+    ):
+        chapter_atom = encode_uint_element(
+            CHAPTER_UID_ID, generate_uid()
+        ) + encode_uint_element(
+            CHAPTER_TIME_START_ID, chapter.start_microseconds * 1000
+        )
+        if end_microseconds is not None:
+            chapter_atom += encode_uint_element(
+                CHAPTER_TIME_END_ID, end_microseconds * 1000
+            )
+
+        chapter_atom += encode_element(
+            CHAPTER_DISPLAY_ID,
+            encode_string_element(CHAP_STRING_ID, chapter.title)
+            + encode_string_element(CHAP_LANGUAGE_ID, "und"),
+        )
+        chapter_atoms += encode_element(CHAPTER_ATOM_ID, chapter_atom)
+
+    return encode_element(
+        EDITION_ENTRY_ID,
+        encode_uint_element(EDITION_UID_ID, generate_uid()) + chapter_atoms,
+    )
+
+
+def get_matroska_duration_microseconds(info_data: bytes) -> Optional[int]:
+    info = dict(read_children(info_data))
+    if DURATION_ID not in info:
+        return None
+
+    timestamp_scale = decode_uint(info.get(TIMESTAMP_SCALE_ID, b"")) or 1_000_000
+    return round(decode_float(info[DURATION_ID]) * timestamp_scale / 1000)
+
+
+def rename_matroska_tracks(
+    tracks_data: bytes,
+    track_titles: Dict[int, str],
+) -> Tuple[bytes, Dict[int, str]]:
+    """
+    Tracksの中身のトラックの名前（Name）を書き換える
+
+    track_titlesのキーはトラックの順番（FFmpegのストリームの番号）
+    書き換えた中身と、トラックのUIDごとの名前を返す
+    """
+    track_uid_titles: Dict[int, str] = {}
+
+    track_entries = without_crc32(read_children(tracks_data))
+    new_track_entries = []
+    track_index = 0
+    for element_id, data in track_entries:
+        if element_id != TRACK_ENTRY_ID:
+            new_track_entries.append((element_id, data))
+            continue
+
+        title = track_titles.get(track_index)
+        track_index += 1
+        if title is None:
+            new_track_entries.append((element_id, data))
+            continue
+
+        children = without_crc32(read_children(data))
+        track_uid = decode_uint(dict(children).get(TRACK_UID_ID, b""))
+        track_uid_titles[track_uid] = title
+
+        new_children = [
+            (child_id, child_data)
+            for child_id, child_data in children
+            if child_id != TRACK_NAME_ID
+        ]
+        new_children.append((TRACK_NAME_ID, title.encode("utf-8")))
+        new_track_entries.append((element_id, encode_children(new_children)))
+
+    missing_indexes = [index for index in track_titles if track_index <= index]
+    if len(missing_indexes) != 0:
+        raise ValueError(f"Track not found: {missing_indexes}")
+
+    return encode_children(new_track_entries), track_uid_titles
+
+
+def retitle_matroska_tags(
+    tags_data: bytes,
+    track_uid_titles: Dict[int, str],
+) -> Optional[bytes]:
+    """
+    Tagsの中身の、トラックを対象とするTITLEを書き換える（書き換えなければNone）
+
+    FFmpegはTagsのTITLEをトラックの名前（Name）より優先して表示するため、古い名前を残さない
+    """
+    changed = False
+    new_tags = []
+    for tag_id, tag_data in without_crc32(read_children(tags_data)):
+        if tag_id != TAG_ID:
+            new_tags.append((tag_id, tag_data))
+            continue
+
+        tag_children = without_crc32(read_children(tag_data))
+        targets = without_crc32(read_children(dict(tag_children).get(TARGETS_ID, b"")))
+        track_uids = [
+            decode_uint(data)
+            for element_id, data in targets
+            if element_id == TAG_TRACK_UID_ID
+        ]
+        title = next(
+            (track_uid_titles[uid] for uid in track_uids if uid in track_uid_titles),
+            None,
+        )
+        if title is None:
+            new_tags.append((tag_id, tag_data))
+            continue
+
+        new_tag_children = []
+        for element_id, data in tag_children:
+            if element_id == SIMPLE_TAG_ID:
+                simple_tag = without_crc32(read_children(data))
+                if dict(simple_tag).get(TAG_NAME_ID, b"").upper() == b"TITLE":
+                    data = encode_children(
+                        [
+                            (
+                                child_id,
+                                (
+                                    title.encode("utf-8")
+                                    if child_id == TAG_STRING_ID
+                                    else child_data
+                                ),
+                            )
+                            for child_id, child_data in simple_tag
+                        ]
+                    )
+                    changed = True
+            new_tag_children.append((element_id, data))
+
+        new_tags.append((tag_id, encode_children(new_tag_children)))
+
+    if not changed:
+        return None
+
+    return encode_children(new_tags)
+
+
+def write_matroska_chapters_in_place(
+    input_video_path: Path,
+    chapters: List[Chapter],
+    audio_titles: Dict[int, str],
+) -> None:
+    """
+    MatroskaファイルのChapters・トラックの名前を、その場で書き換える
+
+    audio_titlesのキーは、matvtool audioのトラックの番号（FFmpegのストリームの番号）
+    チャプターがなければ、Chaptersを削除する
+    """
+    with input_video_path.open("r+b") as file:
+        info_data = read_segment_child_data(file, INFO_ID)
+        duration_microseconds = (
+            get_matroska_duration_microseconds(info_data)
+            if info_data is not None
+            else None
+        )
+
+        # 書き換える前に、すべての要素を組み立てる（途中で失敗しても書き換えない）
+        new_tracks_data: Optional[bytes] = None
+        new_tags_data: Optional[bytes] = None
+        if len(audio_titles) != 0:
+            tracks_data = read_segment_child_data(file, TRACKS_ID)
+            if tracks_data is None:
+                raise MatroskaEditError("Tracks not found")
+
+            new_tracks_data, track_uid_titles = rename_matroska_tracks(
+                tracks_data=tracks_data, track_titles=audio_titles
+            )
+
+            tags_data = read_segment_child_data(file, TAGS_ID)
+            if tags_data is not None:
+                new_tags_data = retitle_matroska_tags(
+                    tags_data=tags_data, track_uid_titles=track_uid_titles
+                )
+
+        replace_segment_child(
+            file,
+            CHAPTERS_ID,
+            (
+                encode_matroska_chapters(
+                    chapters=chapters, duration_microseconds=duration_microseconds
+                )
+                if len(chapters) != 0
+                else None
+            ),
+        )
+
+        if new_tracks_data is not None:
+            replace_segment_child(file, TRACKS_ID, new_tracks_data)
+
+        if new_tags_data is not None:
+            replace_segment_child(file, TAGS_ID, new_tags_data)
+
+
+def escape_ffmetadata_value(value: str) -> str:
+    return re.sub(r"([=;#\\\n])", r"\\\1", value)
+
+
+def format_ffmetadata_chapters(
+    chapters: List[Chapter],
+    duration_microseconds: int,
+) -> str:
+    """
+    FFmpegのメタデータファイル（ffmetadata）のチャプター
+    """
+    lines = [";FFMETADATA1"]
+    for chapter, end_microseconds in zip(
+        chapters,
+        get_chapter_end_microseconds(
+            chapters=chapters, duration_microseconds=duration_microseconds
+        ),
+    ):
+        assert end_microseconds is not None
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000000",
+            f"START={chapter.start_microseconds}",
+            f"END={max(chapter.start_microseconds, end_microseconds)}",
+            f"title={escape_ffmetadata_value(chapter.title)}",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def ffmpeg_remux_chapters(
+    input_video_path: Path,
+    chapters: List[Chapter],
+    audio_titles: Dict[int, str],
+) -> None:
+    """
+    ストリームをコピーして、チャプター・トラックの名前を書き換えたファイルで置き換える
+    """
+    tmp_metadata_path = input_video_path.with_name(
+        f".{input_video_path.name}.{os.getpid()}.ffmetadata"
+    )
+    tmp_output_path = input_video_path.with_name(
+        f".{input_video_path.name}.{os.getpid()}.tmp{input_video_path.suffix}"
+    )
+
+    title_opts: List[str] = []
+    for track_index, title in sorted(audio_titles.items()):
+        title_opts += [
+            f"-metadata:s:{track_index}",
+            f"title={title}",
+        ]
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostats",
+        "-y",
+        "-i",
+        str(input_video_path),
+        "-f",
+        "ffmetadata",
+        "-i",
+        str(tmp_metadata_path),
+        "-map",
+        "0",
+        "-map_metadata",
+        "0",
+        "-map_chapters",
+        "1",
+        *title_opts,
+        "-c",
+        "copy",
+        str(tmp_output_path),
+    ]
+
+    # ffmetadataのチャプターには終わりが必要なため、最後のチャプターは動画の終わりまでにする
+    duration = ffprobe_duration(input_path=input_video_path)
+    duration_microseconds = round(duration * 1_000_000) if duration is not None else 0
+
+    try:
+        tmp_metadata_path.write_text(
+            format_ffmetadata_chapters(
+                chapters=chapters, duration_microseconds=duration_microseconds
+            ),
+            encoding="utf-8",
+        )
+
+        metrics.count_subprocess_spawn(command)
+        with profiling.profile_subprocess(command) as profile_args:
+            proc = subprocess.run(
+                command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            profile_args["pipe_bytes"] = len(proc.stderr)
+
+        if proc.returncode != 0:
+            config.logger.error(proc.stderr.decode("utf-8", errors="replace"))
+            raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+        os.replace(tmp_output_path, input_video_path)
+    finally:
+        tmp_metadata_path.unlink(missing_ok=True)
+        tmp_output_path.unlink(missing_ok=True)
+
+
+def get_audio_track_indexes(input_video_path: Path) -> List[int]:
+    """
+    オーディオトラックの番号（matvtool audioと同じ、FFmpegのストリームの番号）
+    """
+    inp = ffmpeg_get_input(input_path=input_video_path)
+    assert len(inp.streams) != 0
+    stream = inp.streams[0]
+
+    return [track.index for track in stream.tracks if track.type == "Audio"]
+
+
+def write_chapters(
+    input_video_path: Path,
+    chapters: List[Chapter],
+    audio_titles: Dict[int, str],
+    remux: bool = False,
+) -> bool:
+    """
+    チャプター・オーディオトラックの名前を書き込む
+
+    Matroskaファイルはその場で書き換え、できなければ（またはremuxのとき）書き直す
+    その場で書き換えたときはTrue
+
+    audio_titlesにオーディオトラックでない番号があるときはValueError
+    """
+    if len(audio_titles) != 0:
+        audio_track_indexes = get_audio_track_indexes(input_video_path=input_video_path)
+        invalid_indexes = [
+            index for index in audio_titles if index not in audio_track_indexes
+        ]
+        if len(invalid_indexes) != 0:
+            raise ValueError(
+                f"Audio track not found: {invalid_indexes} (audio tracks {audio_track_indexes})"  # noqa: B950
+            )
+
+    if not remux and is_matroska_file(input_video_path):
+        try:
+            write_matroska_chapters_in_place(
+                input_video_path=input_video_path,
+                chapters=chapters,
+                audio_titles=audio_titles,
+            )
+            return True
+        except MatroskaEditError as error:
+            config.logger.warning(f"Failed to edit in place, remuxing: {error}")
+
+    ffmpeg_remux_chapters(
+        input_video_path=input_video_path,
+        chapters=chapters,
+        audio_titles=audio_titles,
+    )
+    return False
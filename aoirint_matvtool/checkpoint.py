@@ -0,0 +1,321 @@
+"""
+find_imageのチェックポイント（--checkpoint_path / --resume）
+
+長時間の走査を中断しても、最後に記録したキーフレームの位置から再開できるように、
+走査の条件・再開位置・それまでの検出結果をJSONファイルに記録する
+
+時刻は整数マイクロ秒で扱う
+- FFmpegの時刻: FFmpegの-ssなどで指定する時刻（FFprobeの時刻 - 開始時刻）
+- 内部時刻: 走査の開始位置（-ss）からの時刻（blackframeフィルタのt）
+"""
+
+import math
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from .key_frames import (
+    ffmpeg_count_frames_between,
+    ffmpeg_first_frame_time_after,
+    ffmpeg_key_frame_time_before,
+)
+
+
+class FindImageCheckpointQuery(BaseModel):
+    """
+    チェックポイントを記録した走査の条件（再開時に一致を確認する）
+    """
+
+    ss: Optional[str]
+    to: Optional[str]
+    input_video_path: str
+    input_video_crop: Optional[str]
+    reference_image_path: str
+    reference_image_crop: Optional[str]
+    fps: Optional[int]
+    blackframe_amount: int
+    blackframe_threshold: int
+    output_interval: float
+    proxy_video_path: Optional[str] = None
+    fast_decode: bool = False
+    scene_threshold: Optional[float] = None
+
+
+class FindImageDetection(BaseModel):
+    input_microseconds: int
+    input_frame: int
+    internal_microseconds: int
+    internal_frame: int
+
+
+class FindImageCheckpoint(BaseModel):
+    query: FindImageCheckpointQuery
+    start_microseconds: int
+    start_frame: float
+    resume_ss_microseconds: int
+    """再開位置のキーフレームのFFmpegの時刻（走査する動画の時刻）"""
+    resume_internal_microseconds: int
+    """再開位置のキーフレームの内部時刻"""
+    resume_internal_frame: int
+    """再開位置より前の内部フレーム数"""
+    prev_input_microseconds: int
+    detections: List[FindImageDetection]
+
+
+def load_find_image_checkpoint(path: Path) -> FindImageCheckpoint:
+    return FindImageCheckpoint.model_validate_json(path.read_text(encoding="utf-8"))
+
+
+def save_find_image_checkpoint(path: Path, checkpoint: FindImageCheckpoint) -> None:
+    """
+    書き込み途中で中断しても壊れないよう、置き換えで書き出す
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(checkpoint.model_dump_json(indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def ffmpeg_first_frame_internal_microseconds(
+    input_video_path: Path,
+    start_time: float,
+    seek_origin_microseconds: int,
+) -> Optional[int]:
+    """
+    走査の最初のフレームの内部時刻
+    """
+    seconds = (
+        seek_origin_microseconds / 1_000_000 + start_time
+        if seek_origin_microseconds != 0
+        else None
+    )
+    frame_time = ffmpeg_first_frame_time_after(
+        input_path=input_video_path,
+        seconds=seconds,
+    )
+    if frame_time is None:
+        return None
+
+    return round((frame_time - start_time) * 1_000_000) - seek_origin_microseconds
+
+
+def ffmpeg_resume_internal_microseconds(
+    input_video_path: Path,
+    start_time: float,
+    seek_origin_microseconds: int,
+    progress_internal_microseconds: int,
+) -> Optional[int]:
+    """
+    走査済みの内部時刻以前で最後のキーフレームの内部時刻（走査の開始位置以前ならNone）
+    """
+    key_frame_time = ffmpeg_key_frame_time_before(
+        input_path=input_video_path,
+        seconds=(
+            (seek_origin_microseconds + progress_internal_microseconds) / 1_000_000
+            + start_time
+        ),
+    )
+    if key_frame_time is None:
+        return None
+
+    resume_internal_microseconds = (
+        round((key_frame_time - start_time) * 1_000_000) - seek_origin_microseconds
+    )
+    if resume_internal_microseconds <= 0:
+        return None
+
+    return resume_internal_microseconds
+
+
+def __round_half_up(value: float) -> int:
+    return math.floor(value + 0.5)
+
+
+def get_fps_filter_frame_count_before(
+    resume_internal_microseconds: int,
+    first_frame_internal_microseconds: int,
+    fps: int,
+) -> int:
+    """
+    fpsフィルタが再開位置より前に出力したフレーム数（1/fps秒単位に丸めた区切りの数）
+    """
+    return __round_half_up(
+        resume_internal_microseconds * fps / 1_000_000
+    ) - __round_half_up(first_frame_internal_microseconds * fps / 1_000_000)
+
+
+def ffmpeg_internal_frame_count_before(
+    input_video_path: Path,
+    start_time: float,
+    seek_origin_microseconds: int,
+    resume_internal_microseconds: int,
+    fps: Optional[int],
+    timestamp_offset_microseconds: int = 0,
+) -> Optional[int]:
+    """
+    再開位置より前に走査した内部フレーム数
+
+    fpsフィルタを使わない場合は、入力のフレームを数える（可変フレームレートでも正確）
+    fpsフィルタの区切りは、timestamp_offset_microsecondsだけずらした時刻で数える
+    """
+    if fps is None:
+        return ffmpeg_count_frames_between(
+            input_path=input_video_path,
+            start_seconds=seek_origin_microseconds / 1_000_000 + start_time,
+            end_seconds=(
+                (seek_origin_microseconds + resume_internal_microseconds) / 1_000_000
+                + start_time
+            ),
+        )
+
+    first_frame_internal_microseconds = ffmpeg_first_frame_internal_microseconds(
+        input_video_path=input_video_path,
+        start_time=start_time,
+        seek_origin_microseconds=seek_origin_microseconds,
+    )
+    if first_frame_internal_microseconds is None:
+        return None
+
+    return get_fps_filter_frame_count_before(
+        resume_internal_microseconds=(
+            resume_internal_microseconds + timestamp_offset_microseconds
+        ),
+        first_frame_internal_microseconds=(
+            first_frame_internal_microseconds + timestamp_offset_microseconds
+        ),
+        fps=fps,
+    )
+
+
+class FindImageCheckpointWriter:
+    """
+    走査中の進捗から再開位置を求めて、チェックポイントを書き出す
+
+    input_video_path・seek_origin_microsecondsは走査する動画（プロキシ動画など）のもの
+    走査する動画の内部時刻 + timestamp_offset_microseconds = 内部時刻
+    """
+
+    def __init__(
+        self,
+        checkpoint_path: Path,
+        query: FindImageCheckpointQuery,
+        input_video_path: Path,
+        start_time: float,
+        seek_origin_microseconds: int,
+        timestamp_offset_microseconds: int,
+        start_microseconds: int,
+        start_frame: float,
+        output_interval_microseconds: int,
+        resume_internal_microseconds: int,
+        resume_internal_frame: int,
+    ) -> None:
+        self.checkpoint_path = checkpoint_path
+        self.query = query
+        self.input_video_path = input_video_path
+        self.start_time = start_time
+        self.seek_origin_microseconds = seek_origin_microseconds
+        self.timestamp_offset_microseconds = timestamp_offset_microseconds
+        self.start_microseconds = start_microseconds
+        self.start_frame = start_frame
+        self.output_interval_microseconds = output_interval_microseconds
+        self.resume_internal_microseconds = resume_internal_microseconds
+        self.resume_internal_frame = resume_internal_frame
+
+    def __scan_internal_microseconds_to_seconds(
+        self, internal_microseconds: int
+    ) -> float:
+        """
+        走査する動画の内部時刻 -> FFprobeの時刻
+        """
+        return (
+            self.seek_origin_microseconds + internal_microseconds
+        ) / 1_000_000 + self.start_time
+
+    def save(
+        self,
+        progress_internal_microseconds: int,
+        detections: List[FindImageDetection],
+    ) -> bool:
+        """
+        前回より先に再開位置のキーフレームが見つかったときだけ書き出す
+        """
+        scan_resume_internal_microseconds = ffmpeg_resume_internal_microseconds(
+            input_video_path=self.input_video_path,
+            start_time=self.start_time,
+            seek_origin_microseconds=self.seek_origin_microseconds,
+            progress_internal_microseconds=(
+                progress_internal_microseconds - self.timestamp_offset_microseconds
+            ),
+        )
+        if scan_resume_internal_microseconds is None:
+            return False
+
+        resume_internal_microseconds = (
+            scan_resume_internal_microseconds + self.timestamp_offset_microseconds
+        )
+        if resume_internal_microseconds <= self.resume_internal_microseconds:
+            return False
+
+        if self.query.fps is None:
+            # 前回の再開位置からのフレーム数を足す（走査の開始位置から数え直さない）
+            prev_scan_resume_internal_microseconds = max(
+                0,
+                self.resume_internal_microseconds - self.timestamp_offset_microseconds,
+            )
+            resume_internal_frame: Optional[int] = (
+                self.resume_internal_frame
+                + ffmpeg_count_frames_between(
+                    input_path=self.input_video_path,
+                    start_seconds=self.__scan_internal_microseconds_to_seconds(
+                        prev_scan_resume_internal_microseconds
+                    ),
+                    end_seconds=self.__scan_internal_microseconds_to_seconds(
+                        scan_resume_internal_microseconds
+                    ),
+                )
+            )
+        else:
+            resume_internal_frame = ffmpeg_internal_frame_count_before(
+                input_video_path=self.input_video_path,
+                start_time=self.start_time,
+                seek_origin_microseconds=self.seek_origin_microseconds,
+                resume_internal_microseconds=scan_resume_internal_microseconds,
+                fps=self.query.fps,
+                timestamp_offset_microseconds=self.timestamp_offset_microseconds,
+            )
+        if resume_internal_frame is None:
+            return False
+
+        # 再開位置以降の検出は、再開後にもう一度検出される
+        kept_detections = [
+            detection
+            for detection in detections
+            if detection.internal_microseconds < resume_internal_microseconds
+        ]
+        prev_input_microseconds = (
+            kept_detections[-1].input_microseconds
+            if len(kept_detections) != 0
+            else -self.output_interval_microseconds
+        )
+
+        save_find_image_checkpoint(
+            path=self.checkpoint_path,
+            checkpoint=FindImageCheckpoint(
+                query=self.query,
+                start_microseconds=self.start_microseconds,
+                start_frame=self.start_frame,
+                resume_ss_microseconds=(
+                    self.seek_origin_microseconds + scan_resume_internal_microseconds
+                ),
+                resume_internal_microseconds=resume_internal_microseconds,
+                resume_internal_frame=resume_internal_frame,
+                prev_input_microseconds=prev_input_microseconds,
+                detections=kept_detections,
+            ),
+        )
+        self.resume_internal_microseconds = resume_internal_microseconds
+        self.resume_internal_frame = resume_internal_frame
+        return True
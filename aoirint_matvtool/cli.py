@@ -1,32 +1,19 @@
 import logging
 import sys
 from argparse import ArgumentParser, Namespace
-from datetime import timedelta
 from pathlib import Path
-
-from tqdm import tqdm
+from typing import Callable, List, Optional
 
 from . import __VERSION__ as PACKAGE_VERSION
 from . import config
-from .crop_scale import FfmpegCropScaleResult, ffmpeg_crop_scale
-from .find_image import (
-    FfmpegBlackframeOutputLine,
-    FfmpegProgressLine,
-    ffmpeg_find_image_generator,
-)
-from .fps import ffmpeg_fps
-from .inputs import ffmpeg_get_input
-from .key_frames import FfmpegKeyFrameOutputLine, ffmpeg_key_frames
-from .select_audio import FfmpegSelectAudioResult, ffmpeg_select_audio
-from .slice import FfmpegSliceResult, ffmpeg_slice
-from .util import (
-    format_timedelta_as_time_unit_syntax_string,
-    get_real_start_timedelta_by_ss,
-    parse_ffmpeg_time_unit_syntax,
-)
+
+# サブコマンドの処理やtqdm・pydanticなどの重い依存は、起動時間短縮のため
+# 各command_*関数の中で遅延importする（--versionやfpsの起動を軽くする）
 
 
 def command_input(args: Namespace) -> None:
+    from .inputs import ffmpeg_get_input
+
     input_path = Path(args.input_path)
     print(
         ffmpeg_get_input(
@@ -36,6 +23,8 @@ def command_input(args: Namespace) -> None:
 
 
 def command_fps(args: Namespace) -> None:
+    from .fps import ffmpeg_fps
+
     input_path = Path(args.input_path)
 
     print(
@@ -46,6 +35,8 @@ def command_fps(args: Namespace) -> None:
 
 
 def command_key_frames(args: Namespace) -> None:
+    from .key_frames import FfmpegKeyFrameOutputLine, ffmpeg_key_frames
+
     input_path = Path(args.input_path)
 
     for output in ffmpeg_key_frames(
@@ -55,12 +46,53 @@ def command_key_frames(args: Namespace) -> None:
             print(f"{output.time:.06f}")
 
 
+def verify_output(
+    input_path: str,
+    output_path: str,
+    ss: Optional[str],
+    to: Optional[str],
+    audio_indexes: Optional[List[int]],
+) -> None:
+    """
+    出力をパケットの一覧だけで入力と比べ（--verify・verify）、不一致があれば例外を送出する
+    """
+    from .verify import ffprobe_verify_output
+
+    result = ffprobe_verify_output(
+        input_path=input_path,
+        output_path=output_path,
+        ss=ss,
+        to=to,
+        audio_indexes=audio_indexes,
+    )
+    for stream in result.streams:
+        print(f"Verify | {stream.describe()}")
+
+    if not result.success:
+        raise Exception(f"Verification failed: {'; '.join(result.mismatches)}")
+
+
 def command_slice(args: Namespace) -> None:
+    from tqdm import tqdm
+
+    from . import metrics
+    from .find_image import FfmpegProgressLine
+    from .seek_index import check_seek_index
+    from .slice import FfmpegSliceResult, ffmpeg_slice
+    from .stream_io import is_stdio_path
+
     ss = args.ss
     to = args.to
-    input_path = Path(args.input_path)
-    output_path = Path(args.output_path)
+    # `-`（標準入力）やURLはPathにしない
+    input_path = args.input_path
+    output_path = args.output_path
+    output_format = args.output_format
+    output_profile = args.output_profile
     progress_type = args.progress_type
+    verify = args.verify
+
+    if verify and (is_stdio_path(input_path) or is_stdio_path(output_path)):
+        raise ValueError("--verify requires file or URL input and output")
 
     # tqdm
     tqdm_pbar = None
@@ -73,8 +105,12 @@ def command_slice(args: Namespace) -> None:
             to=to,
             input_path=input_path,
             output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
         ):
             if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.set_postfix(
                         {
@@ -91,23 +127,109 @@ def command_slice(args: Namespace) -> None:
                     )
 
             if isinstance(output, FfmpegSliceResult):
+                metrics.observe_result(output.success)
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.clear()
 
-                print(f"Output | {output}")
+                # 標準出力に書き出すときは、結果を標準エラー出力に出す
+                print(
+                    f"Output | {output}",
+                    file=sys.stderr if is_stdio_path(output_path) else sys.stdout,
+                )
+
+                # インデックス（moov・Cues）が先頭にあることを確かめる
+                if output.success and output_profile == "seek":
+                    seek_index_check = check_seek_index(
+                        output_path=Path(output_path), output_format=output_format
+                    )
+                    print(f"Index | {seek_index_check.describe()}")
+                    if not seek_index_check.ok:
+                        raise Exception(
+                            f"Seek index check failed: {seek_index_check.describe()}"
+                        )
+
+                # デコードせず、パケットの一覧だけで入力と比べる
+                if output.success and verify:
+                    verify_output(
+                        input_path=input_path,
+                        output_path=output_path,
+                        ss=ss,
+                        to=to,
+                        audio_indexes=None,
+                    )
     finally:
         if tqdm_pbar is not None:
             tqdm_pbar.close()
 
 
 def command_crop_scale(args: Namespace) -> None:
-    input_path = Path(args.input_path)
+    from tqdm import tqdm
+
+    from . import metrics
+    from .crop_scale import FfmpegCropScaleResult, ffmpeg_crop_scale
+    from .find_image import FfmpegProgressLine
+    from .seek_index import check_seek_index
+    from .stream_io import is_stdio_path
+
+    # `-`（標準入力）やURLはPathにしない
+    input_path = args.input_path
     crop = args.crop
     scale = args.scale
     video_codec = args.video_codec
-    output_path = Path(args.output_path)
+    video_preset = args.video_preset
+    target_speed = args.target_speed
+    gop = args.gop
+    output_path = args.output_path
+    output_format = args.output_format
+    output_profile = args.output_profile
     progress_type = args.progress_type
 
+    # 目標の速度を満たすエンコーダ・プリセットを、入力の一部の計測結果から選ぶ
+    if video_codec == "auto":
+        from .crop_scale import get_crop_scale_video_filters
+        from .encoders import (
+            calibrate_encoders,
+            get_calibration_input_opts,
+            get_default_encoders_cache_path,
+            load_encoder_capabilities,
+            parse_target_speed,
+            select_encoder,
+        )
+
+        if is_stdio_path(input_path):
+            raise Exception("-vcodec auto cannot be used with standard input")
+
+        encoders_cache_path = (
+            Path(args.encoders_cache_path)
+            if args.encoders_cache_path is not None
+            else get_default_encoders_cache_path()
+        )
+
+        input_description, input_opts, input_fps = get_calibration_input_opts(
+            input_path=input_path,
+            calibration_seconds=args.calibration_seconds,
+        )
+        calibrations = calibrate_encoders(
+            capabilities=load_encoder_capabilities(cache_path=encoders_cache_path),
+            cache_path=encoders_cache_path,
+            input_description=input_description,
+            input_opts=input_opts,
+            video_filters=get_crop_scale_video_filters(crop=crop, scale=scale),
+            calibration_seconds=args.calibration_seconds,
+        )
+        encoder_config = select_encoder(
+            calibrations=calibrations,
+            target_fps=input_fps * parse_target_speed(target_speed),
+        )
+        video_codec = encoder_config.encoder
+        video_preset = encoder_config.preset
+
+        print(
+            f"Encoder | {encoder_config.describe()}",
+            file=sys.stderr,
+        )
+
     # tqdm
     tqdm_pbar = None
     if progress_type == "tqdm":
@@ -120,8 +242,14 @@ def command_crop_scale(args: Namespace) -> None:
             scale=scale,
             video_codec=video_codec,
             output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
+            video_preset=video_preset,
+            gop=gop,
         ):
             if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.set_postfix(
                         {
@@ -133,138 +261,1474 @@ def command_crop_scale(args: Namespace) -> None:
 
                 if progress_type == "plain":
                     print(
-                        f"Progress | Time {output.time}, frame {output.frame}",
+                        f"Progress | Time {output.time}, frame {output.frame}",
+                        file=sys.stderr,
+                    )
+
+            if isinstance(output, FfmpegCropScaleResult):
+                metrics.observe_result(output.success)
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.clear()
+
+                # 標準出力に書き出すときは、結果を標準エラー出力に出す
+                print(
+                    f"Output | {output}",
+                    file=sys.stderr if is_stdio_path(output_path) else sys.stdout,
+                )
+
+                # インデックス（moov・Cues）が先頭にあることを確かめる
+                if output.success and output_profile == "seek":
+                    seek_index_check = check_seek_index(
+                        output_path=Path(output_path), output_format=output_format
+                    )
+                    print(f"Index | {seek_index_check.describe()}")
+                    if not seek_index_check.ok:
+                        raise Exception(
+                            f"Seek index check failed: {seek_index_check.describe()}"
+                        )
+    finally:
+        if tqdm_pbar is not None:
+            tqdm_pbar.close()
+
+
+def command_encoders(args: Namespace) -> None:
+    from .crop_scale import get_crop_scale_video_filters
+    from .encoders import (
+        ENCODER_CANDIDATES,
+        calibrate_encoders,
+        get_calibration_input_opts,
+        get_default_encoders_cache_path,
+        load_encoder_capabilities,
+    )
+
+    input_path = args.input_path
+    crop = args.crop
+    scale = args.scale
+    calibrate = args.calibrate
+    calibration_seconds = args.calibration_seconds
+    refresh = args.refresh
+    cache_path = (
+        Path(args.cache_path)
+        if args.cache_path is not None
+        else get_default_encoders_cache_path()
+    )
+
+    capabilities = load_encoder_capabilities(cache_path=cache_path, refresh=refresh)
+
+    print(f"Version | {capabilities.ffmpeg_version}")
+    candidate_encoders = {
+        encoder_config.encoder for encoder_config in ENCODER_CANDIDATES
+    }
+    for encoder in capabilities.video_encoders:
+        print(
+            f"Encoder | {encoder}{' (auto candidate)' if encoder in candidate_encoders else ''}"  # noqa: B950
+        )
+
+    if not calibrate:
+        return
+
+    # 入力の指定がなければ、テスト映像（1920x1080、60fps）で計測する
+    if input_path is not None:
+        input_description, input_opts, _ = get_calibration_input_opts(
+            input_path=input_path,
+            calibration_seconds=calibration_seconds,
+        )
+    else:
+        input_description = "testsrc2=size=1920x1080:rate=60"
+        input_opts = ["-f", "lavfi", "-i", input_description]
+
+    calibrations = calibrate_encoders(
+        capabilities=capabilities,
+        cache_path=cache_path,
+        input_description=input_description,
+        input_opts=input_opts,
+        video_filters=get_crop_scale_video_filters(crop=crop, scale=scale),
+        calibration_seconds=calibration_seconds,
+        refresh=refresh,
+    )
+    for calibration in calibrations:
+        fps_text = (
+            f"{calibration.fps:.1f} fps"
+            if calibration.fps is not None
+            else "unavailable"
+        )
+        print(f"Calibration | {calibration.config.describe()} | {fps_text}")
+
+
+def command_proxy(args: Namespace) -> None:
+    from tqdm import tqdm
+
+    from . import metrics
+    from .find_image import FfmpegProgressLine
+    from .proxy import FfmpegProxyResult, ffmpeg_proxy
+
+    input_path = Path(args.input_path)
+    proxy_dir = Path(args.proxy_dir)
+    height = args.height
+    gop = args.gop
+    video_codec = args.video_codec
+    crf = args.crf
+    progress_type = args.progress_type
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    try:
+        for output in ffmpeg_proxy(
+            input_path=input_path,
+            proxy_dir=proxy_dir,
+            height=height,
+            gop=gop,
+            video_codec=video_codec,
+            crf=crf,
+        ):
+            if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.set_postfix(
+                        {
+                            "time": output.time,
+                            "frame": f"{output.frame}",
+                        }
+                    )
+                    tqdm_pbar.refresh()
+
+                if progress_type == "plain":
+                    print(
+                        f"Progress | Time {output.time}, frame {output.frame}",
+                        file=sys.stderr,
+                    )
+
+            if isinstance(output, FfmpegProxyResult):
+                metrics.observe_result(output.success)
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.clear()
+
+                print(f"Output | {output}")
+    finally:
+        if tqdm_pbar is not None:
+            tqdm_pbar.close()
+
+
+def command_find_image(args: Namespace) -> None:
+    input_video_paths = [Path(path) for path in args.input_video_path]
+
+    # 複数のファイル・ディレクトリを指定したときは、ファイルごとに並列に検索する
+    if len(input_video_paths) != 1 or input_video_paths[0].is_dir():
+        command_find_image_batch(args=args, input_video_paths=input_video_paths)
+        return
+
+    def print_output(line: str) -> None:
+        # followでは、検出をすぐに後段へ渡すためフラッシュする
+        print(line, flush=args.follow)
+
+    command_find_image_file(
+        args=args,
+        input_video_path=input_video_paths[0],
+        print_output=print_output,
+    )
+
+
+def command_find_image_batch(args: Namespace, input_video_paths: List[Path]) -> None:
+    """
+    find_image -i に複数のファイル・ディレクトリを指定したとき
+
+    動画の長さを調べ、長い動画から順にワーカー（--jobs）へ割り当てて検索する
+    FPS・キーフレームの取得は、ワーカーごとにほかの動画の検索と並行して行う
+    検出は、検出した動画のパスを付けて、検出した順に出力する
+    """
+    import os
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from tqdm import tqdm
+
+    from . import profiling
+    from .find_image_batch import (
+        expand_input_video_paths,
+        ffprobe_durations,
+        get_largest_first_order,
+    )
+    from .prefetch import InputPrefetcher
+
+    assert (
+        args.checkpoint_path is None and not args.follow
+    ), "--checkpoint_path and --follow cannot be used with multiple input videos"
+
+    input_video_paths = expand_input_video_paths(paths=input_video_paths)
+    if len(input_video_paths) == 0:
+        config.logger.warning("No input video found")
+        return
+
+    jobs = args.jobs if args.jobs is not None else os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(input_video_paths)))
+
+    with profiling.profile_span("ffprobe_durations"):
+        durations = ffprobe_durations(input_video_paths=input_video_paths, jobs=jobs)
+    scheduled_input_video_paths = get_largest_first_order(
+        input_video_paths=input_video_paths,
+        durations=durations,
+    )
+
+    # ファイルごとの進捗は表示せず、完了したファイル数を表示する
+    file_args = Namespace(**{**vars(args), "progress_type": "none"})
+    progress_type = args.progress_type
+
+    output_lock = threading.Lock()
+
+    def find_image_file(input_video_path: Path) -> None:
+        def print_output(line: str) -> None:
+            with output_lock:
+                # 進捗バーを消してから出力する
+                tqdm.write(f"{line} | File {input_video_path}", file=sys.stdout)
+                sys.stdout.flush()
+
+        local_video_path = prefetcher.acquire(input_video_path)
+        try:
+            with profiling.profile_span("find_image_file", path=str(input_video_path)):
+                command_find_image_file(
+                    args=file_args,
+                    input_video_path=input_video_path,
+                    print_output=print_output,
+                    local_video_path=local_video_path,
+                )
+        finally:
+            prefetcher.release(input_video_path)
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm(total=len(scheduled_input_video_paths), unit="file")
+
+    # 処理中の動画の次の--prefetch個を先読みする
+    prefetcher = InputPrefetcher(
+        input_paths=scheduled_input_video_paths,
+        depth=args.prefetch,
+        mode=args.prefetch_mode,
+        scratch_dir=Path(args.prefetch_dir) if args.prefetch_dir is not None else None,
+        max_bytes=args.prefetch_max_bytes,
+    )
+
+    failed_input_video_paths: List[Path] = []
+    try:
+        with prefetcher, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(find_image_file, input_video_path): input_video_path
+                for input_video_path in scheduled_input_video_paths
+            }
+
+            for index, future in enumerate(as_completed(futures)):
+                input_video_path = futures[future]
+                try:
+                    future.result()
+                except Exception:
+                    # ほかの動画の検索は続ける
+                    config.logger.exception(f"find_image failed: {input_video_path}")
+                    failed_input_video_paths.append(input_video_path)
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.update(1)
+
+                if progress_type == "plain":
+                    with output_lock:
+                        print(
+                            f"Progress | File {index + 1}/{len(futures)} {input_video_path}",  # noqa: B950
+                            file=sys.stderr,
+                        )
+    finally:
+        if tqdm_pbar is not None:
+            tqdm_pbar.close()
+
+    if len(failed_input_video_paths) != 0:
+        raise Exception(
+            f"find_image failed for {len(failed_input_video_paths)} input videos"
+        )
+
+
+def command_find_image_file(
+    args: Namespace,
+    input_video_path: Path,
+    print_output: Callable[[str], None],
+    local_video_path: Optional[Path] = None,
+) -> None:
+    """
+    1つの動画を検索する（検出の行はprint_outputで出力する）
+
+    local_video_pathは、先読みでローカルにコピーした動画（走査だけに使う）
+    """
+    import time
+    from datetime import timedelta
+
+    from tqdm import tqdm
+
+    from . import metrics, profiling
+    from .checkpoint import (
+        FindImageCheckpoint,
+        FindImageCheckpointQuery,
+        FindImageCheckpointWriter,
+        FindImageDetection,
+        load_find_image_checkpoint,
+    )
+    from .fast_decode import (
+        ffprobe_video_stream_info,
+        get_fast_decode_lowres,
+        get_lowres_size,
+    )
+    from .find_image import (
+        FfmpegBlackframeEvent,
+        FfmpegProgressEvent,
+        ffmpeg_find_image_event_generator,
+    )
+    from .find_image_cache import (
+        FindImageCacheEntry,
+        FindImageCacheKey,
+        FindImageResultCache,
+        get_cached_find_image_detections,
+    )
+    from .fps import ffmpeg_fps
+    from .key_frames import ffmpeg_start_time
+    from .proxy import (
+        ProxyInfo,
+        ffmpeg_proxy_reference_image,
+        find_proxy,
+        get_proxy_crop_and_scale,
+        get_scaled_crop_and_scale,
+    )
+    from .util import (
+        format_microseconds_as_time_unit_syntax_string,
+        get_file_hash,
+        get_real_start_timedelta_by_ss,
+        get_video_identity,
+        parse_ffmpeg_time_unit_syntax_to_microseconds,
+    )
+
+    ss = args.ss
+    to = args.to
+    input_video_crop = args.input_video_crop
+    reference_image_path = Path(args.reference_image_path)
+    reference_image_crop = args.reference_image_crop
+    fps = args.fps
+    blackframe_amount = args.blackframe_amount
+    blackframe_threshold = args.blackframe_threshold
+    output_interval = args.output_interval
+    progress_type = args.progress_type
+    follow = args.follow
+    follow_timeout = args.follow_timeout
+    checkpoint_path = (
+        Path(args.checkpoint_path) if args.checkpoint_path is not None else None
+    )
+    checkpoint_interval = args.checkpoint_interval
+    resume = args.resume
+    cache_dir = Path(args.cache_dir) if args.cache_dir is not None else None
+    cache_max_bytes = args.cache_max_bytes
+    proxy_dir = Path(args.proxy_dir) if args.proxy_dir is not None else None
+    fast_decode = args.fast_decode
+    interval = args.interval
+    scene_threshold = args.scene_threshold
+
+    assert (
+        not resume or checkpoint_path is not None
+    ), "--resume requires --checkpoint_path"
+    assert not interval or (
+        fps is None
+        and not follow
+        and checkpoint_path is None
+        and cache_dir is None
+        and scene_threshold is None
+    ), "--interval cannot be used with --fps, --follow, --checkpoint_path, --cache_dir or --scene_threshold"  # noqa: B950
+
+    ss_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(ss) if ss is not None else 0
+    )
+    to_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(to) if to is not None else None
+    )
+
+    # プロキシ動画があれば、プロキシ動画を走査する（書き込み中のファイルは除く）
+    scan_video_path = (
+        local_video_path if local_video_path is not None else input_video_path
+    )
+    scan_input_video_crop = input_video_crop
+    scan_reference_image_path = reference_image_path
+    scan_reference_image_crop = reference_image_crop
+    proxy_info: Optional[ProxyInfo] = None
+    if proxy_dir is not None and not follow:
+        with profiling.profile_span("find_proxy"):
+            proxy = find_proxy(proxy_dir=proxy_dir, input_path=input_video_path)
+
+        if proxy is not None:
+            proxy_video_path, found_proxy_info = proxy
+            try:
+                proxy_input_video_crop, reference_image_scale = (
+                    get_proxy_crop_and_scale(
+                        info=found_proxy_info, input_video_crop=input_video_crop
+                    )
+                )
+            except ValueError:
+                config.logger.warning(
+                    f"Proxy video is not used because -icrop is not numeric: {input_video_crop}"  # noqa: B950
+                )
+            else:
+                with profiling.profile_span("ffmpeg_proxy_reference_image"):
+                    scan_reference_image_path = ffmpeg_proxy_reference_image(
+                        proxy_dir=proxy_dir,
+                        reference_image_path=reference_image_path,
+                        reference_image_crop=reference_image_crop,
+                        scale=reference_image_scale,
+                    )
+                scan_reference_image_crop = None
+                scan_input_video_crop = proxy_input_video_crop
+                scan_video_path = proxy_video_path
+                proxy_info = found_proxy_info
+
+    # 高速デコード（-lowresに対応するコーデックでは、切り抜きと参照画像を縮小する）
+    scan_reference_image_scale: Optional[str] = None
+    lowres = 0
+    skip_noref = False
+    if fast_decode:
+        with profiling.profile_span("ffprobe_video_stream_info"):
+            stream_info = ffprobe_video_stream_info(input_path=scan_video_path)
+
+        # Bフレームのない入力では、参照されないフレームを省略できない
+        skip_noref = stream_info.has_b_frames != 0
+
+        lowres = get_fast_decode_lowres(codec_name=stream_info.codec_name)
+        if lowres != 0:
+            lowres_width, lowres_height = get_lowres_size(
+                width=stream_info.width, height=stream_info.height, lowres=lowres
+            )
+            try:
+                lowres_input_video_crop, scan_reference_image_scale = (
+                    get_scaled_crop_and_scale(
+                        input_video_crop=scan_input_video_crop,
+                        source_width=stream_info.width,
+                        source_height=stream_info.height,
+                        width=lowres_width,
+                        height=lowres_height,
+                    )
+                )
+            except ValueError:
+                config.logger.warning(
+                    f"-lowres is not used because -icrop is not numeric: {scan_input_video_crop}"  # noqa: B950
+                )
+                lowres = 0
+            else:
+                scan_input_video_crop = lowres_input_video_crop
+
+    # 走査する動画の時刻（-ss/-to）と、走査する動画の内部時刻を内部時刻にする差
+    scan_ss = ss
+    scan_to = to
+    scan_ss_microseconds = ss_microseconds
+    scan_timestamp_offset_microseconds = 0
+    if proxy_info is not None:
+        # 元の動画の時刻 = プロキシ動画の時刻 + 時刻の差
+        proxy_ss_microseconds = (
+            ss_microseconds - proxy_info.timestamp_offset_microseconds
+        )
+        scan_ss_microseconds = max(0, proxy_ss_microseconds)
+        scan_timestamp_offset_microseconds = (
+            scan_ss_microseconds - proxy_ss_microseconds
+        )
+        scan_ss = (
+            format_microseconds_as_time_unit_syntax_string(scan_ss_microseconds)
+            if ss is not None or scan_ss_microseconds != 0
+            else None
+        )
+        scan_to = (
+            format_microseconds_as_time_unit_syntax_string(
+                max(0, to_microseconds - proxy_info.timestamp_offset_microseconds)
+            )
+            if to_microseconds is not None
+            else None
+        )
+
+    if interval:
+        command_find_image_interval(
+            args=args,
+            input_video_path=input_video_path,
+            print_output=print_output,
+            scan_ss=scan_ss,
+            scan_to=scan_to,
+            scan_video_path=scan_video_path,
+            scan_input_video_crop=scan_input_video_crop,
+            scan_reference_image_path=scan_reference_image_path,
+            scan_reference_image_crop=scan_reference_image_crop,
+            scan_reference_image_scale=scan_reference_image_scale,
+            lowres=lowres,
+            timestamp_offset_microseconds=(
+                proxy_info.timestamp_offset_microseconds
+                if proxy_info is not None
+                else 0
+            ),
+        )
+        return
+
+    checkpoint_query = FindImageCheckpointQuery(
+        ss=ss,
+        to=to,
+        input_video_path=str(input_video_path.resolve()),
+        input_video_crop=input_video_crop,
+        reference_image_path=str(reference_image_path.resolve()),
+        reference_image_crop=reference_image_crop,
+        fps=fps,
+        blackframe_amount=blackframe_amount,
+        blackframe_threshold=blackframe_threshold,
+        output_interval=output_interval,
+        proxy_video_path=(
+            str(scan_video_path.resolve()) if proxy_info is not None else None
+        ),
+        fast_decode=fast_decode,
+        scene_threshold=scene_threshold,
+    )
+
+    # チェックポイントがなければ最初から走査する
+    checkpoint: Optional[FindImageCheckpoint] = None
+    if resume and checkpoint_path is not None and checkpoint_path.exists():
+        checkpoint = load_find_image_checkpoint(path=checkpoint_path)
+        if checkpoint.query != checkpoint_query:
+            raise Exception(
+                f"Checkpoint options do not match: {checkpoint.query.model_dump_json()}"
+            )
+
+    # FPS
+    with profiling.profile_span("ffmpeg_fps"):
+        input_video_fps = ffmpeg_fps(input_path=input_video_path).fps
+    assert input_video_fps is not None, "FPS info not found in the input video"
+
+    internal_fps = fps if fps is not None else input_video_fps
+
+    output_interval_microseconds = round(output_interval * 1_000_000)
+
+    def print_detection(detection: FindImageDetection) -> None:
+        internal_time_string = format_microseconds_as_time_unit_syntax_string(
+            detection.internal_microseconds
+        )
+        input_time_string = format_microseconds_as_time_unit_syntax_string(
+            detection.input_microseconds
+        )
+
+        print_output(
+            f"Output | Time {input_time_string}, frame {detection.input_frame} (Internal time {internal_time_string}, frame {detection.internal_frame})",  # noqa: B950
+        )
+
+    # 書き込み中のファイルはキャッシュしない
+    cache: Optional[FindImageResultCache] = None
+    cache_key: Optional[FindImageCacheKey] = None
+    if cache_dir is not None and not follow:
+        cache = FindImageResultCache(cache_dir=cache_dir, max_bytes=cache_max_bytes)
+        with profiling.profile_span("find_image_cache_lookup"):
+            cache_key = FindImageCacheKey(
+                video_identity=get_video_identity(video_path=input_video_path),
+                reference_image_hash=get_file_hash(path=reference_image_path),
+                input_video_crop=input_video_crop,
+                reference_image_crop=reference_image_crop,
+                fps=fps,
+                blackframe_amount=blackframe_amount,
+                blackframe_threshold=blackframe_threshold,
+                proxy_video_identity=(
+                    get_video_identity(video_path=scan_video_path)
+                    if proxy_info is not None
+                    else None
+                ),
+                fast_decode=fast_decode,
+                scene_threshold=scene_threshold,
+            )
+            cache_entry = cache.lookup(
+                key=cache_key,
+                ss_microseconds=ss_microseconds,
+                to_microseconds=to_microseconds,
+            )
+        metrics.count_find_image_cache(hit=cache_entry is not None)
+
+        if cache_entry is not None:
+            with profiling.profile_span("find_image_cache"):
+                cached_detections = get_cached_find_image_detections(
+                    entry=cache_entry,
+                    input_video_path=input_video_path,
+                    input_video_fps=input_video_fps,
+                    ss=ss,
+                    ss_microseconds=ss_microseconds,
+                    to_microseconds=to_microseconds,
+                    output_interval_microseconds=output_interval_microseconds,
+                )
+
+            for detection in cached_detections:
+                metrics.observe_detection()
+                print_detection(detection)
+            return
+
+    # 行ごとの処理では、時刻を整数マイクロ秒で扱う
+    detections: List[FindImageDetection] = []
+    if checkpoint is None:
+        # Time
+        with profiling.profile_span("get_real_start_timedelta_by_ss"):
+            start_timedelta = get_real_start_timedelta_by_ss(
+                video_path=input_video_path, ss=ss
+            )
+        start_time_total_seconds = start_timedelta.total_seconds()
+        start_frame = start_time_total_seconds * input_video_fps
+
+        start_microseconds = start_timedelta // timedelta(microseconds=1)
+
+        seek_ss = scan_ss
+        timestamp_offset_microseconds = scan_timestamp_offset_microseconds
+        resume_internal_microseconds = 0
+        frame_offset = 0
+        prev_input_microseconds = -output_interval_microseconds
+    else:
+        # 中断前の開始時間の補正を引き継ぎ、再開位置のキーフレームから走査する
+        start_frame = checkpoint.start_frame
+        start_microseconds = checkpoint.start_microseconds
+
+        seek_ss = format_microseconds_as_time_unit_syntax_string(
+            checkpoint.resume_ss_microseconds
+        )
+        timestamp_offset_microseconds = checkpoint.resume_internal_microseconds
+        resume_internal_microseconds = checkpoint.resume_internal_microseconds
+        frame_offset = checkpoint.resume_internal_frame
+        prev_input_microseconds = checkpoint.prev_input_microseconds
+        detections = list(checkpoint.detections)
+
+    checkpoint_writer: Optional[FindImageCheckpointWriter] = None
+    if checkpoint_path is not None:
+        with profiling.profile_span("ffmpeg_start_time"):
+            start_time = ffmpeg_start_time(input_path=scan_video_path)
+
+        checkpoint_writer = FindImageCheckpointWriter(
+            checkpoint_path=checkpoint_path,
+            query=checkpoint_query,
+            input_video_path=scan_video_path,
+            start_time=start_time,
+            seek_origin_microseconds=scan_ss_microseconds,
+            timestamp_offset_microseconds=scan_timestamp_offset_microseconds,
+            start_microseconds=start_microseconds,
+            start_frame=start_frame,
+            output_interval_microseconds=output_interval_microseconds,
+            resume_internal_microseconds=resume_internal_microseconds,
+            resume_internal_frame=frame_offset,
+        )
+
+    # 中断前の検出結果を出力し、中断しなかった場合と同じ出力にする
+    for detection in detections:
+        print_detection(detection)
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    # 中断前の検出は出力間隔を適用済みのため、再開した検索はキャッシュしない
+    cache_internal_microseconds: Optional[List[int]] = (
+        [] if cache is not None and checkpoint is None else None
+    )
+    cache_internal_frames: List[int] = []
+
+    last_checkpoint_time = time.monotonic()
+    last_progress_internal_microseconds: Optional[int] = None
+
+    # Execute
+    with profiling.profile_span("find_image"):
+        try:
+            for output in ffmpeg_find_image_event_generator(
+                input_video_ss=seek_ss,
+                input_video_to=scan_to,
+                input_video_path=scan_video_path,
+                input_video_crop=scan_input_video_crop,
+                reference_image_path=scan_reference_image_path,
+                reference_image_crop=scan_reference_image_crop,
+                fps=fps,
+                blackframe_amount=blackframe_amount,
+                blackframe_threshold=blackframe_threshold,
+                follow=follow,
+                follow_timeout=follow_timeout,
+                timestamp_offset_microseconds=timestamp_offset_microseconds,
+                reference_image_scale=scan_reference_image_scale,
+                fast_decode=fast_decode,
+                lowres=lowres,
+                skip_noref=skip_noref,
+                scene_threshold=scene_threshold,
+            ):
+                if isinstance(output, FfmpegProgressEvent):
+                    metrics.observe_progress(output.time, key=str(input_video_path))
+
+                    if checkpoint_writer is not None:
+                        try:
+                            last_progress_internal_microseconds = (
+                                parse_ffmpeg_time_unit_syntax_to_microseconds(
+                                    output.time
+                                )
+                            )
+                        except ValueError:  # N/A
+                            pass
+
+                        if (
+                            last_progress_internal_microseconds is not None
+                            and checkpoint_interval
+                            <= time.monotonic() - last_checkpoint_time
+                        ):
+                            with profiling.profile_span("save_checkpoint"):
+                                checkpoint_writer.save(
+                                    progress_internal_microseconds=(
+                                        last_progress_internal_microseconds
+                                    ),
+                                    detections=detections,
+                                )
+                            last_checkpoint_time = time.monotonic()
+
+                    if tqdm_pbar is None and progress_type != "plain":
+                        continue
+
+                    internal_microseconds = (
+                        parse_ffmpeg_time_unit_syntax_to_microseconds(output.time)
+                    )
+                    internal_time_string = (
+                        format_microseconds_as_time_unit_syntax_string(
+                            internal_microseconds
+                        )
+                    )
+
+                    # 開始時間(ss)分、検出時刻を補正
+                    input_microseconds = start_microseconds + internal_microseconds
+                    input_time_string = format_microseconds_as_time_unit_syntax_string(
+                        input_microseconds
+                    )
+
+                    # 開始時間(ss)・フレームレート(fps)分、フレームを補正
+                    internal_frame = frame_offset + output.frame
+                    rescaled_output_frame = (
+                        internal_frame / internal_fps * input_video_fps
+                    )
+                    input_frame = int(start_frame + rescaled_output_frame)
+
+                    if tqdm_pbar is not None:
+                        tqdm_pbar.set_postfix(
+                            {
+                                "time": input_time_string,
+                                "frame": f"{input_frame}",
+                                "internal_time": internal_time_string,
+                                "internal_frame": f"{internal_frame}",
+                            }
+                        )
+                        tqdm_pbar.refresh()
+
+                    if progress_type == "plain":
+                        print(
+                            f"Progress | Time {input_time_string}, frame {input_frame} (Internal time {internal_time_string}, frame {internal_frame})",  # noqa: B950
+                            file=sys.stderr,
+                        )
+
+                if isinstance(output, FfmpegBlackframeEvent):
+                    internal_microseconds = round(output.t * 1_000_000)
+
+                    # 再開位置より前のフレームは中断前に走査済み
+                    if internal_microseconds < resume_internal_microseconds:
+                        continue
+
+                    if cache_internal_microseconds is not None:
+                        cache_internal_microseconds.append(internal_microseconds)
+                        cache_internal_frames.append(frame_offset + output.frame)
+
+                    # 開始時間(ss)分、検出時刻を補正
+                    input_microseconds = start_microseconds + internal_microseconds
+
+                    if (
+                        output_interval_microseconds
+                        <= input_microseconds - prev_input_microseconds
+                    ):
+                        # 開始時間(ss)・フレームレート(fps)分、フレームを補正
+                        internal_frame = frame_offset + output.frame
+                        rescaled_output_frame = (
+                            internal_frame / internal_fps * input_video_fps
+                        )
+                        input_frame = int(start_frame + rescaled_output_frame)
+
+                        detection = FindImageDetection(
+                            input_microseconds=input_microseconds,
+                            input_frame=input_frame,
+                            internal_microseconds=internal_microseconds,
+                            internal_frame=internal_frame,
+                        )
+                        if checkpoint_writer is not None:
+                            detections.append(detection)
+
+                        metrics.observe_detection()
+
+                        if tqdm_pbar is not None:
+                            tqdm_pbar.clear()
+
+                        print_detection(detection)
+
+                        prev_input_microseconds = input_microseconds
+
+        except KeyboardInterrupt:
+            # 中断時点までの走査結果を記録してから終了する
+            if (
+                checkpoint_writer is not None
+                and last_progress_internal_microseconds is not None
+            ):
+                checkpoint_writer.save(
+                    progress_internal_microseconds=last_progress_internal_microseconds,
+                    detections=detections,
+                )
+            raise
+
+        finally:
+            if tqdm_pbar is not None:
+                tqdm_pbar.close()
+
+    if (
+        cache is not None
+        and cache_key is not None
+        and cache_internal_microseconds is not None
+    ):
+        cache.store(
+            entry=FindImageCacheEntry(
+                key=cache_key,
+                ss_microseconds=ss_microseconds,
+                to_microseconds=to_microseconds,
+                start_microseconds=start_microseconds,
+                start_frame=start_frame,
+                internal_microseconds=cache_internal_microseconds,
+                internal_frames=cache_internal_frames,
+            )
+        )
+
+    # 走査が完了したら、チェックポイントは不要
+    if checkpoint_path is not None:
+        checkpoint_path.unlink(missing_ok=True)
+
+
+def command_find_image_interval(
+    args: Namespace,
+    input_video_path: Path,
+    print_output: Callable[[str], None],
+    scan_ss: Optional[str],
+    scan_to: Optional[str],
+    scan_video_path: Path,
+    scan_input_video_crop: Optional[str],
+    scan_reference_image_path: Path,
+    scan_reference_image_crop: Optional[str],
+    scan_reference_image_scale: Optional[str],
+    lowres: int,
+    timestamp_offset_microseconds: int,
+) -> None:
+    """
+    find_image --interval: 参照画像が映っている区間を出力する
+
+    timestamp_offset_microsecondsは、走査する動画（プロキシ）の時刻を元の動画の時刻にする差
+    """
+    from tqdm import tqdm
+
+    from . import metrics, profiling
+    from .find_image_interval import (
+        FindImageInterval,
+        FindImageIntervalProgressEvent,
+        ffmpeg_find_image_interval_generator,
+    )
+    from .fps import ffmpeg_fps
+    from .util import format_microseconds_as_time_unit_syntax_string
+
+    progress_type = args.progress_type
+
+    with profiling.profile_span("ffmpeg_fps"):
+        input_video_fps = ffmpeg_fps(input_path=input_video_path).fps
+    assert input_video_fps is not None, "FPS info not found in the input video"
+
+    def get_input_frame(microseconds: int) -> int:
+        return round(microseconds / 1_000_000 * input_video_fps)
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    with profiling.profile_span("find_image_interval"):
+        try:
+            for output in ffmpeg_find_image_interval_generator(
+                input_video_ss=scan_ss,
+                input_video_to=scan_to,
+                input_video_path=scan_video_path,
+                input_video_crop=scan_input_video_crop,
+                reference_image_path=scan_reference_image_path,
+                reference_image_crop=scan_reference_image_crop,
+                frame_microseconds=round(1_000_000 / input_video_fps),
+                blackframe_amount=args.blackframe_amount,
+                blackframe_threshold=args.blackframe_threshold,
+                merge_gap_microseconds=round(args.output_interval * 1_000_000),
+                reference_image_scale=scan_reference_image_scale,
+                fast_decode=args.fast_decode,
+                lowres=lowres,
+            ):
+                if isinstance(output, FindImageIntervalProgressEvent):
+                    input_time_string = format_microseconds_as_time_unit_syntax_string(
+                        output.microseconds + timestamp_offset_microseconds
+                    )
+
+                    if tqdm_pbar is not None:
+                        tqdm_pbar.set_postfix(
+                            {
+                                "phase": output.phase,
+                                "time": input_time_string,
+                            }
+                        )
+                        tqdm_pbar.refresh()
+
+                    if progress_type == "plain":
+                        print(
+                            f"Progress | Phase {output.phase}, time {input_time_string}",
+                            file=sys.stderr,
+                        )
+
+                if isinstance(output, FindImageInterval):
+                    start_microseconds = (
+                        output.start_microseconds + timestamp_offset_microseconds
+                    )
+                    end_microseconds = (
+                        output.end_microseconds + timestamp_offset_microseconds
+                    )
+
+                    start_time_string = format_microseconds_as_time_unit_syntax_string(
+                        start_microseconds
+                    )
+                    end_time_string = format_microseconds_as_time_unit_syntax_string(
+                        end_microseconds
+                    )
+                    duration_string = format_microseconds_as_time_unit_syntax_string(
+                        end_microseconds - start_microseconds
+                    )
+
+                    metrics.observe_detection()
+
+                    if tqdm_pbar is not None:
+                        tqdm_pbar.clear()
+
+                    print_output(
+                        f"Output | Interval {start_time_string} - {end_time_string}, frame {get_input_frame(start_microseconds)} - {get_input_frame(end_microseconds)} (Duration {duration_string})",  # noqa: B950
+                    )
+        finally:
+            if tqdm_pbar is not None:
+                tqdm_pbar.close()
+
+
+def command_find_template(args: Namespace) -> None:
+    from tqdm import tqdm
+
+    from . import metrics, profiling
+    from .find_image import FfmpegProgressLine
+    from .find_template import FindTemplateMatch, ffmpeg_find_template_generator
+    from .fps import ffmpeg_fps
+    from .util import (
+        format_microseconds_as_time_unit_syntax_string,
+        parse_ffmpeg_time_unit_syntax_to_microseconds,
+    )
+
+    ss = args.ss
+    to = args.to
+    input_video_path = Path(args.input_video_path)
+    input_video_crop = args.input_video_crop
+    reference_image_path = Path(args.reference_image_path)
+    reference_image_crop = args.reference_image_crop
+    fps = args.fps
+    analysis_height = args.analysis_height
+    template_scales = args.template_scales
+    threshold = args.threshold
+    batch_size = args.batch_size
+    output_interval = args.output_interval
+    progress_type = args.progress_type
+
+    ss_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(ss) if ss is not None else 0
+    )
+
+    with profiling.profile_span("ffmpeg_fps"):
+        input_video_fps = ffmpeg_fps(input_path=input_video_path).fps
+    assert input_video_fps is not None, "FPS info not found in the input video"
+
+    output_interval_microseconds = round(output_interval * 1_000_000)
+    prev_input_microseconds = -output_interval_microseconds
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    # 時刻は、走査の開始位置（-ss）からの時刻に-ssを足したFFmpegの時刻
+    with profiling.profile_span("find_template"):
+        for output in ffmpeg_find_template_generator(
+            input_video_ss=ss,
+            input_video_to=to,
+            input_video_path=input_video_path,
+            input_video_crop=input_video_crop,
+            reference_image_path=reference_image_path,
+            reference_image_crop=reference_image_crop,
+            fps=fps,
+            analysis_height=analysis_height,
+            template_scales=template_scales,
+            threshold=threshold,
+            batch_size=batch_size,
+        ):
+            if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    ss_microseconds
+                    + parse_ffmpeg_time_unit_syntax_to_microseconds(output.time)
+                )
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.set_postfix(
+                        {
+                            "time": input_time_string,
+                            "internal_frame": f"{output.frame}",
+                        }
+                    )
+                    tqdm_pbar.refresh()
+
+                if progress_type == "plain":
+                    print(
+                        f"Progress | Time {input_time_string} (Internal frame {output.frame})",  # noqa: B950
+                        file=sys.stderr,
+                    )
+
+            if isinstance(output, FindTemplateMatch):
+                input_microseconds = ss_microseconds + output.internal_microseconds
+                if output_interval_microseconds > (
+                    input_microseconds - prev_input_microseconds
+                ):
+                    continue
+
+                prev_input_microseconds = input_microseconds
+                metrics.observe_detection()
+
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    input_microseconds
+                )
+                input_frame = round(input_microseconds * input_video_fps / 1_000_000)
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.clear()
+
+                print(
+                    f"Output | Time {input_time_string}, frame {input_frame}, x {output.x}, y {output.y}, width {output.width}, height {output.height}, scale {output.scale:g}, score {output.score:.3f}"  # noqa: B950
+                )
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.refresh()
+
+
+def command_find_audio(args: Namespace) -> None:
+    from tqdm import tqdm
+
+    from . import metrics, profiling
+    from .find_audio import (
+        FindAudioMatch,
+        ffmpeg_audio_samples,
+        ffmpeg_find_audio_generator,
+    )
+    from .find_image import FfmpegProgressLine
+    from .util import (
+        format_microseconds_as_time_unit_syntax_string,
+        parse_ffmpeg_time_unit_syntax_to_microseconds,
+    )
+
+    ss = args.ss
+    to = args.to
+    input_path = Path(args.input_path)
+    audio_index = args.audio_index
+    reference_audio_path = Path(args.reference_audio_path)
+    reference_audio_index = args.reference_audio_index
+    reference_ss = args.reference_ss
+    reference_to = args.reference_to
+    sample_rate = args.sample_rate
+    threshold = args.threshold
+    chunk_seconds = args.chunk_seconds
+    output_interval = args.output_interval
+    progress_type = args.progress_type
+
+    ss_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(ss) if ss is not None else 0
+    )
+
+    with profiling.profile_span("ffmpeg_audio_samples"):
+        reference = ffmpeg_audio_samples(
+            input_path=reference_audio_path,
+            audio_index=reference_audio_index,
+            sample_rate=sample_rate,
+            ss=reference_ss,
+            to=reference_to,
+        )
+
+    output_interval_microseconds = round(output_interval * 1_000_000)
+    prev_input_microseconds = -output_interval_microseconds
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    # 時刻は、走査の開始位置（-ss）からの時刻に-ssを足したFFmpegの時刻
+    with profiling.profile_span("find_audio"):
+        for output in ffmpeg_find_audio_generator(
+            input_path=input_path,
+            audio_index=audio_index,
+            reference=reference,
+            sample_rate=sample_rate,
+            ss=ss,
+            to=to,
+            threshold=threshold,
+            chunk_seconds=chunk_seconds,
+        ):
+            if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    ss_microseconds
+                    + parse_ffmpeg_time_unit_syntax_to_microseconds(output.time)
+                )
+
+                if tqdm_pbar is not None:
+                    tqdm_pbar.set_postfix(
+                        {
+                            "time": input_time_string,
+                        }
+                    )
+                    tqdm_pbar.refresh()
+
+                if progress_type == "plain":
+                    print(
+                        f"Progress | Time {input_time_string}",
                         file=sys.stderr,
                     )
 
-            if isinstance(output, FfmpegCropScaleResult):
+            if isinstance(output, FindAudioMatch):
+                input_microseconds = ss_microseconds + output.internal_microseconds
+                if output_interval_microseconds > (
+                    input_microseconds - prev_input_microseconds
+                ):
+                    continue
+
+                prev_input_microseconds = input_microseconds
+                metrics.observe_detection()
+
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    input_microseconds
+                )
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.clear()
 
-                print(f"Output | {output}")
-    finally:
-        if tqdm_pbar is not None:
-            tqdm_pbar.close()
+                print(f"Output | Time {input_time_string}, score {output.score:.3f}")
 
+                if tqdm_pbar is not None:
+                    tqdm_pbar.refresh()
+
+
+def command_analyze(args: Namespace) -> None:
+    from tqdm import tqdm
+
+    from . import metrics, profiling
+    from .find_image import FfmpegProgressLine
+    from .find_template import ffmpeg_gray_image
+    from .fps import ffmpeg_fps
+    from .frame_bus import (
+        BlackFrameAnalyzer,
+        FingerprintIndexAnalyzer,
+        FrameAnalyzer,
+        FrameBusResult,
+        ImageMatchAnalyzer,
+        SceneChangeAnalyzer,
+        ffmpeg_frame_bus_generator,
+        get_analysis_frame_size,
+    )
+    from .util import (
+        format_microseconds_as_time_unit_syntax_string,
+        parse_ffmpeg_time_unit_syntax_to_microseconds,
+    )
 
-def command_find_image(args: Namespace) -> None:
     ss = args.ss
     to = args.to
     input_video_path = Path(args.input_video_path)
     input_video_crop = args.input_video_crop
-    reference_image_path = Path(args.reference_image_path)
+    reference_image_paths = [Path(path) for path in args.find_image or []]
     reference_image_crop = args.reference_image_crop
-    fps = args.fps
     blackframe_amount = args.blackframe_amount
     blackframe_threshold = args.blackframe_threshold
-    output_interval = args.output_interval
+    black = args.black
+    scene_threshold = args.scene
+    fingerprint_path = (
+        Path(args.fingerprint_path) if args.fingerprint_path is not None else None
+    )
+    fps = args.fps
+    analysis_height = args.analysis_height
+    slots = args.slots
     progress_type = args.progress_type
 
-    # FPS
-    input_video_fps = ffmpeg_fps(input_path=input_video_path).fps
+    ss_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(ss) if ss is not None else 0
+    )
+
+    with profiling.profile_span("ffmpeg_fps"):
+        input_video_fps = ffmpeg_fps(input_path=input_video_path).fps
     assert input_video_fps is not None, "FPS info not found in the input video"
 
-    internal_fps = fps if fps is not None else input_video_fps
+    frame_width, frame_height = get_analysis_frame_size(
+        input_video_path=input_video_path,
+        input_video_crop=input_video_crop,
+        analysis_height=analysis_height,
+    )
+
+    analyzers: List[FrameAnalyzer] = []
+    for reference_image_path in reference_image_paths:
+        analyzers.append(
+            ImageMatchAnalyzer(
+                name=f"find_image {reference_image_path}",
+                reference_frame=ffmpeg_gray_image(
+                    image_path=reference_image_path,
+                    image_crop=reference_image_crop,
+                    width=frame_width,
+                    height=frame_height,
+                ),
+                blackframe_amount=blackframe_amount,
+                blackframe_threshold=blackframe_threshold,
+            )
+        )
+
+    if black:
+        analyzers.append(
+            BlackFrameAnalyzer(
+                name="black",
+                amount=blackframe_amount,
+                threshold=blackframe_threshold,
+            )
+        )
 
-    # Time
-    start_timedelta = get_real_start_timedelta_by_ss(video_path=input_video_path, ss=ss)
-    start_time_total_seconds = start_timedelta.total_seconds()
-    start_frame = start_time_total_seconds * input_video_fps
+    if scene_threshold is not None:
+        analyzers.append(SceneChangeAnalyzer(name="scene", threshold=scene_threshold))
+
+    if fingerprint_path is not None:
+        analyzers.append(
+            FingerprintIndexAnalyzer(name="fingerprint", output_path=fingerprint_path)
+        )
+
+    assert (
+        len(analyzers) != 0
+    ), "Specify --find_image, --black, --scene or --fingerprint_path"
 
     # tqdm
     tqdm_pbar = None
     if progress_type == "tqdm":
         tqdm_pbar = tqdm()
 
-    prev_input_timedelta = timedelta(seconds=-output_interval)
-
-    # Execute
-    try:
-        for output in ffmpeg_find_image_generator(
+    # 時刻は、走査の開始位置（-ss）からの時刻に-ssを足したFFmpegの時刻
+    with profiling.profile_span("analyze"):
+        for output in ffmpeg_frame_bus_generator(
             input_video_ss=ss,
             input_video_to=to,
             input_video_path=input_video_path,
             input_video_crop=input_video_crop,
-            reference_image_path=reference_image_path,
-            reference_image_crop=reference_image_crop,
             fps=fps,
-            blackframe_amount=blackframe_amount,
-            blackframe_threshold=blackframe_threshold,
+            frame_width=frame_width,
+            frame_height=frame_height,
+            analyzers=analyzers,
+            slot_count=slots,
         ):
             if isinstance(output, FfmpegProgressLine):
-                internal_time = parse_ffmpeg_time_unit_syntax(output.time)
-                internal_timedelta = internal_time.to_timedelta()
+                metrics.observe_progress(output.time)
 
-                internal_time_string = format_timedelta_as_time_unit_syntax_string(
-                    internal_timedelta
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    ss_microseconds
+                    + parse_ffmpeg_time_unit_syntax_to_microseconds(output.time)
                 )
 
-                # 開始時間(ss)分、検出時刻を補正
-                input_timedelta = start_timedelta + internal_timedelta
-                input_time_string = format_timedelta_as_time_unit_syntax_string(
-                    input_timedelta
-                )
-
-                # 開始時間(ss)・フレームレート(fps)分、フレームを補正
-                internal_frame = output.frame
-                rescaled_output_frame = internal_frame / internal_fps * input_video_fps
-                input_frame = int(start_frame + rescaled_output_frame)
-
                 if tqdm_pbar is not None:
                     tqdm_pbar.set_postfix(
                         {
                             "time": input_time_string,
-                            "frame": f"{input_frame}",
-                            "internal_time": internal_time_string,
-                            "internal_frame": f"{internal_frame}",
+                            "internal_frame": f"{output.frame}",
                         }
                     )
                     tqdm_pbar.refresh()
 
                 if progress_type == "plain":
                     print(
-                        f"Progress | Time {input_time_string}, frame {input_frame} (Internal time {internal_time_string}, frame {internal_frame})",  # noqa: B950
+                        f"Progress | Time {input_time_string} (Internal frame {output.frame})",  # noqa: B950
                         file=sys.stderr,
                     )
 
-            if isinstance(output, FfmpegBlackframeOutputLine):
-                internal_timedelta = timedelta(seconds=output.t)
-                internal_time_string = format_timedelta_as_time_unit_syntax_string(
-                    internal_timedelta
+            if isinstance(output, FrameBusResult):
+                metrics.observe_detection()
+
+                input_microseconds = ss_microseconds + output.internal_microseconds
+                input_time_string = format_microseconds_as_time_unit_syntax_string(
+                    input_microseconds
                 )
+                input_frame = round(input_microseconds * input_video_fps / 1_000_000)
 
-                # 開始時間(ss)分、検出時刻を補正
-                input_timedelta = start_timedelta + internal_timedelta
-                input_time_string = format_timedelta_as_time_unit_syntax_string(
-                    input_timedelta
+                if tqdm_pbar is not None:
+                    tqdm_pbar.clear()
+
+                print(
+                    f"Output | {output.analyzer} | Time {input_time_string}, frame {input_frame} (Internal frame {output.frame}), value {output.value:g}"  # noqa: B950
                 )
 
-                if (
-                    timedelta(seconds=output_interval)
-                    <= input_timedelta - prev_input_timedelta
-                ):
-                    # 開始時間(ss)・フレームレート(fps)分、フレームを補正
-                    internal_frame = output.frame
-                    rescaled_output_frame = (
-                        internal_frame / internal_fps * input_video_fps
-                    )
-                    input_frame = int(start_frame + rescaled_output_frame)
+                if tqdm_pbar is not None:
+                    tqdm_pbar.refresh()
 
-                    if tqdm_pbar is not None:
-                        tqdm_pbar.clear()
 
-                    print(
-                        f"Output | Time {input_time_string}, frame {input_frame} (Internal time {internal_time_string}, frame {internal_frame})"  # noqa: B950
-                    )
+def command_chapters(args: Namespace) -> None:
+    from .chapters import parse_find_image_output_chapters, write_chapters
+
+    input_video_path = Path(args.input_video_path)
+    chapters_path = args.chapters_path
+    audio_titles = {
+        int(track_index): title for track_index, title in args.audio_title or []
+    }
+    remux = args.remux
+
+    if chapters_path == "-":
+        chapters = parse_find_image_output_chapters(
+            lines=sys.stdin, input_video_path=input_video_path
+        )
+    else:
+        with open(chapters_path, "r", encoding="utf-8") as fp:
+            chapters = parse_find_image_output_chapters(
+                lines=fp, input_video_path=input_video_path
+            )
 
-                    prev_input_timedelta = input_timedelta
+    in_place = write_chapters(
+        input_video_path=input_video_path,
+        chapters=chapters,
+        audio_titles=audio_titles,
+        remux=remux,
+    )
 
-    finally:
-        if tqdm_pbar is not None:
-            tqdm_pbar.close()
+    print(
+        f"Output | Chapters {len(chapters)}, audio titles {len(audio_titles)} ({'in place' if in_place else 'remuxed'})"  # noqa: B950
+    )
+
+
+def command_extract_frames(args: Namespace) -> None:
+    from tempfile import TemporaryDirectory
+
+    from .chapters import parse_find_image_output_chapters
+    from .extract_frames import (
+        ffmpeg_contact_sheet,
+        ffmpeg_extract_frames,
+        ffprobe_key_frame_interval,
+        get_frame_target_microseconds,
+    )
+    from .fps import ffmpeg_fps
+    from .proxy import ffmpeg_first_frame_microseconds
+    from .util import (
+        format_microseconds_as_time_unit_syntax_string,
+        parse_ffmpeg_time_unit_syntax_to_microseconds,
+    )
+
+    input_video_path = Path(args.input_video_path)
+    times = args.times or []
+    frames = args.frames or []
+    from_path = args.from_path
+    output_dir = Path(args.output_dir) if args.output_dir is not None else None
+    image_format = args.image_format
+    contact_sheet_path = (
+        Path(args.contact_sheet_path) if args.contact_sheet_path is not None else None
+    )
+    columns = args.columns
+    thumbnail_width = args.thumbnail_width
+    dense_gap = args.dense_gap
+    inputs_per_process = args.inputs_per_process
+
+    if output_dir is None and contact_sheet_path is None:
+        raise Exception("Specify --output_dir or --contact_sheet_path")
+
+    fps = ffmpeg_fps(input_path=input_video_path).fps
+    if fps is None:
+        raise Exception("Failed to get fps")
+
+    # フレーム番号は最初の映像フレームから数える（find_imageと同じ）
+    first_frame_microseconds = ffmpeg_first_frame_microseconds(input_video_path) or 0
+
+    def get_frame(microseconds: int) -> int:
+        return round((microseconds - first_frame_microseconds) * fps / 1_000_000)
+
+    target_microseconds = [
+        parse_ffmpeg_time_unit_syntax_to_microseconds(time) for time in times
+    ]
+    target_frames = [get_frame(microseconds) for microseconds in target_microseconds]
+    target_microseconds += [
+        get_frame_target_microseconds(
+            frame=frame, fps=fps, first_frame_microseconds=first_frame_microseconds
+        )
+        for frame in frames
+    ]
+    target_frames += frames
+
+    if from_path is not None:
+        if from_path == "-":
+            chapters = parse_find_image_output_chapters(
+                lines=sys.stdin, input_video_path=input_video_path
+            )
+        else:
+            with open(from_path, "r", encoding="utf-8") as fp:
+                chapters = parse_find_image_output_chapters(
+                    lines=fp, input_video_path=input_video_path
+                )
+
+        target_microseconds += [chapter.start_microseconds for chapter in chapters]
+        target_frames += [get_frame(chapter.start_microseconds) for chapter in chapters]
+
+    if len(target_microseconds) == 0:
+        raise Exception("Specify --times, --frames or --from_path")
+
+    # 疎・密の境目は、キーフレームの間隔（シークしてデコードする量）
+    if dense_gap is None:
+        dense_gap = ffprobe_key_frame_interval(input_path=input_video_path) or 2.0
+
+    with TemporaryDirectory() as tmpdir:
+        image_dir = output_dir if output_dir is not None else Path(tmpdir)
+        output_paths = [
+            image_dir / f"{index:04d}_{frame}.{image_format}"
+            for index, frame in enumerate(target_frames)
+        ]
+
+        extracted_paths = set()
+        for output in ffmpeg_extract_frames(
+            input_path=input_video_path,
+            target_microseconds=target_microseconds,
+            output_paths=output_paths,
+            dense_gap_microseconds=round(dense_gap * 1_000_000),
+            frame_microseconds=round(1_000_000 / fps),
+            image_format=image_format,
+            inputs_per_process=inputs_per_process,
+        ):
+            extracted_paths.add(output.output_path)
+
+            if output_dir is not None:
+                print(
+                    f"Output | Time {format_microseconds_as_time_unit_syntax_string(output.frame_microseconds)}, frame {get_frame(output.frame_microseconds)}, path {output.output_path}"  # noqa: B950
+                )
+
+        if contact_sheet_path is not None:
+            # 指定した順に並べる
+            ffmpeg_contact_sheet(
+                image_paths=[path for path in output_paths if path in extracted_paths],
+                output_path=contact_sheet_path,
+                columns=columns,
+                thumbnail_width=thumbnail_width,
+            )
+            print(
+                f"Output | Contact sheet {len(extracted_paths)} frames, path {contact_sheet_path}"  # noqa: B950
+            )
 
 
 def command_audio(args: Namespace) -> None:
+    from .inputs import ffmpeg_get_input
+
     input_path = Path(args.input_path)
 
     inp = ffmpeg_get_input(
@@ -288,10 +1752,25 @@ def command_audio(args: Namespace) -> None:
 
 
 def command_select_audio(args: Namespace) -> None:
-    input_path = Path(args.input_path)
+    from tqdm import tqdm
+
+    from . import metrics
+    from .find_image import FfmpegProgressLine
+    from .seek_index import check_seek_index
+    from .select_audio import FfmpegSelectAudioResult, ffmpeg_select_audio
+    from .stream_io import is_stdio_path
+
+    # `-`（標準入力）やURLはPathにしない
+    input_path = args.input_path
     audio_indexes = args.audio_index
-    output_path = Path(args.output_path)
+    output_path = args.output_path
+    output_format = args.output_format
+    output_profile = args.output_profile
     progress_type = args.progress_type
+    verify = args.verify
+
+    if verify and (is_stdio_path(input_path) or is_stdio_path(output_path)):
+        raise ValueError("--verify requires file or URL input and output")
 
     # tqdm
     tqdm_pbar = None
@@ -303,8 +1782,12 @@ def command_select_audio(args: Namespace) -> None:
             input_path=input_path,
             audio_indexes=audio_indexes,
             output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
         ):
             if isinstance(output, FfmpegProgressLine):
+                metrics.observe_progress(output.time)
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.set_postfix(
                         {
@@ -321,21 +1804,305 @@ def command_select_audio(args: Namespace) -> None:
                     )
 
             if isinstance(output, FfmpegSelectAudioResult):
+                metrics.observe_result(output.success)
+
                 if tqdm_pbar is not None:
                     tqdm_pbar.clear()
 
-                print(f"Output | {output}")
+                # 標準出力に書き出すときは、結果を標準エラー出力に出す
+                print(
+                    f"Output | {output}",
+                    file=sys.stderr if is_stdio_path(output_path) else sys.stdout,
+                )
+
+                # インデックス（moov・Cues）が先頭にあることを確かめる
+                if output.success and output_profile == "seek":
+                    seek_index_check = check_seek_index(
+                        output_path=Path(output_path), output_format=output_format
+                    )
+                    print(f"Index | {seek_index_check.describe()}")
+                    if not seek_index_check.ok:
+                        raise Exception(
+                            f"Seek index check failed: {seek_index_check.describe()}"
+                        )
+
+                # デコードせず、パケットの一覧だけで入力と比べる
+                if output.success and verify:
+                    verify_output(
+                        input_path=input_path,
+                        output_path=output_path,
+                        ss=None,
+                        to=None,
+                        audio_indexes=audio_indexes,
+                    )
+    finally:
+        if tqdm_pbar is not None:
+            tqdm_pbar.close()
+
+
+def command_join(args: Namespace) -> None:
+    import os
+
+    from tqdm import tqdm
+
+    from . import metrics
+    from .find_image import FfmpegProgressLine
+    from .find_image_batch import ffprobe_durations
+    from .join import FfmpegJoinResult, check_join_inputs, ffmpeg_join
+    from .prefetch import InputPrefetcher
+    from .util import parse_ffmpeg_time_unit_syntax_to_microseconds
+
+    input_paths = [Path(input_path) for input_path in args.input_path]
+    jobs = args.jobs if args.jobs is not None else os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(input_paths)))
+    output_path = Path(args.output_path)
+    progress_type = args.progress_type
+    prefetch = args.prefetch
+
+    # 連結を始める前に、トラックの構成が異なる入力をまとめて報告する
+    incompatible_inputs = check_join_inputs(input_paths=input_paths, jobs=jobs)
+    for incompatible_input in incompatible_inputs:
+        print(
+            f"Incompatible | File {incompatible_input.input_path} | {incompatible_input.reason}",  # noqa: B950
+            file=sys.stderr,
+        )
+
+    if len(incompatible_inputs) != 0:
+        raise Exception(f"{len(incompatible_inputs)} incompatible input(s)")
+
+    # 連結中の入力（進捗の時刻と入力の長さから求める）の次の--prefetch個をページキャッシュに載せる
+    input_end_microseconds: List[int] = []
+    if prefetch > 0:
+        durations = ffprobe_durations(input_video_paths=input_paths, jobs=jobs)
+        end_microseconds = 0
+        for input_path in input_paths:
+            end_microseconds += round((durations[input_path] or 0.0) * 1_000_000)
+            input_end_microseconds.append(end_microseconds)
+
+    prefetcher = InputPrefetcher(input_paths=input_paths, depth=prefetch)
+    input_index = 0
+
+    # tqdm
+    tqdm_pbar = None
+    if progress_type == "tqdm":
+        tqdm_pbar = tqdm()
+
+    try:
+        with prefetcher:
+            prefetcher.acquire(input_paths[input_index])
+
+            for output in ffmpeg_join(
+                input_paths=input_paths,
+                output_path=output_path,
+            ):
+                if isinstance(output, FfmpegProgressLine):
+                    metrics.observe_progress(output.time)
+
+                    if prefetch > 0:
+                        try:
+                            microseconds = (
+                                parse_ffmpeg_time_unit_syntax_to_microseconds(
+                                    output.time
+                                )
+                            )
+                        except ValueError:  # N/A
+                            microseconds = 0
+
+                        while (
+                            input_index < len(input_paths) - 1
+                            and input_end_microseconds[input_index] <= microseconds
+                        ):
+                            prefetcher.release(input_paths[input_index])
+                            input_index += 1
+                            prefetcher.acquire(input_paths[input_index])
+
+                    if tqdm_pbar is not None:
+                        tqdm_pbar.set_postfix(
+                            {
+                                "time": output.time,
+                                "frame": f"{output.frame}",
+                            }
+                        )
+                        tqdm_pbar.refresh()
+
+                    if progress_type == "plain":
+                        print(
+                            f"Progress | Time {output.time}, frame {output.frame}",
+                            file=sys.stderr,
+                        )
+
+                if isinstance(output, FfmpegJoinResult):
+                    metrics.observe_result(output.success)
+
+                    if tqdm_pbar is not None:
+                        tqdm_pbar.clear()
+
+                    print(f"Output | {output}")
     finally:
         if tqdm_pbar is not None:
             tqdm_pbar.close()
 
 
+def command_verify(args: Namespace) -> None:
+    verify_output(
+        input_path=args.input_path,
+        output_path=args.output_path,
+        ss=args.ss,
+        to=args.to,
+        audio_indexes=args.audio_index,
+    )
+
+
+def command_stats(args: Namespace) -> None:
+    from .stats import ffprobe_packet_stats
+    from .util import format_microseconds_as_time_unit_syntax_string
+
+    input_path = args.input_path
+    bitrate_interval = args.bitrate_interval
+    gap_threshold = args.gap_threshold
+    print_bitrate = args.bitrate
+
+    if bitrate_interval <= 0:
+        raise ValueError("--bitrate_interval must be positive")
+
+    result = ffprobe_packet_stats(
+        input_path=input_path,
+        bitrate_interval=bitrate_interval,
+        gap_threshold=gap_threshold,
+    )
+
+    for stream in result.streams:
+        name = f"{stream.index} {stream.codec_type}"
+
+        bitrate_string = f"{stream.bitrate / 1000:.1f} kbps"
+        full_interval_bitrates = result.get_full_interval_bitrates(stream)
+        if len(full_interval_bitrates) != 0:
+            bitrate_string += f" (per {bitrate_interval:g} s: min {min(full_interval_bitrates) / 1000:.1f}, max {max(full_interval_bitrates) / 1000:.1f} kbps)"  # noqa: B950
+
+        packet_duration_string = (
+            f", packet duration {stream.packet_duration:g} s"
+            if stream.packet_duration is not None
+            else ""
+        )
+        print(
+            f"Stream | {name} | {stream.packet_count} packets, {stream.key_packet_count} keyframes, {stream.duration:.3f} s, {bitrate_string}{packet_duration_string}"  # noqa: B950
+        )
+
+        if stream.codec_type == "video":
+            gop_string = ", ".join(
+                f"{length} x {count}" for length, count in stream.gop_histogram.items()
+            )
+            keyframe_interval_string = (
+                f" | keyframe interval {stream.keyframe_interval_min:.3f} - {stream.keyframe_interval_max:.3f} s"  # noqa: B950
+                if stream.keyframe_interval_min is not None
+                and stream.keyframe_interval_max is not None
+                else ""
+            )
+            print(f"GOP | {name} | {gop_string or 'none'}{keyframe_interval_string}")
+
+        if stream.start_offset is not None and stream.end_offset is not None:
+            print(
+                f"Drift | {name} | start {stream.start_offset:+.3f} s, end {stream.end_offset:+.3f} s (A/V drift {stream.end_offset - stream.start_offset:+.3f} s)"  # noqa: B950
+            )
+
+        for discontinuity in stream.discontinuities:
+            time_string = format_microseconds_as_time_unit_syntax_string(
+                round(discontinuity.time * 1_000_000)
+            )
+            print(
+                f"Discontinuity | {name} | Time {time_string}, {discontinuity.delta:+.3f} s"  # noqa: B950
+            )
+
+        omitted_count = stream.discontinuity_count - len(stream.discontinuities)
+        if 0 < omitted_count:
+            print(f"Discontinuity | {name} | {omitted_count} more")
+
+    if print_bitrate:
+        interval_count = max(
+            (len(stream.interval_bitrates) for stream in result.streams), default=0
+        )
+        for interval_index in range(interval_count):
+            time_string = format_microseconds_as_time_unit_syntax_string(
+                round(
+                    (result.origin_seconds + interval_index * bitrate_interval)
+                    * 1_000_000
+                )
+            )
+            bitrate_strings = [
+                f"{stream.index} {stream.codec_type} {interval_bitrate / 1000:.1f} kbps"  # noqa: B950
+                for stream in result.streams
+                for interval_bitrate in stream.interval_bitrates[
+                    interval_index : interval_index + 1
+                ]
+            ]
+            print(f"Bitrate | Time {time_string} | {' | '.join(bitrate_strings)}")
+
+
+def run_handler(args: Namespace) -> None:
+    """
+    --profileでChrome Trace形式（.jsonlならJSON Lines）の処理段階・サブプロセスの記録、
+    --profile_pythonでcProfileの統計（pstats形式）、
+    --metrics_pathでPrometheusのtextfile形式のメトリクスを書き出す
+    """
+    profile_path = args.profile_path
+    profile_python_path = args.profile_python_path
+    metrics_path = args.metrics_path
+
+    if profile_path is None and profile_python_path is None and metrics_path is None:
+        args.handler(args)
+        return
+
+    import cProfile
+
+    from . import metrics, profiling
+
+    if profile_path is not None:
+        profiling.profiler = profiling.Profiler()
+
+    if metrics_path is not None:
+        metrics.exporter = metrics.MetricsExporter(
+            path=Path(metrics_path),
+            interval=args.metrics_interval,
+        )
+        metrics.exporter.start()
+
+    python_profiler = cProfile.Profile() if profile_python_path is not None else None
+    subcommand = args.handler.__name__.removeprefix("command_")
+
+    try:
+        with (
+            metrics.metrics_job(subcommand),
+            profiling.profile_span(args.handler.__name__, category="command"),
+        ):
+            if python_profiler is not None:
+                python_profiler.runcall(args.handler, args)
+            else:
+                args.handler(args)
+    finally:
+        if python_profiler is not None:
+            python_profiler.dump_stats(profile_python_path)
+
+        if profiling.profiler is not None:
+            profiling.profiler.write(Path(profile_path))
+
+        if metrics.exporter is not None:
+            metrics.exporter.stop()
+
+
 def main() -> None:
     parser = ArgumentParser()
     parser.add_argument("-l", "--log_level", type=int, default=logging.INFO)
     parser.add_argument("-v", "--version", action="version", version=PACKAGE_VERSION)
     parser.add_argument("--ffmpeg_path", type=str, default=config.FFMPEG_PATH)
     parser.add_argument("--ffprobe_path", type=str, default=config.FFPROBE_PATH)
+    parser.add_argument(
+        "--profile", "--trace", dest="profile_path", type=str, required=False
+    )
+    parser.add_argument(
+        "--profile_python", dest="profile_python_path", type=str, required=False
+    )
+    parser.add_argument("--metrics_path", type=str, required=False)
+    parser.add_argument("--metrics_interval", type=float, default=15)
 
     subparsers = parser.add_subparsers()
 
@@ -362,6 +2129,13 @@ def main() -> None:
         choices=("tqdm", "plain", "none"),
         default="tqdm",
     )
+    parser_slice.add_argument(
+        "--output_format", type=str, choices=("matroska", "mp4"), required=False
+    )
+    parser_slice.add_argument(
+        "--output_profile", type=str, choices=("default", "seek"), default="default"
+    )
+    parser_slice.add_argument("--verify", action="store_true")
     parser_slice.add_argument("output_path", type=str)
     parser_slice.set_defaults(handler=command_slice)
 
@@ -369,7 +2143,21 @@ def main() -> None:
     parser_crop_scale.add_argument("-i", "--input_path", type=str, required=True)
     parser_crop_scale.add_argument("--crop", type=str, required=False)
     parser_crop_scale.add_argument("--scale", type=str, required=False)
-    parser_crop_scale.add_argument("-vcodec", "--video_codec", type=str, required=False)
+    parser_crop_scale.add_argument(
+        "-vcodec",
+        "--vcodec",
+        "--video_codec",
+        dest="video_codec",
+        type=str,
+        required=False,
+    )
+    parser_crop_scale.add_argument(
+        "-preset", "--video_preset", type=str, required=False
+    )
+    parser_crop_scale.add_argument("--target_speed", type=str, default="1x")
+    parser_crop_scale.add_argument("--gop", type=int, required=False)
+    parser_crop_scale.add_argument("--calibration_seconds", type=float, default=3.0)
+    parser_crop_scale.add_argument("--encoders_cache_path", type=str, required=False)
     parser_crop_scale.add_argument(
         "-p",
         "--progress_type",
@@ -377,13 +2165,61 @@ def main() -> None:
         choices=("tqdm", "plain", "none"),
         default="tqdm",
     )
+    parser_crop_scale.add_argument(
+        "--output_format", type=str, choices=("matroska", "mp4"), required=False
+    )
+    parser_crop_scale.add_argument(
+        "--output_profile", type=str, choices=("default", "seek"), default="default"
+    )
     parser_crop_scale.add_argument("output_path", type=str)
     parser_crop_scale.set_defaults(handler=command_crop_scale)
 
+    parser_encoders = subparsers.add_parser("encoders")
+    parser_encoders.add_argument("-i", "--input_path", type=str, required=False)
+    parser_encoders.add_argument("--crop", type=str, required=False)
+    parser_encoders.add_argument("--scale", type=str, required=False)
+    parser_encoders.add_argument("--calibrate", action="store_true")
+    parser_encoders.add_argument("--calibration_seconds", type=float, default=3.0)
+    parser_encoders.add_argument("--refresh", action="store_true")
+    parser_encoders.add_argument("--cache_path", type=str, required=False)
+    parser_encoders.set_defaults(handler=command_encoders)
+
+    parser_proxy = subparsers.add_parser("proxy")
+    parser_proxy.add_argument("-i", "--input_path", type=str, required=True)
+    parser_proxy.add_argument("--proxy_dir", type=str, required=True)
+    parser_proxy.add_argument("--height", type=int, default=480)
+    parser_proxy.add_argument("--gop", type=int, default=15)
+    parser_proxy.add_argument("-vcodec", "--video_codec", type=str, default="libx264")
+    parser_proxy.add_argument("--crf", type=int, default=23)
+    parser_proxy.add_argument(
+        "-p",
+        "--progress_type",
+        type=str,
+        choices=("tqdm", "plain", "none"),
+        default="tqdm",
+    )
+    parser_proxy.set_defaults(handler=command_proxy)
+
     parser_find_image = subparsers.add_parser("find_image")
     parser_find_image.add_argument("-ss", type=str, required=False)
     parser_find_image.add_argument("-to", type=str, required=False)
-    parser_find_image.add_argument("-i", "--input_video_path", type=str, required=True)
+    parser_find_image.add_argument(
+        "-i",
+        "--input_video_path",
+        type=str,
+        nargs="+",
+        action="extend",
+        required=True,
+    )
+    parser_find_image.add_argument("-j", "--jobs", type=int, required=False)
+    parser_find_image.add_argument("--prefetch", type=int, default=0)
+    parser_find_image.add_argument(
+        "--prefetch_mode", type=str, choices=("cache", "copy"), default="cache"
+    )
+    parser_find_image.add_argument("--prefetch_dir", type=str, required=False)
+    parser_find_image.add_argument(
+        "--prefetch_max_bytes", type=int, default=16 * 1024 * 1024 * 1024
+    )
     parser_find_image.add_argument(
         "-icrop", "--input_video_crop", type=str, required=False
     )
@@ -399,6 +2235,19 @@ def main() -> None:
         "-bt", "--blackframe_threshold", type=int, default=32
     )
     parser_find_image.add_argument("-it", "--output_interval", type=float, default=0)
+    parser_find_image.add_argument("--follow", action="store_true")
+    parser_find_image.add_argument("--follow_timeout", type=float, default=10.0)
+    parser_find_image.add_argument("--checkpoint_path", type=str, required=False)
+    parser_find_image.add_argument("--checkpoint_interval", type=float, default=60.0)
+    parser_find_image.add_argument("--resume", action="store_true")
+    parser_find_image.add_argument("--cache_dir", type=str, required=False)
+    parser_find_image.add_argument("--proxy_dir", type=str, required=False)
+    parser_find_image.add_argument("--fast_decode", action="store_true")
+    parser_find_image.add_argument("--interval", action="store_true")
+    parser_find_image.add_argument("--scene_threshold", type=float, required=False)
+    parser_find_image.add_argument(
+        "--cache_max_bytes", type=int, default=256 * 1024 * 1024
+    )
     parser_find_image.add_argument(
         "-p",
         "--progress_type",
@@ -408,6 +2257,121 @@ def main() -> None:
     )
     parser_find_image.set_defaults(handler=command_find_image)
 
+    parser_find_template = subparsers.add_parser("find_template")
+    parser_find_template.add_argument("-ss", type=str, required=False)
+    parser_find_template.add_argument("-to", type=str, required=False)
+    parser_find_template.add_argument(
+        "-i", "--input_video_path", type=str, required=True
+    )
+    parser_find_template.add_argument(
+        "-icrop", "--input_video_crop", type=str, required=False
+    )
+    parser_find_template.add_argument(
+        "-ref", "--reference_image_path", type=str, required=True
+    )
+    parser_find_template.add_argument(
+        "-refcrop", "--reference_image_crop", type=str, required=False
+    )
+    parser_find_template.add_argument("--fps", type=int, required=False)
+    parser_find_template.add_argument("--analysis_height", type=int, default=360)
+    parser_find_template.add_argument(
+        "--template_scales", type=float, nargs="+", default=[1.0]
+    )
+    parser_find_template.add_argument("--threshold", type=float, default=0.9)
+    parser_find_template.add_argument("--batch_size", type=int, default=16)
+    parser_find_template.add_argument("-it", "--output_interval", type=float, default=0)
+    parser_find_template.add_argument(
+        "-p",
+        "--progress_type",
+        type=str,
+        choices=("tqdm", "plain", "none"),
+        default="tqdm",
+    )
+    parser_find_template.set_defaults(handler=command_find_template)
+
+    parser_find_audio = subparsers.add_parser("find_audio")
+    parser_find_audio.add_argument("-ss", type=str, required=False)
+    parser_find_audio.add_argument("-to", type=str, required=False)
+    parser_find_audio.add_argument("-i", "--input_path", type=str, required=True)
+    parser_find_audio.add_argument("--audio_index", type=int, default=0)
+    parser_find_audio.add_argument(
+        "-ref", "--reference_audio_path", type=str, required=True
+    )
+    parser_find_audio.add_argument("--reference_audio_index", type=int, default=0)
+    parser_find_audio.add_argument("-refss", "--reference_ss", type=str, required=False)
+    parser_find_audio.add_argument("-refto", "--reference_to", type=str, required=False)
+    parser_find_audio.add_argument("--sample_rate", type=int, default=8000)
+    parser_find_audio.add_argument("--threshold", type=float, default=0.6)
+    parser_find_audio.add_argument("--chunk_seconds", type=float, default=60.0)
+    parser_find_audio.add_argument("-it", "--output_interval", type=float, default=0)
+    parser_find_audio.add_argument(
+        "-p",
+        "--progress_type",
+        type=str,
+        choices=("tqdm", "plain", "none"),
+        default="tqdm",
+    )
+    parser_find_audio.set_defaults(handler=command_find_audio)
+
+    parser_analyze = subparsers.add_parser("analyze")
+    parser_analyze.add_argument("-ss", type=str, required=False)
+    parser_analyze.add_argument("-to", type=str, required=False)
+    parser_analyze.add_argument("-i", "--input_video_path", type=str, required=True)
+    parser_analyze.add_argument(
+        "-icrop", "--input_video_crop", type=str, required=False
+    )
+    parser_analyze.add_argument("--find_image", type=str, action="append")
+    parser_analyze.add_argument(
+        "-refcrop", "--reference_image_crop", type=str, required=False
+    )
+    parser_analyze.add_argument("-ba", "--blackframe_amount", type=int, default=98)
+    parser_analyze.add_argument("-bt", "--blackframe_threshold", type=int, default=32)
+    parser_analyze.add_argument("--black", action="store_true")
+    parser_analyze.add_argument("--scene", type=float, required=False)
+    parser_analyze.add_argument("--fingerprint_path", type=str, required=False)
+    parser_analyze.add_argument("--fps", type=int, required=False)
+    parser_analyze.add_argument("--analysis_height", type=int, default=360)
+    parser_analyze.add_argument("--slots", type=int, default=32)
+    parser_analyze.add_argument(
+        "-p",
+        "--progress_type",
+        type=str,
+        choices=("tqdm", "plain", "none"),
+        default="tqdm",
+    )
+    parser_analyze.set_defaults(handler=command_analyze)
+
+    parser_chapters = subparsers.add_parser("chapters")
+    parser_chapters.add_argument("-i", "--input_video_path", type=str, required=True)
+    parser_chapters.add_argument("chapters_path", type=str)
+    parser_chapters.add_argument(
+        "--audio_title",
+        type=str,
+        nargs=2,
+        action="append",
+        metavar=("TRACK_INDEX", "TITLE"),
+    )
+    parser_chapters.add_argument("--remux", action="store_true")
+    parser_chapters.set_defaults(handler=command_chapters)
+
+    parser_extract_frames = subparsers.add_parser("extract_frames")
+    parser_extract_frames.add_argument(
+        "-i", "--input_video_path", type=str, required=True
+    )
+    parser_extract_frames.add_argument("--times", type=str, nargs="+", action="extend")
+    parser_extract_frames.add_argument("--frames", type=int, nargs="+", action="extend")
+    parser_extract_frames.add_argument("--from_path", type=str, required=False)
+    parser_extract_frames.add_argument("-o", "--output_dir", type=str, required=False)
+    parser_extract_frames.add_argument(
+        "--image_format", type=str, choices=("png", "jpg"), default="png"
+    )
+    parser_extract_frames.add_argument("--contact_sheet_path", type=str, required=False)
+    parser_extract_frames.add_argument("--columns", type=int, default=4)
+    parser_extract_frames.add_argument("--thumbnail_width", type=int, default=320)
+    parser_extract_frames.add_argument("--dense_gap", type=float, required=False)
+    parser_extract_frames.add_argument("--inputs_per_process", type=int, default=16)
+    parser_extract_frames.set_defaults(handler=command_extract_frames)
+
     parser_audio = subparsers.add_parser("audio")
     parser_audio.add_argument("-i", "--input_path", type=str, required=True)
     parser_audio.set_defaults(handler=command_audio)
@@ -424,9 +2388,47 @@ def main() -> None:
         choices=("tqdm", "plain", "none"),
         default="tqdm",
     )
+    parser_select_audio.add_argument(
+        "--output_format", type=str, choices=("matroska", "mp4"), required=False
+    )
+    parser_select_audio.add_argument(
+        "--output_profile", type=str, choices=("default", "seek"), default="default"
+    )
+    parser_select_audio.add_argument("--verify", action="store_true")
     parser_select_audio.add_argument("output_path", type=str)
     parser_select_audio.set_defaults(handler=command_select_audio)
 
+    parser_verify = subparsers.add_parser("verify")
+    parser_verify.add_argument("-ss", type=str, required=False)
+    parser_verify.add_argument("-to", type=str, required=False)
+    parser_verify.add_argument("-i", "--input_path", type=str, required=True)
+    parser_verify.add_argument("--audio_index", type=int, nargs="+", required=False)
+    parser_verify.add_argument("output_path", type=str)
+    parser_verify.set_defaults(handler=command_verify)
+
+    parser_stats = subparsers.add_parser("stats")
+    parser_stats.add_argument("-i", "--input_path", type=str, required=True)
+    parser_stats.add_argument("--bitrate_interval", type=float, default=1.0)
+    parser_stats.add_argument("--gap_threshold", type=float, default=0.1)
+    parser_stats.add_argument("--bitrate", action="store_true")
+    parser_stats.set_defaults(handler=command_stats)
+
+    parser_join = subparsers.add_parser("join")
+    parser_join.add_argument(
+        "-i", "--input_path", type=str, nargs="+", action="extend", required=True
+    )
+    parser_join.add_argument("-j", "--jobs", type=int, required=False)
+    parser_join.add_argument("--prefetch", type=int, default=0)
+    parser_join.add_argument(
+        "-p",
+        "--progress_type",
+        type=str,
+        choices=("tqdm", "plain", "none"),
+        default="tqdm",
+    )
+    parser_join.add_argument("output_path", type=str)
+    parser_join.set_defaults(handler=command_join)
+
     args = parser.parse_args()
 
     log_level = args.log_level
@@ -439,6 +2441,6 @@ def main() -> None:
     config.FFPROBE_PATH = args.ffprobe_path
 
     if hasattr(args, "handler"):
-        args.handler(args)
+        run_handler(args)
     else:
         parser.print_help()
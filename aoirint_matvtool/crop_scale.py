@@ -1,12 +1,19 @@
 import re
 import subprocess
 from pathlib import Path
-from typing import Iterable, Optional, Union
+from typing import Iterable, List, Optional, Union
 
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
 from .find_image import FfmpegProgressLine
+from .seek_index import get_output_profile_options
+from .stream_io import (
+    get_ffmpeg_input_url,
+    get_ffmpeg_output_format_options,
+    get_ffmpeg_output_url,
+    is_stdio_path,
+)
 from .util import exclude_none
 
 
@@ -15,14 +22,10 @@ class FfmpegCropScaleResult(BaseModel):
     message: Optional[str]
 
 
-def ffmpeg_crop_scale(
-    input_path: Path,
+def get_crop_scale_video_filters(
     crop: Optional[str],
     scale: Optional[str],
-    video_codec: Optional[str],
-    output_path: Path,
-) -> Iterable[Union[FfmpegCropScaleResult, FfmpegProgressLine]]:
-    # TODO: quality control
+) -> List[str]:
     if crop is not None and "," in crop:
         raise ValueError("Invalid crop argument. Remove ',' from crop.")
 
@@ -32,7 +35,7 @@ def ffmpeg_crop_scale(
     crop_filter_string = f"crop={crop}" if crop is not None else None
     scale_filter_string = f"scale={scale}" if scale is not None else None
 
-    video_filters = list(
+    return list(
         exclude_none(
             [
                 crop_filter_string,
@@ -40,56 +43,89 @@ def ffmpeg_crop_scale(
             ]
         )
     )
+
+
+def ffmpeg_crop_scale(
+    input_path: Union[Path, str],
+    crop: Optional[str],
+    scale: Optional[str],
+    video_codec: Optional[str],
+    output_path: Union[Path, str],
+    output_format: Optional[str] = None,
+    output_profile: str = "default",
+    video_preset: Optional[str] = None,
+    gop: Optional[int] = None,
+) -> Iterable[Union[FfmpegCropScaleResult, FfmpegProgressLine]]:
+    # TODO: quality control
+    video_filters = get_crop_scale_video_filters(crop=crop, scale=scale)
     video_filter_opts = (
         ["-filter:v", ",".join(video_filters)] if len(video_filters) != 0 else []
     )
 
     video_codec_opts = ["-c:v", video_codec] if video_codec is not None else []
+    video_preset_opts = ["-preset", video_preset] if video_preset is not None else []
+    # キーフレームの間隔（フレーム数）
+    gop_opts = ["-g", str(gop)] if gop is not None else []
 
     command = [
         config.FFMPEG_PATH,
         "-hide_banner",
         "-n",  # fail if already exists
         "-i",
-        str(input_path),
+        get_ffmpeg_input_url(input_path),
         *video_filter_opts,
         *video_codec_opts,
+        *video_preset_opts,
+        *gop_opts,
         "-c:a",
         "copy",
         "-map",
         "0",
         "-map_metadata",
         "0",
-        str(output_path),
+        *get_ffmpeg_output_format_options(
+            output_path=output_path, output_format=output_format
+        ),
+        *get_output_profile_options(
+            output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
+        ),
+        get_ffmpeg_output_url(output_path),
     ]
-    proc = subprocess.Popen(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
-    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=None if is_stdio_path(output_path) else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
 
-    lines = []
-    try:
-        while proc.poll() is None:
-            assert proc.stderr is not None
-            line = proc.stderr.readline().rstrip()
-            lines += [line]
-
-            match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
-            if match:
-                frame = int(match.group(1))
-                _time = match.group(2).strip()
-
-                progress = FfmpegProgressLine(
-                    frame=frame,
-                    time=_time,
-                )
-                yield progress
-
-        returncode = proc.wait()
-    finally:
-        proc.kill()
+        lines = []
+        try:
+            while proc.poll() is None:
+                assert proc.stderr is not None
+                line = proc.stderr.readline()
+                profile_args["pipe_bytes"] += len(line)
+
+                line = line.rstrip()
+                lines += [line]
+
+                match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
+                if match:
+                    frame = int(match.group(1))
+                    _time = match.group(2).strip()
+
+                    progress = FfmpegProgressLine(
+                        frame=frame,
+                        time=_time,
+                    )
+                    yield progress
+
+            returncode = proc.wait()
+        finally:
+            proc.kill()
 
     if returncode != 0:
         # skip Input or indented block to head the error message
@@ -0,0 +1,355 @@
+"""
+映像エンコーダの検出と速度の計測（matvtool encoders、crop_scale -vcodec auto）
+
+FFmpegのバージョンと使えるエンコーダを一度だけ調べてキャッシュ（JSON）に記録する
+FFmpegの実行ファイルが変わったら（パス・サイズ・更新時刻）調べ直す
+
+候補のエンコーダ・プリセット（ENCODER_CANDIDATES）ごとに、入力の一部を実際に
+エンコードして（デコード・フィルタを含む）fpsを計測し、入力の形式とフィルタごとに記録する
+ハードウェアエンコーダは、一覧にあってもデバイスがなければ計測に失敗し、候補から外れる
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image_batch import ffprobe_duration
+from .fps import ffmpeg_fps
+from .inputs import ffmpeg_get_input
+
+ENCODER_CACHE_VERSION = 1
+
+FFMPEG_ENCODER_PATTERN = re.compile(r"^ V[A-Z.]{5} (\S+)\s")
+FFMPEG_PROGRESS_FRAME_PATTERN = re.compile(r"frame=\s*(\d+)\s")
+
+
+class EncoderConfig(BaseModel):
+    encoder: str
+    preset: Optional[str]
+
+    def describe(self) -> str:
+        if self.preset is None:
+            return self.encoder
+
+        return f"{self.encoder} {self.preset}"
+
+
+ENCODER_CANDIDATES = [
+    EncoderConfig(encoder="libx264", preset="medium"),
+    EncoderConfig(encoder="h264_nvenc", preset="p5"),
+    EncoderConfig(encoder="h264_qsv", preset="medium"),
+    EncoderConfig(encoder="libx264", preset="fast"),
+    EncoderConfig(encoder="h264_videotoolbox", preset=None),
+    EncoderConfig(encoder="h264_nvenc", preset="p1"),
+    EncoderConfig(encoder="h264_qsv", preset="veryfast"),
+    EncoderConfig(encoder="libx264", preset="veryfast"),
+    EncoderConfig(encoder="libx264", preset="ultrafast"),
+]
+"""-vcodec autoの候補（H.264、圧縮効率の高い順）"""
+
+
+class EncoderCalibration(BaseModel):
+    config: EncoderConfig
+    fps: Optional[float]
+    """計測したfps（エンコードに失敗したらNone）"""
+
+
+class EncoderCapabilities(BaseModel):
+    version: int = ENCODER_CACHE_VERSION
+    ffmpeg_identity: str
+    ffmpeg_version: str
+    video_encoders: List[str]
+    calibrations: Dict[str, List[EncoderCalibration]] = {}
+    """計測の条件（get_calibration_key）ごとの計測結果"""
+
+
+def get_default_encoders_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(cache_home) / "matvtool" / "encoders.json"
+
+
+def get_ffmpeg_identity() -> str:
+    """
+    FFmpegの実行ファイルの同一性（パス・サイズ・更新時刻）
+    """
+    ffmpeg_path = shutil.which(config.FFMPEG_PATH) or config.FFMPEG_PATH
+    stat = os.stat(ffmpeg_path)
+    return f"{os.path.realpath(ffmpeg_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def run_ffmpeg_info(options: List[str]) -> str:
+    command = [config.FFMPEG_PATH, "-hide_banner", *options]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    return proc.stdout
+
+
+def ffmpeg_version() -> str:
+    # ffmpeg version 6.1.1-3ubuntu5 Copyright (c) 2000-2023 the FFmpeg developers
+    first_line = run_ffmpeg_info(["-version"]).split("\n", 1)[0]
+    match = re.match(r"^ffmpeg version (\S+)", first_line)
+    if not match:
+        raise Exception(f"Unsupported FFmpeg version line: {first_line}")
+
+    return match.group(1)
+
+
+def ffmpeg_video_encoders() -> List[str]:
+    # V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)  # noqa: B950
+    video_encoders: List[str] = []
+    for line in run_ffmpeg_info(["-encoders"]).splitlines():
+        match = FFMPEG_ENCODER_PATTERN.match(line)
+        if match and match.group(1) != "=":
+            video_encoders.append(match.group(1))
+
+    return video_encoders
+
+
+def save_encoder_capabilities(
+    capabilities: EncoderCapabilities,
+    cache_path: Path,
+) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_cache_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    tmp_cache_path.write_text(capabilities.model_dump_json(), encoding="utf-8")
+    os.replace(tmp_cache_path, cache_path)
+
+
+def load_encoder_capabilities(
+    cache_path: Path,
+    refresh: bool = False,
+) -> EncoderCapabilities:
+    """
+    キャッシュからFFmpegのバージョンとエンコーダの一覧を読み込む
+    （キャッシュがない・FFmpegが変わった・refreshのときは調べ直して記録する）
+    """
+    ffmpeg_identity = get_ffmpeg_identity()
+
+    if not refresh and cache_path.exists():
+        try:
+            capabilities = EncoderCapabilities.model_validate_json(
+                cache_path.read_text(encoding="utf-8")
+            )
+            if (
+                capabilities.version == ENCODER_CACHE_VERSION
+                and capabilities.ffmpeg_identity == ffmpeg_identity
+            ):
+                metrics.count_probe_cache(hit=True)
+                return capabilities
+        except ValueError:
+            config.logger.warning(f"Ignored broken encoders cache: {cache_path}")
+
+    metrics.count_probe_cache(hit=False)
+    capabilities = EncoderCapabilities(
+        ffmpeg_identity=ffmpeg_identity,
+        ffmpeg_version=ffmpeg_version(),
+        video_encoders=ffmpeg_video_encoders(),
+    )
+    save_encoder_capabilities(capabilities=capabilities, cache_path=cache_path)
+    return capabilities
+
+
+def get_calibration_key(
+    input_description: str,
+    video_filters: List[str],
+    calibration_seconds: float,
+) -> str:
+    """
+    計測の条件（入力の形式・フィルタ・計測の長さ）のハッシュ
+    """
+    key = "\n".join(
+        [input_description, ",".join(video_filters), f"{calibration_seconds:.3f}"]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def ffmpeg_calibrate_encoder(
+    input_opts: List[str],
+    video_filters: List[str],
+    encoder_config: EncoderConfig,
+    calibration_seconds: float,
+) -> Optional[float]:
+    """
+    入力の一部をエンコードして（出力は捨てる）、fpsを計測する（失敗したらNone）
+    """
+    video_filter_opts = (
+        ["-filter:v", ",".join(video_filters)] if len(video_filters) != 0 else []
+    )
+    preset_opts = (
+        ["-preset", encoder_config.preset] if encoder_config.preset is not None else []
+    )
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostdin",
+        *input_opts,
+        "-t",
+        f"{calibration_seconds:.6f}",
+        "-map",
+        "0:v:0",
+        *video_filter_opts,
+        "-c:v",
+        encoder_config.encoder,
+        *preset_opts,
+        "-f",
+        "null",
+        "-",
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        start_time = time.perf_counter()
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            errors="replace",
+        )
+        elapsed_seconds = time.perf_counter() - start_time
+        profile_args["pipe_bytes"] = len(proc.stderr)
+
+    if proc.returncode != 0:
+        config.logger.info(
+            f"Encoder unavailable: {encoder_config.describe()} (code {proc.returncode})"
+        )
+        return None
+
+    # frame=  180 fps=...（最後の進捗）
+    frame_matches = FFMPEG_PROGRESS_FRAME_PATTERN.findall(proc.stderr)
+    if len(frame_matches) == 0 or elapsed_seconds <= 0:
+        return None
+
+    return int(frame_matches[-1]) / elapsed_seconds
+
+
+def calibrate_encoders(
+    capabilities: EncoderCapabilities,
+    cache_path: Path,
+    input_description: str,
+    input_opts: List[str],
+    video_filters: List[str],
+    calibration_seconds: float = 3.0,
+    refresh: bool = False,
+) -> List[EncoderCalibration]:
+    """
+    使える候補のエンコーダ・プリセットのfpsを計測する（同じ条件の計測結果はキャッシュを使う）
+    """
+    calibration_key = get_calibration_key(
+        input_description=input_description,
+        video_filters=video_filters,
+        calibration_seconds=calibration_seconds,
+    )
+    if not refresh and calibration_key in capabilities.calibrations:
+        metrics.count_probe_cache(hit=True)
+        return capabilities.calibrations[calibration_key]
+
+    metrics.count_probe_cache(hit=False)
+
+    calibrations = [
+        EncoderCalibration(
+            config=encoder_config,
+            fps=ffmpeg_calibrate_encoder(
+                input_opts=input_opts,
+                video_filters=video_filters,
+                encoder_config=encoder_config,
+                calibration_seconds=calibration_seconds,
+            ),
+        )
+        for encoder_config in ENCODER_CANDIDATES
+        if encoder_config.encoder in capabilities.video_encoders
+    ]
+
+    capabilities.calibrations[calibration_key] = calibrations
+    save_encoder_capabilities(capabilities=capabilities, cache_path=cache_path)
+    return calibrations
+
+
+def get_calibration_input_opts(
+    input_path: Union[Path, str],
+    calibration_seconds: float,
+) -> Tuple[str, List[str], float]:
+    """
+    入力の形式（映像トラックの説明）・計測の入力オプション（動画の中央付近）・fps
+    """
+    inp = ffmpeg_get_input(input_path=input_path)
+    video_track = next(
+        track
+        for stream in inp.streams
+        for track in stream.tracks
+        if track.type == "Video"
+    )
+
+    fps = ffmpeg_fps(input_path=input_path).fps
+    if fps is None:
+        raise Exception("Failed to get fps")
+
+    duration = ffprobe_duration(input_path=input_path)
+    ss = max(0.0, (duration or 0.0) / 2 - calibration_seconds / 2)
+
+    return (
+        video_track.text,
+        ["-ss", f"{ss:.6f}", "-i", str(input_path)],
+        fps,
+    )
+
+
+def select_encoder(
+    calibrations: List[EncoderCalibration],
+    target_fps: float,
+) -> EncoderConfig:
+    """
+    目標のfpsを満たす候補のうち、圧縮効率の高い（ENCODER_CANDIDATESの順で先の）ものを選ぶ
+    満たす候補がなければ、最も速いものを選ぶ
+    """
+    available_calibrations = [
+        calibration for calibration in calibrations if calibration.fps is not None
+    ]
+    if len(available_calibrations) == 0:
+        raise Exception("No available encoder")
+
+    for calibration in available_calibrations:
+        assert calibration.fps is not None
+        if target_fps <= calibration.fps:
+            return calibration.config
+
+    fastest_calibration = max(
+        available_calibrations,
+        key=lambda calibration: calibration.fps or 0.0,
+    )
+    config.logger.warning(
+        f"No encoder meets the target {target_fps:.1f} fps. Use the fastest: {fastest_calibration.config.describe()} ({fastest_calibration.fps:.1f} fps)"  # noqa: B950
+    )
+    return fastest_calibration.config
+
+
+def parse_target_speed(string: str) -> float:
+    """
+    2x・1.5のような速度の倍率
+    """
+    speed = float(string.removesuffix("x"))
+    if speed <= 0:
+        raise ValueError(f"Invalid target speed: {string}")
+
+    return speed
@@ -0,0 +1,375 @@
+"""
+多数の時刻のフレームの書き出し（matvtool extract_frames）
+
+時刻を並べて、間隔がキーフレーム間隔（dense_gap）以下の時刻をまとめる（バッチ）
+- 疎な時刻（1つだけのバッチ）は、キーフレームへシークしてその時刻までデコードする
+- 密な時刻（複数のバッチ）は、最初の時刻へシークして最後の時刻まで1回だけ順にデコードし、
+  selectフィルタで各時刻のフレームを選ぶ
+
+複数のバッチを1つのFFmpegの入力（-ss/-to）として、inputs_per_process個ずつ1つのプロセスで書き出す
+各時刻のフレームは、その時刻以降で最初のフレーム（find_imageの時刻ならそのフレーム）
+"""
+
+import os
+import re
+import shutil
+import statistics
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Generator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .util import format_microseconds_as_time_unit_syntax_string
+
+FFMPEG_EXTRACT_FRAMES_SHOWINFO_PATTERN = re.compile(
+    r"^\[extract_frames_(\d+) @ \S+\] n:\s*\d+ pts:\s*\S+ pts_time:(\S+)"
+)
+
+
+class ExtractFramesBatch(BaseModel):
+    start_microseconds: int
+    """シーク先（最初の時刻）"""
+    end_microseconds: int
+    """デコードの終わり（最後の時刻の次のフレームまで）"""
+    target_microseconds: List[int]
+
+
+class ExtractedFrame(BaseModel):
+    target_microseconds: int
+    frame_microseconds: int
+    """書き出したフレームの時刻"""
+    output_path: Path
+
+
+def ffprobe_key_frame_interval(
+    input_path: Path,
+    probe_seconds: float = 60.0,
+) -> Optional[float]:
+    """
+    先頭probe_seconds秒のキーフレームの間隔の中央値（秒、デコードせずパケットから調べる）
+    """
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-read_intervals",
+        f"%+{probe_seconds:.6f}",
+        "-select_streams",
+        "v:0",
+        "-show_packets",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    # 0.000000,K__
+    key_frame_times: List[float] = []
+    for line in proc.stdout.splitlines():
+        row = line.split(",")
+        if len(row) < 2 or not row[1].startswith("K"):
+            continue
+
+        try:
+            key_frame_times.append(float(row[0]))
+        except ValueError:  # N/A
+            continue
+
+    key_frame_times.sort()
+    intervals = [
+        next_time - time
+        for time, next_time in zip(key_frame_times, key_frame_times[1:])
+        if time < next_time
+    ]
+    if len(intervals) == 0:
+        return None
+
+    return statistics.median(intervals)
+
+
+def get_frame_target_microseconds(
+    frame: int, fps: float, first_frame_microseconds: int
+) -> int:
+    """
+    フレーム番号（最初の映像フレームが0、find_imageと同じ）のフレームを選ぶ時刻
+    （そのフレームの半フレーム前）
+
+    first_frame_microsecondsは最初の映像フレームのFFmpegの時刻
+    （AACの音声を含むMKVなどでは、映像がコンテナの開始時刻より後から始まる）
+
+    MKVなどの時刻はミリ秒単位に丸められ、公称の時刻より前になることがあるため、
+    公称の時刻を指定すると次のフレームを選んでしまう
+    """
+    return max(0, first_frame_microseconds + round((frame - 0.5) * 1_000_000 / fps))
+
+
+def get_extract_frames_batches(
+    target_microseconds: List[int],
+    dense_gap_microseconds: int,
+    frame_microseconds: int,
+) -> List[ExtractFramesBatch]:
+    """
+    時刻を並べて、間隔がdense_gap_microseconds以下の時刻を1つのバッチにまとめる
+    """
+    batches: List[ExtractFramesBatch] = []
+    for microseconds in sorted(set(target_microseconds)):
+        if (
+            len(batches) != 0
+            and microseconds - batches[-1].target_microseconds[-1]
+            <= dense_gap_microseconds
+        ):
+            batch = batches[-1]
+            batch.target_microseconds.append(microseconds)
+            batch.end_microseconds = microseconds + frame_microseconds
+            continue
+
+        batches.append(
+            ExtractFramesBatch(
+                start_microseconds=microseconds,
+                end_microseconds=microseconds + frame_microseconds,
+                target_microseconds=[microseconds],
+            )
+        )
+
+    return batches
+
+
+def get_select_expression(
+    target_microseconds: List[int],
+    start_microseconds: int,
+) -> str:
+    """
+    各時刻以降で最初のフレームを選ぶselectフィルタの式（時刻はシーク先からの相対時刻）
+    """
+    terms = []
+    for microseconds in target_microseconds:
+        # 時刻の丸め誤差を考慮して1マイクロ秒の余裕を持たせる
+        seconds = f"{(microseconds - start_microseconds - 1) / 1_000_000:.6f}"
+        # 最初のフレームのprev_tはNaN（gteは0）
+        terms.append(f"gte(t,{seconds})*not(gte(prev_t,{seconds}))")
+
+    return "+".join(terms)
+
+
+def ffmpeg_extract_frame_batches(
+    input_path: Path,
+    batches: List[ExtractFramesBatch],
+    work_dir: Path,
+    image_format: str,
+) -> List[List[Tuple[int, Path]]]:
+    """
+    バッチごとの入力を1つのプロセスでデコードし、選んだフレームを画像に書き出す
+
+    バッチごとに、選んだフレームの時刻（FFmpegの時刻）と画像のパスを返す
+    """
+    input_opts: List[str] = []
+    filters: List[str] = []
+    output_opts: List[str] = []
+    for batch_index, batch in enumerate(batches):
+        input_opts += [
+            "-ss",
+            format_microseconds_as_time_unit_syntax_string(batch.start_microseconds),
+            "-to",
+            format_microseconds_as_time_unit_syntax_string(batch.end_microseconds),
+            "-i",
+            str(input_path),
+        ]
+
+        select_expression = get_select_expression(
+            target_microseconds=batch.target_microseconds,
+            start_microseconds=batch.start_microseconds,
+        )
+        filters.append(
+            f"[{batch_index}:v:0]select='{select_expression}',showinfo@extract_frames_{batch_index}[v{batch_index}]"  # noqa: B950
+        )
+
+        output_opts += [
+            "-map",
+            f"[v{batch_index}]",
+            "-vsync",
+            "passthrough",
+            "-f",
+            "image2",
+            str(work_dir / f"{batch_index}_%06d.{image_format}"),
+        ]
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostats",
+        *input_opts,
+        "-filter_complex",
+        ";".join(filters),
+        *output_opts,
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        profile_args["pipe_bytes"] = len(proc.stderr)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    # [extract_frames_0 @ 0x...] n:   0 pts:    200 pts_time:0.2     duration:...
+    batch_frames: List[List[Tuple[int, Path]]] = [[] for _ in batches]
+    for line_bytes in proc.stderr.splitlines():
+        line = line_bytes.decode("utf-8", errors="replace")
+        match = FFMPEG_EXTRACT_FRAMES_SHOWINFO_PATTERN.match(line)
+        if not match:
+            continue
+
+        batch_index = int(match.group(1))
+        frames = batch_frames[batch_index]
+        frames.append(
+            (
+                batches[batch_index].start_microseconds
+                + round(float(match.group(2)) * 1_000_000),
+                work_dir / f"{batch_index}_{len(frames) + 1:06d}.{image_format}",
+            )
+        )
+
+    return batch_frames
+
+
+def ffmpeg_extract_frames(
+    input_path: Path,
+    target_microseconds: List[int],
+    output_paths: List[Path],
+    dense_gap_microseconds: int,
+    frame_microseconds: int,
+    image_format: str = "png",
+    inputs_per_process: int = 16,
+) -> Generator[ExtractedFrame, None, None]:
+    """
+    各時刻（FFmpegの時刻）のフレームを、output_paths（時刻と同じ順）に書き出す
+
+    時刻が動画の範囲外のときは書き出さない
+    """
+    output_path_by_target: Dict[int, List[Path]] = {}
+    for microseconds, output_path in zip(target_microseconds, output_paths):
+        output_path_by_target.setdefault(microseconds, []).append(output_path)
+
+    batches = get_extract_frames_batches(
+        target_microseconds=target_microseconds,
+        dense_gap_microseconds=dense_gap_microseconds,
+        frame_microseconds=frame_microseconds,
+    )
+
+    for process_index in range(0, len(batches), inputs_per_process):
+        process_batches = batches[process_index : process_index + inputs_per_process]
+
+        with TemporaryDirectory() as tmpdir:
+            batch_frames = ffmpeg_extract_frame_batches(
+                input_path=input_path,
+                batches=process_batches,
+                work_dir=Path(tmpdir),
+                image_format=image_format,
+            )
+
+            for batch, frames in zip(process_batches, batch_frames):
+                for microseconds in batch.target_microseconds:
+                    # 時刻以降で最初に選んだフレーム
+                    frame = next(
+                        (
+                            (frame_time, image_path)
+                            for frame_time, image_path in frames
+                            if microseconds - 1 <= frame_time
+                        ),
+                        None,
+                    )
+                    if frame is None:
+                        config.logger.warning(
+                            f"Frame not found: {format_microseconds_as_time_unit_syntax_string(microseconds)}"  # noqa: B950
+                        )
+                        continue
+
+                    frame_time, image_path = frame
+                    for output_path in output_path_by_target[microseconds]:
+                        output_path.parent.mkdir(parents=True, exist_ok=True)
+                        tmp_output_path = output_path.with_name(
+                            f".{output_path.name}.{os.getpid()}.tmp"
+                        )
+                        shutil.copyfile(image_path, tmp_output_path)
+                        os.replace(tmp_output_path, output_path)
+
+                        yield ExtractedFrame(
+                            target_microseconds=microseconds,
+                            frame_microseconds=frame_time,
+                            output_path=output_path,
+                        )
+
+
+def ffmpeg_contact_sheet(
+    image_paths: List[Path],
+    output_path: Path,
+    columns: int,
+    thumbnail_width: int,
+) -> None:
+    """
+    画像を縮小して、columns列に並べた1枚の画像（コンタクトシート）を書き出す
+    """
+    rows = (len(image_paths) + columns - 1) // columns
+
+    with TemporaryDirectory() as tmpdir:
+        # 画像の一覧（concat demuxer）
+        concat_list_path = Path(tmpdir) / "images.txt"
+        concat_list_path.write_text(
+            "".join(
+                "file '{}'\n".format(str(path.resolve()).replace("'", "'\\''"))
+                for path in image_paths
+            ),
+            encoding="utf-8",
+        )
+
+        command = [
+            config.FFMPEG_PATH,
+            "-hide_banner",
+            "-nostats",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            str(concat_list_path),
+            "-filter:v",
+            f"scale={thumbnail_width}:-2,tile={columns}x{rows}:padding=4:margin=4",
+            "-frames:v",
+            "1",
+            "-update",
+            "1",
+            str(output_path),
+        ]
+
+        metrics.count_subprocess_spawn(command)
+        with profiling.profile_subprocess(command) as profile_args:
+            proc = subprocess.run(
+                command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            profile_args["pipe_bytes"] = len(proc.stderr)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
@@ -0,0 +1,131 @@
+"""
+解析用の高速デコード（find_image --fast_decode）
+
+比較にはデコードの画質が必要ないため、デコーダの処理の一部を省略する
+- -skip_loop_filter all: デブロッキングフィルタ（H.264/HEVCなど）を省略
+- -skip_idct noref: 参照されないフレームの逆DCTを省略（誤差が後続のフレームに伝播しない）
+- -skip_frame noref: 参照されないフレームをデコードしない
+  （--fpsの間引きと組み合わせ、入力にBフレームがある場合のみ、fpsフィルタが前後のフレームで補う）
+- -lowres: 縦横1/2^Nの解像度でデコード（MPEG-1/2/4、MJPEGなど対応するコーデックのみ）
+
+画質を落としたフレームと比較するため、検出結果が通常のデコードと一致するとは限らない
+速くなるか・検出結果が一致するかは、動画の内容とコーデック（GOPの構成）による
+"""
+
+import os
+import subprocess
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from . import config, metrics, profiling
+
+FAST_DECODE_LOWRES = 1
+"""-lowresに対応するコーデックで、縦横1/2の解像度でデコード"""
+
+LOWRES_CODEC_NAMES = {
+    "h261",
+    "h263",
+    "h263p",
+    "mjpeg",
+    "mpeg1video",
+    "mpeg2video",
+    "mpeg4",
+    "msmpeg4v1",
+    "msmpeg4v2",
+    "msmpeg4v3",
+    "wmv1",
+    "wmv2",
+}
+"""-lowresに対応するデコーダ（H.264、HEVC、VP9、AV1などは非対応）"""
+
+
+class VideoStreamInfo(NamedTuple):
+    codec_name: str
+    width: int
+    height: int
+    has_b_frames: int
+    """並べ替えが必要なBフレームの数（0ならBフレームがない）"""
+
+
+def ffprobe_video_stream_info(input_path: Path) -> VideoStreamInfo:
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name,width,height,has_b_frames",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    # h264,1920,1080,2
+    codec_name, width_string, height_string, has_b_frames_string = (
+        proc.stdout.strip().split(",")[:4]
+    )
+    return VideoStreamInfo(
+        codec_name=codec_name,
+        width=int(width_string),
+        height=int(height_string),
+        has_b_frames=int(has_b_frames_string),
+    )
+
+
+def get_fast_decode_lowres(codec_name: str) -> int:
+    return FAST_DECODE_LOWRES if codec_name in LOWRES_CODEC_NAMES else 0
+
+
+def get_lowres_size(width: int, height: int, lowres: int) -> Tuple[int, int]:
+    """
+    -lowresでデコードしたフレームの解像度（切り上げ）
+    """
+    return -(-width >> lowres), -(-height >> lowres)
+
+
+def get_fast_decode_input_opts(
+    fps: Optional[int], lowres: int, skip_noref: bool
+) -> List[str]:
+    """
+    入力動画（-iの前）に指定するデコーダのオプション
+
+    skip_norefが真のとき、--fpsの間引きと組み合わせて参照されないフレームをデコードしない
+    """
+    opts = [
+        "-skip_loop_filter",
+        "all",
+        "-skip_idct",
+        "noref",
+        # 自動（0）ではスレッド数が16までに制限されるため、CPUの数を指定する
+        "-threads",
+        f"{os.cpu_count() or 0}",
+    ]
+
+    # フレームを間引かない場合は、フレーム番号がずれるため省略しない
+    # 参照されないフレームがない入力では、省略できるフレームがない
+    if fps is not None and skip_noref:
+        opts += [
+            "-skip_frame",
+            "noref",
+        ]
+
+    if lowres != 0:
+        opts += [
+            "-lowres",
+            f"{lowres}",
+        ]
+
+    return opts
@@ -0,0 +1,319 @@
+"""
+音声の検索（matvtool find_audio）
+
+オーディオトラックを1つだけ、低いサンプリングレートのモノラルのPCM（f32le）として
+FFmpegの標準出力から順に読み、参照音声（ジングルなど）との相互相関を計算する
+
+PCMを一定の長さ（チャンク）ごとに、参照音声の長さ分だけ前のチャンクと重ねて、
+NumPyのFFTで相互相関を計算し（overlap-save）、
+正規化相互相関（-1から1、1で完全に一致）を一致度とする
+一致度がthreshold以上の区間ごとに、参照音声の長さの中で最も一致した位置を出力する
+
+NumPyは任意の依存関係（pip install "aoirint-matvtool[audio]"）
+"""
+
+import collections
+import subprocess
+import threading
+from pathlib import Path
+from typing import IO, Deque, Generator, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image import FfmpegProgressLine
+from .util import format_microseconds_as_time_unit_syntax_string
+
+try:
+    import numpy as np
+    import numpy.typing as npt
+except ImportError as error:  # 任意の依存関係
+    raise ImportError(
+        'find_audio requires NumPy: pip install "aoirint-matvtool[audio]"'
+    ) from error
+
+
+MINIMUM_WINDOW_VARIANCE = 1e-8
+"""無音の（振幅の分散がこれ未満の）範囲は、一致度を0とする"""
+
+
+class FindAudioMatch(BaseModel):
+    internal_microseconds: int
+    """走査の開始位置（-ss）からの、参照音声の先頭の時刻"""
+    score: float
+
+
+def get_audio_decode_command(
+    input_path: Path,
+    audio_index: int,
+    sample_rate: int,
+    ss: Optional[str] = None,
+    to: Optional[str] = None,
+) -> List[str]:
+    slice_opts = []
+    if ss is not None:
+        slice_opts += ["-ss", ss]
+
+    if to is not None:
+        slice_opts += ["-to", to]
+
+    return [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostdin",
+        "-nostats",
+        "-loglevel",
+        "error",
+        *slice_opts,
+        "-i",
+        str(input_path),
+        "-map",
+        f"0:a:{audio_index}",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "-f",
+        "f32le",
+        "-",
+    ]
+
+
+def ffmpeg_audio_samples(
+    input_path: Path,
+    audio_index: int,
+    sample_rate: int,
+    ss: Optional[str] = None,
+    to: Optional[str] = None,
+) -> "npt.NDArray[np.float32]":
+    """
+    オーディオトラックをモノラルのPCMとしてすべて読む（参照音声）
+    """
+    command = get_audio_decode_command(
+        input_path=input_path,
+        audio_index=audio_index,
+        sample_rate=sample_rate,
+        ss=ss,
+        to=to,
+    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+
+class AudioCorrelator:
+    """
+    チャンクごとに、参照音声との正規化相互相関を計算する（overlap-save）
+    """
+
+    def __init__(
+        self,
+        reference: "npt.NDArray[np.float32]",
+        chunk_samples: int,
+    ) -> None:
+        if len(reference) == 0:
+            raise ValueError("Reference audio is empty")
+
+        self.reference_samples = len(reference)
+        self.chunk_samples = chunk_samples
+
+        # 重ねた前のチャンクの末尾と、新しいチャンクを巡回せずに相関できるFFTの長さ
+        fft_size = 1
+        while fft_size < chunk_samples + self.reference_samples - 1:
+            fft_size *= 2
+        self.fft_size = fft_size
+
+        centered_reference = reference.astype(np.float64) - float(np.mean(reference))
+        self.reference_norm = float(np.linalg.norm(centered_reference))
+        if self.reference_norm == 0:
+            raise ValueError("Reference audio is silent")
+
+        self.reference_spectrum = np.conj(np.fft.rfft(centered_reference, n=fft_size))
+
+    def correlate(
+        self,
+        samples: "npt.NDArray[np.float32]",
+    ) -> "npt.NDArray[np.float64]":
+        """
+        samples[i:i+参照音声の長さ]と参照音声の一致度（len(samples) - 参照音声の長さ + 1個）
+        """
+        window = self.reference_samples
+        position_count = len(samples) - window + 1
+        if position_count <= 0:
+            return np.zeros(0, dtype=np.float64)
+
+        values = samples.astype(np.float64)
+
+        # 参照音声は平均0のため、分子は窓の平均を引かなくても同じ
+        numerators = np.fft.irfft(
+            np.fft.rfft(values, n=self.fft_size) * self.reference_spectrum,
+            n=self.fft_size,
+        )[:position_count]
+
+        # 窓ごとの分散（累積和）
+        cumsum = np.concatenate([[0.0], np.cumsum(values)])
+        cumsum_squares = np.concatenate([[0.0], np.cumsum(values * values)])
+        window_sums = cumsum[window:] - cumsum[:-window]
+        window_square_sums = cumsum_squares[window:] - cumsum_squares[:-window]
+        window_variances = np.maximum(
+            window_square_sums - window_sums * window_sums / window, 0.0
+        )
+
+        denominators = np.sqrt(window_variances) * self.reference_norm
+        scores: "npt.NDArray[np.float64]" = np.where(
+            window_variances < MINIMUM_WINDOW_VARIANCE * window,
+            0.0,
+            numerators / np.maximum(denominators, 1e-12),
+        )
+        return scores
+
+
+class PeakPicker:
+    """
+    一致度がthreshold以上の位置から、min_distance以内で最も一致した位置を選ぶ
+    （チャンクをまたいでも同じ結果になるように、次の候補まで確定を待つ）
+    """
+
+    def __init__(self, threshold: float, min_distance: int) -> None:
+        self.threshold = threshold
+        self.min_distance = min_distance
+        self.pending: Optional[Tuple[int, float]] = None
+
+    def push(
+        self,
+        scores: "npt.NDArray[np.float64]",
+        start_position: int,
+    ) -> List[Tuple[int, float]]:
+        peaks: List[Tuple[int, float]] = []
+        for index in np.flatnonzero(scores >= self.threshold):
+            position = start_position + int(index)
+            score = float(scores[index])
+
+            if self.pending is not None:
+                pending_position, pending_score = self.pending
+                if position - pending_position <= self.min_distance:
+                    if pending_score < score:
+                        self.pending = (position, score)
+                    continue
+
+                peaks.append(self.pending)
+
+            self.pending = (position, score)
+
+        return peaks
+
+    def flush(self) -> List[Tuple[int, float]]:
+        peaks = [self.pending] if self.pending is not None else []
+        self.pending = None
+        return peaks
+
+
+def read_stderr_tail(stderr: IO[bytes], lines: Deque[str]) -> None:
+    for line in stderr:
+        lines.append(line.decode("utf-8", errors="replace").rstrip())
+
+
+def ffmpeg_find_audio_generator(
+    input_path: Path,
+    audio_index: int,
+    reference: "npt.NDArray[np.float32]",
+    sample_rate: int = 8000,
+    ss: Optional[str] = None,
+    to: Optional[str] = None,
+    threshold: float = 0.6,
+    chunk_seconds: float = 60.0,
+) -> Generator[Union[FindAudioMatch, FfmpegProgressLine], None, None]:
+    """
+    参照音声（sample_rateのモノラルのPCM）と一致度がthreshold以上の位置を出力する
+    """
+    chunk_samples = max(1, round(chunk_seconds * sample_rate))
+    correlator = AudioCorrelator(reference=reference, chunk_samples=chunk_samples)
+    peak_picker = PeakPicker(
+        threshold=threshold, min_distance=correlator.reference_samples
+    )
+
+    def to_match(position: int, score: float) -> FindAudioMatch:
+        return FindAudioMatch(
+            internal_microseconds=round(position * 1_000_000 / sample_rate),
+            score=score,
+        )
+
+    command = get_audio_decode_command(
+        input_path=input_path,
+        audio_index=audio_index,
+        sample_rate=sample_rate,
+        ss=ss,
+        to=to,
+    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        stderr_lines: Deque[str] = collections.deque(maxlen=10)
+        assert proc.stderr is not None
+        stderr_thread = threading.Thread(
+            target=read_stderr_tail,
+            args=(proc.stderr, stderr_lines),
+            daemon=True,
+        )
+        stderr_thread.start()
+
+        # 前のチャンクの末尾（参照音声の長さ - 1）を重ねる
+        overlap = np.zeros(0, dtype=np.float32)
+        overlap_position = 0
+        sample_count = 0
+        try:
+            assert proc.stdout is not None
+            while True:
+                chunk_bytes = proc.stdout.read(chunk_samples * 4)
+                # f32le（4バイト）の途中で終わった端数は捨てる
+                chunk_bytes = chunk_bytes[: len(chunk_bytes) // 4 * 4]
+                if len(chunk_bytes) == 0:
+                    break
+
+                profile_args["pipe_bytes"] += len(chunk_bytes)
+                chunk = np.frombuffer(chunk_bytes, dtype=np.float32)
+                samples = np.concatenate([overlap, chunk])
+
+                for position, score in peak_picker.push(
+                    scores=correlator.correlate(samples),
+                    start_position=overlap_position,
+                ):
+                    yield to_match(position=position, score=score)
+
+                sample_count += len(chunk)
+                keep_samples = min(len(samples), correlator.reference_samples - 1)
+                overlap = samples[len(samples) - keep_samples :]
+                overlap_position = sample_count - keep_samples
+
+                yield FfmpegProgressLine(
+                    frame=sample_count,
+                    time=format_microseconds_as_time_unit_syntax_string(
+                        round(sample_count * 1_000_000 / sample_rate)
+                    ),
+                )
+
+            for position, score in peak_picker.flush():
+                yield to_match(position=position, score=score)
+
+            returncode = proc.wait()
+            stderr_thread.join()
+            if returncode != 0:
+                config.logger.error("\n".join(stderr_lines))
+                raise Exception(f"FFmpeg errored. code {returncode}")
+        finally:
+            proc.kill()
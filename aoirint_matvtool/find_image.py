@@ -1,11 +1,12 @@
 import re
 import subprocess
 from pathlib import Path
-from typing import Generator, Optional, Union
+from typing import Generator, List, NamedTuple, Optional, Union
 
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
+from .fast_decode import get_fast_decode_input_opts
 from .util import exclude_none
 
 
@@ -21,6 +22,178 @@ class FfmpegBlackframeOutputLine(BaseModel):
 class FfmpegProgressLine(BaseModel):
     frame: int
     time: str
+    speed: Optional[str] = None
+
+
+# 1行ごとに大量に発生するイベントは、pydanticモデルを経由せず軽量なNamedTupleで扱う
+# pydanticモデルへの変換は、公開APIの境界（to_model）でのみ行う
+class FfmpegBlackframeEvent(NamedTuple):
+    frame: int
+    pblack: int
+    pts: int
+    t: float
+    type: str
+    last_keyframe: int
+
+    def to_model(self) -> FfmpegBlackframeOutputLine:
+        return FfmpegBlackframeOutputLine(
+            frame=self.frame,
+            pblack=self.pblack,
+            pts=self.pts,
+            t=self.t,
+            type=self.type,
+            last_keyframe=self.last_keyframe,
+        )
+
+
+class FfmpegProgressEvent(NamedTuple):
+    frame: int
+    time: str
+    speed: Optional[str] = None
+
+    def to_model(self) -> FfmpegProgressLine:
+        return FfmpegProgressLine(
+            frame=self.frame,
+            time=self.time,
+            speed=self.speed,
+        )
+
+
+class FfmpegMetadataFrameEvent(NamedTuple):
+    """
+    metadataフィルタ（mode=print）が出力したフレーム
+    """
+
+    frame: int
+    pts: int
+    t: float
+
+
+FFMPEG_BLACKFRAME_LINE_PATTERN = re.compile(
+    r"^\[Parsed_blackframe[^\]]*\]\ frame:(\d+)\ pblack:(\d+)\ pts:(-?\d+)\ t:(\S+)\ type:(\S+)\ last_keyframe:(-?\d+)"  # noqa: B950
+)
+FFMPEG_METADATA_FRAME_LINE_PATTERN = re.compile(
+    r"^\[Parsed_metadata[^\]]*\]\ frame:(\d+)\s+pts:(-?\d+)\s+pts_time:(\S+)"
+)
+FFMPEG_PROGRESS_LINE_PATTERN = re.compile(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$")
+
+
+def parse_ffmpeg_blackframe_line(line: str) -> Optional[FfmpegBlackframeEvent]:
+    # [Parsed_blackframe_3 @ 0x...] frame:810 pblack:99 pts:13516 t:13.516000 type:P last_keyframe:720  # noqa: B950
+    if not line.startswith("[Parsed_blackframe"):
+        return None
+
+    match = FFMPEG_BLACKFRAME_LINE_PATTERN.match(line)
+    if not match:
+        return None
+
+    frame, pblack, pts, t, _type, last_keyframe = match.groups()
+
+    return FfmpegBlackframeEvent(
+        frame=int(frame),
+        pblack=int(pblack),
+        pts=int(pts),
+        t=float(t),
+        type=_type,
+        last_keyframe=int(last_keyframe),
+    )
+
+
+def parse_ffmpeg_metadata_frame_line(line: str) -> Optional[FfmpegMetadataFrameEvent]:
+    # [Parsed_metadata_2 @ 0x...] frame:810  pts:13516   pts_time:13.516
+    if not line.startswith("[Parsed_metadata"):
+        return None
+
+    match = FFMPEG_METADATA_FRAME_LINE_PATTERN.match(line)
+    if not match:
+        return None
+
+    frame, pts, t = match.groups()
+
+    return FfmpegMetadataFrameEvent(
+        frame=int(frame),
+        pts=int(pts),
+        t=float(t),
+    )
+
+
+def parse_ffmpeg_progress_line(line: str) -> Optional[FfmpegProgressEvent]:
+    # frame=  810 fps=...  q=-0.0 size=N/A time=00:00:13.51 bitrate=N/A speed=27x
+    if not line.startswith("frame="):
+        return None
+
+    match = FFMPEG_PROGRESS_LINE_PATTERN.match(line)
+    if not match:
+        return None
+
+    _, speed_separator, speed = line.rpartition("speed=")
+
+    return FfmpegProgressEvent(
+        frame=int(match.group(1)),
+        time=match.group(2).strip(),
+        speed=speed.strip() if speed_separator else None,
+    )
+
+
+class SceneChangeGate:
+    """
+    画面が変化したフレームだけを比較する走査（scene_threshold）の結果を、全フレームの結果に戻す
+
+    比較したフレーム（blackframe、amount=0で全フレームを出力）と、
+    変化しなかったフレーム（metadata）を入力の順に受け取り、入力のフレーム番号を振り直す
+    変化しなかったフレームには、直前に比較したフレームの結果を引き継ぐ
+    """
+
+    def __init__(self, blackframe_amount: int) -> None:
+        self.blackframe_amount = blackframe_amount
+        self.frame = 0
+        self.compared_frames: List[int] = []
+        """比較したフレームの、入力のフレーム番号（blackframeのフレーム番号の変換用）"""
+        self.last_compared_event: Optional[FfmpegBlackframeEvent] = None
+
+    def compare(self, event: FfmpegBlackframeEvent) -> Optional[FfmpegBlackframeEvent]:
+        """
+        比較したフレーム（一致しなければNone）
+        """
+        frame = self.frame
+        self.frame += 1
+        self.compared_frames.append(frame)
+
+        last_keyframe = (
+            self.compared_frames[event.last_keyframe]
+            if 0 <= event.last_keyframe < len(self.compared_frames)
+            else -1
+        )
+        self.last_compared_event = event._replace(
+            frame=frame,
+            last_keyframe=last_keyframe,
+        )
+
+        if event.pblack < self.blackframe_amount:
+            return None
+
+        return self.last_compared_event
+
+    def carry(self, event: FfmpegMetadataFrameEvent) -> Optional[FfmpegBlackframeEvent]:
+        """
+        変化しなかったフレーム（直前に比較したフレームが一致しなければNone）
+        """
+        frame = self.frame
+        self.frame += 1
+
+        last_compared_event = self.last_compared_event
+        if (
+            last_compared_event is None
+            or last_compared_event.pblack < self.blackframe_amount
+        ):
+            return None
+
+        return last_compared_event._replace(
+            frame=frame,
+            pts=event.pts,
+            t=event.t,
+            type="?",
+        )
 
 
 def ffmpeg_find_image_generator(
@@ -33,18 +206,108 @@ def ffmpeg_find_image_generator(
     fps: Optional[int],
     blackframe_amount: int = 98,
     blackframe_threshold: int = 32,
+    follow: bool = False,
+    follow_timeout: float = 10.0,
+    timestamp_offset_microseconds: int = 0,
+    reference_image_scale: Optional[str] = None,
+    fast_decode: bool = False,
+    lowres: int = 0,
+    skip_noref: bool = False,
+    key_frames_only: bool = False,
+    scene_threshold: Optional[float] = None,
 ) -> Generator[Union[FfmpegBlackframeOutputLine, FfmpegProgressLine], None, None]:
+    for event in ffmpeg_find_image_event_generator(
+        input_video_ss=input_video_ss,
+        input_video_to=input_video_to,
+        input_video_path=input_video_path,
+        input_video_crop=input_video_crop,
+        reference_image_path=reference_image_path,
+        reference_image_crop=reference_image_crop,
+        fps=fps,
+        blackframe_amount=blackframe_amount,
+        blackframe_threshold=blackframe_threshold,
+        follow=follow,
+        follow_timeout=follow_timeout,
+        timestamp_offset_microseconds=timestamp_offset_microseconds,
+        reference_image_scale=reference_image_scale,
+        fast_decode=fast_decode,
+        lowres=lowres,
+        skip_noref=skip_noref,
+        key_frames_only=key_frames_only,
+        scene_threshold=scene_threshold,
+    ):
+        yield event.to_model()
+
+
+def ffmpeg_find_image_event_generator(
+    input_video_ss: Optional[str],
+    input_video_to: Optional[str],
+    input_video_path: Path,
+    input_video_crop: Optional[str],
+    reference_image_path: Path,
+    reference_image_crop: Optional[str],
+    fps: Optional[int],
+    blackframe_amount: int = 98,
+    blackframe_threshold: int = 32,
+    follow: bool = False,
+    follow_timeout: float = 10.0,
+    timestamp_offset_microseconds: int = 0,
+    reference_image_scale: Optional[str] = None,
+    fast_decode: bool = False,
+    lowres: int = 0,
+    skip_noref: bool = False,
+    key_frames_only: bool = False,
+    scene_threshold: Optional[float] = None,
+) -> Generator[Union[FfmpegBlackframeEvent, FfmpegProgressEvent], None, None]:
+    """
+    ffmpeg_find_image_generatorの軽量イベント版（pydanticモデルを生成しない）
+
+    followが真のとき、書き込み中の動画ファイル（MKV、フラグメント化されたMP4）を
+    末尾で待機しながら読み続け、follow_timeout秒間ファイルが伸びなければ終了する
+
+    timestamp_offset_microsecondsを指定すると、フレームの時刻をずらして出力する
+    （チェックポイントから再開するとき、中断前と同じ時刻・fpsの区切りで検出するため）
+
+    参照画像は1度だけデコードし、blendフィルタが最後のフレームを繰り返して比較する
+    reference_image_scaleを指定すると、切り抜いた参照画像をその大きさに拡大縮小する
+
+    fast_decodeが真のとき、デコーダの処理の一部を省略する（fast_decode.py）
+    さらにlowresを指定すると、縦横1/2^lowresの解像度でデコードする
+    （input_video_crop・reference_image_scaleはデコードした解像度に合わせて指定する）
+    skip_norefが真のとき、fpsと組み合わせて参照されないフレームをデコードしない
+
+    key_frames_onlyが真のとき、キーフレームだけをデコードして比較する
+
+    scene_thresholdを指定すると、直前のフレームからの変化（selectフィルタのscene、0-1）が
+    scene_thresholdを超えたフレーム（と最初のフレーム）だけを比較し、
+    ほかのフレームには直前に比較したフレームの結果を引き継ぐ（SceneChangeGate）
+    """
+    timestamp_filter_setpts = (
+        f"setpts=round(PTS+{timestamp_offset_microseconds}/1000000/TB)"
+        if timestamp_offset_microseconds != 0
+        else None
+    )
+
     # Create the input video filter_complex string
     input_video_filter_fps = f"fps={fps}" if fps is not None else None
     input_video_filter_crop = (
         f"crop={input_video_crop}" if input_video_crop is not None else None
     )
 
+    # 変化したフレームを1番目の出力（比較）、変化しなかったフレームを2番目の出力へ振り分ける
+    input_video_filter_select = (
+        f"select=outputs=2:expr='if(eq(n,0)+gt(scene,{scene_threshold}),1,2)'"
+        if scene_threshold is not None
+        else None
+    )
+
     input_video_filters = list(
         exclude_none(
             [
+                timestamp_filter_setpts,
                 input_video_filter_fps,
                 input_video_filter_crop,
+                input_video_filter_select,
             ]
         )
     )
@@ -52,19 +315,37 @@ def ffmpeg_find_image_generator(
     input_video_filter_complex: Optional[str] = None
     if len(input_video_filters) != 0:
         input_video_filter_inner_string = ",".join(input_video_filters)
-        input_video_filter_complex = f"[0:v]{input_video_filter_inner_string}[va]"
+        input_video_filter_outputs = (
+            "[va][vu]" if input_video_filter_select is not None else "[va]"
+        )
+        input_video_filter_complex = (
+            f"[0:v]{input_video_filter_inner_string}{input_video_filter_outputs}"
+        )
+
+    # 変化しなかったフレームは、時刻だけを出力して捨てる
+    unchanged_video_filter_complex = (
+        "[vu]metadata=mode=print:key=lavfi.scene_score,nullsink"
+        if input_video_filter_select is not None
+        else None
+    )
 
     # Create the reference image filter_complex string
-    reference_image_filter_fps = f"fps={fps}" if fps is not None else None
+    # 1フレームの参照画像にはfpsフィルタを使わず、出力のタイムベースだけを合わせる
+    reference_image_filter_settb = f"settb=1/{fps}" if fps is not None else None
     reference_image_filter_crop = (
         f"crop={reference_image_crop}" if reference_image_crop is not None else None
     )
+    reference_image_filter_scale = (
+        f"scale={reference_image_scale}" if reference_image_scale is not None else None
+    )
 
     reference_image_filters = list(
         exclude_none(
             [
-                reference_image_filter_fps,
+                timestamp_filter_setpts,
+                reference_image_filter_settb,
                 reference_image_filter_crop,
+                reference_image_filter_scale,
             ]
         )
     )
@@ -77,9 +358,12 @@ def ffmpeg_find_image_generator(
         )
 
     # Create the blend filter_complex string
-    blend_filter_complex_inner_string = f"blend=difference:shortest=1,blackframe=amount={blackframe_amount}:threshold={blackframe_threshold}"  # noqa: B950
+    # 参照画像の終了後は最後のフレームを繰り返し、入力動画の終了で終わる
+    # 変化しなかったフレームに結果を引き継ぐため、比較したフレームはすべて出力する
+    blackframe_filter_amount = 0 if scene_threshold is not None else blackframe_amount
+    blend_filter_complex_inner_string = f"blend=difference,blackframe=amount={blackframe_filter_amount}:threshold={blackframe_threshold}"  # noqa: B950
     blend_input_a_name = "va" if input_video_filter_complex is not None else "0:v"
-    blend_input_b_name = "vb" if input_video_filter_complex is not None else "1:v"
+    blend_input_b_name = "vb" if reference_image_filter_complex is not None else "1:v"
 
     blend_filter_complex = f"[{blend_input_a_name}][{blend_input_b_name}]{blend_filter_complex_inner_string}"  # noqa: B950
 
@@ -88,6 +372,7 @@ def ffmpeg_find_image_generator(
         exclude_none(
             [
                 input_video_filter_complex,
+                unchanged_video_filter_complex,
                 reference_image_filter_complex,
                 blend_filter_complex,
             ]
@@ -108,15 +393,39 @@ def ffmpeg_find_image_generator(
             input_video_to,
         ]
 
+    # 書き込み中のファイルの追従（fileプロトコルのfollowオプション）
+    follow_opts = []
+    input_video_url = str(input_video_path)
+    if follow:
+        follow_opts += [
+            "-follow",
+            "1",
+            "-rw_timeout",
+            str(int(follow_timeout * 1_000_000)),
+        ]
+        input_video_url = f"file:{input_video_path}"
+
+    decode_opts = (
+        get_fast_decode_input_opts(fps=fps, lowres=lowres, skip_noref=skip_noref)
+        if fast_decode
+        else []
+    )
+    if key_frames_only:
+        # 後に指定したオプションが優先される
+        decode_opts += [
+            "-skip_frame",
+            "nokey",
+        ]
+
     # Command Argument List
     command = [
         config.FFMPEG_PATH,
         "-hide_banner",
         *slice_opts,
+        *follow_opts,
+        *decode_opts,
         "-i",
-        str(input_video_path),
-        "-loop",
-        "1",
+        input_video_url,
         "-i",
         str(reference_image_path),
         "-an",
@@ -126,45 +435,58 @@ def ffmpeg_find_image_generator(
         "null",
         "-",
     ]
-    proc = subprocess.Popen(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
-    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+        scene_change_gate = (
+            SceneChangeGate(blackframe_amount=blackframe_amount)
+            if scene_threshold is not None
+            else None
+        )
 
-    try:
-        while proc.poll() is None:
+        pipe_bytes = 0
+        follow_timed_out = False
+        try:
             assert proc.stderr is not None
-            line = proc.stderr.readline().rstrip()
-
-            match = re.match(r"^\[Parsed_blackframe.+?\]\ (frame:.+)$", line)
-            if (
-                match
-            ):  # "frame:810 pblack:99 pts:13516 t:13.516000 type:P last_keyframe:720"
-                result = match.group(1).strip()
-
-                result_dict = {}
-                for key_value in result.split(" "):
-                    key, value = key_value.split(":", maxsplit=2)
-                    result_dict[key] = value
-
-                output = FfmpegBlackframeOutputLine.parse_obj(result_dict)
-                yield output
-
-            match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
-            if match:
-                frame = int(match.group(1))
-                _time = match.group(2).strip()
-
-                progress = FfmpegProgressLine(
-                    frame=frame,
-                    time=_time,
-                )
-                yield progress
-
-        returncode = proc.wait()
-        if returncode != 0:
-            raise Exception(f"FFmpeg errored. code {returncode}")
-    finally:
-        proc.kill()
+            for line in proc.stderr:
+                pipe_bytes += len(line)
+
+                # followの待機時間切れによる読み込みエラー（ファイルの伸びが止まった）
+                if follow and "Input/output error" in line:
+                    follow_timed_out = True
+
+                blackframe_event = parse_ffmpeg_blackframe_line(line)
+                if blackframe_event is not None:
+                    if scene_change_gate is not None:
+                        blackframe_event = scene_change_gate.compare(blackframe_event)
+                        if blackframe_event is None:
+                            continue
+
+                    yield blackframe_event
+                    continue
+
+                if scene_change_gate is not None:
+                    metadata_frame_event = parse_ffmpeg_metadata_frame_line(line)
+                    if metadata_frame_event is not None:
+                        blackframe_event = scene_change_gate.carry(metadata_frame_event)
+                        if blackframe_event is not None:
+                            yield blackframe_event
+                        continue
+
+                progress_event = parse_ffmpeg_progress_line(line)
+                if progress_event is not None:
+                    profiling.profile_ffmpeg_speed(progress_event.speed)
+                    yield progress_event
+
+            returncode = proc.wait()
+            if returncode != 0 and not follow_timed_out:
+                raise Exception(f"FFmpeg errored. code {returncode}")
+        finally:
+            profile_args["pipe_bytes"] = pipe_bytes
+            proc.kill()
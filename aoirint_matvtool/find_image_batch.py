@@ -0,0 +1,117 @@
+"""
+複数の動画の検索（find_image -i に複数のファイル・ディレクトリを指定）
+
+長い動画から順に（Longest Processing Time first）ワーカーへ割り当て、
+最後に長い動画だけが残って待たされる時間（テールレイテンシ）を抑える
+"""
+
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from . import config, metrics, profiling
+
+VIDEO_FILE_SUFFIXES = {
+    ".avi",
+    ".flv",
+    ".m2ts",
+    ".m4v",
+    ".mkv",
+    ".mov",
+    ".mp4",
+    ".mpg",
+    ".mts",
+    ".ts",
+    ".webm",
+    ".wmv",
+}
+"""ディレクトリから検索する動画の拡張子（小文字）"""
+
+
+def expand_input_video_paths(paths: List[Path]) -> List[Path]:
+    """
+    ディレクトリを、その中（サブディレクトリを含む）の動画ファイルに展開する
+
+    ファイルは拡張子を問わずそのまま、重複は最初の1つだけ残す
+    """
+    input_video_paths: List[Path] = []
+    for path in paths:
+        if path.is_dir():
+            input_video_paths += sorted(
+                child_path
+                for child_path in path.rglob("*")
+                if child_path.suffix.lower() in VIDEO_FILE_SUFFIXES
+                and child_path.is_file()
+            )
+        else:
+            input_video_paths.append(path)
+
+    return list(dict.fromkeys(input_video_paths))
+
+
+def ffprobe_duration(input_path: Union[Path, str]) -> Optional[float]:
+    """
+    動画の長さ（秒、コンテナに記録されていなければNone）
+    """
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    try:
+        return float(proc.stdout.strip())
+    except ValueError:  # N/A
+        return None
+
+
+def get_largest_first_order(
+    input_video_paths: List[Path],
+    durations: Dict[Path, Optional[float]],
+) -> List[Path]:
+    """
+    長い動画から順に並べる（長さが分からない動画は最後、同じ長さは指定順）
+    """
+    return sorted(
+        input_video_paths,
+        key=lambda input_video_path: -(durations.get(input_video_path) or 0.0),
+    )
+
+
+def ffprobe_durations(
+    input_video_paths: List[Path],
+    jobs: int,
+) -> Dict[Path, Optional[float]]:
+    """
+    動画の長さを並列に調べる（調べられなかった動画はNone）
+    """
+
+    def probe(input_video_path: Path) -> Optional[float]:
+        try:
+            return ffprobe_duration(input_path=input_video_path)
+        except Exception:
+            config.logger.warning(f"Failed to probe duration: {input_video_path}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(
+            zip(input_video_paths, executor.map(probe, input_video_paths)),
+        )
@@ -0,0 +1,243 @@
+"""
+find_imageの検索結果キャッシュ（--cache_dir）
+
+動画の同一性（util.get_video_identity）、参照画像のハッシュ、
+検索条件をキーとして、検索範囲（-ss/-to）内のblackframeの検出をすべて記録する
+出力間隔（-it）は記録した検出から後で適用するため、キーに含めない
+
+キャッシュは1エントリ1ファイルで、合計サイズが上限を超えたら最後に使った時刻
+（ファイルの更新時刻）が古いものから削除する（LRU）
+"""
+
+import hashlib
+import os
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .checkpoint import (
+    FindImageDetection,
+    ffmpeg_first_frame_internal_microseconds,
+    ffmpeg_internal_frame_count_before,
+)
+from .key_frames import ffmpeg_start_time
+from .util import get_real_start_timedelta_by_ss
+
+
+class FindImageCacheKey(BaseModel):
+    video_identity: str
+    reference_image_hash: str
+    input_video_crop: Optional[str]
+    reference_image_crop: Optional[str]
+    fps: Optional[int]
+    blackframe_amount: int
+    blackframe_threshold: int
+    proxy_video_identity: Optional[str] = None
+    fast_decode: bool = False
+    scene_threshold: Optional[float] = None
+
+
+class FindImageCacheEntry(BaseModel):
+    key: FindImageCacheKey
+    ss_microseconds: int
+    """検索範囲の開始（FFmpegの時刻、-ssなしなら0）"""
+    to_microseconds: Optional[int]
+    """検索範囲の終了（FFmpegの時刻、-toなしならNone）"""
+    start_microseconds: int
+    start_frame: float
+    internal_microseconds: List[int]
+    internal_frames: List[int]
+
+
+class FindImageResultCache:
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get_key_hash(self, key: FindImageCacheKey) -> str:
+        return hashlib.sha256(key.model_dump_json().encode("utf-8")).hexdigest()
+
+    def lookup(
+        self,
+        key: FindImageCacheKey,
+        ss_microseconds: int,
+        to_microseconds: Optional[int],
+    ) -> Optional[FindImageCacheEntry]:
+        """
+        検索範囲を含むエントリを探す（同じ開始位置のエントリを優先）
+        """
+        if not self.cache_dir.exists():
+            return None
+
+        candidates: List[Tuple[FindImageCacheEntry, Path]] = []
+        for entry_path in self.cache_dir.glob(f"{self.get_key_hash(key)}-*.json"):
+            try:
+                entry = FindImageCacheEntry.model_validate_json(
+                    entry_path.read_text(encoding="utf-8")
+                )
+            except (OSError, ValueError):  # 削除された・壊れたエントリ
+                continue
+
+            if entry.key != key or ss_microseconds < entry.ss_microseconds:
+                continue
+
+            if entry.to_microseconds is not None and (
+                to_microseconds is None or entry.to_microseconds < to_microseconds
+            ):
+                continue
+
+            # fpsフィルタの区切り（開始位置から1/fps秒ごと）が一致する場合のみ
+            if (
+                key.fps is not None
+                and (ss_microseconds - entry.ss_microseconds) * key.fps % 1_000_000 != 0
+            ):
+                continue
+
+            candidates.append((entry, entry_path))
+
+        if len(candidates) == 0:
+            return None
+
+        entry, entry_path = min(
+            candidates,
+            key=lambda candidate: ss_microseconds - candidate[0].ss_microseconds,
+        )
+
+        # 最後に使った時刻を更新（LRU）
+        try:
+            os.utime(entry_path)
+        except OSError:  # 他のプロセスが削除した
+            pass
+
+        return entry
+
+    def store(self, entry: FindImageCacheEntry) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        to_string = (
+            f"{entry.to_microseconds}" if entry.to_microseconds is not None else "end"
+        )
+        entry_path = (
+            self.cache_dir
+            / f"{self.get_key_hash(entry.key)}-{entry.ss_microseconds}-{to_string}.json"
+        )
+
+        tmp_path = entry_path.with_name(f".{entry_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(entry.model_dump_json(), encoding="utf-8")
+        os.replace(tmp_path, entry_path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        合計サイズが上限以下になるまで、最後に使った時刻が古いエントリを削除する
+        """
+        entries = []
+        for entry_path in self.cache_dir.glob("*.json"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+def get_cached_find_image_detections(
+    entry: FindImageCacheEntry,
+    input_video_path: Path,
+    input_video_fps: float,
+    ss: Optional[str],
+    ss_microseconds: int,
+    to_microseconds: Optional[int],
+    output_interval_microseconds: int,
+) -> List[FindImageDetection]:
+    """
+    キャッシュした検出から、指定範囲（-ss/-to）で検索した場合と同じ出力を作る
+    """
+    fps = entry.key.fps
+    internal_fps = fps if fps is not None else input_video_fps
+
+    offset_microseconds = ss_microseconds - entry.ss_microseconds
+    if offset_microseconds == 0:
+        start_microseconds = entry.start_microseconds
+        start_frame = entry.start_frame
+        frame_offset = 0
+    else:
+        # より広い範囲の検索結果から、開始位置の補正とフレーム番号を計算し直す
+        start_timedelta = get_real_start_timedelta_by_ss(
+            video_path=input_video_path, ss=ss
+        )
+        start_microseconds = start_timedelta // timedelta(microseconds=1)
+        start_frame = start_timedelta.total_seconds() * input_video_fps
+
+        # 狭い範囲の検索の最初のフレームより前に、広い範囲の検索で走査したフレーム数
+        # （fpsフィルタを使う場合は、狭い範囲の検索の最初のフレームの区切りまで）
+        start_time = ffmpeg_start_time(input_path=input_video_path)
+        resume_internal_microseconds = offset_microseconds
+        if fps is not None:
+            first_frame_internal_microseconds = (
+                ffmpeg_first_frame_internal_microseconds(
+                    input_video_path=input_video_path,
+                    start_time=start_time,
+                    seek_origin_microseconds=ss_microseconds,
+                )
+            )
+            if first_frame_internal_microseconds is None:
+                return []
+
+            resume_internal_microseconds += first_frame_internal_microseconds
+
+        internal_frame_count = ffmpeg_internal_frame_count_before(
+            input_video_path=input_video_path,
+            start_time=start_time,
+            seek_origin_microseconds=entry.ss_microseconds,
+            resume_internal_microseconds=resume_internal_microseconds,
+            fps=fps,
+        )
+        if internal_frame_count is None:
+            return []
+
+        frame_offset = internal_frame_count
+
+    detections: List[FindImageDetection] = []
+    prev_input_microseconds = -output_interval_microseconds
+    for entry_internal_microseconds, entry_internal_frame in zip(
+        entry.internal_microseconds, entry.internal_frames
+    ):
+        if (
+            to_microseconds is not None
+            and to_microseconds <= entry.ss_microseconds + entry_internal_microseconds
+        ):
+            break
+
+        internal_microseconds = entry_internal_microseconds - offset_microseconds
+        internal_frame = entry_internal_frame - frame_offset
+        if internal_microseconds < 0 or internal_frame < 0:
+            continue
+
+        input_microseconds = start_microseconds + internal_microseconds
+        if output_interval_microseconds > input_microseconds - prev_input_microseconds:
+            continue
+
+        rescaled_output_frame = internal_frame / internal_fps * input_video_fps
+        detections.append(
+            FindImageDetection(
+                input_microseconds=input_microseconds,
+                input_frame=int(start_frame + rescaled_output_frame),
+                internal_microseconds=internal_microseconds,
+                internal_frame=internal_frame,
+            )
+        )
+        prev_input_microseconds = input_microseconds
+
+    return detections
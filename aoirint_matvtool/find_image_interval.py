@@ -0,0 +1,247 @@
+"""
+参照画像が映っている区間の検索（find_image --interval）
+
+1. キーフレームだけをデコードして比較し、映っているかどうかを疎に調べる
+2. 前後のキーフレームで結果が異なるGOP（と範囲の先頭・末尾）だけを、
+   キーフレームへシークして結果が変わるフレームまで比較し、区間の境界をフレーム単位で求める
+
+シークはキーフレームからのデコードになるため、GOPの中を二分探索するよりも、
+キーフレームから境界まで1度だけデコードする方が安い
+
+前後のキーフレームがともに映っていないGOPの中だけに映る区間は検出できない
+"""
+
+from pathlib import Path
+from typing import Dict, Generator, List, NamedTuple, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from .find_image import (
+    FfmpegBlackframeEvent,
+    FfmpegProgressEvent,
+    ffmpeg_find_image_event_generator,
+)
+from .util import (
+    format_microseconds_as_time_unit_syntax_string,
+    parse_ffmpeg_time_unit_syntax_to_microseconds,
+)
+
+
+class FindImageInterval(BaseModel):
+    start_microseconds: int
+    """区間の最初のフレームのFFmpegの時刻"""
+    end_microseconds: int
+    """区間の後の最初のフレームのFFmpegの時刻（区間を含まない）"""
+
+
+class FindImageIntervalProgressEvent(NamedTuple):
+    phase: str
+    """key_frames: キーフレームの比較、frames: 境界を含むGOPの比較"""
+    microseconds: int
+    """走査中のFFmpegの時刻"""
+
+
+def get_find_image_intervals(
+    frame_states: Dict[int, bool],
+    end_microseconds: int,
+    merge_gap_microseconds: int = 0,
+) -> List[FindImageInterval]:
+    """
+    フレームの時刻ごとの比較結果を、映っている区間にまとめる
+
+    調べていないフレームは、直前に調べたフレームと同じ結果とみなす
+    最後のフレームまで映っているときは、end_microsecondsを区間の終わりにする
+    """
+    intervals: List[FindImageInterval] = []
+
+    start_microseconds: Optional[int] = None
+    for microseconds, matched in sorted(frame_states.items()):
+        if matched and start_microseconds is None:
+            start_microseconds = microseconds
+        elif not matched and start_microseconds is not None:
+            intervals.append(
+                FindImageInterval(
+                    start_microseconds=start_microseconds,
+                    end_microseconds=microseconds,
+                )
+            )
+            start_microseconds = None
+
+    if start_microseconds is not None:
+        intervals.append(
+            FindImageInterval(
+                start_microseconds=start_microseconds,
+                end_microseconds=max(start_microseconds, end_microseconds),
+            )
+        )
+
+    # 短い途切れを挟んだ区間をつなげる
+    merged_intervals: List[FindImageInterval] = []
+    for interval in intervals:
+        if (
+            len(merged_intervals) != 0
+            and interval.start_microseconds - merged_intervals[-1].end_microseconds
+            < merge_gap_microseconds
+        ):
+            merged_intervals[-1].end_microseconds = interval.end_microseconds
+            continue
+
+        merged_intervals.append(interval)
+
+    return merged_intervals
+
+
+def ffmpeg_find_image_interval_generator(
+    input_video_ss: Optional[str],
+    input_video_to: Optional[str],
+    input_video_path: Path,
+    input_video_crop: Optional[str],
+    reference_image_path: Path,
+    reference_image_crop: Optional[str],
+    frame_microseconds: int,
+    blackframe_amount: int = 98,
+    blackframe_threshold: int = 32,
+    merge_gap_microseconds: int = 0,
+    reference_image_scale: Optional[str] = None,
+    fast_decode: bool = False,
+    lowres: int = 0,
+) -> Generator[
+    Union[FindImageInterval, FindImageIntervalProgressEvent],
+    None,
+    None,
+]:
+    """
+    参照画像が映っている区間（FFmpegの時刻、[start, end)）
+
+    frame_microsecondsは1フレームの長さ（最後のフレームまで映っている区間の終わり）
+    """
+    ss_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(input_video_ss)
+        if input_video_ss is not None
+        else 0
+    )
+    to_microseconds = (
+        parse_ffmpeg_time_unit_syntax_to_microseconds(input_video_to)
+        if input_video_to is not None
+        else None
+    )
+
+    # FFmpegの時刻ごとの比較結果（blackframeにすべてのフレームを出力させ、ここで判定する）
+    frame_states: Dict[int, bool] = {}
+
+    def scan(
+        phase: str,
+        start_microseconds: int,
+        end_microseconds: Optional[int],
+        key_frames_only: bool,
+        stop_state: Optional[bool] = None,
+    ) -> Generator[FindImageIntervalProgressEvent, None, None]:
+        """
+        stop_stateを指定すると、比較結果がstop_stateのフレームで走査を打ち切る
+        """
+        outputs = ffmpeg_find_image_event_generator(
+            input_video_ss=format_microseconds_as_time_unit_syntax_string(
+                start_microseconds
+            ),
+            input_video_to=(
+                format_microseconds_as_time_unit_syntax_string(end_microseconds)
+                if end_microseconds is not None
+                else None
+            ),
+            input_video_path=input_video_path,
+            input_video_crop=input_video_crop,
+            reference_image_path=reference_image_path,
+            reference_image_crop=reference_image_crop,
+            fps=None,
+            blackframe_amount=0,
+            blackframe_threshold=blackframe_threshold,
+            reference_image_scale=reference_image_scale,
+            fast_decode=fast_decode,
+            lowres=lowres,
+            key_frames_only=key_frames_only,
+        )
+        try:
+            for output in outputs:
+                if isinstance(output, FfmpegBlackframeEvent):
+                    microseconds = start_microseconds + round(output.t * 1_000_000)
+                    if (
+                        end_microseconds is not None
+                        and end_microseconds <= microseconds
+                    ):
+                        continue
+
+                    matched = blackframe_amount <= output.pblack
+                    frame_states[microseconds] = matched
+
+                    if matched == stop_state:
+                        break
+
+                if isinstance(output, FfmpegProgressEvent):
+                    try:
+                        progress_microseconds = (
+                            parse_ffmpeg_time_unit_syntax_to_microseconds(output.time)
+                        )
+                    except ValueError:  # N/A
+                        continue
+
+                    yield FindImageIntervalProgressEvent(
+                        phase=phase,
+                        microseconds=start_microseconds + progress_microseconds,
+                    )
+        finally:
+            # 打ち切ったFFmpegを終了する
+            outputs.close()
+
+    yield from scan(
+        phase="key_frames",
+        start_microseconds=ss_microseconds,
+        end_microseconds=to_microseconds,
+        key_frames_only=True,
+    )
+    key_frame_states = sorted(frame_states.items())
+
+    # 全フレームを比較する範囲（境界を含みうるGOP）と、走査を打ち切る比較結果
+    segments: List[Tuple[int, Optional[int], Optional[bool]]] = []
+    if len(key_frame_states) == 0:
+        segments.append((ss_microseconds, to_microseconds, None))
+    else:
+        # 範囲の先頭から最初のキーフレームまで
+        first_key_frame_microseconds = key_frame_states[0][0]
+        if ss_microseconds < first_key_frame_microseconds:
+            segments.append((ss_microseconds, first_key_frame_microseconds, None))
+
+        # 結果が変わったフレームより後は、次のキーフレームと同じ結果とみなす
+        for (key_frame_microseconds, matched), (
+            next_key_frame_microseconds,
+            next_matched,
+        ) in zip(key_frame_states, key_frame_states[1:]):
+            if matched != next_matched:
+                segments.append(
+                    (key_frame_microseconds, next_key_frame_microseconds, next_matched)
+                )
+
+        # 最後のキーフレームから範囲の末尾まで（区間の終わりを求めるため、常に比較する）
+        segments.append((key_frame_states[-1][0], to_microseconds, None))
+
+    for start_microseconds, end_microseconds, stop_state in segments:
+        yield from scan(
+            phase="frames",
+            start_microseconds=start_microseconds,
+            end_microseconds=end_microseconds,
+            key_frames_only=False,
+            stop_state=stop_state,
+        )
+
+    if len(frame_states) == 0:
+        return
+
+    last_frame_end_microseconds = max(frame_states) + frame_microseconds
+    if to_microseconds is not None:
+        last_frame_end_microseconds = min(last_frame_end_microseconds, to_microseconds)
+
+    for interval in get_find_image_intervals(
+        frame_states=frame_states,
+        end_microseconds=last_frame_end_microseconds,
+        merge_gap_microseconds=merge_gap_microseconds,
+    ):
+        yield interval
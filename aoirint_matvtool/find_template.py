@@ -0,0 +1,464 @@
+"""
+位置に依らないテンプレート検索（matvtool find_template）
+
+動画を縮小したグレースケールのフレームとして1回だけデコードし、
+参照画像（テンプレート）がフレーム中（-icropを指定したときはその範囲内）の
+どこにあっても検出する
+
+フレームをまとめて（バッチ）NumPyのFFTで相互相関を計算し、
+正規化相互相関（-1から1、1で完全に一致）を一致度とする
+大きさの異なるテンプレート（template_scales）も、同じフレームのFFTで比較する
+
+NumPyは任意の依存関係（pip install "aoirint-matvtool[template]"）
+"""
+
+import queue
+import re
+import subprocess
+import threading
+from pathlib import Path
+from typing import IO, Generator, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image import FfmpegProgressLine
+from .proxy import ffprobe_video_size, parse_crop
+from .util import exclude_none, format_microseconds_as_time_unit_syntax_string
+
+try:
+    import numpy as np
+    import numpy.typing as npt
+except ImportError as error:  # 任意の依存関係
+    raise ImportError(
+        'find_template requires NumPy: pip install "aoirint-matvtool[template]"'
+    ) from error
+
+
+FFMPEG_SHOWINFO_PTS_TIME_PATTERN = re.compile(r"^\[Parsed_showinfo.+\ pts_time:(\S+)")
+
+MINIMUM_WINDOW_VARIANCE = 1.0
+"""一様な（輝度の分散がこれ未満の）範囲は、一致度を0とする"""
+
+
+class FindTemplateMatch(BaseModel):
+    internal_microseconds: int
+    """走査の開始位置（-ss）からの時刻"""
+    x: int
+    y: int
+    width: int
+    height: int
+    """元の動画の解像度での、一致した範囲"""
+    scale: float
+    score: float
+
+
+def get_window_sums(
+    integral: "npt.NDArray[np.float64]",
+    window_height: int,
+    window_width: int,
+) -> "npt.NDArray[np.float64]":
+    """
+    積分画像（先頭に0の行・列を追加したもの）から、各位置の範囲の和を求める
+    """
+    height = integral.shape[1] - window_height
+    width = integral.shape[2] - window_width
+
+    sums: "npt.NDArray[np.float64]" = (
+        integral[:, window_height:, window_width:]
+        - integral[:, :height, window_width:]
+        - integral[:, window_height:, :width]
+        + integral[:, :height, :width]
+    )
+    return sums
+
+
+class TemplateMatcher:
+    """
+    同じ大きさのフレームのバッチと、複数のテンプレートの正規化相互相関を計算する
+    """
+
+    def __init__(
+        self,
+        frame_height: int,
+        frame_width: int,
+        templates: List["npt.NDArray[np.uint8]"],
+    ) -> None:
+        self.frame_shape = (frame_height, frame_width)
+        self.template_shapes: List[Tuple[int, int]] = []
+        self.template_norms: List[float] = []
+        self.template_ffts: List["npt.NDArray[np.complex128]"] = []
+
+        for template in templates:
+            template_height, template_width = template.shape
+            if frame_height < template_height or frame_width < template_width:
+                raise ValueError("Template is larger than the frame")
+
+            # テンプレートの平均を引いておくと、相互相関がフレーム側の平均に依らない
+            zero_mean_template = template.astype(np.float64) - template.mean()
+            norm = float(np.sqrt(np.sum(zero_mean_template**2)))
+            if norm == 0:
+                raise ValueError("Template has no contrast")
+
+            self.template_shapes.append((template_height, template_width))
+            self.template_norms.append(norm)
+            self.template_ffts.append(
+                np.conj(np.fft.rfft2(zero_mean_template, s=self.frame_shape))
+            )
+
+    def match(
+        self,
+        frames: "npt.NDArray[np.uint8]",
+    ) -> Tuple[
+        "npt.NDArray[np.float64]",
+        "npt.NDArray[np.int64]",
+        "npt.NDArray[np.int64]",
+        "npt.NDArray[np.int64]",
+    ]:
+        """
+        フレームごとに、最も一致したテンプレートの一致度・左上の位置（x, y）・番号
+        """
+        batch_size = frames.shape[0]
+        frame_height, frame_width = self.frame_shape
+
+        values = frames.astype(np.float64)
+        frames_fft = np.fft.rfft2(values, axes=(-2, -1))
+
+        # 範囲ごとの輝度の和・二乗和（積分画像）
+        integral = np.zeros((batch_size, frame_height + 1, frame_width + 1))
+        integral[:, 1:, 1:] = values.cumsum(axis=1).cumsum(axis=2)
+        squared_integral = np.zeros_like(integral)
+        squared_integral[:, 1:, 1:] = (values**2).cumsum(axis=1).cumsum(axis=2)
+
+        best_scores = np.full(batch_size, -np.inf)
+        best_xs = np.zeros(batch_size, dtype=np.int64)
+        best_ys = np.zeros(batch_size, dtype=np.int64)
+        best_indices = np.zeros(batch_size, dtype=np.int64)
+
+        for template_index, (template_height, template_width) in enumerate(
+            self.template_shapes
+        ):
+            # 循環相関のうち、テンプレートがはみ出さない範囲
+            height = frame_height - template_height + 1
+            width = frame_width - template_width + 1
+            correlation = np.fft.irfft2(
+                frames_fft * self.template_ffts[template_index],
+                s=self.frame_shape,
+                axes=(-2, -1),
+            )[:, :height, :width]
+
+            size = template_height * template_width
+            sums = get_window_sums(integral, template_height, template_width)
+            squared_sums = get_window_sums(
+                squared_integral, template_height, template_width
+            )
+            variances = np.maximum(squared_sums - sums**2 / size, 0)
+
+            denominators = np.sqrt(variances) * self.template_norms[template_index]
+            scores = np.where(
+                variances >= MINIMUM_WINDOW_VARIANCE * size,
+                correlation / np.maximum(denominators, 1e-12),
+                0.0,
+            )
+
+            flat_scores = scores.reshape(batch_size, -1)
+            positions = flat_scores.argmax(axis=1)
+            max_scores = flat_scores[np.arange(batch_size), positions]
+
+            improved = max_scores > best_scores
+            best_scores = np.where(improved, max_scores, best_scores)
+            best_ys = np.where(improved, positions // width, best_ys)
+            best_xs = np.where(improved, positions % width, best_xs)
+            best_indices = np.where(improved, template_index, best_indices)
+
+        return np.minimum(best_scores, 1.0), best_xs, best_ys, best_indices
+
+
+def ffmpeg_gray_image(
+    image_path: Path,
+    image_crop: Optional[str],
+    width: int,
+    height: int,
+) -> "npt.NDArray[np.uint8]":
+    """
+    画像を切り抜き・拡大縮小したグレースケールの画素
+    """
+    image_filters = list(
+        exclude_none(
+            [
+                f"crop={image_crop}" if image_crop is not None else None,
+                f"scale={width}:{height}",
+                "format=gray",
+            ]
+        )
+    )
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-i",
+        str(image_path),
+        "-filter:v",
+        ",".join(image_filters),
+        "-frames:v",
+        "1",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "gray",
+        "-",
+    ]
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0 or len(proc.stdout) != width * height:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    return np.frombuffer(proc.stdout, dtype=np.uint8).reshape(height, width)
+
+
+def get_template_sizes(
+    template_width: int,
+    template_height: int,
+    frame_scale: float,
+    template_scales: List[float],
+) -> List[Tuple[float, int, int]]:
+    """
+    縮小したフレームに合わせたテンプレートの大きさ（大きさの倍率、幅、高さ）
+    """
+    return [
+        (
+            template_scale,
+            max(2, round(template_width * frame_scale * template_scale)),
+            max(2, round(template_height * frame_scale * template_scale)),
+        )
+        for template_scale in template_scales
+    ]
+
+
+def read_showinfo_times(
+    stderr: IO[bytes],
+    frame_times: "queue.Queue[Optional[int]]",
+) -> None:
+    # [Parsed_showinfo_3 @ 0x...] n:   0 pts:     25 pts_time:5       duration:...
+    for line_bytes in stderr:
+        line = line_bytes.decode("utf-8", errors="replace").rstrip()
+
+        match = FFMPEG_SHOWINFO_PTS_TIME_PATTERN.match(line)
+        if match:
+            frame_times.put(round(float(match.group(1)) * 1_000_000))
+
+    frame_times.put(None)
+
+
+def ffmpeg_find_template_generator(
+    input_video_ss: Optional[str],
+    input_video_to: Optional[str],
+    input_video_path: Path,
+    input_video_crop: Optional[str],
+    reference_image_path: Path,
+    reference_image_crop: Optional[str],
+    fps: Optional[int],
+    analysis_height: int = 360,
+    template_scales: Optional[List[float]] = None,
+    threshold: float = 0.9,
+    batch_size: int = 16,
+) -> Generator[Union[FindTemplateMatch, FfmpegProgressLine], None, None]:
+    """
+    一致度がthreshold以上のフレームごとに、最も一致した位置を出力する
+
+    フレームは縦analysis_height以下に縮小して比較し（拡大はしない）、
+    位置・大きさは元の動画の解像度に戻して出力する
+    切り抜き（-icrop）は数値のみ（式はValueError）
+    """
+    if template_scales is None:
+        template_scales = [1.0]
+
+    source_width, source_height = ffprobe_video_size(input_path=input_video_path)
+    if input_video_crop is not None:
+        region_width, region_height, region_x, region_y = parse_crop(
+            crop=input_video_crop,
+            source_width=source_width,
+            source_height=source_height,
+        )
+    else:
+        region_width, region_height, region_x, region_y = (
+            source_width,
+            source_height,
+            0,
+            0,
+        )
+
+    frame_scale = min(1.0, analysis_height / source_height)
+    frame_width = max(1, round(region_width * frame_scale))
+    frame_height = max(1, round(region_height * frame_scale))
+
+    # 拡大縮小で丸めた後の、縮小したフレームの座標から元の動画の座標への倍率
+    scale_x = region_width / frame_width
+    scale_y = region_height / frame_height
+
+    reference_width, reference_height = ffprobe_video_size(
+        input_path=reference_image_path
+    )
+    if reference_image_crop is not None:
+        reference_width, reference_height, _, _ = parse_crop(
+            crop=reference_image_crop,
+            source_width=reference_width,
+            source_height=reference_height,
+        )
+
+    template_sizes = [
+        (template_scale, template_width, template_height)
+        for template_scale, template_width, template_height in get_template_sizes(
+            template_width=reference_width,
+            template_height=reference_height,
+            frame_scale=frame_scale,
+            template_scales=template_scales,
+        )
+        if template_width <= frame_width and template_height <= frame_height
+    ]
+    if len(template_sizes) == 0:
+        raise ValueError("Reference image is larger than the search region")
+
+    matcher = TemplateMatcher(
+        frame_height=frame_height,
+        frame_width=frame_width,
+        templates=[
+            ffmpeg_gray_image(
+                image_path=reference_image_path,
+                image_crop=reference_image_crop,
+                width=template_width,
+                height=template_height,
+            )
+            for _, template_width, template_height in template_sizes
+        ],
+    )
+
+    input_video_filters = list(
+        exclude_none(
+            [
+                f"fps={fps}" if fps is not None else None,
+                f"crop={input_video_crop}" if input_video_crop is not None else None,
+                f"scale={frame_width}:{frame_height}",
+                "format=gray",
+                "showinfo",
+            ]
+        )
+    )
+
+    slice_opts = []
+    if input_video_ss is not None:
+        slice_opts += [
+            "-ss",
+            input_video_ss,
+        ]
+
+    if input_video_to is not None:
+        slice_opts += [
+            "-to",
+            input_video_to,
+        ]
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostats",
+        *slice_opts,
+        "-i",
+        str(input_video_path),
+        "-an",
+        "-sn",
+        "-dn",
+        "-filter:v",
+        ",".join(input_video_filters),
+        "-vsync",
+        "passthrough",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "gray",
+        "-",
+    ]
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        # フレームの時刻（showinfoフィルタ）を標準エラー出力から読む
+        frame_times: "queue.Queue[Optional[int]]" = queue.Queue()
+        assert proc.stderr is not None
+        stderr_thread = threading.Thread(
+            target=read_showinfo_times,
+            args=(proc.stderr, frame_times),
+            daemon=True,
+        )
+        stderr_thread.start()
+
+        frame_bytes = frame_width * frame_height
+        frame_count = 0
+        try:
+            assert proc.stdout is not None
+            while True:
+                batch_frames: List[bytes] = []
+                batch_times: List[int] = []
+                while len(batch_frames) < batch_size:
+                    frame = proc.stdout.read(frame_bytes)
+                    if len(frame) != frame_bytes:
+                        break
+
+                    frame_time = frame_times.get()
+                    if frame_time is None:
+                        break
+
+                    profile_args["pipe_bytes"] += frame_bytes
+                    batch_frames.append(frame)
+                    batch_times.append(frame_time)
+
+                if len(batch_frames) == 0:
+                    break
+
+                frames = np.frombuffer(b"".join(batch_frames), dtype=np.uint8).reshape(
+                    len(batch_frames), frame_height, frame_width
+                )
+                scores, xs, ys, template_indices = matcher.match(frames)
+
+                for index, frame_time in enumerate(batch_times):
+                    if scores[index] < threshold:
+                        continue
+
+                    template_scale, template_width, template_height = template_sizes[
+                        template_indices[index]
+                    ]
+                    yield FindTemplateMatch(
+                        internal_microseconds=frame_time,
+                        x=region_x + round(xs[index] * scale_x),
+                        y=region_y + round(ys[index] * scale_y),
+                        width=round(template_width * scale_x),
+                        height=round(template_height * scale_y),
+                        scale=template_scale,
+                        score=float(scores[index]),
+                    )
+
+                frame_count += len(batch_frames)
+                yield FfmpegProgressLine(
+                    frame=frame_count,
+                    time=format_microseconds_as_time_unit_syntax_string(
+                        batch_times[-1]
+                    ),
+                )
+
+            returncode = proc.wait()
+            stderr_thread.join()
+            if returncode != 0:
+                raise Exception(f"FFmpeg errored. code {returncode}")
+        finally:
+            proc.kill()
@@ -1,6 +1,6 @@
 import re
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 from pydantic import BaseModel
 
@@ -13,7 +13,7 @@ class FfmpegFpsResult(BaseModel):
     fps: Optional[float]
 
 
-def ffmpeg_fps(input_path: Path) -> FfmpegFpsResult:
+def ffmpeg_fps(input_path: Union[Path, str]) -> FfmpegFpsResult:
     input_video = ffmpeg_get_input(input_path=input_path)
 
     input_video_track = next(
@@ -0,0 +1,670 @@
+"""
+1回のデコードを複数の解析で共有するフレームバス（matvtool analyze）
+
+FFmpegが縮小したグレースケールのフレーム（rawvideo）を、
+共有メモリ（multiprocessing.shared_memory）のリングバッファのスロットへ直接読み込む
+解析プロセスは、スロットをNumPyのビューとしてコピーせずに読む
+すべての解析プロセスが読み終えたスロットにだけ次のフレームを書き込む（背圧）
+
+解析を増やしても、デコードは1回のまま、解析プロセス（CPUのコア）が増える
+
+共有メモリの先頭には、int64の管理領域（書き込んだフレーム数、終了フラグ、
+解析プロセスごとの読み終えたフレーム数、スロットごとのフレームの時刻）を置く
+
+NumPyは任意の依存関係（pip install "aoirint-matvtool[analyze]"）
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import queue
+import subprocess
+import threading
+from multiprocessing import shared_memory
+from multiprocessing.synchronize import Condition
+from pathlib import Path
+from typing import Any, Generator, List, NamedTuple, Optional, Tuple, Union, cast
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image import FfmpegProgressLine
+from .find_template import read_showinfo_times
+from .proxy import ffprobe_video_size, parse_crop
+from .util import exclude_none, format_microseconds_as_time_unit_syntax_string
+
+try:
+    import numpy as np
+    import numpy.typing as npt
+except ImportError as error:  # 任意の依存関係
+    raise ImportError(
+        'analyze requires NumPy: pip install "aoirint-matvtool[analyze]"'
+    ) from error
+
+
+WRITE_COUNT_INDEX = 0
+"""管理領域: 書き込んだフレーム数"""
+CLOSED_INDEX = 1
+"""管理領域: 0以外なら、これ以上フレームを書き込まない"""
+READ_COUNT_INDEX = 2
+"""管理領域: 解析プロセスごとの読み終えたフレーム数の先頭"""
+
+
+class FrameBusLayout(NamedTuple):
+    """
+    共有メモリの配置（解析プロセスへ渡す）
+    """
+
+    shared_memory_name: str
+    slot_count: int
+    consumer_count: int
+    frame_height: int
+    frame_width: int
+
+    @property
+    def frame_times_index(self) -> int:
+        """管理領域: スロットごとのフレームの時刻の先頭"""
+        return READ_COUNT_INDEX + self.consumer_count
+
+    @property
+    def header_bytes(self) -> int:
+        return (self.frame_times_index + self.slot_count) * 8
+
+    @property
+    def size(self) -> int:
+        return (
+            self.header_bytes + self.slot_count * self.frame_height * self.frame_width
+        )
+
+
+def get_frame_bus_views(
+    layout: FrameBusLayout,
+    bus_shared_memory: shared_memory.SharedMemory,
+) -> Tuple["npt.NDArray[np.int64]", "npt.NDArray[np.uint8]"]:
+    """
+    共有メモリの管理領域と、スロット（スロット数 x 高さ x 幅）のビュー
+
+    ビューを残したまま共有メモリを閉じることはできない
+    """
+    buffer = bus_shared_memory.buf
+    assert buffer is not None
+    header: "npt.NDArray[np.int64]" = np.ndarray(
+        (layout.frame_times_index + layout.slot_count,),
+        dtype=np.int64,
+        buffer=buffer,
+    )
+    frames: "npt.NDArray[np.uint8]" = np.ndarray(
+        (layout.slot_count, layout.frame_height, layout.frame_width),
+        dtype=np.uint8,
+        buffer=buffer,
+        offset=layout.header_bytes,
+    )
+    return header, frames
+
+
+class FrameBusResult(BaseModel):
+    analyzer: str
+    frame: int
+    """走査の開始位置（-ss）からのフレーム番号"""
+    internal_microseconds: int
+    """走査の開始位置（-ss）からの時刻"""
+    value: float
+    """解析ごとの値（find_image・black: 一致・黒の画素の割合、scene: 変化の大きさ）"""
+
+
+class FrameAnalyzer:
+    """
+    解析プロセスで、フレームを順に受け取る解析
+
+    解析プロセスへ渡すため、pickleできる値だけを持つ
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def start(self) -> None:
+        """解析プロセスで、最初のフレームの前に呼ばれる"""
+
+    def analyze(
+        self,
+        frame_index: int,
+        internal_microseconds: int,
+        frame: "npt.NDArray[np.uint8]",
+    ) -> Optional[float]:
+        """
+        フレームを解析し、出力する値（出力しなければNone）を返す
+
+        frameはスロットのビューのため、呼び出しの後も使うときはコピーする
+        """
+        raise NotImplementedError
+
+    def finish(self) -> None:
+        """解析プロセスで、最後のフレームの後に呼ばれる"""
+
+
+def count_pixels_below(
+    frame: "npt.NDArray[np.uint8]",
+    threshold: int,
+) -> int:
+    return int(np.count_nonzero(frame < threshold))
+
+
+class ImageMatchAnalyzer(FrameAnalyzer):
+    """
+    参照画像との差の小さい画素の割合（find_imageのblend=difference,blackframeと同じ判定）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        reference_frame: "npt.NDArray[np.uint8]",
+        blackframe_amount: int = 98,
+        blackframe_threshold: int = 32,
+    ) -> None:
+        super().__init__(name=name)
+        self.reference_frame = reference_frame
+        self.blackframe_amount = blackframe_amount
+        self.blackframe_threshold = blackframe_threshold
+
+    def start(self) -> None:
+        self.max_frame = np.empty_like(self.reference_frame)
+        self.difference_frame = np.empty_like(self.reference_frame)
+
+    def analyze(
+        self,
+        frame_index: int,
+        internal_microseconds: int,
+        frame: "npt.NDArray[np.uint8]",
+    ) -> Optional[float]:
+        # 符号なし整数のまま差の絶対値を求める（max - min）
+        np.maximum(frame, self.reference_frame, out=self.max_frame)
+        np.minimum(frame, self.reference_frame, out=self.difference_frame)
+        np.subtract(self.max_frame, self.difference_frame, out=self.difference_frame)
+
+        pblack = (
+            count_pixels_below(self.difference_frame, self.blackframe_threshold)
+            * 100
+            // self.difference_frame.size
+        )
+        if pblack < self.blackframe_amount:
+            return None
+
+        return float(pblack)
+
+
+class BlackFrameAnalyzer(FrameAnalyzer):
+    """
+    黒い画素の割合（blackframeフィルタと同じ判定）
+    """
+
+    def __init__(self, name: str, amount: int = 98, threshold: int = 32) -> None:
+        super().__init__(name=name)
+        self.amount = amount
+        self.threshold = threshold
+
+    def analyze(
+        self,
+        frame_index: int,
+        internal_microseconds: int,
+        frame: "npt.NDArray[np.uint8]",
+    ) -> Optional[float]:
+        pblack = count_pixels_below(frame, self.threshold) * 100 // frame.size
+        if pblack < self.amount:
+            return None
+
+        return float(pblack)
+
+
+class SceneChangeAnalyzer(FrameAnalyzer):
+    """
+    直前のフレームからの変化（selectフィルタのsceneと同じ計算、0-1）
+    """
+
+    def __init__(self, name: str, threshold: float) -> None:
+        super().__init__(name=name)
+        self.threshold = threshold
+
+    def start(self) -> None:
+        self.prev_frame: Optional["npt.NDArray[np.uint8]"] = None
+        self.prev_mafd = 0.0
+
+    def analyze(
+        self,
+        frame_index: int,
+        internal_microseconds: int,
+        frame: "npt.NDArray[np.uint8]",
+    ) -> Optional[float]:
+        prev_frame = self.prev_frame
+        self.prev_frame = frame.copy()
+        if prev_frame is None:
+            return None
+
+        difference = np.maximum(frame, prev_frame) - np.minimum(frame, prev_frame)
+        mafd = float(difference.sum(dtype=np.uint64)) / frame.size
+        score = min(max(min(mafd, abs(mafd - self.prev_mafd)) / 100, 0.0), 1.0)
+        self.prev_mafd = mafd
+
+        if score <= self.threshold:
+            return None
+
+        return score
+
+
+def get_difference_hash(frame: "npt.NDArray[np.uint8]") -> int:
+    """
+    フレームの64ビットの差分ハッシュ（dHash）
+
+    縦8x横9の区画の平均輝度を求め、左右に隣り合う区画の大小をビットにする
+    """
+    height, width = frame.shape
+    row_starts = np.linspace(0, height, 9, dtype=np.int64)[:-1]
+    column_starts = np.linspace(0, width, 10, dtype=np.int64)[:-1]
+
+    sums = np.add.reduceat(
+        np.add.reduceat(frame.astype(np.uint32), row_starts, axis=0),
+        column_starts,
+        axis=1,
+    )
+    row_sizes = np.diff(np.append(row_starts, height))
+    column_sizes = np.diff(np.append(column_starts, width))
+    means = sums / np.outer(row_sizes, column_sizes)
+
+    bits = (means[:, 1:] > means[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class FingerprintIndexAnalyzer(FrameAnalyzer):
+    """
+    フレームごとの差分ハッシュを、JSON Lines（frame、internal_microseconds、dhash）で書き出す
+    """
+
+    def __init__(self, name: str, output_path: Path) -> None:
+        super().__init__(name=name)
+        self.output_path = output_path
+
+    def start(self) -> None:
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_output_path = self.output_path.with_name(
+            f".{self.output_path.name}.{os.getpid()}.tmp"
+        )
+        self.output_file = self.tmp_output_path.open("w", encoding="utf-8")
+
+    def analyze(
+        self,
+        frame_index: int,
+        internal_microseconds: int,
+        frame: "npt.NDArray[np.uint8]",
+    ) -> Optional[float]:
+        self.output_file.write(
+            json.dumps(
+                {
+                    "frame": frame_index,
+                    "internal_microseconds": internal_microseconds,
+                    "dhash": f"{get_difference_hash(frame):016x}",
+                }
+            )
+            + "\n"
+        )
+        return None
+
+    def finish(self) -> None:
+        self.output_file.close()
+        os.replace(self.tmp_output_path, self.output_path)
+
+
+def run_frame_analyzer(
+    layout: FrameBusLayout,
+    consumer_index: int,
+    analyzer: FrameAnalyzer,
+    condition: Condition,
+    results: "multiprocessing.Queue[Optional[FrameBusResult]]",
+) -> None:
+    """
+    解析プロセスの処理（書き込まれたフレームを順に解析し、出力する値をresultsへ送る）
+
+    終了時（失敗時を含む）に、resultsへNoneを送る
+    """
+    bus_shared_memory = shared_memory.SharedMemory(name=layout.shared_memory_name)
+    try:
+        header, frames = get_frame_bus_views(
+            layout=layout, bus_shared_memory=bus_shared_memory
+        )
+        read_count_index = READ_COUNT_INDEX + consumer_index
+
+        analyzer.start()
+
+        frame_index = 0
+        while True:
+            with condition:
+                while (
+                    header[WRITE_COUNT_INDEX] <= frame_index
+                    and header[CLOSED_INDEX] == 0
+                ):
+                    condition.wait()
+                write_count = int(header[WRITE_COUNT_INDEX])
+
+            if write_count <= frame_index:
+                break
+
+            while frame_index < write_count:
+                slot = frame_index % layout.slot_count
+                internal_microseconds = int(header[layout.frame_times_index + slot])
+
+                value = analyzer.analyze(
+                    frame_index=frame_index,
+                    internal_microseconds=internal_microseconds,
+                    frame=frames[slot],
+                )
+                if value is not None:
+                    results.put(
+                        FrameBusResult(
+                            analyzer=analyzer.name,
+                            frame=frame_index,
+                            internal_microseconds=internal_microseconds,
+                            value=value,
+                        )
+                    )
+
+                # 読み終えたスロットを、次のフレームの書き込みに明け渡す
+                frame_index += 1
+                with condition:
+                    header[read_count_index] = frame_index
+                    condition.notify_all()
+
+        analyzer.finish()
+
+        del header, frames
+    finally:
+        bus_shared_memory.close()
+        results.put(None)
+
+
+def read_frames_into_bus(
+    proc: "subprocess.Popen[bytes]",
+    layout: FrameBusLayout,
+    bus_shared_memory: shared_memory.SharedMemory,
+    condition: Condition,
+    stop_event: threading.Event,
+    profile_args: Any,
+) -> None:
+    """
+    FFmpegの出力を、すべての解析プロセスが読み終えたスロットへ直接読み込む
+
+    終了時（失敗時を含む）に、終了フラグを立てる
+    """
+    header, frames = get_frame_bus_views(
+        layout=layout, bus_shared_memory=bus_shared_memory
+    )
+    read_counts = header[READ_COUNT_INDEX : layout.frame_times_index]
+    try:
+        # フレームの時刻（showinfoフィルタ）を標準エラー出力から読む
+        frame_times: "queue.Queue[Optional[int]]" = queue.Queue()
+        assert proc.stderr is not None
+        stderr_thread = threading.Thread(
+            target=read_showinfo_times,
+            args=(proc.stderr, frame_times),
+            daemon=True,
+        )
+        stderr_thread.start()
+
+        # bufsize=0のため、標準出力はバッファのないFileIO
+        stdout = cast(io.RawIOBase, proc.stdout)
+        frame_bytes = layout.frame_width * layout.frame_height
+        frame_index = 0
+        while not stop_event.is_set():
+            slot = frame_index % layout.slot_count
+            with condition:
+                while (
+                    layout.slot_count <= frame_index - read_counts.min()
+                    and not stop_event.is_set()
+                ):
+                    condition.wait(timeout=0.5)
+
+            slot_frame = frames[slot].reshape(-1)
+            filled = 0
+            while filled < frame_bytes:
+                size = stdout.readinto(slot_frame[filled:])
+                if not size:
+                    break
+                filled += size
+
+            if filled != frame_bytes:
+                break
+
+            frame_time = frame_times.get()
+            if frame_time is None:
+                break
+
+            profile_args["pipe_bytes"] += frame_bytes
+
+            frame_index += 1
+            with condition:
+                header[layout.frame_times_index + slot] = frame_time
+                header[WRITE_COUNT_INDEX] = frame_index
+                condition.notify_all()
+
+        stderr_thread.join()
+    finally:
+        with condition:
+            header[CLOSED_INDEX] = 1
+            condition.notify_all()
+
+        del header, frames, read_counts
+
+
+def get_analysis_frame_size(
+    input_video_path: Path,
+    input_video_crop: Optional[str],
+    analysis_height: int,
+) -> Tuple[int, int]:
+    """
+    切り抜いた範囲を縦analysis_height以下に縮小した大きさ（幅、高さ、拡大はしない）
+
+    切り抜き（-icrop）は数値のみ（式はValueError）
+    """
+    source_width, source_height = ffprobe_video_size(input_path=input_video_path)
+
+    region_width, region_height = source_width, source_height
+    if input_video_crop is not None:
+        region_width, region_height, _, _ = parse_crop(
+            crop=input_video_crop,
+            source_width=source_width,
+            source_height=source_height,
+        )
+
+    frame_scale = min(1.0, analysis_height / source_height)
+    return (
+        max(1, round(region_width * frame_scale)),
+        max(1, round(region_height * frame_scale)),
+    )
+
+
+def ffmpeg_frame_bus_generator(
+    input_video_ss: Optional[str],
+    input_video_to: Optional[str],
+    input_video_path: Path,
+    input_video_crop: Optional[str],
+    fps: Optional[int],
+    frame_width: int,
+    frame_height: int,
+    analyzers: List[FrameAnalyzer],
+    slot_count: int = 32,
+) -> Generator[Union[FrameBusResult, FfmpegProgressLine], None, None]:
+    """
+    1回のデコードで、解析ごとのプロセスにすべてのフレームを解析させる
+
+    解析の出力は、解析プロセスが送った順に出力する（解析ごとにはフレームの順）
+    """
+    # 子プロセスはスレッドの状態を引き継がないよう、forkせずに起動する
+    context = multiprocessing.get_context("spawn")
+
+    layout_without_name = FrameBusLayout(
+        shared_memory_name="",
+        slot_count=slot_count,
+        consumer_count=len(analyzers),
+        frame_height=frame_height,
+        frame_width=frame_width,
+    )
+    bus_shared_memory = shared_memory.SharedMemory(
+        create=True, size=layout_without_name.size
+    )
+    layout = layout_without_name._replace(shared_memory_name=bus_shared_memory.name)
+
+    header, _ = get_frame_bus_views(layout=layout, bus_shared_memory=bus_shared_memory)
+    header[:] = 0
+
+    condition = context.Condition()
+    results: "multiprocessing.Queue[Optional[FrameBusResult]]" = context.Queue()
+
+    processes = [
+        context.Process(
+            target=run_frame_analyzer,
+            args=(layout, consumer_index, analyzer, condition, results),
+            daemon=True,
+        )
+        for consumer_index, analyzer in enumerate(analyzers)
+    ]
+
+    input_video_filters = list(
+        exclude_none(
+            [
+                f"fps={fps}" if fps is not None else None,
+                f"crop={input_video_crop}" if input_video_crop is not None else None,
+                f"scale={frame_width}:{frame_height}",
+                "format=gray",
+                "showinfo",
+            ]
+        )
+    )
+
+    slice_opts = []
+    if input_video_ss is not None:
+        slice_opts += [
+            "-ss",
+            input_video_ss,
+        ]
+
+    if input_video_to is not None:
+        slice_opts += [
+            "-to",
+            input_video_to,
+        ]
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-nostats",
+        *slice_opts,
+        "-i",
+        str(input_video_path),
+        "-an",
+        "-sn",
+        "-dn",
+        "-filter:v",
+        ",".join(input_video_filters),
+        "-vsync",
+        "passthrough",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "gray",
+        "-",
+    ]
+
+    # 解析プロセスが失敗したときに、書き込みの待機を打ち切る
+    stop_event = threading.Event()
+    producer_errors: List[Exception] = []
+
+    def produce(proc: "subprocess.Popen[bytes]", profile_args: Any) -> None:
+        try:
+            read_frames_into_bus(
+                proc=proc,
+                layout=layout,
+                bus_shared_memory=bus_shared_memory,
+                condition=condition,
+                stop_event=stop_event,
+                profile_args=profile_args,
+            )
+        except Exception as error:
+            producer_errors.append(error)
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        for process in processes:
+            process.start()
+
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        producer_thread = threading.Thread(
+            target=produce,
+            args=(proc, profile_args),
+            daemon=True,
+        )
+        producer_thread.start()
+
+        try:
+            running_count = len(processes)
+            progress_frame_count = 0
+            while running_count != 0:
+                try:
+                    result = results.get(timeout=0.5)
+                except queue.Empty:
+                    for process, analyzer in zip(processes, analyzers):
+                        if process.exitcode not in (None, 0):
+                            raise Exception(f"Frame analyzer errored: {analyzer.name}")
+
+                    with condition:
+                        write_count = int(header[WRITE_COUNT_INDEX])
+                        last_frame_time = int(
+                            header[
+                                layout.frame_times_index
+                                + (write_count - 1) % slot_count
+                            ]
+                        )
+
+                    if progress_frame_count != write_count:
+                        progress_frame_count = write_count
+                        yield FfmpegProgressLine(
+                            frame=write_count,
+                            time=format_microseconds_as_time_unit_syntax_string(
+                                last_frame_time
+                            ),
+                        )
+                    continue
+
+                if result is None:
+                    running_count -= 1
+                    continue
+
+                yield result
+
+            producer_thread.join()
+            if len(producer_errors) != 0:
+                raise producer_errors[0]
+
+            returncode = proc.wait()
+            if returncode != 0:
+                raise Exception(f"FFmpeg errored. code {returncode}")
+
+            for process, analyzer in zip(processes, analyzers):
+                process.join()
+                if process.exitcode != 0:
+                    raise Exception(f"Frame analyzer errored: {analyzer.name}")
+        finally:
+            stop_event.set()
+            proc.kill()
+            producer_thread.join()
+
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+            del header
+            bus_shared_memory.close()
+            bus_shared_memory.unlink()
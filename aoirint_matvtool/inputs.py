@@ -1,11 +1,11 @@
 import re
 import subprocess
 from pathlib import Path
-from typing import List
+from typing import List, Union
 
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
 from .config import logger
 
 
@@ -96,14 +96,18 @@ def __read_first_metadata_items(
 
 
 # API
-def ffmpeg_get_input(input_path: Path) -> FfmpegInput:
+def ffmpeg_get_input(input_path: Union[Path, str]) -> FfmpegInput:
     command = [
         config.FFMPEG_PATH,
         "-hide_banner",
         "-i",
         str(input_path),
     ]
-    proc = subprocess.run(command, stderr=subprocess.PIPE)
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(command, stderr=subprocess.PIPE)
+        profile_args["pipe_bytes"] = len(proc.stderr)
+
     stderr = proc.stderr.decode("utf-8")
 
     lines = stderr.splitlines()
@@ -0,0 +1,285 @@
+"""
+複数の録画ファイルの連結（matvtool join）
+
+OBS Studioなどで分割された録画ファイルを、再エンコードせずに（ストリームのコピー）連結する
+すべての入力を並列に調べ、映像・音声のトラックの構成（コーデック・解像度・
+サンプリングレート・チャンネルレイアウト）が一致しない入力を、連結を始める前にまとめて報告する
+
+すべてのオーディオトラックと、そのメタデータ（最初の入力のもの）を残す
+"""
+
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image import FfmpegProgressLine
+from .inputs import FfmpegInput, FfmpegTrack, ffmpeg_get_input
+
+
+class JoinTrackLayout(BaseModel):
+    """
+    連結するために一致が必要なトラックの性質
+    """
+
+    type: str
+    codec: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    pixel_format: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channel_layout: Optional[str] = None
+
+    def describe(self) -> str:
+        if self.type == "Video":
+            return f"Video {self.codec} {self.width}x{self.height} {self.pixel_format}"
+
+        return f"Audio {self.codec} {self.sample_rate} Hz {self.channel_layout}"
+
+
+class JoinIncompatibleInput(BaseModel):
+    input_path: Path
+    reason: str
+
+
+class FfmpegJoinResult(BaseModel):
+    success: bool
+    message: Optional[str]
+
+
+def split_stream_text(text: str) -> List[str]:
+    """
+    FFmpegのストリームの説明を、括弧の中を区切らずにカンマで分ける
+
+    h264 (High), yuv420p(tv, bt709, progressive), 1920x1080 [SAR 1:1 DAR 16:9], ...
+    """
+    fields: List[str] = []
+    depth = 0
+    field = ""
+    for char in text:
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+
+        if char == "," and depth == 0:
+            fields.append(field.strip())
+            field = ""
+            continue
+
+        field += char
+
+    fields.append(field.strip())
+    return fields
+
+
+def get_join_track_layout(track: FfmpegTrack) -> JoinTrackLayout:
+    fields = split_stream_text(track.text)
+    codec = fields[0].split(" ")[0]
+
+    if track.type == "Video":
+        width: Optional[int] = None
+        height: Optional[int] = None
+        for field in fields[1:]:
+            match = re.match(r"^(\d+)x(\d+)\b", field)
+            if match:
+                width = int(match.group(1))
+                height = int(match.group(2))
+                break
+
+        pixel_format = fields[1].split("(")[0] if 1 < len(fields) else None
+
+        return JoinTrackLayout(
+            type=track.type,
+            codec=codec,
+            width=width,
+            height=height,
+            pixel_format=pixel_format,
+        )
+
+    sample_rate: Optional[int] = None
+    channel_layout: Optional[str] = None
+    for field_index, field in enumerate(fields):
+        match = re.match(r"^(\d+) Hz$", field)
+        if match:
+            sample_rate = int(match.group(1))
+            if field_index + 1 < len(fields):
+                channel_layout = fields[field_index + 1]
+            break
+
+    return JoinTrackLayout(
+        type=track.type,
+        codec=codec,
+        sample_rate=sample_rate,
+        channel_layout=channel_layout,
+    )
+
+
+def get_join_track_layouts(inp: FfmpegInput) -> List[JoinTrackLayout]:
+    return [
+        get_join_track_layout(track)
+        for stream in inp.streams
+        for track in stream.tracks
+    ]
+
+
+def get_join_incompatible_reason(
+    track_layouts: List[JoinTrackLayout],
+    first_track_layouts: List[JoinTrackLayout],
+) -> Optional[str]:
+    """
+    最初の入力とトラックの構成が異なる理由（一致すればNone）
+    """
+    if len(track_layouts) != len(first_track_layouts):
+        return f"{len(track_layouts)} tracks (expected {len(first_track_layouts)})"
+
+    for track_index, (track_layout, first_track_layout) in enumerate(
+        zip(track_layouts, first_track_layouts)
+    ):
+        if track_layout != first_track_layout:
+            return f"Track {track_index}: {track_layout.describe()} (expected {first_track_layout.describe()})"  # noqa: B950
+
+    return None
+
+
+def check_join_inputs(
+    input_paths: List[Path],
+    jobs: int,
+) -> List[JoinIncompatibleInput]:
+    """
+    入力を並列に調べ、最初の入力とトラックの構成が異なる入力を返す
+    """
+
+    def probe(input_path: Path) -> Union[List[JoinTrackLayout], str]:
+        try:
+            return get_join_track_layouts(ffmpeg_get_input(input_path=input_path))
+        except Exception as error:
+            return f"Failed to probe: {error}"
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        probe_results = list(executor.map(probe, input_paths))
+
+    first_probe_result = probe_results[0]
+    if isinstance(first_probe_result, str):
+        return [
+            JoinIncompatibleInput(input_path=input_paths[0], reason=first_probe_result)
+        ]
+
+    incompatible_inputs: List[JoinIncompatibleInput] = []
+    for input_path, probe_result in zip(input_paths, probe_results):
+        reason = (
+            probe_result
+            if isinstance(probe_result, str)
+            else get_join_incompatible_reason(
+                track_layouts=probe_result,
+                first_track_layouts=first_probe_result,
+            )
+        )
+        if reason is not None:
+            incompatible_inputs.append(
+                JoinIncompatibleInput(input_path=input_path, reason=reason)
+            )
+
+    return incompatible_inputs
+
+
+def format_concat_list(input_paths: List[Path]) -> str:
+    """
+    concat demuxerの入力ファイルの一覧（絶対パス）
+    """
+    lines = []
+    for input_path in input_paths:
+        escaped_path = str(input_path.resolve()).replace("'", "'\\''")
+        lines.append(f"file '{escaped_path}'")
+
+    return "\n".join(lines) + "\n"
+
+
+def ffmpeg_join(
+    input_paths: List[Path],
+    output_path: Path,
+) -> Iterable[Union[FfmpegJoinResult, FfmpegProgressLine]]:
+    """
+    入力をストリームのコピーで連結する（トラックの構成はcheck_join_inputsで確かめておく）
+    """
+    concat_list_path = output_path.with_name(
+        f".{output_path.name}.{os.getpid()}.concat.txt"
+    )
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-n",  # fail if already exists
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        str(concat_list_path),
+        "-map",
+        "0:v?",
+        "-map",
+        "0:a?",
+        "-map_metadata",
+        "0",
+        "-c",
+        "copy",
+        str(output_path),
+    ]
+
+    try:
+        concat_list_path.write_text(
+            format_concat_list(input_paths=input_paths), encoding="utf-8"
+        )
+
+        metrics.count_subprocess_spawn(command)
+        with profiling.profile_subprocess(command) as profile_args:
+            proc = subprocess.Popen(
+                command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                encoding="utf-8",
+            )
+
+            lines = []
+            try:
+                while proc.poll() is None:
+                    assert proc.stderr is not None
+                    line = proc.stderr.readline()
+                    profile_args["pipe_bytes"] += len(line)
+
+                    line = line.rstrip()
+                    lines += [line]
+
+                    match = re.match(
+                        r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line
+                    )
+                    if match:
+                        yield FfmpegProgressLine(
+                            frame=int(match.group(1)),
+                            time=match.group(2).strip(),
+                        )
+
+                assert proc.stderr is not None
+                lines += proc.stderr.read().splitlines()
+                returncode = proc.wait()
+            finally:
+                proc.kill()
+    finally:
+        concat_list_path.unlink(missing_ok=True)
+
+    if returncode != 0:
+        yield FfmpegJoinResult(
+            success=False,
+            message="\n".join(lines[-10:]),
+        )
+    else:
+        yield FfmpegJoinResult(
+            success=True,
+            message=None,
+        )
@@ -1,16 +1,43 @@
 import subprocess
 from pathlib import Path
-from typing import Generator
+from typing import Generator, List, Optional, Union
 
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
 
 
 class FfmpegKeyFrameOutputLine(BaseModel):
     time: float
 
 
+def __parse_frame_time_line(line: str) -> Optional[float]:
+    # frame,0.007000
+    # frame,0.007000,side_data,H.26[45] User Data Unregistered SEI message
+    # frame,0.007000side_data,H.26[45] User Data Unregistered SEI message
+    row = line.split(",")
+    if len(row) < 2:
+        return None
+
+    if row[0] != "frame":
+        return None
+
+    seconds_string = row[1].strip()
+
+    # Workaround for FFprobe issue: (side_data.+)?
+    # https://trac.ffmpeg.org/ticket/7153
+    # Correct: frame,0.007000,side_data,H.26[45] User Data Unregistered SEI message
+    # Broken: frame,0.007000side_data,H.26[45] User Data Unregistered SEI message
+    if seconds_string.endswith("side_data"):
+        # 0.007000side_data -> 0.007000
+        seconds_string = seconds_string[:-9]
+
+    try:
+        return float(seconds_string)
+    except ValueError:  # N/A
+        return None
+
+
 def ffmpeg_key_frames(
     input_path: Path,
 ) -> Generator[FfmpegKeyFrameOutputLine, None, None]:
@@ -23,49 +50,219 @@ def ffmpeg_key_frames(
         "v",
         "-show_frames",
         "-show_entries",
-        "frame=pkt_pts_time",
+        "frame=best_effort_timestamp_time",
         "-of",
         "csv",
         str(input_path),
     ]
 
-    proc = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        encoding="utf-8",
-    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+
+        try:
+            while proc.poll() is None:
+                assert proc.stdout is not None
+                line = proc.stdout.readline()
+                profile_args["pipe_bytes"] += len(line)
+
+                line = line.rstrip()
+
+                seconds = __parse_frame_time_line(line)
+                if seconds is None:
+                    continue
+
+                output = FfmpegKeyFrameOutputLine(time=seconds)
+                yield output
+
+            result_code = proc.wait()
+            if result_code != 0:
+                raise Exception(f"FFmpeg errored. code {result_code}")
+        finally:
+            proc.kill()
+
+
+def __ffprobe_frame_times(
+    input_path: Path,
+    read_intervals: str,
+    key_frames_only: bool,
+) -> List[float]:
+    skip_frame_opts = ["-skip_frame", "nokey"] if key_frames_only else []
+
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        *skip_frame_opts,
+        "-read_intervals",
+        read_intervals,
+        "-select_streams",
+        "v",
+        "-show_frames",
+        "-show_entries",
+        "frame=best_effort_timestamp_time",
+        "-of",
+        "csv",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    frame_times: List[float] = []
+    for line in proc.stdout.splitlines():
+        frame_time = __parse_frame_time_line(line)
+        if frame_time is not None:
+            frame_times.append(frame_time)
+
+    return frame_times
+
+
+def ffmpeg_start_time(input_path: Union[Path, str]) -> float:
+    """
+    入力ファイルの開始時刻（FFprobeの時刻と、FFmpegの-ssなどの時刻の差）
+    """
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-show_entries",
+        "format=start_time",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
 
     try:
-        while proc.poll() is None:
-            assert proc.stdout is not None
-            line = proc.stdout.readline().rstrip()
-
-            # frame,0.007000
-            # frame,0.007000,side_data,H.26[45] User Data Unregistered SEI message
-            # frame,0.007000side_data,H.26[45] User Data Unregistered SEI message
-            row = line.split(",")
-            if len(row) < 2:
-                continue
-
-            if row[0] != "frame":
-                continue
-
-            seconds_string = row[1].strip()
-
-            # Workaround for FFprobe issue: (side_data.+)?
-            # https://trac.ffmpeg.org/ticket/7153
-            # Correct: frame,0.007000,side_data,H.26[45] User Data Unregistered SEI message
-            # Broken: frame,0.007000side_data,H.26[45] User Data Unregistered SEI message
-            if seconds_string.endswith("side_data"):
-                seconds_string = seconds_string[:-9]  # 0.007000side_data -> 0.007000
-
-            seconds = float(seconds_string)
-            output = FfmpegKeyFrameOutputLine(time=seconds)
-            yield output
-
-        result_code = proc.wait()
-        if result_code != 0:
-            raise Exception(f"FFmpeg errored. code {result_code}")
-    finally:
-        proc.kill()
+        return float(proc.stdout.strip())
+    except ValueError:  # N/A
+        return 0.0
+
+
+def ffmpeg_key_frame_time_before(input_path: Path, seconds: float) -> Optional[float]:
+    """
+    指定時刻（FFprobeの時刻）以前で最後のキーフレームの時刻を、シーク1回で取得
+    """
+    key_frame_times = __ffprobe_frame_times(
+        input_path=input_path,
+        read_intervals=f"{seconds:.6f}%+#1",
+        key_frames_only=True,
+    )
+    if len(key_frame_times) == 0:
+        config.logger.warning(f"Key frame not found at {seconds:.6f}: {input_path}")
+        return None
+
+    key_frame_time = key_frame_times[0]
+    if seconds < key_frame_time:
+        return None
+
+    return key_frame_time
+
+
+def ffmpeg_first_frame_time_after(
+    input_path: Path, seconds: Optional[float]
+) -> Optional[float]:
+    """
+    指定時刻（FFprobeの時刻）以降で最初のフレームの時刻
+    """
+    # 終了位置を相対指定（%+1）にすると、シーク先のキーフレームからの相対時間になるため、
+    # 絶対時刻で指定する
+    read_intervals = (
+        f"{seconds:.6f}%{seconds + 1:.6f}" if seconds is not None else "%+1"
+    )
+    frame_times = __ffprobe_frame_times(
+        input_path=input_path,
+        read_intervals=read_intervals,
+        key_frames_only=False,
+    )
+
+    # 精度誤差を考慮して1マイクロ秒の余裕を持たせる
+    candidates = [
+        frame_time
+        for frame_time in frame_times
+        if seconds is None or seconds - 0.000001 <= frame_time
+    ]
+    if len(candidates) == 0:
+        return None
+
+    return min(candidates)
+
+
+def ffmpeg_count_frames_between(
+    input_path: Path,
+    start_seconds: float,
+    end_seconds: float,
+) -> int:
+    """
+    指定範囲（FFprobeの時刻、start_seconds以上end_seconds未満）の映像フレーム数
+
+    デコードせず、パケットの時刻から数える（可変フレームレートでも正確）
+    """
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-read_intervals",
+        f"{start_seconds:.6f}%{end_seconds + 1:.6f}",
+        "-select_streams",
+        "v",
+        "-show_packets",
+        "-show_entries",
+        "packet=pts_time",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    start_microseconds = round(start_seconds * 1_000_000)
+    end_microseconds = round(end_seconds * 1_000_000)
+
+    count = 0
+    for line in proc.stdout.splitlines():
+        try:
+            microseconds = round(float(line.strip().rstrip(",")) * 1_000_000)
+        except ValueError:  # N/A
+            continue
+
+        if start_microseconds <= microseconds < end_microseconds:
+            count += 1
+
+    return count
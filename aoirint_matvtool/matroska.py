@@ -0,0 +1,491 @@
+"""
+MatroskaファイルのEBMLの読み書き
+
+Segment直下の要素（Chapters・Tags・Tracksなど）を、ファイル全体を書き直さずに置き換える
+1. 元の要素とその直後のVoid要素に収まれば、その場で上書きし、余りをVoid要素にする
+2. 収まらなければ、ほかのVoid要素か、Segmentの末尾に書き込み、元の要素をVoid要素にする
+3. SeekHeadの位置を書き換える
+
+サイズが不明な要素（書き込み途中のファイルなど）や、
+SeekHeadを書き換える余地がないファイルはMatroskaEditError
+"""
+
+import os
+import struct
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+SEEK_HEAD_ID = 0x114D9B74
+SEEK_ID = 0x4DBB
+SEEK_ID_ID = 0x53AB
+SEEK_POSITION_ID = 0x53AC
+INFO_ID = 0x1549A966
+TIMESTAMP_SCALE_ID = 0x2AD7B1
+DURATION_ID = 0x4489
+TRACKS_ID = 0x1654AE6B
+CHAPTERS_ID = 0x1043A770
+TAGS_ID = 0x1254C367
+CUES_ID = 0x1C53BB6B
+CLUSTER_ID = 0x1F43B675
+VOID_ID = 0xEC
+CRC32_ID = 0xBF
+
+UNKNOWN_SIZE = None
+
+
+class MatroskaEditError(Exception):
+    """
+    その場で書き換えられないファイル（書き直しが必要）
+    """
+
+
+class EbmlElement(NamedTuple):
+    id: int
+    position: int
+    """要素（ID）の先頭のファイル中の位置"""
+    data_position: int
+    data_size: Optional[int]
+    """サイズが不明な要素はNone"""
+    size_width: int
+    """サイズのバイト数"""
+
+    @property
+    def end_position(self) -> int:
+        assert self.data_size is not None
+        return self.data_position + self.data_size
+
+    @property
+    def size(self) -> int:
+        """ヘッダを含む要素全体のバイト数"""
+        return self.end_position - self.position
+
+
+def decode_vint(data: bytes, position: int, keep_marker: bool) -> Tuple[int, int]:
+    """
+    可変長整数（値、バイト数）
+
+    サイズのすべての値のビットが1のとき（不明なサイズ）は、値を-1とする
+    """
+    if len(data) <= position:
+        raise MatroskaEditError("Unexpected end of EBML data")
+
+    first = data[position]
+    width = 1
+    marker = 0x80
+    while width <= 8 and not first & marker:
+        width += 1
+        marker >>= 1
+
+    if 8 < width:
+        raise MatroskaEditError("Invalid EBML variable size integer")
+
+    if len(data) < position + width:
+        raise MatroskaEditError("Unexpected end of EBML data")
+
+    value = first if keep_marker else first & (marker - 1)
+    all_ones = value == marker - 1
+    for byte in data[position + 1 : position + width]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+
+    if not keep_marker and all_ones:
+        return -1, width
+
+    return value, width
+
+
+def encode_element_id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+
+def encode_vint(value: int, width: Optional[int] = None) -> bytes:
+    """
+    サイズの可変長整数（widthを指定しなければ最小のバイト数）
+    """
+    if width is None:
+        width = 1
+        # 値のビットがすべて1の値は、不明なサイズを表すため使えない
+        while (1 << (7 * width)) - 1 <= value:
+            width += 1
+
+    if 8 < width or (1 << (7 * width)) - 1 <= value:
+        raise MatroskaEditError(f"Size {value} does not fit in {width} bytes")
+
+    return ((1 << (7 * width)) | value).to_bytes(width, "big")
+
+
+def encode_element(
+    element_id: int,
+    data: bytes,
+    size_width: Optional[int] = None,
+) -> bytes:
+    return encode_element_id(element_id) + encode_vint(len(data), size_width) + data
+
+
+def encode_uint_element(element_id: int, value: int) -> bytes:
+    return encode_element(
+        element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+    )
+
+
+def encode_string_element(element_id: int, value: str) -> bytes:
+    return encode_element(element_id, value.encode("utf-8"))
+
+
+def encode_void_element(size: int) -> bytes:
+    """
+    ヘッダを含めてsizeバイトのVoid要素（sizeは2以上）
+    """
+    if size < 2:
+        raise MatroskaEditError(f"Void element of {size} bytes")
+
+    # サイズのバイト数を増やすと中身が減るため、収まるバイト数を探す
+    for size_width in range(1, 9):
+        data_size = size - 1 - size_width
+        if 0 <= data_size < (1 << (7 * size_width)) - 1:
+            return encode_element(VOID_ID, bytes(data_size), size_width)
+
+    raise MatroskaEditError(f"Void element of {size} bytes")
+
+
+def decode_uint(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+def decode_float(data: bytes) -> float:
+    if len(data) == 4:
+        value: float = struct.unpack(">f", data)[0]
+        return value
+
+    if len(data) == 8:
+        value = struct.unpack(">d", data)[0]
+        return value
+
+    return 0.0
+
+
+def read_children(data: bytes) -> List[Tuple[int, bytes]]:
+    """
+    マスター要素の中身を、子要素（ID、中身）に分ける
+    """
+    children: List[Tuple[int, bytes]] = []
+    position = 0
+    while position < len(data):
+        element_id, id_width = decode_vint(data, position, keep_marker=True)
+        data_size, size_width = decode_vint(
+            data, position + id_width, keep_marker=False
+        )
+        if data_size < 0:
+            raise MatroskaEditError("Unknown-sized element in a master element")
+
+        data_position = position + id_width + size_width
+        if len(data) < data_position + data_size:
+            raise MatroskaEditError("Unexpected end of EBML data")
+
+        children.append((element_id, data[data_position : data_position + data_size]))
+        position = data_position + data_size
+
+    return children
+
+
+def without_crc32(children: List[Tuple[int, bytes]]) -> List[Tuple[int, bytes]]:
+    """
+    CRC-32要素を除く（中身を書き換えると一致しなくなるため）
+    """
+    return [
+        (element_id, data) for element_id, data in children if element_id != CRC32_ID
+    ]
+
+
+def encode_children(children: List[Tuple[int, bytes]]) -> bytes:
+    return b"".join(encode_element(element_id, data) for element_id, data in children)
+
+
+def read_element_header(file: BinaryIO, position: int) -> EbmlElement:
+    file.seek(position)
+    header = file.read(12)
+
+    element_id, id_width = decode_vint(header, 0, keep_marker=True)
+    data_size, size_width = decode_vint(header, id_width, keep_marker=False)
+
+    return EbmlElement(
+        id=element_id,
+        position=position,
+        data_position=position + id_width + size_width,
+        data_size=data_size if 0 <= data_size else UNKNOWN_SIZE,
+        size_width=size_width,
+    )
+
+
+def read_element_data(file: BinaryIO, element: EbmlElement) -> bytes:
+    assert element.data_size is not None
+    file.seek(element.data_position)
+    data = file.read(element.data_size)
+    if len(data) != element.data_size:
+        raise MatroskaEditError("Unexpected end of file")
+
+    return data
+
+
+class MatroskaSegment(NamedTuple):
+    segment: EbmlElement
+    children: List[EbmlElement]
+    """Segment直下の要素（Clusterを含む）"""
+    file_size: int
+
+
+def read_matroska_segment(file: BinaryIO) -> MatroskaSegment:
+    """
+    最初のSegmentと、その直下の要素の位置
+
+    Clusterの中は読まずに、サイズで読み飛ばす
+    """
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+
+    ebml_header = read_element_header(file, 0)
+    if ebml_header.id != EBML_ID or ebml_header.data_size is None:
+        raise MatroskaEditError("Not an EBML file")
+
+    segment = read_element_header(file, ebml_header.end_position)
+    if segment.id != SEGMENT_ID:
+        raise MatroskaEditError("Segment not found")
+
+    segment_end_position = (
+        segment.end_position if segment.data_size is not None else file_size
+    )
+    # 末尾に別のデータ（2つ目のSegmentなど）があると、Segmentの末尾に書き足せない
+    if segment_end_position != file_size:
+        raise MatroskaEditError("Data after the first segment")
+
+    children: List[EbmlElement] = []
+    position = segment.data_position
+    while position < segment_end_position:
+        element = read_element_header(file, position)
+        if element.data_size is None:
+            raise MatroskaEditError(
+                f"Unknown-sized element {element.id:X} at {position}"
+            )
+
+        if segment_end_position < element.end_position:
+            raise MatroskaEditError(f"Truncated element {element.id:X} at {position}")
+
+        children.append(element)
+        position = element.end_position
+
+    return MatroskaSegment(segment=segment, children=children, file_size=file_size)
+
+
+def find_child(
+    matroska_segment: MatroskaSegment,
+    element_id: int,
+) -> Optional[EbmlElement]:
+    return next(
+        (child for child in matroska_segment.children if child.id == element_id),
+        None,
+    )
+
+
+def get_free_size(matroska_segment: MatroskaSegment, element: EbmlElement) -> int:
+    """
+    要素と、その直後に続くVoid要素を合わせたバイト数
+    """
+    children = matroska_segment.children
+    index = children.index(element)
+
+    size = element.size
+    for child in children[index + 1 :]:
+        if child.id != VOID_ID:
+            break
+        size += child.size
+
+    return size
+
+
+def fit_element(
+    element_id: int,
+    data: bytes,
+    free_size: int,
+) -> Optional[bytes]:
+    """
+    free_sizeバイトにちょうど収まるように、要素（と余りのVoid要素）をエンコードする
+
+    余りが1バイトのときは、要素のサイズのバイト数を1つ増やして埋める
+    収まらなければNone
+    """
+    element = encode_element(element_id, data)
+    remaining_size = free_size - len(element)
+    if remaining_size < 0:
+        return None
+
+    if remaining_size == 0:
+        return element
+
+    if remaining_size == 1:
+        size_width = len(encode_vint(len(data))) + 1
+        if 8 < size_width:
+            return None
+        return encode_element(element_id, data, size_width)
+
+    return element + encode_void_element(remaining_size)
+
+
+def write_at(file: BinaryIO, position: int, data: bytes) -> None:
+    file.seek(position)
+    file.write(data)
+
+
+def replace_segment_child(
+    file: BinaryIO,
+    element_id: int,
+    data: Optional[bytes],
+) -> None:
+    """
+    Segment直下の要素（element_idの最初の要素）を、中身dataの要素に置き換える
+
+    dataがNoneのときは要素を削除する（Void要素にする）
+    fileは読み書き可能なバイナリモードで開く
+    """
+    matroska_segment = read_matroska_segment(file)
+    segment = matroska_segment.segment
+    old_element = find_child(matroska_segment, element_id)
+
+    if data is None:
+        if old_element is not None:
+            write_at(file, old_element.position, encode_void_element(old_element.size))
+            update_seek_head(file, element_id, None)
+        return
+
+    # 1. 元の要素の位置に収まる
+    if old_element is not None:
+        fitted = fit_element(
+            element_id, data, get_free_size(matroska_segment, old_element)
+        )
+        if fitted is not None:
+            write_at(file, old_element.position, fitted)
+            return
+
+    # 2. ほかのVoid要素に収まる
+    for child in matroska_segment.children:
+        if child.id != VOID_ID:
+            continue
+
+        # 直前のVoid要素に続くVoid要素は、直前のVoid要素とまとめて調べる
+        # SeekHeadの直後のVoid要素は、SeekHeadを書き換える余地として残す
+        index = matroska_segment.children.index(child)
+        if index != 0 and matroska_segment.children[index - 1].id in (
+            VOID_ID,
+            SEEK_HEAD_ID,
+        ):
+            continue
+
+        fitted = fit_element(element_id, data, get_free_size(matroska_segment, child))
+        if fitted is None:
+            continue
+
+        update_seek_head(file, element_id, child.position - segment.data_position)
+        write_at(file, child.position, fitted)
+        if old_element is not None:
+            write_at(file, old_element.position, encode_void_element(old_element.size))
+        return
+
+    # 3. Segmentの末尾に書き足す
+    element = encode_element(element_id, data)
+    new_position = matroska_segment.file_size
+    update_seek_head(file, element_id, new_position - segment.data_position)
+
+    if segment.data_size is not None:
+        new_segment_size = segment.data_size + len(element)
+        write_at(
+            file,
+            segment.data_position - segment.size_width,
+            encode_vint(new_segment_size, segment.size_width),
+        )
+
+    write_at(file, new_position, element)
+    if old_element is not None:
+        write_at(file, old_element.position, encode_void_element(old_element.size))
+
+
+def update_seek_head(
+    file: BinaryIO,
+    element_id: int,
+    segment_position: Optional[int],
+) -> None:
+    """
+    SeekHeadの、element_idの要素の位置（Segmentの中身の先頭からの位置）を書き換える
+
+    segment_positionがNoneのときは、element_idの項目を削除する
+    SeekHeadがなければ何もしない（プレーヤーはSegmentを先頭から読む）
+    """
+    matroska_segment = read_matroska_segment(file)
+    seek_heads = [
+        child for child in matroska_segment.children if child.id == SEEK_HEAD_ID
+    ]
+    if len(seek_heads) == 0:
+        return
+
+    # element_idの項目があるSeekHead（なければ最初のSeekHead）を書き換える
+    target_seek_head = seek_heads[0]
+    target_seeks: Optional[List[Tuple[int, bytes]]] = None
+    for seek_head in seek_heads:
+        seeks = read_children(read_element_data(file, seek_head))
+        if any(
+            seek_id == SEEK_ID
+            and decode_uint(dict(read_children(seek_data)).get(SEEK_ID_ID, b""))
+            == element_id
+            for seek_id, seek_data in seeks
+        ):
+            target_seek_head = seek_head
+            target_seeks = seeks
+            break
+
+    if target_seeks is None:
+        target_seeks = read_children(read_element_data(file, target_seek_head))
+
+    new_seeks = [
+        (seek_id, seek_data)
+        for seek_id, seek_data in without_crc32(target_seeks)
+        if not (
+            seek_id == SEEK_ID
+            and decode_uint(dict(read_children(seek_data)).get(SEEK_ID_ID, b""))
+            == element_id
+        )
+    ]
+    if segment_position is not None:
+        new_seeks.append(
+            (
+                SEEK_ID,
+                encode_element(SEEK_ID_ID, encode_element_id(element_id))
+                + encode_uint_element(SEEK_POSITION_ID, segment_position),
+            )
+        )
+
+    fitted = fit_element(
+        SEEK_HEAD_ID,
+        encode_children(new_seeks),
+        get_free_size(matroska_segment, target_seek_head),
+    )
+    if fitted is None:
+        raise MatroskaEditError("No room to update SeekHead")
+
+    write_at(file, target_seek_head.position, fitted)
+
+
+def read_segment_child_data(
+    file: BinaryIO,
+    element_id: int,
+) -> Optional[bytes]:
+    matroska_segment = read_matroska_segment(file)
+    element = find_child(matroska_segment, element_id)
+    if element is None:
+        return None
+
+    return read_element_data(file, element)
+
+
+def is_matroska_file(path: Path) -> bool:
+    with path.open("rb") as file:
+        return file.read(4) == encode_element_id(EBML_ID)
@@ -0,0 +1,340 @@
+"""
+node-exporterのtextfile collector向けのメトリクス出力（--metrics_path）
+
+exporterがNoneのとき（既定）は何も記録しない
+
+複数のプロセスが同じ.promファイルを共有できるように、書き出しのたびに
+ファイルをロックして既存の値を読み込み、前回の書き出し以降の増分を加算する
+（カウンタ・ヒストグラムのみを扱うため、増分の加算で集計できる）
+"""
+
+import contextlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Generator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+class MetricDefinition(NamedTuple):
+    type: str
+    help: str
+
+
+METRIC_DEFINITIONS: Dict[str, MetricDefinition] = {
+    "matvtool_jobs_started_total": MetricDefinition(
+        type="counter",
+        help="Number of started jobs by subcommand.",
+    ),
+    "matvtool_jobs_succeeded_total": MetricDefinition(
+        type="counter",
+        help="Number of succeeded jobs by subcommand.",
+    ),
+    "matvtool_jobs_failed_total": MetricDefinition(
+        type="counter",
+        help="Number of failed jobs by subcommand.",
+    ),
+    "matvtool_media_seconds_processed_total": MetricDefinition(
+        type="counter",
+        help="Media seconds processed by subcommand.",
+    ),
+    "matvtool_realtime_factor": MetricDefinition(
+        type="histogram",
+        help="Media seconds processed per wall-clock second of a job.",
+    ),
+    "matvtool_find_image_detections_total": MetricDefinition(
+        type="counter",
+        help="Number of find_image detections.",
+    ),
+    "matvtool_subprocess_spawns_total": MetricDefinition(
+        type="counter",
+        help="Number of spawned FFmpeg/FFprobe subprocesses by program.",
+    ),
+    "matvtool_probe_cache_requests_total": MetricDefinition(
+        type="counter",
+        help="Number of probe cache lookups by result (hit/miss).",
+    ),
+    "matvtool_find_image_cache_requests_total": MetricDefinition(
+        type="counter",
+        help="Number of find_image result cache lookups by result (hit/miss).",
+    ),
+    "matvtool_prefetch_bytes_total": MetricDefinition(
+        type="counter",
+        help="Bytes of inputs prefetched by mode (cache/copy).",
+    ),
+}
+
+REALTIME_FACTOR_BUCKETS = [0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_sample_key(name: str, labels: Labels) -> str:
+    if len(labels) == 0:
+        return name
+
+    label_string = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{name}{{{label_string}}}"
+
+
+def parse_prom_file(text: str) -> Dict[str, float]:
+    """
+    このモジュールが書き出した.promファイルのサンプル行を読み込む
+    """
+    samples: Dict[str, float] = {}
+    for line in text.splitlines():
+        if line == "" or line.startswith("#"):
+            continue
+
+        key, _, value = line.rpartition(" ")
+        try:
+            samples[key] = float(value)
+        except ValueError:
+            continue
+
+    return samples
+
+
+def get_sample_sort_key(key: str) -> Tuple[str, float]:
+    # ヒストグラムのバケットをleの昇順に並べる
+    _, le_separator, le_string = key.partition('le="')
+    if not le_separator:
+        return (key, 0.0)
+
+    le_value = le_string.partition('"')[0]
+    return (key.replace(f'le="{le_value}"', ""), float(le_value))
+
+
+def format_prom_file(samples: Dict[str, float]) -> str:
+    lines: List[str] = []
+    for name, definition in METRIC_DEFINITIONS.items():
+        sample_names = (name, f"{name}_bucket", f"{name}_sum", f"{name}_count")
+        metric_samples = sorted(
+            (
+                (key, value)
+                for key, value in samples.items()
+                if key.partition("{")[0] in sample_names
+            ),
+            key=lambda sample: get_sample_sort_key(sample[0]),
+        )
+        if len(metric_samples) == 0:
+            continue
+
+        lines.append(f"# HELP {name} {definition.help}")
+        lines.append(f"# TYPE {name} {definition.type}")
+        for key, value in metric_samples:
+            lines.append(f"{key} {value:.17g}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    def __init__(self, path: Path, interval: float) -> None:
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending: Dict[str, float] = {}
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1.0) -> None:
+        key = format_sample_key(name, labels)
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0.0) + value
+
+    def observe_histogram(
+        self,
+        name: str,
+        labels: Labels,
+        value: float,
+        buckets: List[float],
+    ) -> None:
+        with self.lock:
+            # 累積ヒストグラムのため、該当しないバケットも0で出力する
+            for bucket in [*buckets, float("inf")]:
+                le = "+Inf" if bucket == float("inf") else f"{bucket:g}"
+                key = format_sample_key(f"{name}_bucket", (*labels, ("le", le)))
+                increment = 1.0 if value <= bucket else 0.0
+                self.pending[key] = self.pending.get(key, 0.0) + increment
+
+            for suffix, increment in (("_sum", value), ("_count", 1.0)):
+                key = format_sample_key(f"{name}{suffix}", labels)
+                self.pending[key] = self.pending.get(key, 0.0) + increment
+
+    def flush(self) -> None:
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = self.path.with_name(self.path.name + ".lock")
+
+        with lock_path.open("a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+            samples = (
+                parse_prom_file(self.path.read_text(encoding="utf-8"))
+                if self.path.exists()
+                else {}
+            )
+            for key, value in pending.items():
+                samples[key] = samples.get(key, 0.0) + value
+
+            # node-exporterが書き込み途中のファイルを読まないよう、置き換えで書き出す
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(format_prom_file(samples), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        self.flush()
+
+
+class MetricsJob:
+    def __init__(self, subcommand: str) -> None:
+        self.subcommand = subcommand
+        self.start_time = time.perf_counter()
+        self.media_microseconds: Dict[str, int] = {}
+        """入力（observe_progressのkey）ごとの処理済みのメディア時間"""
+        self.failed = False
+
+
+exporter: Optional[MetricsExporter] = None
+current_job: Optional[MetricsJob] = None
+
+
+@contextlib.contextmanager
+def metrics_job(subcommand: str) -> Generator[None, None, None]:
+    """
+    サブコマンドの実行を1ジョブとして記録
+    """
+    global current_job
+
+    current_exporter = exporter
+    if current_exporter is None:
+        yield
+        return
+
+    labels: Labels = (("subcommand", subcommand),)
+    job = MetricsJob(subcommand=subcommand)
+    current_job = job
+    current_exporter.increment("matvtool_jobs_started_total", labels)
+
+    try:
+        yield
+    except BaseException:
+        job.failed = True
+        raise
+    finally:
+        current_job = None
+
+        status = "failed" if job.failed else "succeeded"
+        current_exporter.increment(f"matvtool_jobs_{status}_total", labels)
+
+        media_seconds = sum(job.media_microseconds.values()) / 1_000_000
+        elapsed = time.perf_counter() - job.start_time
+        if media_seconds > 0:
+            current_exporter.increment(
+                "matvtool_media_seconds_processed_total", labels, media_seconds
+            )
+            if elapsed > 0:
+                current_exporter.observe_histogram(
+                    "matvtool_realtime_factor",
+                    labels,
+                    media_seconds / elapsed,
+                    REALTIME_FACTOR_BUCKETS,
+                )
+
+
+def observe_progress(time_string: str, key: str = "") -> None:
+    """
+    FFmpegの進捗行の時刻から、処理済みのメディア時間を記録
+
+    複数の入力を並行して処理するジョブでは、入力ごとにkeyを分けて記録し、合計する
+    """
+    job = current_job
+    if exporter is None or job is None:
+        return
+
+    from .util import parse_ffmpeg_time_unit_syntax_to_microseconds
+
+    try:
+        microseconds = parse_ffmpeg_time_unit_syntax_to_microseconds(time_string)
+    except ValueError:  # N/A
+        return
+
+    job.media_microseconds[key] = max(job.media_microseconds.get(key, 0), microseconds)
+
+
+def observe_result(success: bool) -> None:
+    job = current_job
+    if job is not None and not success:
+        job.failed = True
+
+
+def observe_detection() -> None:
+    current_exporter = exporter
+    if current_exporter is None:
+        return
+
+    current_exporter.increment("matvtool_find_image_detections_total")
+
+
+def count_subprocess_spawn(command: List[str]) -> None:
+    current_exporter = exporter
+    if current_exporter is None:
+        return
+
+    program = Path(command[0]).name
+    current_exporter.increment(
+        "matvtool_subprocess_spawns_total", (("program", program),)
+    )
+
+
+def count_probe_cache(hit: bool) -> None:
+    current_exporter = exporter
+    if current_exporter is None:
+        return
+
+    result = "hit" if hit else "miss"
+    current_exporter.increment(
+        "matvtool_probe_cache_requests_total", (("result", result),)
+    )
+
+
+def count_find_image_cache(hit: bool) -> None:
+    current_exporter = exporter
+    if current_exporter is None:
+        return
+
+    result = "hit" if hit else "miss"
+    current_exporter.increment(
+        "matvtool_find_image_cache_requests_total", (("result", result),)
+    )
+
+
+def count_prefetch_bytes(mode: str, value: int) -> None:
+    current_exporter = exporter
+    if current_exporter is None:
+        return
+
+    current_exporter.increment(
+        "matvtool_prefetch_bytes_total", (("mode", mode),), value=float(value)
+    )
@@ -0,0 +1,248 @@
+"""
+入力の先読み（find_image -i に複数のファイル・ディレクトリ、join の --prefetch）
+
+NASなどの遅いストレージの入力を、処理中の入力の次のN個まで、バックグラウンドのスレッドで読む
+各入力の読み始めのI/Oの待ち時間を、前の入力の処理（デコード）と重ねる
+
+- cache: ファイルを大きな単位で順に読み捨て、OSのページキャッシュに載せる
+- copy: ローカルの作業ディレクトリへ、合計の上限（max_bytes）以内でコピーし、処理後に削除する
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from types import TracebackType
+from typing import Dict, List, Optional, Set, Type
+
+from . import config, metrics, profiling
+
+PREFETCH_MODES = ("cache", "copy")
+
+PREFETCH_CHUNK_SIZE = 8 * 1024 * 1024
+"""1回に読むバイト数"""
+
+
+class InputPrefetcher:
+    """
+    input_pathsの順に、acquireした入力の次のdepth個までを先読みする
+
+    acquireは、処理を始める入力のパス（copyでコピーが終わっていればコピーのパス）を返す
+    releaseで、処理を終えた入力のコピーを削除する
+    """
+
+    def __init__(
+        self,
+        input_paths: List[Path],
+        depth: int,
+        mode: str = "cache",
+        scratch_dir: Optional[Path] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        if mode not in PREFETCH_MODES:
+            raise ValueError(f"Unsupported prefetch mode: {mode}")
+
+        self.input_paths = input_paths
+        self.depth = depth
+        self.mode = mode
+        self.scratch_dir = scratch_dir
+        self.max_bytes = max_bytes
+
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.next_index = 0
+        self.acquired_count = 0
+        self.acquired_paths: Set[Path] = set()
+        self.released_paths: Set[Path] = set()
+        self.prefetching_paths: Set[Path] = set()
+        self.local_paths: Dict[Path, Path] = {}
+        self.local_bytes: Dict[Path, int] = {}
+        self.used_bytes = 0
+
+        self.created_scratch_dir: Optional[Path] = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self) -> "InputPrefetcher":
+        if self.depth <= 0:
+            return self
+
+        if self.mode == "copy":
+            if self.scratch_dir is None:
+                self.created_scratch_dir = Path(tempfile.mkdtemp(prefix="matvtool-"))
+                self.scratch_dir = self.created_scratch_dir
+            else:
+                self.scratch_dir.mkdir(parents=True, exist_ok=True)
+
+        self.thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        if self.thread.is_alive():
+            self.thread.join()
+
+        for local_path in self.local_paths.values():
+            local_path.unlink(missing_ok=True)
+        self.local_paths.clear()
+
+        if self.created_scratch_dir is not None:
+            shutil.rmtree(self.created_scratch_dir, ignore_errors=True)
+
+    def acquire(self, input_path: Path) -> Path:
+        with self.condition:
+            self.acquired_count += 1
+            self.acquired_paths.add(input_path)
+            self.condition.notify_all()
+
+            # コピーの途中なら、最初から読み直すより終わるのを待つほうが速い
+            while self.mode == "copy" and input_path in self.prefetching_paths:
+                self.condition.wait()
+
+            return self.local_paths.get(input_path, input_path)
+
+    def release(self, input_path: Path) -> None:
+        with self.condition:
+            self.released_paths.add(input_path)
+
+            local_path = self.local_paths.pop(input_path, None)
+            if local_path is not None:
+                local_path.unlink(missing_ok=True)
+                self.used_bytes -= self.local_bytes.pop(input_path)
+
+            self.condition.notify_all()
+
+    def get_next_input_path(self) -> Optional[Path]:
+        """
+        次に先読みする入力（処理中の入力の次のdepth個まで進んだら待つ、終了したらNone）
+        """
+        with self.condition:
+            while True:
+                if self.stopped or self.next_index >= len(self.input_paths):
+                    return None
+
+                # 最初の入力の処理を始めるまでは、先読みしない（処理と同じ入力を読み合う）
+                if 0 < self.acquired_count and (
+                    self.next_index < self.acquired_count + self.depth
+                ):
+                    input_path = self.input_paths[self.next_index]
+                    self.next_index += 1
+
+                    # 処理を始めた入力は、先読みしない
+                    if input_path in self.acquired_paths:
+                        continue
+
+                    self.prefetching_paths.add(input_path)
+                    return input_path
+
+                self.condition.wait()
+
+    def run(self) -> None:
+        while True:
+            input_path = self.get_next_input_path()
+            if input_path is None:
+                return
+
+            try:
+                with profiling.profile_span(
+                    "prefetch", path=str(input_path), mode=self.mode
+                ) as span_args:
+                    if self.mode == "copy":
+                        read_bytes = self.copy_input(input_path)
+                    else:
+                        read_bytes = self.warm_input(input_path)
+                    span_args["bytes_read"] = read_bytes
+
+                metrics.count_prefetch_bytes(mode=self.mode, value=read_bytes)
+            except OSError as error:
+                config.logger.warning(f"Failed to prefetch {input_path}: {error}")
+            finally:
+                with self.condition:
+                    self.prefetching_paths.discard(input_path)
+                    self.condition.notify_all()
+
+    def is_cancelled(self, input_path: Path) -> bool:
+        with self.condition:
+            return self.stopped or input_path in self.released_paths
+
+    def warm_input(self, input_path: Path) -> int:
+        """
+        ファイルを順に読み捨てて、ページキャッシュに載せる
+        """
+        read_bytes = 0
+        buffer = bytearray(PREFETCH_CHUNK_SIZE)
+        with open(input_path, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):  # Windows・macOSにはない
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+            while not self.is_cancelled(input_path):
+                size = file.readinto(buffer)
+                if not size:
+                    break
+                read_bytes += size
+
+        return read_bytes
+
+    def reserve_bytes(self, input_path: Path, size: int) -> bool:
+        """
+        コピーの容量を確保する（ほかのコピーが削除されるまで待つ、収まらなければFalse）
+        """
+        assert self.scratch_dir is not None
+
+        with self.condition:
+            if self.max_bytes is not None and self.max_bytes < size:
+                return False
+
+            while (
+                self.max_bytes is not None and self.max_bytes < self.used_bytes + size
+            ):
+                if self.stopped or input_path in self.acquired_paths:
+                    return False
+                self.condition.wait()
+
+            if shutil.disk_usage(self.scratch_dir).free < size:
+                return False
+
+            self.used_bytes += size
+            return True
+
+    def copy_input(self, input_path: Path) -> int:
+        """
+        作業ディレクトリへコピーする（コピー中の一時ファイルから置き換える）
+        """
+        assert self.scratch_dir is not None
+
+        size = input_path.stat().st_size
+        if not self.reserve_bytes(input_path=input_path, size=size):
+            config.logger.info(f"Skipped prefetch over max bytes: {input_path}")
+            return 0
+
+        local_path = self.scratch_dir / f"{self.next_index:06d}_{input_path.name}"
+        tmp_local_path = local_path.with_name(f".{local_path.name}.{os.getpid()}.tmp")
+        try:
+            shutil.copyfile(input_path, tmp_local_path)
+            os.replace(tmp_local_path, local_path)
+        except BaseException:
+            tmp_local_path.unlink(missing_ok=True)
+            with self.condition:
+                self.used_bytes -= size
+            raise
+
+        with self.condition:
+            # コピー中に処理を終えた入力のコピーは使わない
+            if self.stopped or input_path in self.released_paths:
+                local_path.unlink(missing_ok=True)
+                self.used_bytes -= size
+            else:
+                self.local_paths[input_path] = local_path
+                self.local_bytes[input_path] = size
+
+        return size
@@ -0,0 +1,189 @@
+"""
+処理段階・サブプロセスごとの時間計測（--profile / --trace）
+
+profilerがNoneのとき（既定）は何も記録しない
+"""
+
+import contextlib
+import json
+import os
+import shlex
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def elapsed_microseconds(self) -> float:
+        return (time.perf_counter() - self.origin) * 1_000_000
+
+    def add_complete_event(
+        self,
+        name: str,
+        category: str,
+        start_microseconds: float,
+        duration_microseconds: float,
+        args: Dict[str, Any],
+    ) -> None:
+        with self.lock:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start_microseconds,
+                    "dur": duration_microseconds,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def add_counter_event(self, name: str, values: Dict[str, float]) -> None:
+        with self.lock:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": self.elapsed_microseconds(),
+                    "pid": os.getpid(),
+                    "args": values,
+                }
+            )
+
+    def write(self, path: Path) -> None:
+        """
+        拡張子が.jsonlならJSON Lines、それ以外ならChrome Trace Event形式で書き出す
+        """
+        with self.lock:
+            events = list(self.events)
+
+        with path.open("w", encoding="utf-8") as fp:
+            if path.suffix == ".jsonl":
+                for event in events:
+                    fp.write(json.dumps(event, ensure_ascii=False) + "\n")
+            else:
+                json.dump(
+                    {
+                        "traceEvents": events,
+                        "displayTimeUnit": "ms",
+                    },
+                    fp,
+                    ensure_ascii=False,
+                )
+
+
+profiler: Optional[Profiler] = None
+
+
+def get_children_cpu_seconds() -> float:
+    """
+    回収済みの子プロセスのCPU時間（user + system）
+    """
+    if resource is None:
+        return 0.0
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_children_read_bytes() -> int:
+    """
+    回収済みの子プロセスがストレージから読んだバイト数（ブロック数 x 512）
+
+    ページキャッシュから読んだ分は含まない
+    """
+    if resource is None:
+        return 0
+
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_inblock * 512
+
+
+@contextlib.contextmanager
+def profile_span(
+    name: str,
+    category: str = "stage",
+    **args: Any,
+) -> Generator[Dict[str, Any], None, None]:
+    """
+    処理段階の実時間・CPU時間を記録
+
+    yieldした辞書に値を追加すると、スパンの引数として記録される
+    """
+    span_args: Dict[str, Any] = dict(args)
+
+    current_profiler = profiler
+    if current_profiler is None:
+        yield span_args
+        return
+
+    start_microseconds = current_profiler.elapsed_microseconds()
+    start_cpu_seconds = time.process_time()
+    start_children_cpu_seconds = get_children_cpu_seconds()
+    start_children_read_bytes = get_children_read_bytes()
+
+    try:
+        yield span_args
+    finally:
+        # Python側の処理時間と、子プロセス（FFmpeg）の処理時間を分けて記録
+        span_args["cpu_seconds"] = time.process_time() - start_cpu_seconds
+        span_args["children_cpu_seconds"] = (
+            get_children_cpu_seconds() - start_children_cpu_seconds
+        )
+        # 子プロセス（FFmpeg）の入力のI/O
+        span_args["children_read_bytes"] = (
+            get_children_read_bytes() - start_children_read_bytes
+        )
+
+        current_profiler.add_complete_event(
+            name=name,
+            category=category,
+            start_microseconds=start_microseconds,
+            duration_microseconds=(
+                current_profiler.elapsed_microseconds() - start_microseconds
+            ),
+            args=span_args,
+        )
+
+
+def profile_subprocess(
+    command: List[str],
+) -> contextlib.AbstractContextManager[Dict[str, Any]]:
+    """
+    サブプロセスの起動から終了（回収）までを記録
+
+    pipe_bytesには、標準出力・標準エラー出力からPythonが読んだバイト数を加える
+    """
+    return profile_span(
+        Path(command[0]).name,
+        category="subprocess",
+        command=shlex.join(command),
+        pipe_bytes=0,
+    )
+
+
+def profile_ffmpeg_speed(speed: Optional[str]) -> None:
+    """
+    FFmpegの進捗行のspeed（例: 4.5x）をカウンタとして記録
+    """
+    current_profiler = profiler
+    if current_profiler is None or speed is None:
+        return
+
+    try:
+        value = float(speed.rstrip("x"))
+    except ValueError:  # N/A
+        return
+
+    current_profiler.add_counter_event("ffmpeg_speed", {"speed": value})
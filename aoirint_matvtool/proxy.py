@@ -0,0 +1,408 @@
+"""
+解析用の低解像度プロキシ動画（matvtool proxy）
+
+プロキシは動画の同一性（util.get_video_identity）ごとにプロキシディレクトリへ保存し、
+元の動画との対応（解像度、時刻の差）を同じ名前のJSONファイルに記録する
+
+フレームは間引かず（-vsync passthrough）、元の動画と同じフレームを同じ時刻に持つため、
+プロキシで検索した時刻・フレーム番号は、時刻の差を補正すれば元の動画のものになる
+"""
+
+import hashlib
+import os
+import re
+import subprocess
+from pathlib import Path
+from typing import Iterable, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .find_image import FfmpegProgressLine
+from .key_frames import ffmpeg_first_frame_time_after, ffmpeg_start_time
+from .util import exclude_none, get_file_hash, get_video_identity
+
+
+class ProxyInfo(BaseModel):
+    source_path: str
+    source_identity: str
+    source_width: int
+    source_height: int
+    width: int
+    height: int
+    gop: int
+    timestamp_offset_microseconds: int
+    """元の動画のFFmpegの時刻 - プロキシのFFmpegの時刻"""
+
+
+class FfmpegProxyResult(BaseModel):
+    success: bool
+    message: Optional[str]
+    proxy_path: Optional[str] = None
+
+
+def get_proxy_paths(proxy_dir: Path, source_identity: str) -> Tuple[Path, Path]:
+    return (
+        proxy_dir / f"{source_identity}.mkv",
+        proxy_dir / f"{source_identity}.json",
+    )
+
+
+def ffprobe_video_size(input_path: Path) -> Tuple[int, int]:
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    # 1920,1080
+    width_string, height_string = proc.stdout.strip().split(",")[:2]
+    return int(width_string), int(height_string)
+
+
+def ffmpeg_first_frame_microseconds(input_path: Path) -> Optional[int]:
+    """
+    最初の映像フレームのFFmpegの時刻
+    """
+    frame_time = ffmpeg_first_frame_time_after(input_path=input_path, seconds=None)
+    if frame_time is None:
+        return None
+
+    start_time = ffmpeg_start_time(input_path=input_path)
+    return round((frame_time - start_time) * 1_000_000)
+
+
+def find_proxy(proxy_dir: Path, input_path: Path) -> Optional[Tuple[Path, ProxyInfo]]:
+    """
+    入力動画のプロキシを探す（なければNone）
+    """
+    proxy_path, info_path = get_proxy_paths(
+        proxy_dir=proxy_dir,
+        source_identity=get_video_identity(video_path=input_path),
+    )
+    if not proxy_path.exists() or not info_path.exists():
+        return None
+
+    info = ProxyInfo.model_validate_json(info_path.read_text(encoding="utf-8"))
+    return proxy_path, info
+
+
+def parse_crop(crop: str, source_width: int, source_height: int) -> Tuple[int, ...]:
+    """
+    数値の切り抜き（cropフィルタの引数）の幅・高さ・x・y（式を使っているときはValueError）
+    """
+    # w=1600:h=900:x=0:y=0, 1600:900:0:0, 1600:900
+    keys = ["w", "h", "x", "y"]
+    items = crop.split(":")
+    if len(keys) < len(items):
+        raise ValueError(f"Unsupported crop: {crop}")
+
+    values = {}
+    for index, item in enumerate(items):
+        key, separator, value = item.partition("=")
+        if not separator:
+            key, value = keys[index], item
+        values[key] = int(value)
+
+    width = values.get("w", source_width)
+    height = values.get("h", source_height)
+
+    # FFmpegのcropフィルタと同じく、x・yを省略したときは中央を切り取る
+    x = values.get("x", (source_width - width) // 2)
+    y = values.get("y", (source_height - height) // 2)
+    return width, height, x, y
+
+
+def get_scaled_crop_and_scale(
+    input_video_crop: Optional[str],
+    source_width: int,
+    source_height: int,
+    width: int,
+    height: int,
+) -> Tuple[Optional[str], str]:
+    """
+    元の解像度の切り抜き（-icrop）を縮小した解像度に合わせ、
+    参照画像を合わせる大きさ（scaleフィルタの引数）とともに返す
+
+    切り抜きが数値でない（式を使っている）ときはValueError
+    """
+    if input_video_crop is None:
+        return None, f"{width}:{height}"
+
+    crop_width, crop_height, x, y = parse_crop(
+        crop=input_video_crop,
+        source_width=source_width,
+        source_height=source_height,
+    )
+
+    # 色差の間引きに合わせて偶数に丸める
+    def scale_even(value: int, source_size: int, size: int) -> int:
+        return round(value * size / source_size / 2) * 2
+
+    scaled_x = scale_even(x, source_width, width)
+    scaled_y = scale_even(y, source_height, height)
+    scaled_width = min(
+        max(2, scale_even(crop_width, source_width, width)),
+        width - scaled_x,
+    )
+    scaled_height = min(
+        max(2, scale_even(crop_height, source_height, height)),
+        height - scaled_y,
+    )
+
+    return (
+        f"w={scaled_width}:h={scaled_height}:x={scaled_x}:y={scaled_y}",
+        f"{scaled_width}:{scaled_height}",
+    )
+
+
+def get_proxy_crop_and_scale(
+    info: ProxyInfo,
+    input_video_crop: Optional[str],
+) -> Tuple[Optional[str], str]:
+    """
+    元の動画の切り抜き（-icrop）をプロキシの解像度に合わせ、
+    参照画像を合わせる大きさ（scaleフィルタの引数）とともに返す
+
+    切り抜きが数値でない（式を使っている）ときはValueError
+    """
+    return get_scaled_crop_and_scale(
+        input_video_crop=input_video_crop,
+        source_width=info.source_width,
+        source_height=info.source_height,
+        width=info.width,
+        height=info.height,
+    )
+
+
+def ffmpeg_proxy_reference_image(
+    proxy_dir: Path,
+    reference_image_path: Path,
+    reference_image_crop: Optional[str],
+    scale: str,
+) -> Path:
+    """
+    参照画像を切り抜いてプロキシの解像度に合わせた画像（作成済みなら再利用する）
+
+    検索のたびに、参照画像を1フレームごとに拡大縮小しないように、あらかじめ作成する
+    """
+    digest = hashlib.sha256(
+        f"{get_file_hash(path=reference_image_path)}:{reference_image_crop}:{scale}".encode(
+            "utf-8"
+        )
+    ).hexdigest()
+    output_path = proxy_dir / "reference_images" / f"{digest}.png"
+    if output_path.exists():
+        return output_path
+
+    reference_image_filters = list(
+        exclude_none(
+            [
+                (
+                    f"crop={reference_image_crop}"
+                    if reference_image_crop is not None
+                    else None
+                ),
+                f"scale={scale}",
+            ]
+        )
+    )
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_output_path = output_path.with_name(
+        f".{output_path.stem}.{os.getpid()}.tmp.png"
+    )
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-y",
+        "-i",
+        str(reference_image_path),
+        "-filter:v",
+        ",".join(reference_image_filters),
+        "-frames:v",
+        "1",
+        str(tmp_output_path),
+    ]
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stderr)
+
+    if proc.returncode != 0:
+        tmp_output_path.unlink(missing_ok=True)
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    os.replace(tmp_output_path, output_path)
+    return output_path
+
+
+def ffmpeg_proxy(
+    input_path: Path,
+    proxy_dir: Path,
+    height: int,
+    gop: int,
+    video_codec: str,
+    crf: int,
+) -> Iterable[Union[FfmpegProxyResult, FfmpegProgressLine]]:
+    source_identity = get_video_identity(video_path=input_path)
+    proxy_path, info_path = get_proxy_paths(
+        proxy_dir=proxy_dir,
+        source_identity=source_identity,
+    )
+
+    # エンコードする前に、元の動画の最初のフレームを確認する
+    source_first_frame_microseconds = ffmpeg_first_frame_microseconds(input_path)
+    if source_first_frame_microseconds is None:
+        yield FfmpegProxyResult(
+            success=False,
+            message="Video frame not found",
+        )
+        return
+
+    source_width, source_height = ffprobe_video_size(input_path=input_path)
+
+    proxy_dir.mkdir(parents=True, exist_ok=True)
+    tmp_proxy_path = proxy_path.with_name(f".{proxy_path.stem}.{os.getpid()}.tmp.mkv")
+
+    command = [
+        config.FFMPEG_PATH,
+        "-hide_banner",
+        "-y",
+        "-i",
+        str(input_path),
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-dn",
+        "-vsync",
+        "passthrough",
+        "-filter:v",
+        f"scale=-2:{height}",
+        "-c:v",
+        video_codec,
+        "-g",
+        f"{gop}",
+        "-crf",
+        f"{crf}",
+        "-pix_fmt",
+        "yuv420p",
+        str(tmp_proxy_path),
+    ]
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+        lines = []
+        try:
+            while proc.poll() is None:
+                assert proc.stderr is not None
+                line = proc.stderr.readline()
+                profile_args["pipe_bytes"] += len(line)
+
+                line = line.rstrip()
+                lines += [line]
+
+                match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
+                if match:
+                    frame = int(match.group(1))
+                    _time = match.group(2).strip()
+
+                    progress = FfmpegProgressLine(
+                        frame=frame,
+                        time=_time,
+                    )
+                    yield progress
+
+            returncode = proc.wait()
+        finally:
+            proc.kill()
+
+    if returncode != 0:
+        tmp_proxy_path.unlink(missing_ok=True)
+
+        # skip Input or indented block to head the error message
+        line_index = 0
+        while line_index < len(lines):
+            line = lines[line_index]
+            match = re.search(r"^(Input|  ).+$", line)
+            if not match:
+                break
+            line_index += 1
+
+        message = "\n".join(lines[line_index:]) if line_index != len(lines) else None
+
+        yield FfmpegProxyResult(
+            success=False,
+            message=message,
+        )
+        return
+
+    # 元の動画とプロキシの時刻の差（コンテナのタイムスタンプの丸めなど）
+    proxy_first_frame_microseconds = ffmpeg_first_frame_microseconds(tmp_proxy_path)
+    if proxy_first_frame_microseconds is None:
+        tmp_proxy_path.unlink(missing_ok=True)
+
+        yield FfmpegProxyResult(
+            success=False,
+            message="Video frame not found",
+        )
+        return
+
+    proxy_width, proxy_height = ffprobe_video_size(input_path=tmp_proxy_path)
+
+    info = ProxyInfo(
+        source_path=str(input_path.resolve()),
+        source_identity=source_identity,
+        source_width=source_width,
+        source_height=source_height,
+        width=proxy_width,
+        height=proxy_height,
+        gop=gop,
+        timestamp_offset_microseconds=(
+            source_first_frame_microseconds - proxy_first_frame_microseconds
+        ),
+    )
+
+    os.replace(tmp_proxy_path, proxy_path)
+
+    tmp_info_path = info_path.with_name(f".{info_path.name}.{os.getpid()}.tmp")
+    tmp_info_path.write_text(info.model_dump_json(indent=2), encoding="utf-8")
+    os.replace(tmp_info_path, info_path)
+
+    yield FfmpegProxyResult(
+        success=True,
+        message=None,
+        proxy_path=str(proxy_path),
+    )
@@ -0,0 +1,200 @@
+"""
+編集ソフトで開く・シークするのが速い出力（--output_profile seek）
+
+MP4（MOV）は、インデックス（moov）をファイルの先頭に移す（-movflags +faststart）
+Matroskaは、インデックス（Cues）を最初のClusterの前に置く
+（-cues_to_front、対応していないFFmpegでは-reserve_index_spaceで先頭に領域を確保）
+
+書き出した後、インデックスがあり、映像・音声のデータ（mdat・Cluster）より前にあることを、
+ファイルの先頭から要素のヘッダーだけを読んで（データは読み飛ばして）確かめる
+"""
+
+import os
+import struct
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .matroska import CLUSTER_ID, CUES_ID, MatroskaEditError, read_matroska_segment
+from .stream_io import is_stdio_path
+
+OUTPUT_PROFILES = ("default", "seek")
+
+MP4_FORMATS = {"mp4", "mov", "ipod"}
+MP4_EXTENSIONS = {".mp4", ".m4v", ".m4a", ".mov"}
+MATROSKA_FORMATS = {"matroska", "webm"}
+MATROSKA_EXTENSIONS = {".mkv", ".mka", ".webm"}
+
+MATROSKA_RESERVE_INDEX_SPACE = 256 * 1024
+"""-cues_to_frontに対応していないFFmpegで、先頭に確保するCuesの領域（バイト）"""
+
+
+class SeekIndexCheck(BaseModel):
+    container: str
+    index_position: Optional[int]
+    """インデックス（moov・Cues）の位置（なければNone）"""
+    media_position: Optional[int]
+    """最初の映像・音声のデータ（mdat・Cluster）の位置"""
+
+    @property
+    def ok(self) -> bool:
+        return self.index_position is not None and (
+            self.media_position is None or self.index_position < self.media_position
+        )
+
+    def describe(self) -> str:
+        index_name = "moov" if self.container == "mp4" else "Cues"
+        if self.index_position is None:
+            return f"{index_name} not found"
+
+        placement = "front" if self.ok else "end"
+        return f"{index_name} at {self.index_position} ({placement}, media at {self.media_position})"  # noqa: B950
+
+
+def get_output_container(
+    output_path: Union[Path, str],
+    output_format: Optional[str],
+) -> Optional[str]:
+    """
+    出力の形式（mp4・matroska、それ以外はNone）
+    """
+    if output_format is not None:
+        if output_format in MP4_FORMATS:
+            return "mp4"
+        if output_format in MATROSKA_FORMATS:
+            return "matroska"
+        return None
+
+    suffix = Path(output_path).suffix.lower()
+    if suffix in MP4_EXTENSIONS:
+        return "mp4"
+    if suffix in MATROSKA_EXTENSIONS:
+        return "matroska"
+    return None
+
+
+def ffmpeg_supports_cues_to_front() -> bool:
+    command = [config.FFMPEG_PATH, "-hide_banner", "-h", "muxer=matroska"]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    return proc.returncode == 0 and "cues_to_front" in proc.stdout
+
+
+def get_output_profile_options(
+    output_path: Union[Path, str],
+    output_format: Optional[str],
+    output_profile: str,
+) -> List[str]:
+    if output_profile == "default":
+        return []
+
+    if output_profile != "seek":
+        raise ValueError(f"Unsupported output profile: {output_profile}")
+
+    # インデックスを先頭に置くには、書き出した後にファイルを書き換える必要がある
+    if is_stdio_path(output_path):
+        raise ValueError("Output profile seek requires a file output")
+
+    container = get_output_container(
+        output_path=output_path, output_format=output_format
+    )
+    if container == "mp4":
+        return ["-movflags", "+faststart"]
+
+    if container == "matroska":
+        if ffmpeg_supports_cues_to_front():
+            return ["-cues_to_front", "1"]
+
+        return ["-reserve_index_space", str(MATROSKA_RESERVE_INDEX_SPACE)]
+
+    raise ValueError(f"Output profile seek supports MP4 or Matroska: {output_path}")
+
+
+def check_mp4_seek_index(path: Path) -> SeekIndexCheck:
+    """
+    最上位のボックス（moov・mdat）の位置
+    """
+    index_position: Optional[int] = None
+    media_position: Optional[int] = None
+
+    with open(path, "rb") as file:
+        file_size = os.fstat(file.fileno()).st_size
+        position = 0
+        while position + 8 <= file_size:
+            file.seek(position)
+            size, box_type = struct.unpack(">I4s", file.read(8))
+            if size == 1:  # 64ビットのサイズ
+                (size,) = struct.unpack(">Q", file.read(8))
+            elif size == 0:  # ファイルの末尾まで
+                size = file_size - position
+
+            if box_type == b"moov" and index_position is None:
+                index_position = position
+            if box_type == b"mdat" and media_position is None:
+                media_position = position
+
+            if size < 8:
+                break
+            position += size
+
+    return SeekIndexCheck(
+        container="mp4",
+        index_position=index_position,
+        media_position=media_position,
+    )
+
+
+def check_matroska_seek_index(path: Path) -> SeekIndexCheck:
+    """
+    Segment直下の要素（Cues・Cluster）の位置
+    """
+    with open(path, "rb") as file:
+        try:
+            matroska_segment = read_matroska_segment(file)
+        except MatroskaEditError as error:
+            config.logger.warning(f"Failed to read Matroska elements: {error}")
+            return SeekIndexCheck(
+                container="matroska", index_position=None, media_position=None
+            )
+
+    index_position: Optional[int] = None
+    media_position: Optional[int] = None
+    for element in matroska_segment.children:
+        if element.id == CUES_ID and index_position is None:
+            index_position = element.position
+        if element.id == CLUSTER_ID and media_position is None:
+            media_position = element.position
+
+    return SeekIndexCheck(
+        container="matroska",
+        index_position=index_position,
+        media_position=media_position,
+    )
+
+
+def check_seek_index(
+    output_path: Path,
+    output_format: Optional[str],
+) -> SeekIndexCheck:
+    container = get_output_container(
+        output_path=output_path, output_format=output_format
+    )
+    if container == "mp4":
+        return check_mp4_seek_index(output_path)
+
+    if container == "matroska":
+        return check_matroska_seek_index(output_path)
+
+    raise ValueError(f"Unsupported container: {output_path}")
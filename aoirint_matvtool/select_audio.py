@@ -5,8 +5,15 @@ from typing import Iterable, List, Optional, Union
 
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
 from .find_image import FfmpegProgressLine
+from .seek_index import get_output_profile_options
+from .stream_io import (
+    get_ffmpeg_input_url,
+    get_ffmpeg_output_format_options,
+    get_ffmpeg_output_url,
+    is_stdio_path,
+)
 
 
 class FfmpegSelectAudioResult(BaseModel):
@@ -15,9 +22,11 @@ class FfmpegSelectAudioResult(BaseModel):
 
 
 def ffmpeg_select_audio(
-    input_path: Path,
+    input_path: Union[Path, str],
     audio_indexes: List[int],
-    output_path: Path,
+    output_path: Union[Path, str],
+    output_format: Optional[str] = None,
+    output_profile: str = "default",
 ) -> Iterable[Union[FfmpegSelectAudioResult, FfmpegProgressLine]]:
     audio_map_options = []
     for audio_index in audio_indexes:
@@ -29,7 +38,7 @@ def ffmpeg_select_audio(
         "-hide_banner",
         "-n",  # fail if already exists
         "-i",
-        str(input_path),
+        get_ffmpeg_input_url(input_path),
         "-map",
         "0:v:0",
         *audio_map_options,
@@ -37,36 +46,49 @@ def ffmpeg_select_audio(
         "0",
         "-c",
         "copy",
-        str(output_path),
+        *get_ffmpeg_output_format_options(
+            output_path=output_path, output_format=output_format
+        ),
+        *get_output_profile_options(
+            output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
+        ),
+        get_ffmpeg_output_url(output_path),
     ]
-    proc = subprocess.Popen(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
-    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=None if is_stdio_path(output_path) else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+        lines = []
+        try:
+            while proc.poll() is None:
+                assert proc.stderr is not None
+                line = proc.stderr.readline()
+                profile_args["pipe_bytes"] += len(line)
 
-    lines = []
-    try:
-        while proc.poll() is None:
-            assert proc.stderr is not None
-            line = proc.stderr.readline().rstrip()
-            lines += [line]
+                line = line.rstrip()
+                lines += [line]
 
-            match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
-            if match:
-                frame = int(match.group(1))
-                _time = match.group(2).strip()
+                match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
+                if match:
+                    frame = int(match.group(1))
+                    _time = match.group(2).strip()
 
-                progress = FfmpegProgressLine(
-                    frame=frame,
-                    time=_time,
-                )
-                yield progress
+                    progress = FfmpegProgressLine(
+                        frame=frame,
+                        time=_time,
+                    )
+                    yield progress
 
-        returncode = proc.wait()
-    finally:
-        proc.kill()
+            returncode = proc.wait()
+        finally:
+            proc.kill()
 
     if returncode != 0:
         # skip Input or indented block to head the error message
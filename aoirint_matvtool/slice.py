@@ -6,7 +6,14 @@ from typing import Iterable, Optional, Union
 from aoirint_matvtool.find_image import FfmpegProgressLine
 from pydantic import BaseModel
 
-from . import config
+from . import config, metrics, profiling
+from .seek_index import get_output_profile_options
+from .stream_io import (
+    get_ffmpeg_input_url,
+    get_ffmpeg_output_format_options,
+    get_ffmpeg_output_url,
+    is_stdio_path,
+)
 
 
 class FfmpegSliceResult(BaseModel):
@@ -17,55 +24,74 @@ class FfmpegSliceResult(BaseModel):
 def ffmpeg_slice(
     ss: str,
     to: str,
-    input_path: Path,
-    output_path: Path,
+    input_path: Union[Path, str],
+    output_path: Union[Path, str],
+    output_format: Optional[str] = None,
+    output_profile: str = "default",
 ) -> Iterable[Union[FfmpegSliceResult, FfmpegProgressLine]]:
+    # 標準入力はシークできず、入力の-ssではシークに失敗して空のファイルを書き出すため、
+    # 先頭から読みながら出力で切り出す（開始位置より後のキーフレームから書き出す）
+    trim_opts = ["-ss", ss, "-to", to]
+    input_trim_opts = trim_opts if not is_stdio_path(input_path) else []
+    output_trim_opts = trim_opts if is_stdio_path(input_path) else []
+
     command = [
         config.FFMPEG_PATH,
         "-hide_banner",
         "-n",  # fail if already exists
-        "-ss",
-        ss,
-        "-to",
-        to,
+        *input_trim_opts,
         "-i",
-        str(input_path),
+        get_ffmpeg_input_url(input_path),
+        *output_trim_opts,
         "-map",
         "0",
         "-map_metadata",
         "0",
         "-c",
         "copy",
-        str(output_path),
+        *get_ffmpeg_output_format_options(
+            output_path=output_path, output_format=output_format
+        ),
+        *get_output_profile_options(
+            output_path=output_path,
+            output_format=output_format,
+            output_profile=output_profile,
+        ),
+        get_ffmpeg_output_url(output_path),
     ]
-    proc = subprocess.Popen(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
-    )
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=None if is_stdio_path(output_path) else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+        lines = []
+        try:
+            while proc.poll() is None:
+                assert proc.stderr is not None
+                line = proc.stderr.readline()
+                profile_args["pipe_bytes"] += len(line)
 
-    lines = []
-    try:
-        while proc.poll() is None:
-            assert proc.stderr is not None
-            line = proc.stderr.readline().rstrip()
-            lines += [line]
+                line = line.rstrip()
+                lines += [line]
 
-            match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
-            if match:
-                frame = int(match.group(1))
-                _time = match.group(2).strip()
+                match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
+                if match:
+                    frame = int(match.group(1))
+                    _time = match.group(2).strip()
 
-                progress = FfmpegProgressLine(
-                    frame=frame,
-                    time=_time,
-                )
-                yield progress
+                    progress = FfmpegProgressLine(
+                        frame=frame,
+                        time=_time,
+                    )
+                    yield progress
 
-        returncode = proc.wait()
-    finally:
-        proc.kill()
+            returncode = proc.wait()
+        finally:
+            proc.kill()
 
     if returncode != 0:
         # skip Input or indented block to head the error message
@@ -0,0 +1,528 @@
+"""
+パケットの統計（matvtool stats）
+
+デコードせず、FFprobeを1回だけ実行してすべてのトラックのパケットの一覧
+（pts・dts・長さ・サイズ・フラグ）を読み、トラックごとに集計する
+
+- GOPの長さ（キーフレームから次のキーフレームまでのパケット数）のヒストグラムと、キーフレームの間隔
+- 一定の間隔（既定で1秒）ごとのビットレート
+- 映像の最初のトラックとの開始・終了時刻の差（A/Vのずれ）
+- 時刻の不連続（前のパケットの終わりから、gap_threshold秒より大きく飛ぶ・戻る）
+
+FFprobeの出力をSTATS_CHUNK_PACKETS行ずつNumPyの配列に読み込み、チャンクごとにまとめて計算して、
+チャンクをまたぐ値（最後の数個のパケットの時刻、最後のキーフレームからのパケット数など）だけを持ち越す
+数千万個のパケットでも、メモリはチャンクと、区間ごとのビットレートの分だけ使う
+
+NumPyは任意の依存関係（pip install "aoirint-matvtool[analyze]"）
+"""
+
+import io
+import itertools
+import math
+import subprocess
+from pathlib import Path
+from typing import Dict, Generator, Iterable, List, Optional, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .verify import ProbeStream, ffprobe_streams
+
+try:
+    import numpy as np
+    import numpy.typing as npt
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError as error:  # 任意の依存関係
+    raise ImportError(
+        'stats requires NumPy: pip install "aoirint-matvtool[analyze]"'
+    ) from error
+
+
+STATS_CHUNK_PACKETS = 65536
+"""1回に配列に読み込むパケット数"""
+
+STATS_REORDER_PACKETS = 16
+"""Bフレームで時刻の順が入れ替わるパケットの数の上限（x264の--bframesの上限）"""
+
+STATS_MAX_DISCONTINUITIES = 100
+"""トラックごとに記録する時刻の不連続の数（それ以上は数だけ数える）"""
+
+PACKET_DTYPE = np.dtype(
+    [
+        ("stream_index", np.int32),
+        ("pts", np.float64),
+        ("dts", np.float64),
+        ("duration", np.float64),
+        ("size", np.int64),
+        ("flags", "S8"),
+    ]
+)
+
+
+class TimestampDiscontinuity(BaseModel):
+    time: float
+    """不連続の後のパケットの時刻（dts）"""
+    delta: float
+    """前のパケットの時刻と長さから予想される時刻との差（負なら戻っている）"""
+
+
+class StreamStats(BaseModel):
+    index: int
+    codec_type: str
+    packet_count: int
+    key_packet_count: int
+    total_bytes: int
+    start_seconds: Optional[float]
+    end_seconds: Optional[float]
+    packet_duration: Optional[float]
+    """最も多いパケットの長さ（映像ではフレームの間隔）"""
+    gop_histogram: Dict[int, int]
+    keyframe_interval_min: Optional[float]
+    keyframe_interval_max: Optional[float]
+    interval_bitrates: List[float]
+    """区間ごとのビットレート（bit/s、StatsResult.origin_secondsから）"""
+    discontinuity_count: int
+    discontinuities: List[TimestampDiscontinuity]
+    start_offset: Optional[float] = None
+    """映像の最初のトラックとの開始時刻の差"""
+    end_offset: Optional[float] = None
+    """映像の最初のトラックとの終了時刻の差"""
+
+    @property
+    def duration(self) -> float:
+        if self.start_seconds is None or self.end_seconds is None:
+            return 0.0
+        return self.end_seconds - self.start_seconds
+
+    @property
+    def bitrate(self) -> float:
+        duration = self.duration
+        return self.total_bytes * 8 / duration if 0 < duration else 0.0
+
+
+class StatsResult(BaseModel):
+    origin_seconds: float
+    """区間ごとのビットレートの最初の区間の開始時刻"""
+    bitrate_interval: float
+    streams: List[StreamStats]
+
+    def get_full_interval_bitrates(self, stream: StreamStats) -> List[float]:
+        """
+        トラックの最初から最後までに全体が含まれる区間のビットレート（端の区間を除く）
+        """
+        if stream.start_seconds is None or stream.end_seconds is None:
+            return []
+
+        first_index = math.ceil(
+            (stream.start_seconds - self.origin_seconds) / self.bitrate_interval
+        )
+        end_index = math.floor(
+            (stream.end_seconds - self.origin_seconds) / self.bitrate_interval
+        )
+        return stream.interval_bitrates[max(first_index, 0) : end_index]
+
+
+class StreamStatsAccumulator:
+    """
+    1つのトラックのパケットの配列を、チャンクごとに集計する
+    """
+
+    def __init__(
+        self,
+        stream: ProbeStream,
+        bitrate_interval: float,
+        gap_threshold: float,
+    ) -> None:
+        self.stream = stream
+        self.bitrate_interval = bitrate_interval
+        self.gap_threshold = gap_threshold
+
+        self.packet_count = 0
+        self.key_packet_count = 0
+        self.total_bytes = 0
+        self.start_seconds: Optional[float] = None
+        self.end_seconds: Optional[float] = None
+        self.duration_counts: Dict[float, int] = {}
+
+        # GOP（最初のキーフレームより前と、最後のキーフレームから後のパケットは数えない）
+        self.gop_histogram: Dict[int, int] = {}
+        self.packets_since_key: Optional[int] = None
+        self.last_key_time: Optional[float] = None
+        self.keyframe_interval_min: Optional[float] = None
+        self.keyframe_interval_max: Optional[float] = None
+
+        self.interval_bytes: npt.NDArray[np.float64] = np.zeros(0, dtype=np.float64)
+
+        # 時刻の不連続（前のチャンクの最後のパケットと、そのうちまだ調べていない数）
+        self.tail_times: npt.NDArray[np.float64] = np.zeros(0, dtype=np.float64)
+        self.tail_durations: npt.NDArray[np.float64] = np.zeros(0, dtype=np.float64)
+        self.pending_count = 0
+        self.discontinuity_count = 0
+        self.discontinuities: List[TimestampDiscontinuity] = []
+
+    def update(self, packets: npt.NDArray[np.void], origin_seconds: float) -> None:
+        if len(packets) == 0:
+            return
+
+        pts = packets["pts"]
+        dts = packets["dts"]
+        durations = np.nan_to_num(packets["duration"])
+        sizes = packets["size"]
+        keys = packets["flags"].astype("S1") == b"K"
+
+        # 表示時刻（ptsがなければdts）
+        # MatroskaのBフレームのdtsは、FFprobeでは推測した値やN/Aになるため使わない
+        times = np.where(np.isnan(pts), dts, pts)
+
+        self.packet_count += len(packets)
+        self.key_packet_count += int(np.count_nonzero(keys))
+        self.total_bytes += int(sizes.sum())
+
+        timed = ~np.isnan(times)
+        if timed.any():
+            self.update_bitrate(
+                times=times[timed], sizes=sizes[timed], origin_seconds=origin_seconds
+            )
+
+        # 表示するパケットの範囲（MP4のエディットリストで捨てるパケットを除く）
+        shown = timed & (np.char.find(packets["flags"], b"D") < 0)
+        if shown.any():
+            start_seconds = float(times[shown].min())
+            end_seconds = float((times[shown] + durations[shown]).max())
+            if self.start_seconds is None or start_seconds < self.start_seconds:
+                self.start_seconds = start_seconds
+            if self.end_seconds is None or self.end_seconds < end_seconds:
+                self.end_seconds = end_seconds
+
+        rounded_durations, duration_counts = np.unique(
+            np.round(durations, 6), return_counts=True
+        )
+        for duration, count in zip(
+            rounded_durations.tolist(), duration_counts.tolist()
+        ):
+            self.duration_counts[duration] = (
+                self.duration_counts.get(duration, 0) + count
+            )
+
+        self.update_gop(keys=keys, times=times)
+        self.update_discontinuities(times=times[timed], durations=durations[timed])
+
+    def update_bitrate(
+        self,
+        times: npt.NDArray[np.float64],
+        sizes: npt.NDArray[np.int64],
+        origin_seconds: float,
+    ) -> None:
+        bins = np.floor((times - origin_seconds) / self.bitrate_interval).astype(
+            np.int64
+        )
+        np.clip(bins, 0, None, out=bins)
+
+        interval_bytes = np.bincount(bins, weights=sizes)
+        if len(self.interval_bytes) < len(interval_bytes):
+            self.interval_bytes = np.pad(
+                self.interval_bytes, (0, len(interval_bytes) - len(self.interval_bytes))
+            )
+        self.interval_bytes[: len(interval_bytes)] += interval_bytes
+
+    def update_gop(
+        self,
+        keys: npt.NDArray[np.bool_],
+        times: npt.NDArray[np.float64],
+    ) -> None:
+        key_positions = np.flatnonzero(keys)
+        if len(key_positions) == 0:
+            if self.packets_since_key is not None:
+                self.packets_since_key += len(keys)
+            return
+
+        gop_lengths = np.diff(key_positions)
+        if self.packets_since_key is not None:
+            gop_lengths = np.concatenate(
+                ([self.packets_since_key + key_positions[0]], gop_lengths)
+            )
+        self.packets_since_key = int(len(keys) - key_positions[-1])
+
+        lengths, counts = np.unique(gop_lengths, return_counts=True)
+        for length, count in zip(lengths.tolist(), counts.tolist()):
+            self.gop_histogram[length] = self.gop_histogram.get(length, 0) + count
+
+        key_times = times[key_positions]
+        key_times = key_times[~np.isnan(key_times)]
+        if self.last_key_time is not None:
+            key_times = np.concatenate(([self.last_key_time], key_times))
+        if len(key_times) == 0:
+            return
+
+        self.last_key_time = float(key_times[-1])
+        if 2 <= len(key_times):
+            intervals = np.diff(key_times)
+            interval_min = float(intervals.min())
+            interval_max = float(intervals.max())
+            if (
+                self.keyframe_interval_min is None
+                or interval_min < self.keyframe_interval_min
+            ):
+                self.keyframe_interval_min = interval_min
+            if (
+                self.keyframe_interval_max is None
+                or self.keyframe_interval_max < interval_max
+            ):
+                self.keyframe_interval_max = interval_max
+
+    def update_discontinuities(
+        self,
+        times: npt.NDArray[np.float64],
+        durations: npt.NDArray[np.float64],
+        final: bool = False,
+    ) -> None:
+        """
+        Bフレームでファイル内の順と時刻の順が入れ替わるため、ファイル内で前後
+        STATS_REORDER_PACKETS個のパケットと比べる（チャンクの最後のパケットは次のチャンクで調べる）
+
+        - 飛ぶ: 前後のパケットのうち時刻が前のものの、最も遅い終わりからgap_threshold秒より後
+        - 戻る: 直前のパケットのどれよりもgap_threshold秒より前（差は、その最も遅い終わりから）
+        """
+        all_times = np.concatenate((self.tail_times, times))
+        all_durations = np.concatenate((self.tail_durations, durations))
+
+        # 調べるパケットの範囲（ファイル内の順）
+        start = len(self.tail_times) - self.pending_count
+        end = (
+            len(all_times)
+            if final
+            else max(start, len(all_times) - STATS_REORDER_PACKETS)
+        )
+
+        self.tail_times = all_times[-2 * STATS_REORDER_PACKETS :]
+        self.tail_durations = all_durations[-2 * STATS_REORDER_PACKETS :]
+        self.pending_count = len(all_times) - end
+
+        if start == end:
+            return
+
+        # パケットごとに、ファイル内で前後STATS_REORDER_PACKETS個ずつ（中央が自身）
+        padding = STATS_REORDER_PACKETS
+        window_size = 2 * STATS_REORDER_PACKETS + 1
+        window_times = sliding_window_view(
+            np.pad(all_times, padding, constant_values=np.inf), window_size
+        )[start:end]
+        window_ends = sliding_window_view(
+            np.pad(all_times + all_durations, padding, constant_values=-np.inf),
+            window_size,
+        )[start:end]
+        target_times = all_times[start:end]
+
+        # 戻る
+        prev_min_times = window_times[:, :padding].min(axis=1)
+        prev_max_ends = window_ends[:, :padding].max(axis=1)
+        back_mask = np.isfinite(prev_min_times) & (
+            target_times < prev_min_times - self.gap_threshold
+        )
+
+        # 飛ぶ
+        earlier_max_ends = np.where(
+            window_times < target_times[:, np.newaxis], window_ends, -np.inf
+        ).max(axis=1)
+        forward_gaps = target_times - earlier_max_ends
+        forward_mask = np.isfinite(earlier_max_ends) & (
+            self.gap_threshold < forward_gaps
+        )
+
+        jump_mask = back_mask | forward_mask
+        jump_deltas = np.where(back_mask, target_times - prev_max_ends, forward_gaps)[
+            jump_mask
+        ]
+        jump_times = target_times[jump_mask]
+
+        self.discontinuity_count += len(jump_times)
+        remaining = max(STATS_MAX_DISCONTINUITIES - len(self.discontinuities), 0)
+        for time, delta in zip(
+            jump_times[:remaining].tolist(), jump_deltas[:remaining].tolist()
+        ):
+            self.discontinuities.append(TimestampDiscontinuity(time=time, delta=delta))
+
+    def finish(self) -> None:
+        """
+        最後のパケットの時刻の不連続を調べる
+        """
+        empty = np.zeros(0, dtype=np.float64)
+        self.update_discontinuities(times=empty, durations=empty, final=True)
+
+    def result(self) -> StreamStats:
+        packet_duration = (
+            max(self.duration_counts.items(), key=lambda item: item[1])[0]
+            if len(self.duration_counts) != 0
+            else None
+        )
+
+        return StreamStats(
+            index=self.stream.index,
+            codec_type=self.stream.codec_type,
+            packet_count=self.packet_count,
+            key_packet_count=self.key_packet_count,
+            total_bytes=self.total_bytes,
+            start_seconds=self.start_seconds,
+            end_seconds=self.end_seconds,
+            packet_duration=packet_duration,
+            gop_histogram=dict(sorted(self.gop_histogram.items())),
+            keyframe_interval_min=self.keyframe_interval_min,
+            keyframe_interval_max=self.keyframe_interval_max,
+            interval_bitrates=(
+                self.interval_bytes * 8 / self.bitrate_interval
+            ).tolist(),
+            discontinuity_count=self.discontinuity_count,
+            discontinuities=self.discontinuities,
+        )
+
+
+def read_packet_chunks(
+    lines: Iterable[bytes],
+    chunk_packets: int = STATS_CHUNK_PACKETS,
+) -> Generator[npt.NDArray[np.void], None, None]:
+    """
+    FFprobeのCSV（stream_index,pts_time,dts_time,duration_time,size,flags）を、
+    chunk_packets行ずつ構造化配列に読み込む
+    """
+    while True:
+        block = b"".join(itertools.islice(lines, chunk_packets))
+        if len(block) == 0:
+            return
+
+        # 0,8.333000,8.300000,0.033000,1234,K__
+        # サイドデータ（MP4のスキップするサンプル数など）があると、列と空の行が増える
+        yield np.loadtxt(
+            io.BytesIO(block.replace(b"N/A", b"nan")),
+            delimiter=",",
+            dtype=PACKET_DTYPE,
+            usecols=list(range(len(PACKET_DTYPE.descr))),
+            ndmin=1,
+        )
+
+
+def compute_packet_stats(
+    streams: List[ProbeStream],
+    chunks: Iterable[npt.NDArray[np.void]],
+    bitrate_interval: float = 1.0,
+    gap_threshold: float = 0.1,
+) -> StatsResult:
+    accumulators: Dict[int, StreamStatsAccumulator] = {
+        stream.index: StreamStatsAccumulator(
+            stream=stream,
+            bitrate_interval=bitrate_interval,
+            gap_threshold=gap_threshold,
+        )
+        for stream in streams
+    }
+
+    origin_seconds: Optional[float] = None
+    for chunk in chunks:
+        if origin_seconds is None:
+            times = np.where(np.isnan(chunk["pts"]), chunk["dts"], chunk["pts"])
+            if np.isnan(times).all():
+                continue
+            origin_seconds = float(np.nanmin(times))
+
+        stream_indexes = chunk["stream_index"]
+        for stream_index in np.unique(stream_indexes).tolist():
+            accumulator = accumulators.get(stream_index)
+            if accumulator is None:
+                accumulator = StreamStatsAccumulator(
+                    stream=ProbeStream(
+                        index=stream_index, codec_type="unknown", title=None
+                    ),
+                    bitrate_interval=bitrate_interval,
+                    gap_threshold=gap_threshold,
+                )
+                accumulators[stream_index] = accumulator
+
+            accumulator.update(
+                packets=chunk[stream_indexes == stream_index],
+                origin_seconds=origin_seconds,
+            )
+
+    stream_stats: List[StreamStats] = []
+    for _, accumulator in sorted(accumulators.items()):
+        accumulator.finish()
+        stream_stats.append(accumulator.result())
+
+    # 映像の最初のトラックとの開始・終了時刻の差
+    video_stats = next(
+        (
+            stats
+            for stats in stream_stats
+            if stats.codec_type == "video" and stats.start_seconds is not None
+        ),
+        None,
+    )
+    if video_stats is not None:
+        assert video_stats.start_seconds is not None
+        assert video_stats.end_seconds is not None
+        for stats in stream_stats:
+            if stats is video_stats or stats.start_seconds is None:
+                continue
+            assert stats.end_seconds is not None
+            stats.start_offset = stats.start_seconds - video_stats.start_seconds
+            stats.end_offset = stats.end_seconds - video_stats.end_seconds
+
+    return StatsResult(
+        origin_seconds=origin_seconds if origin_seconds is not None else 0.0,
+        bitrate_interval=bitrate_interval,
+        streams=stream_stats,
+    )
+
+
+def ffprobe_packet_stats(
+    input_path: Union[Path, str],
+    bitrate_interval: float = 1.0,
+    gap_threshold: float = 0.1,
+) -> StatsResult:
+    """
+    FFprobeを1回だけ実行して、すべてのトラックのパケットを集計する
+    """
+    streams = ffprobe_streams(input_path)
+
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-show_entries",
+        "packet=stream_index,pts_time,dts_time,duration_time,size,flags",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            assert proc.stdout is not None
+            stdout = proc.stdout
+
+            def counted_lines() -> Generator[bytes, None, None]:
+                for line in stdout:
+                    profile_args["pipe_bytes"] += len(line)
+                    yield line
+
+            result = compute_packet_stats(
+                streams=streams,
+                chunks=read_packet_chunks(counted_lines()),
+                bitrate_interval=bitrate_interval,
+                gap_threshold=gap_threshold,
+            )
+
+            returncode = proc.wait()
+        finally:
+            proc.kill()
+
+    if returncode != 0:
+        raise Exception(f"FFmpeg errored. code {returncode}")
+
+    return result
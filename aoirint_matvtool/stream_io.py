@@ -0,0 +1,66 @@
+"""
+標準入出力・URLの入出力（slice・select_audio・crop_scale）
+
+入力・出力のパスの`-`は標準入力・標準出力、`http://`などのURLはFFmpegにそのまま渡す
+標準出力には、シークせずに書き出せる形式（Matroska・断片化MP4）で書き出す
+"""
+
+import re
+from pathlib import Path
+from typing import List, Optional, Union
+
+STDIO_PATH = "-"
+STREAM_OUTPUT_FORMATS = ("matroska", "mp4")
+
+URL_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]*://")
+
+
+def is_url(path: Union[Path, str]) -> bool:
+    # Pathにすると//が/になるため、URLは文字列のまま扱う
+    return isinstance(path, str) and URL_PATTERN.match(path) is not None
+
+
+def is_stdio_path(path: Union[Path, str]) -> bool:
+    return isinstance(path, str) and path == STDIO_PATH
+
+
+def get_ffmpeg_input_url(input_path: Union[Path, str]) -> str:
+    if is_stdio_path(input_path):
+        return "pipe:0"
+
+    return str(input_path)
+
+
+def get_ffmpeg_output_url(output_path: Union[Path, str]) -> str:
+    if is_stdio_path(output_path):
+        return "pipe:1"
+
+    return str(output_path)
+
+
+def get_ffmpeg_output_format_options(
+    output_path: Union[Path, str],
+    output_format: Optional[str],
+) -> List[str]:
+    """
+    出力の形式のオプション（標準出力は拡張子から形式を決められないため、省略時はMatroska）
+    """
+    if output_format is None:
+        if not is_stdio_path(output_path):
+            return []
+
+        output_format = "matroska"
+
+    if output_format not in STREAM_OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    if output_format == "mp4":
+        # moovを先頭に置き、キーフレームごとの断片として書き出す（シーク不要）
+        return [
+            "-f",
+            "mp4",
+            "-movflags",
+            "frag_keyframe+empty_moov+default_base_moof",
+        ]
+
+    return ["-f", output_format]
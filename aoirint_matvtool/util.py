@@ -1,4 +1,4 @@
-import re
+import hashlib
 from datetime import timedelta
 from math import log10
 from pathlib import Path
@@ -10,6 +10,8 @@ from .key_frames import FfmpegKeyFrameOutputLine, ffmpeg_key_frames
 
 T = TypeVar("T")
 
+VIDEO_IDENTITY_CHUNK_SIZE = 1024 * 1024
+
 
 def exclude_none(iterable: Iterable[Optional[T]]) -> Iterable[T]:
     """
@@ -52,45 +54,53 @@ def integer_part_and_decimal_part_to_float(
 
 
 def parse_ffmpeg_time_unit_syntax(string: str) -> FfmpegTimeUnitSyntax:
-    match = re.match(r"^(\d+):(\d+):(\d+)(\.\d+)?$", string)  # HOURS:MM:SS.MILLISECONDS
-    if match:
-        hours = int(match.group(1))
-        minutes = int(match.group(2))
-        seconds = int(match.group(3))
-        microseconds = (
-            int(match.group(4)[1:]) if match.group(4) is not None else 0
-        )  # maybe None
-
-        return FfmpegTimeUnitSyntax(
-            hours=hours,
-            minutes=minutes,
-            seconds=seconds,
-            microseconds=microseconds,
-        )
+    total_microseconds = parse_ffmpeg_time_unit_syntax_to_microseconds(string)
+    if total_microseconds < 0:
+        raise ValueError(f"Unsupported syntax: {string}")
+
+    hours, remainder = divmod(total_microseconds, 3_600_000_000)
+    minutes, remainder = divmod(remainder, 60_000_000)
+    seconds, microseconds = divmod(remainder, 1_000_000)
+
+    return FfmpegTimeUnitSyntax(
+        hours=hours,
+        minutes=minutes,
+        seconds=seconds,
+        microseconds=microseconds,
+    )
 
-    match = re.match(r"^(\d+)(\.\d+)?$", string)  # SECONDS
-    if match:
-        time_seconds_integer_part = int(match.group(1))
-        time_seconds_decimal_part = int(match.group(2)) if match.group(2) is None else 0
 
-        time_seconds = integer_part_and_decimal_part_to_float(
-            integer_part=time_seconds_integer_part,
-            decimal_part=time_seconds_decimal_part,
-        )
+def parse_ffmpeg_time_unit_syntax_to_microseconds(string: str) -> int:
+    """
+    FFmpegの時間表記（HOURS:MM:SS.MILLISECONDS、SECONDS）を整数マイクロ秒に変換
+
+    進捗行ごとに呼ばれるため、正規表現・pydanticモデル・timedeltaを経由しない
+    """
+    sign = 1
+    unsigned_string = string
+    if unsigned_string.startswith("-"):
+        sign = -1
+        unsigned_string = unsigned_string[1:]
 
-        td = timedelta(seconds=time_seconds)
-        hours, remainder = divmod(td.seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        microseconds = td.microseconds
+    integer_string, _, decimal_string = unsigned_string.partition(".")
+    integer_parts = integer_string.split(":")
 
-        return FfmpegTimeUnitSyntax(
-            hours=hours,
-            minutes=minutes,
-            seconds=seconds,
-            microseconds=microseconds,
-        )
+    if len(integer_parts) not in (1, 3) or not all(
+        part.isdigit() for part in integer_parts
+    ):
+        raise ValueError(f"Unsupported syntax: {string}")
+
+    if decimal_string != "" and not decimal_string.isdigit():
+        raise ValueError(f"Unsupported syntax: {string}")
+
+    total_seconds = 0
+    for part in integer_parts:
+        total_seconds = total_seconds * 60 + int(part)
+
+    # 小数部は6桁（マイクロ秒）に揃える
+    microseconds = int(decimal_string[:6].ljust(6, "0")) if decimal_string else 0
 
-    raise ValueError(f"Unsupported syntax: {string}")
+    return sign * (total_seconds * 1_000_000 + microseconds)
 
 
 def get_real_start_timedelta_by_ss(
@@ -100,10 +110,9 @@ def get_real_start_timedelta_by_ss(
     """
     ssオプションから実時間での開始時間を計算
     """
-    raw_start_time = parse_ffmpeg_time_unit_syntax(ss) if ss is not None else None
     raw_start_timedelta = (
-        raw_start_time.to_timedelta()
-        if raw_start_time is not None
+        timedelta(microseconds=parse_ffmpeg_time_unit_syntax_to_microseconds(ss))
+        if ss is not None
         else timedelta(seconds=0)
     )
     # raw_end_time = parse_ffmpeg_time_unit_syntax(to) if to is not None else None
@@ -131,3 +140,37 @@ def format_timedelta_as_time_unit_syntax_string(td: timedelta) -> str:
     microseconds = td.microseconds
 
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{microseconds:06d}"
+
+
+def format_microseconds_as_time_unit_syntax_string(microseconds: int) -> str:
+    sign = "-" if microseconds < 0 else ""
+    hours, remainder = divmod(abs(microseconds), 3_600_000_000)
+    minutes, remainder = divmod(remainder, 60_000_000)
+    seconds, microseconds_part = divmod(remainder, 1_000_000)
+
+    return f"{sign}{hours:02d}:{minutes:02d}:{seconds:02d}.{microseconds_part:06d}"
+
+
+def get_video_identity(video_path: Path) -> str:
+    """
+    ファイルサイズと、先頭・中央・末尾の内容から動画を識別する（全体は読まない）
+    """
+    size = video_path.stat().st_size
+
+    digest = hashlib.sha256(f"{size}".encode("ascii"))
+    with video_path.open("rb") as fp:
+        for offset in sorted(
+            {
+                0,
+                max(0, size // 2 - VIDEO_IDENTITY_CHUNK_SIZE // 2),
+                max(0, size - VIDEO_IDENTITY_CHUNK_SIZE),
+            }
+        ):
+            fp.seek(offset)
+            digest.update(fp.read(VIDEO_IDENTITY_CHUNK_SIZE))
+
+    return digest.hexdigest()
+
+
+def get_file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
@@ -0,0 +1,524 @@
+"""
+出力の検証（slice・select_audioの--verify、matvtool verify）
+
+デコードせず、FFprobeでパケットの一覧だけを読み、入力の範囲（-ss・-to）と出力を比べる
+
+- トラックの数・種類、オーディオトラックのタイトル（出力がMatroskaか、出力にタイトルがあるとき）
+- トラックごとのパケット数・長さ（最初のパケットから最後のパケットの終わりまで）
+- 映像トラックが最初のパケットからキーフレームであること
+
+-ssは、FFmpegと同じく直前のキーフレームまで戻る
+FFprobeの-read_intervalsは、どれかのトラックが終了位置を越えると読むのをやめるため、
+範囲の終わりがあるときは、トラックごとにFFprobeを並列に実行する
+範囲の境目のパケットの扱いで数個ずれることがあるため、
+VERIFY_PACKET_TOLERANCE個（長さはその分の時間）までの差は一致とみなす
+"""
+
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from . import config, metrics, profiling
+from .key_frames import ffmpeg_start_time
+from .stream_io import is_stdio_path
+from .util import parse_ffmpeg_time_unit_syntax_to_microseconds
+
+VERIFY_PACKET_TOLERANCE = 2
+VERIFY_START_PACKETS = 1000
+"""-ssのシーク位置から、トラックごとの最初のパケットを探すパケット数"""
+MINIMUM_VERIFY_DURATION_TOLERANCE = 0.1
+"""長さの差の許容（秒）の最小値"""
+
+
+class ProbeStream(BaseModel):
+    index: int
+    codec_type: str
+    title: Optional[str]
+
+
+class ProbePacket(NamedTuple):
+    time: float
+    decode_time: float
+    duration: float
+    key: bool
+
+
+class StreamPacketSummary(BaseModel):
+    packet_count: int
+    key_packet_count: int
+    first_packet_key: bool
+    duration: float
+    packet_duration: float
+    """パケットの長さの中央値（秒）"""
+
+
+class VerifyStreamComparison(BaseModel):
+    output_index: int
+    codec_type: str
+    title: Optional[str]
+    output: StreamPacketSummary
+    expected: StreamPacketSummary
+
+    def describe(self) -> str:
+        return f"Stream {self.output_index} {self.codec_type}: {self.output.packet_count} packets (expected {self.expected.packet_count}), {self.output.duration:.3f} s (expected {self.expected.duration:.3f} s)"  # noqa: B950
+
+
+class FfmpegVerifyResult(BaseModel):
+    success: bool
+    streams: List[VerifyStreamComparison]
+    mismatches: List[str]
+
+
+def ffprobe_streams(input_path: Union[Path, str]) -> List[ProbeStream]:
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-show_entries",
+        "stream=index,codec_type:stream_tags=title",
+        "-of",
+        "json",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    return [
+        ProbeStream(
+            index=stream["index"],
+            codec_type=stream.get("codec_type", "unknown"),
+            title=stream.get("tags", {}).get("title"),
+        )
+        for stream in json.loads(proc.stdout).get("streams", [])
+    ]
+
+
+def ffprobe_format_names(input_path: Union[Path, str]) -> List[str]:
+    """
+    コンテナの形式名（matroska,webmなど）
+    """
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-show_entries",
+        "format=format_name",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        profile_args["pipe_bytes"] = len(proc.stdout)
+
+    if proc.returncode != 0:
+        raise Exception(f"FFmpeg errored. code {proc.returncode}")
+
+    return proc.stdout.strip().split(",")
+
+
+def parse_packet_time(string: str) -> Optional[float]:
+    try:
+        return float(string)
+    except ValueError:  # N/A
+        return None
+
+
+def ffprobe_packets(
+    input_path: Union[Path, str],
+    read_intervals: Optional[str] = None,
+    ignore_editlist: bool = False,
+    stream_index: Optional[int] = None,
+) -> Dict[int, List[ProbePacket]]:
+    """
+    トラックごとのパケットの時刻・長さ・キーフレームか（ファイル内の順）
+
+    read_intervalsの終了位置は、どれかのトラックのパケットが越えた時点で読むのをやめるため、
+    トラックごとに正確に読むには、stream_indexでトラックを1つに絞る
+
+    ignore_editlistのとき、MP4（MOV）のエディットリストの範囲外のパケットも読む
+    （-ssの直前のキーフレームから始まる映像に合わせて、音声の先頭がエディットリストで隠れる）
+    """
+    read_intervals_opts = (
+        ["-read_intervals", read_intervals] if read_intervals is not None else []
+    )
+    ignore_editlist_opts = ["-ignore_editlist", "1"] if ignore_editlist else []
+    select_streams_opts = (
+        ["-select_streams", str(stream_index)] if stream_index is not None else []
+    )
+
+    command = [
+        config.FFPROBE_PATH,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        *read_intervals_opts,
+        *ignore_editlist_opts,
+        *select_streams_opts,
+        "-show_entries",
+        "packet=stream_index,pts_time,dts_time,duration_time,flags",
+        "-of",
+        "csv=p=0",
+        str(input_path),
+    ]
+
+    packets: Dict[int, List[ProbePacket]] = {}
+
+    metrics.count_subprocess_spawn(command)
+    with profiling.profile_subprocess(command) as profile_args:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+
+        try:
+            assert proc.stdout is not None
+            for line in proc.stdout:
+                profile_args["pipe_bytes"] += len(line)
+
+                # 0,8.333000,8.300000,0.033000,K__
+                fields = line.rstrip().split(",")
+                if len(fields) < 5:
+                    continue
+
+                # 表示時刻（pts）とデコード時刻（dts）、片方しかなければもう片方で代用する
+                packet_time = parse_packet_time(fields[1])
+                decode_time = parse_packet_time(fields[2])
+                if packet_time is None:
+                    packet_time = decode_time
+                if decode_time is None:
+                    decode_time = packet_time
+                if packet_time is None or decode_time is None:
+                    continue
+
+                packets.setdefault(int(fields[0]), []).append(
+                    ProbePacket(
+                        time=packet_time,
+                        decode_time=decode_time,
+                        duration=parse_packet_time(fields[3]) or 0.0,
+                        key=fields[4].startswith("K"),
+                    )
+                )
+
+            returncode = proc.wait()
+        finally:
+            proc.kill()
+
+    if returncode != 0:
+        raise Exception(f"FFmpeg errored. code {returncode}")
+
+    return packets
+
+
+def summarize_packets(packets: List[ProbePacket]) -> StreamPacketSummary:
+    if len(packets) == 0:
+        return StreamPacketSummary(
+            packet_count=0,
+            key_packet_count=0,
+            first_packet_key=False,
+            duration=0.0,
+            packet_duration=0.0,
+        )
+
+    start_time = min(packet.time for packet in packets)
+    end_time = max(packet.time + packet.duration for packet in packets)
+    packet_durations = sorted(packet.duration for packet in packets)
+
+    return StreamPacketSummary(
+        packet_count=len(packets),
+        key_packet_count=sum(1 for packet in packets if packet.key),
+        first_packet_key=packets[0].key,
+        duration=end_time - start_time,
+        packet_duration=packet_durations[len(packet_durations) // 2],
+    )
+
+
+def get_expected_streams(
+    input_streams: List[ProbeStream],
+    audio_indexes: Optional[List[int]],
+) -> List[ProbeStream]:
+    """
+    出力に含まれるはずの入力のトラック（slice: すべて、select_audio: 最初の映像と指定した音声）
+    """
+    if audio_indexes is None:
+        return input_streams
+
+    video_streams = [stream for stream in input_streams if stream.codec_type == "video"]
+    audio_streams = [stream for stream in input_streams if stream.codec_type == "audio"]
+
+    expected_streams = video_streams[:1]
+    for audio_index in audio_indexes:
+        if audio_index < 0 or len(audio_streams) <= audio_index:
+            raise ValueError(f"Audio track {audio_index} not found")
+        expected_streams.append(audio_streams[audio_index])
+
+    return expected_streams
+
+
+def ffprobe_stream_start_times(
+    input_path: Union[Path, str],
+    input_streams: List[ProbeStream],
+    seconds: float,
+) -> Tuple[float, Dict[int, float]]:
+    """
+    -ssでFFmpegがシークしたあと、トラックごとに最初に読むパケットのデコード時刻と、その最小値
+
+    シークした位置から最初のVERIFY_START_PACKETS個のパケットを読む
+    FFmpegは、シーク後に読んだパケットをキーフレームより前の時刻のものも含めて出力するため、
+    キーフレームの時刻では切らない
+    """
+    packets = ffprobe_packets(
+        input_path, read_intervals=f"{seconds:.6f}%+#{VERIFY_START_PACKETS}"
+    )
+
+    seek_seconds = seconds
+    video_stream = next(
+        (stream for stream in input_streams if stream.codec_type == "video"), None
+    )
+    if video_stream is not None:
+        video_packets = packets.get(video_stream.index, [])
+        if len(video_packets) != 0 and video_packets[0].time <= seconds + 0.000001:
+            seek_seconds = video_packets[0].time
+
+    stream_start_seconds = {
+        index: stream_packets[0].decode_time
+        for index, stream_packets in packets.items()
+        if len(stream_packets) != 0
+    }
+
+    return min([seek_seconds, *stream_start_seconds.values()]), stream_start_seconds
+
+
+def get_range_packets(
+    packets: Dict[int, List[ProbePacket]],
+    start_seconds: Optional[float],
+    stream_start_seconds: Dict[int, float],
+    end_seconds: Optional[float],
+) -> Dict[int, List[ProbePacket]]:
+    """
+    入力の範囲（デコード時刻がトラックごとの開始時刻以上end_seconds未満）のパケット
+
+    FFmpegの-toは、デコード時刻で切るため、end_secondsより後に表示するBフレームも出力に含まれる
+    """
+    range_packets: Dict[int, List[ProbePacket]] = {}
+    for index, stream_packets in packets.items():
+        range_start_seconds = stream_start_seconds.get(index, start_seconds)
+
+        # 精度誤差を考慮して1マイクロ秒の余裕を持たせる
+        range_packets[index] = [
+            packet
+            for packet in stream_packets
+            if (
+                range_start_seconds is None
+                or range_start_seconds - 0.000001 <= packet.decode_time
+            )
+            and (end_seconds is None or packet.decode_time < end_seconds - 0.000001)
+        ]
+
+    return range_packets
+
+
+def compare_streams(
+    output_streams: List[ProbeStream],
+    expected_streams: List[ProbeStream],
+    output_packets: Dict[int, List[ProbePacket]],
+    expected_packets: Dict[int, List[ProbePacket]],
+    output_title_supported: bool = True,
+) -> FfmpegVerifyResult:
+    """
+    output_title_supported: 出力のコンテナがトラックのタイトルを保存できるか
+    （できないときは、出力にタイトルがあるトラックだけタイトルを比べる）
+    """
+    mismatches: List[str] = []
+
+    output_audio_count = sum(
+        1 for stream in output_streams if stream.codec_type == "audio"
+    )
+    expected_audio_count = sum(
+        1 for stream in expected_streams if stream.codec_type == "audio"
+    )
+    if output_audio_count != expected_audio_count:
+        mismatches.append(
+            f"Audio track count {output_audio_count} (expected {expected_audio_count})"
+        )
+
+    if len(output_streams) != len(expected_streams):
+        mismatches.append(
+            f"Stream count {len(output_streams)} (expected {len(expected_streams)})"
+        )
+
+    comparisons: List[VerifyStreamComparison] = []
+    for output_stream, expected_stream in zip(output_streams, expected_streams):
+        label = f"Stream {output_stream.index} {output_stream.codec_type}"
+
+        if output_stream.codec_type != expected_stream.codec_type:
+            mismatches.append(f"{label}: type (expected {expected_stream.codec_type})")
+            continue
+
+        if (
+            output_stream.codec_type == "audio"
+            and (output_title_supported or output_stream.title is not None)
+            and output_stream.title != expected_stream.title
+        ):
+            mismatches.append(
+                f"{label}: title {output_stream.title!r} (expected {expected_stream.title!r})"  # noqa: B950
+            )
+
+        comparison = VerifyStreamComparison(
+            output_index=output_stream.index,
+            codec_type=output_stream.codec_type,
+            title=output_stream.title,
+            output=summarize_packets(output_packets.get(output_stream.index, [])),
+            expected=summarize_packets(expected_packets.get(expected_stream.index, [])),
+        )
+        comparisons.append(comparison)
+
+        output = comparison.output
+        expected = comparison.expected
+
+        if VERIFY_PACKET_TOLERANCE < abs(output.packet_count - expected.packet_count):
+            mismatches.append(
+                f"{label}: {output.packet_count} packets (expected {expected.packet_count})"  # noqa: B950
+            )
+
+        duration_tolerance = max(
+            MINIMUM_VERIFY_DURATION_TOLERANCE,
+            VERIFY_PACKET_TOLERANCE * expected.packet_duration,
+        )
+        if duration_tolerance < abs(output.duration - expected.duration):
+            mismatches.append(
+                f"{label}: {output.duration:.3f} s (expected {expected.duration:.3f} s)"
+            )
+
+        if output_stream.codec_type == "video" and 0 < expected.key_packet_count:
+            if output.key_packet_count == 0:
+                mismatches.append(f"{label}: no key frame")
+            elif not output.first_packet_key:
+                mismatches.append(f"{label}: first packet is not a key frame")
+
+    return FfmpegVerifyResult(
+        success=len(mismatches) == 0,
+        streams=comparisons,
+        mismatches=mismatches,
+    )
+
+
+def ffprobe_verify_output(
+    input_path: Union[Path, str],
+    output_path: Union[Path, str],
+    ss: Optional[str] = None,
+    to: Optional[str] = None,
+    audio_indexes: Optional[List[int]] = None,
+) -> FfmpegVerifyResult:
+    """
+    出力（slice: -ss・-toの範囲のすべてのトラック、select_audio: 最初の映像と指定した音声）を、
+    入力のパケットと比べて検証する
+    """
+    if is_stdio_path(input_path) or is_stdio_path(output_path):
+        raise ValueError("Verification requires file or URL input and output")
+
+    # FFmpegの-ss・-toは、FFprobeの時刻では入力の開始時刻からの相対時刻
+    start_seconds: Optional[float] = None
+    end_seconds: Optional[float] = None
+    if ss is not None or to is not None:
+        start_time = ffmpeg_start_time(input_path=input_path)
+        if ss is not None:
+            start_seconds = (
+                start_time + parse_ffmpeg_time_unit_syntax_to_microseconds(ss) / 1e6
+            )
+        if to is not None:
+            end_seconds = (
+                start_time + parse_ffmpeg_time_unit_syntax_to_microseconds(to) / 1e6
+            )
+
+    # 入力と出力を並列に読む
+    with ThreadPoolExecutor() as executor:
+        output_streams_future = executor.submit(ffprobe_streams, output_path)
+        output_format_names_future = executor.submit(ffprobe_format_names, output_path)
+        output_packets_future = executor.submit(
+            ffprobe_packets, output_path, None, True
+        )
+
+        input_streams = ffprobe_streams(input_path)
+        expected_streams = get_expected_streams(
+            input_streams=input_streams, audio_indexes=audio_indexes
+        )
+
+        # -ssは、FFmpegと同じく直前のキーフレームまで戻る
+        stream_start_seconds: Dict[int, float] = {}
+        if start_seconds is not None:
+            start_seconds, stream_start_seconds = ffprobe_stream_start_times(
+                input_path=input_path,
+                input_streams=input_streams,
+                seconds=start_seconds,
+            )
+
+        # 終了位置を相対指定にすると、シーク先のキーフレームからの相対時間になるため、
+        # 絶対時刻で指定する
+        read_intervals: Optional[str] = None
+        if start_seconds is not None or end_seconds is not None:
+            read_intervals = (
+                f"{start_seconds:.6f}%" if start_seconds is not None else "%"
+            ) + (f"{end_seconds + 1:.6f}" if end_seconds is not None else "")
+
+        # 範囲の終わりがあるときは、トラックごとに読む
+        if end_seconds is not None:
+            input_packets_futures = [
+                executor.submit(
+                    ffprobe_packets, input_path, read_intervals, False, stream.index
+                )
+                for stream in expected_streams
+            ]
+        else:
+            input_packets_futures = [
+                executor.submit(ffprobe_packets, input_path, read_intervals)
+            ]
+
+        output_streams = output_streams_future.result()
+        output_format_names = output_format_names_future.result()
+        output_packets = output_packets_future.result()
+        input_packets: Dict[int, List[ProbePacket]] = {}
+        for input_packets_future in input_packets_futures:
+            input_packets.update(input_packets_future.result())
+
+    expected_packets = get_range_packets(
+        packets=input_packets,
+        start_seconds=start_seconds,
+        stream_start_seconds=stream_start_seconds,
+        end_seconds=end_seconds,
+    )
+
+    return compare_streams(
+        output_streams=output_streams,
+        expected_streams=expected_streams,
+        output_packets=output_packets,
+        expected_packets=expected_packets,
+        # MP4などは、FFmpegがトラックのタイトルを書き出さない
+        output_title_supported="matroska" in output_format_names,
+    )
@@ -0,0 +1,155 @@
+"""
+find_imageの行ごとの処理（FFmpeg標準エラー出力のパース・時刻計算）のマイクロベンチマーク
+
+pydanticモデルを経由する従来の処理と、軽量イベント・整数マイクロ秒による処理の
+1秒あたりの処理行数を比較する
+
+python benchmarks/bench_find_image_events.py --num_lines 200000
+"""
+
+import re
+import time
+from argparse import ArgumentParser
+from datetime import timedelta
+from typing import Callable, List
+
+from aoirint_matvtool.find_image import (
+    FfmpegBlackframeEvent,
+    FfmpegBlackframeOutputLine,
+    FfmpegProgressEvent,
+    FfmpegProgressLine,
+    parse_ffmpeg_blackframe_line,
+    parse_ffmpeg_progress_line,
+)
+from aoirint_matvtool.util import (
+    FfmpegTimeUnitSyntax,
+    format_microseconds_as_time_unit_syntax_string,
+    format_timedelta_as_time_unit_syntax_string,
+    parse_ffmpeg_time_unit_syntax_to_microseconds,
+)
+
+
+def create_lines(num_lines: int) -> List[str]:
+    lines: List[str] = []
+    for index in range(num_lines):
+        frame = index // 2
+        seconds = frame / 60
+        if index % 2 == 0:
+            lines.append(
+                f"[Parsed_blackframe_3 @ 0x5581] frame:{frame} pblack:99 pts:{frame * 1000} t:{seconds:.6f} type:P last_keyframe:0"  # noqa: B950
+            )
+        else:
+            hours, remainder = divmod(seconds, 3600)
+            minutes, remainder = divmod(remainder, 60)
+            lines.append(
+                f"frame={frame:5d} fps=240 q=-0.0 size=N/A time={int(hours):02d}:{int(minutes):02d}:{remainder:05.2f} bitrate=N/A speed=4.0x"  # noqa: B950
+            )
+
+    return lines
+
+
+def legacy_parse_ffmpeg_time_unit_syntax(string: str) -> FfmpegTimeUnitSyntax:
+    match = re.match(r"^(\d+):(\d+):(\d+)(\.\d+)?$", string)
+    assert match is not None
+    return FfmpegTimeUnitSyntax(
+        hours=int(match.group(1)),
+        minutes=int(match.group(2)),
+        seconds=int(match.group(3)),
+        microseconds=int(match.group(4)[1:]) if match.group(4) is not None else 0,
+    )
+
+
+def process_legacy(lines: List[str]) -> None:
+    """
+    変更前の処理（pydanticモデル・正規表現・timedelta）
+    """
+    start_timedelta = timedelta(seconds=0)
+    for line in lines:
+        match = re.match(r"^\[Parsed_blackframe.+?\]\ (frame:.+)$", line)
+        if match:
+            result_dict = {}
+            for key_value in match.group(1).strip().split(" "):
+                key, value = key_value.split(":", maxsplit=2)
+                result_dict[key] = value
+
+            blackframe = FfmpegBlackframeOutputLine.model_validate(result_dict)
+            internal_timedelta = timedelta(seconds=blackframe.t)
+            format_timedelta_as_time_unit_syntax_string(internal_timedelta)
+            format_timedelta_as_time_unit_syntax_string(
+                start_timedelta + internal_timedelta
+            )
+
+        match = re.match(r"^frame=\ *(\d+?)\ .+time=(.+?)\ bitrate.+$", line)
+        if match:
+            progress = FfmpegProgressLine(
+                frame=int(match.group(1)),
+                time=match.group(2).strip(),
+            )
+            internal_timedelta = legacy_parse_ffmpeg_time_unit_syntax(
+                progress.time
+            ).to_timedelta()
+            format_timedelta_as_time_unit_syntax_string(internal_timedelta)
+            format_timedelta_as_time_unit_syntax_string(
+                start_timedelta + internal_timedelta
+            )
+
+
+def process_events(lines: List[str]) -> None:
+    """
+    変更後の処理（軽量イベント・整数マイクロ秒）
+    """
+    start_microseconds = 0
+    for line in lines:
+        event: FfmpegBlackframeEvent | FfmpegProgressEvent | None = (
+            parse_ffmpeg_blackframe_line(line)
+        )
+        if event is None:
+            event = parse_ffmpeg_progress_line(line)
+
+        if isinstance(event, FfmpegBlackframeEvent):
+            internal_microseconds = round(event.t * 1_000_000)
+        elif isinstance(event, FfmpegProgressEvent):
+            internal_microseconds = parse_ffmpeg_time_unit_syntax_to_microseconds(
+                event.time
+            )
+        else:
+            continue
+
+        format_microseconds_as_time_unit_syntax_string(internal_microseconds)
+        format_microseconds_as_time_unit_syntax_string(
+            start_microseconds + internal_microseconds
+        )
+
+
+def measure_lines_per_second(
+    process: Callable[[List[str]], None],
+    lines: List[str],
+    repeat: int,
+) -> float:
+    best_elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process(lines)
+        best_elapsed = min(best_elapsed, time.perf_counter() - start)
+
+    return len(lines) / best_elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--num_lines", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = create_lines(num_lines=args.num_lines)
+
+    legacy_lps = measure_lines_per_second(process_legacy, lines, repeat=args.repeat)
+    events_lps = measure_lines_per_second(process_events, lines, repeat=args.repeat)
+
+    print(f"Before (pydantic): {legacy_lps:,.0f} lines/s")
+    print(f"After (events): {events_lps:,.0f} lines/s")
+    print(f"Speedup: {events_lps / legacy_lps:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+"""
+合成したマルチオーディオトラック動画を使った、各サブコマンドのエンドツーエンドベンチマーク
+
+FFmpegのtestsrc2/sineソースで決定的な動画を生成し、
+matvtoolの各サブコマンドを別プロセスで実行して、
+処理時間・CPU時間・スループット（実時間比、フレーム/秒、MB/秒）・ピークメモリ使用量を計測する
+
+# 計測してJSONに保存
+python benchmarks/bench_operations.py run --duration 60 --size 1280x720 --output current.json
+
+# 保存済みのベースラインと比較（劣化があれば終了コード1）
+python benchmarks/bench_operations.py compare baseline.json current.json
+
+find_imageの高速デコード（--fast_decode）は、通常のデコードの検出結果に対する
+再現率（recall）・適合率（precision）も記録する
+（-lowresに対応するコーデックは --video_codec mpeg2video などで計測する）
+"""
+
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+OPERATION_NAMES = [
+    "input",
+    "key_frames",
+    "slice",
+    "select_audio",
+    "crop_scale",
+    "find_image",
+    "find_image_fast_decode",
+    "find_image_fps",
+    "find_image_fps_fast_decode",
+]
+
+
+class SyntheticVideoParams(NamedTuple):
+    duration: float
+    width: int
+    height: int
+    fps: int
+    gop: int
+    audio_tracks: int
+    video_codec: str
+
+
+class OperationCase(NamedTuple):
+    name: str
+    args: List[str]
+    output_path: Optional[Path]
+    media_seconds: float
+    accuracy_baseline: Optional[str] = None
+    """検出結果を比較する通常のデコードのケース名"""
+
+
+class OperationMeasurement(NamedTuple):
+    wall_seconds: float
+    cpu_seconds: float
+    peak_rss_kilobytes: int
+
+
+def generate_synthetic_video(
+    ffmpeg_path: str,
+    params: SyntheticVideoParams,
+    output_path: Path,
+) -> None:
+    """
+    決定的な合成動画（映像1トラック、周波数の異なる正弦波の音声Nトラック）を生成
+    """
+    size = f"{params.width}x{params.height}"
+
+    audio_input_opts: List[str] = []
+    audio_map_opts: List[str] = []
+    for audio_index in range(params.audio_tracks):
+        frequency = 220 * (audio_index + 1)
+        audio_input_opts += [
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency={frequency}:sample_rate=48000:duration={params.duration}",
+        ]
+        audio_map_opts += [
+            "-map",
+            f"{audio_index + 1}:a",
+            f"-metadata:s:a:{audio_index}",
+            f"title=Track {audio_index + 1}",
+        ]
+
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={size}:rate={params.fps}:duration={params.duration}",
+        *audio_input_opts,
+        "-map",
+        "0:v",
+        *audio_map_opts,
+        "-c:v",
+        params.video_codec,
+        "-g",
+        str(params.gop),
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-fflags",
+        "+bitexact",
+        "-flags",
+        "+bitexact",
+        str(output_path),
+    ]
+    subprocess.run(command, check=True)
+
+
+def extract_reference_image(
+    ffmpeg_path: str,
+    video_path: Path,
+    seconds: float,
+    output_path: Path,
+) -> None:
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-ss",
+        f"{seconds:.6f}",
+        "-i",
+        str(video_path),
+        "-frames:v",
+        "1",
+        str(output_path),
+    ]
+    subprocess.run(command, check=True)
+
+
+def measure_command(
+    command: List[str],
+    stdout_path: Optional[Path] = None,
+) -> OperationMeasurement:
+    """
+    コマンドを実行し、wait4で子孫プロセスを含むCPU時間・ピークRSSを取得
+
+    stdout_pathを指定すると、標準出力をファイルに保存する
+    """
+    with TemporaryDirectory() as stderr_dir:
+        stderr_path = Path(stderr_dir) / "stderr.txt"
+        with contextlib.ExitStack() as stack:
+            stderr_file = stack.enter_context(stderr_path.open("wb"))
+            stdout_file = (
+                stack.enter_context(stdout_path.open("wb"))
+                if stdout_path is not None
+                else subprocess.DEVNULL
+            )
+
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                command,
+                stdout=stdout_file,
+                stderr=stderr_file,
+            )
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall_seconds = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+        if proc.returncode != 0:
+            stderr = stderr_path.read_text(encoding="utf-8", errors="replace")
+            raise Exception(
+                f"Benchmark command failed. code {proc.returncode}: {command}\n{stderr}"
+            )
+
+    return OperationMeasurement(
+        wall_seconds=wall_seconds,
+        cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+        peak_rss_kilobytes=rusage.ru_maxrss,
+    )
+
+
+def create_operation_cases(
+    params: SyntheticVideoParams,
+    video_path: Path,
+    reference_image_path: Path,
+    work_dir: Path,
+) -> List[OperationCase]:
+    quarter = params.duration / 4
+
+    return [
+        OperationCase(
+            name="input",
+            args=["input", "-i", str(video_path)],
+            output_path=None,
+            media_seconds=params.duration,
+        ),
+        OperationCase(
+            name="key_frames",
+            args=["key_frames", "-i", str(video_path)],
+            output_path=None,
+            media_seconds=params.duration,
+        ),
+        OperationCase(
+            name="slice",
+            args=[
+                "slice",
+                "-ss",
+                f"{quarter:.6f}",
+                "-to",
+                f"{quarter * 3:.6f}",
+                "-i",
+                str(video_path),
+                "-p",
+                "none",
+                str(work_dir / "slice.mkv"),
+            ],
+            output_path=work_dir / "slice.mkv",
+            media_seconds=quarter * 2,
+        ),
+        OperationCase(
+            name="select_audio",
+            args=[
+                "select_audio",
+                "-i",
+                str(video_path),
+                "--audio_index",
+                "0",
+                "-p",
+                "none",
+                "--",
+                str(work_dir / "select_audio.mkv"),
+            ],
+            output_path=work_dir / "select_audio.mkv",
+            media_seconds=params.duration,
+        ),
+        OperationCase(
+            name="crop_scale",
+            args=[
+                "crop_scale",
+                "-i",
+                str(video_path),
+                "--crop",
+                "w=iw/2:h=ih/2:x=0:y=0",
+                "--scale",
+                f"{params.width}:{params.height}",
+                "-vcodec",
+                params.video_codec,
+                "-p",
+                "none",
+                str(work_dir / "crop_scale.mkv"),
+            ],
+            output_path=work_dir / "crop_scale.mkv",
+            media_seconds=params.duration,
+        ),
+        *create_find_image_cases(
+            params=params,
+            video_path=video_path,
+            reference_image_path=reference_image_path,
+        ),
+    ]
+
+
+def create_find_image_cases(
+    params: SyntheticVideoParams,
+    video_path: Path,
+    reference_image_path: Path,
+) -> List[OperationCase]:
+    """
+    通常のデコードと高速デコード（--fast_decode）のfind_image
+    """
+    find_image_args = [
+        "find_image",
+        "-i",
+        str(video_path),
+        "-ref",
+        str(reference_image_path),
+        "-p",
+        "none",
+    ]
+    fps_args = ["--fps", f"{max(1, params.fps // 3)}"]
+
+    return [
+        OperationCase(
+            name="find_image",
+            args=find_image_args,
+            output_path=None,
+            media_seconds=params.duration,
+        ),
+        OperationCase(
+            name="find_image_fast_decode",
+            args=[*find_image_args, "--fast_decode"],
+            output_path=None,
+            media_seconds=params.duration,
+            accuracy_baseline="find_image",
+        ),
+        OperationCase(
+            name="find_image_fps",
+            args=[*find_image_args, *fps_args],
+            output_path=None,
+            media_seconds=params.duration,
+        ),
+        OperationCase(
+            name="find_image_fps_fast_decode",
+            args=[*find_image_args, *fps_args, "--fast_decode"],
+            output_path=None,
+            media_seconds=params.duration,
+            accuracy_baseline="find_image_fps",
+        ),
+    ]
+
+
+def parse_find_image_detection_times(output: str) -> Set[str]:
+    # Output | Time 00:00:13.023000, frame 390 (Internal time ...)
+    return {
+        line.partition("Time ")[2].partition(",")[0]
+        for line in output.splitlines()
+        if line.startswith("Output | ")
+    }
+
+
+def get_detection_accuracy(
+    baseline_times: Set[str],
+    times: Set[str],
+) -> Dict[str, float]:
+    """
+    通常のデコードの検出を正解とした、再現率・適合率
+    """
+    matched = len(baseline_times & times)
+    return {
+        "recall": matched / len(baseline_times) if len(baseline_times) != 0 else 1.0,
+        "precision": matched / len(times) if len(times) != 0 else 1.0,
+    }
+
+
+def run_benchmark(args: Namespace) -> Dict[str, Any]:
+    width, height = (int(value) for value in args.size.split("x"))
+    params = SyntheticVideoParams(
+        duration=args.duration,
+        width=width,
+        height=height,
+        fps=args.fps,
+        gop=args.gop,
+        audio_tracks=args.audio_tracks,
+        video_codec=args.video_codec,
+    )
+    operation_names = args.operations or OPERATION_NAMES
+
+    matvtool_command = [
+        sys.executable,
+        "-m",
+        "aoirint_matvtool",
+        "--ffmpeg_path",
+        args.ffmpeg_path,
+        "--ffprobe_path",
+        args.ffprobe_path,
+    ]
+
+    results: Dict[str, Any] = {}
+    detection_times: Dict[str, Set[str]] = {}
+    with TemporaryDirectory() as work_dir_string:
+        work_dir = Path(work_dir_string)
+        video_path = work_dir / "synthetic.mkv"
+        reference_image_path = work_dir / "reference.png"
+
+        generate_synthetic_video(
+            ffmpeg_path=args.ffmpeg_path,
+            params=params,
+            output_path=video_path,
+        )
+        extract_reference_image(
+            ffmpeg_path=args.ffmpeg_path,
+            video_path=video_path,
+            seconds=params.duration / 2,
+            output_path=reference_image_path,
+        )
+        video_bytes = video_path.stat().st_size
+
+        cases = create_operation_cases(
+            params=params,
+            video_path=video_path,
+            reference_image_path=reference_image_path,
+            work_dir=work_dir,
+        )
+
+        for case in cases:
+            if case.name not in operation_names:
+                continue
+
+            stdout_path = work_dir / f"{case.name}.stdout.txt"
+
+            measurements: List[OperationMeasurement] = []
+            for _ in range(args.repeat):
+                if case.output_path is not None:
+                    case.output_path.unlink(missing_ok=True)
+
+                measurements.append(
+                    measure_command(
+                        [*matvtool_command, *case.args],
+                        stdout_path=stdout_path,
+                    )
+                )
+
+            best = min(measurements, key=lambda measurement: measurement.wall_seconds)
+            processed_bytes = video_bytes * case.media_seconds / params.duration
+
+            results[case.name] = {
+                "wall_seconds": best.wall_seconds,
+                "cpu_seconds": best.cpu_seconds,
+                "realtime_factor": case.media_seconds / best.wall_seconds,
+                "frames_per_second": case.media_seconds
+                * params.fps
+                / best.wall_seconds,
+                "megabytes_per_second": processed_bytes / 1_000_000 / best.wall_seconds,
+                "peak_rss_kilobytes": max(
+                    measurement.peak_rss_kilobytes for measurement in measurements
+                ),
+            }
+
+            if case.name.startswith("find_image"):
+                detection_times[case.name] = parse_find_image_detection_times(
+                    stdout_path.read_text(encoding="utf-8")
+                )
+                results[case.name]["detections"] = len(detection_times[case.name])
+
+            baseline_times = (
+                detection_times.get(case.accuracy_baseline)
+                if case.accuracy_baseline is not None
+                else None
+            )
+            if baseline_times is not None:
+                results[case.name].update(
+                    get_detection_accuracy(
+                        baseline_times=baseline_times,
+                        times=detection_times[case.name],
+                    )
+                )
+
+            accuracy_string = (
+                f", recall {results[case.name]['recall']:.2f}, "
+                f"precision {results[case.name]['precision']:.2f}"
+                if "recall" in results[case.name]
+                else ""
+            )
+            print(
+                f"{case.name}: {best.wall_seconds:.3f} s, "
+                f"{results[case.name]['realtime_factor']:.2f}x realtime, "
+                f"{results[case.name]['frames_per_second']:.1f} frames/s"
+                f"{accuracy_string}",
+                file=sys.stderr,
+            )
+
+    ffmpeg_version_proc = subprocess.run(
+        [args.ffmpeg_path, "-version"],
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+    )
+    ffmpeg_version = (ffmpeg_version_proc.stdout.splitlines() or [""])[0]
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ffmpeg": ffmpeg_version,
+        },
+        "params": params._asdict(),
+        "results": results,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float,
+) -> List[str]:
+    """
+    ベースラインに対して、スループットが閾値より低下した・ピークメモリが閾値より増加した項目を列挙
+    """
+    regressions: List[str] = []
+
+    for name, baseline_result in baseline["results"].items():
+        current_result = current["results"].get(name)
+        if current_result is None:
+            continue
+
+        baseline_rtf = baseline_result["realtime_factor"]
+        current_rtf = current_result["realtime_factor"]
+        if current_rtf < baseline_rtf * (1 - threshold):
+            regressions.append(
+                f"{name}: realtime factor {baseline_rtf:.2f}x -> {current_rtf:.2f}x"
+            )
+
+        baseline_rss = baseline_result["peak_rss_kilobytes"]
+        current_rss = current_result["peak_rss_kilobytes"]
+        if current_rss > baseline_rss * (1 + threshold):
+            regressions.append(
+                f"{name}: peak RSS {baseline_rss} KiB -> {current_rss} KiB"
+            )
+
+    return regressions
+
+
+def command_run(args: Namespace) -> None:
+    report = run_benchmark(args)
+
+    report_string = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(report_string + "\n", encoding="utf-8")
+    else:
+        print(report_string)
+
+
+def command_compare(args: Namespace) -> None:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+
+    if baseline["params"] != current["params"]:
+        print("Warning | Benchmark params differ from the baseline", file=sys.stderr)
+
+    for name, current_result in current["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None:
+            continue
+
+        print(
+            f"{name}: {baseline_result['realtime_factor']:.2f}x -> "
+            f"{current_result['realtime_factor']:.2f}x realtime, "
+            f"{baseline_result['peak_rss_kilobytes']} KiB -> "
+            f"{current_result['peak_rss_kilobytes']} KiB"
+        )
+
+    regressions = compare_results(
+        baseline=baseline,
+        current=current,
+        threshold=args.threshold,
+    )
+    for regression in regressions:
+        print(f"Regression | {regression}")
+
+    if len(regressions) != 0:
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    parser_run = subparsers.add_parser("run")
+    parser_run.add_argument("--duration", type=float, default=30)
+    parser_run.add_argument("--size", type=str, default="1280x720")
+    parser_run.add_argument("--fps", type=int, default=30)
+    parser_run.add_argument("--gop", type=int, default=60)
+    parser_run.add_argument("--audio_tracks", type=int, default=3)
+    parser_run.add_argument("--video_codec", type=str, default="libx264")
+    parser_run.add_argument("--repeat", type=int, default=1)
+    parser_run.add_argument(
+        "--operations", type=str, nargs="+", choices=OPERATION_NAMES, required=False
+    )
+    parser_run.add_argument("--ffmpeg_path", type=str, default="ffmpeg")
+    parser_run.add_argument("--ffprobe_path", type=str, default="ffprobe")
+    parser_run.add_argument("-o", "--output", type=str, required=False)
+    parser_run.set_defaults(handler=command_run)
+
+    parser_compare = subparsers.add_parser("compare")
+    parser_compare.add_argument("baseline", type=str)
+    parser_compare.add_argument("current", type=str)
+    parser_compare.add_argument("--threshold", type=float, default=0.1)
+    parser_compare.set_defaults(handler=command_compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
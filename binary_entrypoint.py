@@ -2,7 +2,11 @@
 PyInstallerでバイナリビルドするときのエントリーポイント
 """
 
+import multiprocessing
+
 from aoirint_matvtool.cli import main
 
 if __name__ == "__main__":
+    # analyzeの解析プロセス（spawn）を、バイナリから起動できるようにする
+    multiprocessing.freeze_support()
     main()
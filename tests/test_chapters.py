@@ -0,0 +1,214 @@
+import json
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict
+from unittest import TestCase
+
+from aoirint_matvtool.chapters import (
+    Chapter,
+    parse_find_image_output_chapters,
+    write_chapters,
+)
+
+
+def create_multi_audio_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=5",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=5",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=880:duration=5",
+            "-map",
+            "0",
+            "-map",
+            "1",
+            "-map",
+            "2",
+            "-metadata:s:a:0",
+            "title=Game",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def ffprobe_chapters_and_streams(video_path: Path) -> Dict[str, Any]:
+    proc = subprocess.run(
+        [
+            "ffprobe",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-show_chapters",
+            "-show_entries",
+            "stream=index:stream_tags=title",
+            "-of",
+            "json",
+            str(video_path),
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    result: Dict[str, Any] = json.loads(proc.stdout)
+    return result
+
+
+class TestChapters(TestCase):
+    def test_parse_find_image_output_chapters(self) -> None:
+        lines = [
+            "Output | Time 00:00:03.000000, frame 30 (Internal time 00:00:03.000000, frame 30)\n",  # noqa: B950
+            "Output | Time 00:00:01.000000, frame 10 (Internal time 00:00:01.000000, frame 10) | File a.mkv\n",  # noqa: B950
+            "Output | Time 00:00:02.000000, frame 20 (Internal time 00:00:02.000000, frame 20) | File b.mkv\n",  # noqa: B950
+            "Output | Interval 00:00:04.000000 - 00:00:04.500000, frame 40 - 45 (Duration 00:00:00.500000)\n",  # noqa: B950
+            "Progress | Time 00:00:04.000000\n",
+        ]
+
+        assert parse_find_image_output_chapters(
+            lines=lines, input_video_path=Path("a.mkv")
+        ) == [
+            Chapter(
+                start_microseconds=1_000_000, end_microseconds=None, title="Chapter 1"
+            ),
+            Chapter(
+                start_microseconds=3_000_000, end_microseconds=None, title="Chapter 2"
+            ),
+            Chapter(
+                start_microseconds=4_000_000,
+                end_microseconds=4_500_000,
+                title="Chapter 3",
+            ),
+        ]
+
+    def test_write_chapters_in_place(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            create_multi_audio_test_video(video_path)
+            original_size = video_path.stat().st_size
+
+            chapters = [
+                Chapter(
+                    start_microseconds=microseconds,
+                    end_microseconds=None,
+                    title=f"Chapter {number}",
+                )
+                for number, microseconds in enumerate([1_000_000, 2_500_000], start=1)
+            ]
+            assert write_chapters(
+                input_video_path=video_path,
+                chapters=chapters,
+                audio_titles={2: "マイク"},
+            )
+
+            # 元の要素に収まらないチャプターは、末尾に移して書き換える
+            many_chapters = [
+                Chapter(
+                    start_microseconds=index * 10_000,
+                    end_microseconds=None,
+                    title=f"Chapter {index + 1}",
+                )
+                for index in range(100)
+            ]
+            assert write_chapters(
+                input_video_path=video_path,
+                chapters=many_chapters,
+                audio_titles={1: "Game BGM"},
+            )
+            moved_size = video_path.stat().st_size
+
+            probe = ffprobe_chapters_and_streams(video_path)
+
+            # 映像・音声のデータ（Cluster）はそのまま、FFmpegで最後までデコードできる
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-xerror",
+                    "-i",
+                    str(video_path),
+                    "-f",
+                    "null",
+                    "-",
+                ],
+                check=True,
+            )
+
+        assert original_size < moved_size < original_size + 20_000
+        assert len(probe["chapters"]) == 100
+        assert probe["chapters"][1]["start_time"] == "0.010000"
+        assert probe["chapters"][1]["end_time"] == "0.020000"
+        assert probe["chapters"][1]["tags"]["title"] == "Chapter 2"
+        assert [stream.get("tags", {}).get("title") for stream in probe["streams"]] == [
+            None,
+            "Game BGM",
+            "マイク",
+        ]
+
+    def test_write_chapters_remux(self) -> None:
+        chapters = [
+            Chapter(
+                start_microseconds=microseconds,
+                end_microseconds=None,
+                title=f"Chapter {number}",
+            )
+            for number, microseconds in enumerate([1_000_000, 3_000_000], start=1)
+        ]
+
+        with TemporaryDirectory() as tmpdir:
+            # Matroska以外のファイルは書き直す
+            mp4_video_path = Path(tmpdir) / "video.mp4"
+            create_multi_audio_test_video(mp4_video_path)
+            assert not write_chapters(
+                input_video_path=mp4_video_path,
+                chapters=chapters,
+                audio_titles={},
+            )
+
+            mkv_video_path = Path(tmpdir) / "video.mkv"
+            create_multi_audio_test_video(mkv_video_path)
+            assert not write_chapters(
+                input_video_path=mkv_video_path,
+                chapters=chapters,
+                audio_titles={2: "Mic"},
+                remux=True,
+            )
+
+            # オーディオトラックでない番号（映像）は書き換えない
+            with self.assertRaises(ValueError):
+                write_chapters(
+                    input_video_path=mkv_video_path,
+                    chapters=chapters,
+                    audio_titles={0: "Game Audio"},
+                )
+
+            mp4_probe = ffprobe_chapters_and_streams(mp4_video_path)
+            mkv_probe = ffprobe_chapters_and_streams(mkv_video_path)
+            remaining_paths = sorted(Path(tmpdir).iterdir())
+
+        assert remaining_paths == [mkv_video_path, mp4_video_path]
+        # MP4の最初のチャプターは、動画の先頭から始まる
+        for probe in [mp4_probe, mkv_probe]:
+            assert len(probe["chapters"]) == 2
+            assert probe["chapters"][0]["end_time"] == "3.000000"
+            assert probe["chapters"][1]["start_time"] == "3.000000"
+            assert 5.0 <= float(probe["chapters"][1]["end_time"])
+            assert probe["chapters"][1]["tags"]["title"] == "Chapter 2"
+
+        assert mkv_probe["chapters"][0]["start_time"] == "1.000000"
+
+        assert mkv_probe["streams"][1]["tags"]["title"] == "Game"
+        assert mkv_probe["streams"][2]["tags"]["title"] == "Mic"
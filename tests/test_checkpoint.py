@@ -0,0 +1,249 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Optional
+from unittest import TestCase
+
+from aoirint_matvtool.checkpoint import (
+    FindImageCheckpoint,
+    FindImageCheckpointQuery,
+    FindImageDetection,
+    get_fps_filter_frame_count_before,
+    load_find_image_checkpoint,
+    save_find_image_checkpoint,
+)
+from aoirint_matvtool.find_image import (
+    FfmpegBlackframeEvent,
+    ffmpeg_find_image_event_generator,
+)
+
+from .test_find_image import create_test_video, extract_frame
+
+
+def find_blackframes(
+    video_path: Path,
+    reference_image_path: Path,
+    ss: Optional[str],
+    fps: Optional[int],
+    timestamp_offset_microseconds: int,
+) -> Dict[int, int]:
+    """
+    内部時刻（マイクロ秒） -> blackframeフィルタのフレーム番号
+    """
+    return {
+        round(event.t * 1_000_000): event.frame
+        for event in ffmpeg_find_image_event_generator(
+            input_video_ss=ss,
+            input_video_to=None,
+            input_video_path=video_path,
+            input_video_crop=None,
+            reference_image_path=reference_image_path,
+            reference_image_crop=None,
+            fps=fps,
+            timestamp_offset_microseconds=timestamp_offset_microseconds,
+        )
+        if isinstance(event, FfmpegBlackframeEvent)
+    }
+
+
+def create_repeating_test_video(video_path: Path) -> None:
+    # 4秒ごとに1秒間、画像が重なる
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=gray:size=640x360:rate=30:duration=120",
+            "-f",
+            "lavfi",
+            "-i",
+            "mandelbrot=size=160x160",
+            "-filter_complex",
+            "[1:v]trim=end_frame=1,loop=-1:1[icon];[0:v][icon]overlay=x=100:y=50:shortest=1:enable='lt(mod(t,4),1)'",  # noqa: B950
+            "-g",
+            "30",
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def find_image_command(
+    video_path: Path, reference_image_path: Path, checkpoint_path: Optional[Path]
+) -> List[str]:
+    checkpoint_opts = (
+        [
+            "--checkpoint_path",
+            str(checkpoint_path),
+            "--checkpoint_interval",
+            "0",
+            "--resume",
+        ]
+        if checkpoint_path is not None
+        else []
+    )
+    return [
+        sys.executable,
+        "-m",
+        "aoirint_matvtool",
+        "find_image",
+        "-i",
+        str(video_path),
+        "-ref",
+        str(reference_image_path),
+        "-it",
+        "1",
+        "-p",
+        "none",
+        *checkpoint_opts,
+    ]
+
+
+class TestCheckpoint(TestCase):
+    def test_save_and_load_find_image_checkpoint(self) -> None:
+        checkpoint = FindImageCheckpoint(
+            query=FindImageCheckpointQuery(
+                ss="00:01:00",
+                to=None,
+                input_video_path="/input.mkv",
+                input_video_crop=None,
+                reference_image_path="/reference.png",
+                reference_image_crop="100:100:0:0",
+                fps=10,
+                blackframe_amount=98,
+                blackframe_threshold=32,
+                output_interval=1.0,
+            ),
+            start_microseconds=58_000_000,
+            start_frame=1740.0,
+            resume_ss_microseconds=64_000_000,
+            resume_internal_microseconds=4_000_000,
+            resume_internal_frame=40,
+            prev_input_microseconds=61_000_000,
+            detections=[
+                FindImageDetection(
+                    input_microseconds=61_000_000,
+                    input_frame=1830,
+                    internal_microseconds=3_000_000,
+                    internal_frame=30,
+                ),
+            ],
+        )
+
+        with TemporaryDirectory() as tmpdir:
+            checkpoint_path = Path(tmpdir) / "checkpoint" / "find_image.json"
+            save_find_image_checkpoint(path=checkpoint_path, checkpoint=checkpoint)
+
+            assert load_find_image_checkpoint(path=checkpoint_path) == checkpoint
+            assert list(checkpoint_path.parent.iterdir()) == [checkpoint_path]
+
+    def test_get_fps_filter_frame_count_before(self) -> None:
+        # 最初のフレームは0.2秒、再開位置は2.05秒の区切り
+        assert (
+            get_fps_filter_frame_count_before(
+                resume_internal_microseconds=2_050_000,
+                first_frame_internal_microseconds=200_000,
+                fps=10,
+            )
+            == 19
+        )
+
+    def test_find_image_resume_with_timestamp_offset(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_test_video(video_path, duration=4, fps=10)
+            extract_frame(video_path, seconds=3.0, image_path=reference_image_path)
+
+            for fps in [None, 5]:
+                full_blackframes = find_blackframes(
+                    video_path=video_path,
+                    reference_image_path=reference_image_path,
+                    ss=None,
+                    fps=fps,
+                    timestamp_offset_microseconds=0,
+                )
+                resumed_blackframes = find_blackframes(
+                    video_path=video_path,
+                    reference_image_path=reference_image_path,
+                    ss="2",
+                    fps=fps,
+                    timestamp_offset_microseconds=2_000_000,
+                )
+
+                # 再開後も、中断しなかった場合と同じ時刻で検出される
+                assert len(resumed_blackframes) != 0
+                assert resumed_blackframes.keys() == full_blackframes.keys()
+
+                frame_offset = 20 if fps is None else 10
+                for internal_microseconds, frame in resumed_blackframes.items():
+                    assert (
+                        frame_offset + frame == full_blackframes[internal_microseconds]
+                    )
+
+    def test_find_image_kill_and_resume(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+            checkpoint_path = Path(tmpdir) / "checkpoint.json"
+
+            create_repeating_test_video(video_path)
+            extract_frame(video_path, seconds=0.5, image_path=reference_image_path)
+
+            full_proc = subprocess.run(
+                find_image_command(
+                    video_path=video_path,
+                    reference_image_path=reference_image_path,
+                    checkpoint_path=None,
+                ),
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+                check=True,
+            )
+
+            # チェックポイントが書き出された時点で強制終了する
+            proc = subprocess.Popen(
+                find_image_command(
+                    video_path=video_path,
+                    reference_image_path=reference_image_path,
+                    checkpoint_path=checkpoint_path,
+                ),
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                while not checkpoint_path.exists() and proc.poll() is None:
+                    time.sleep(0.01)
+            finally:
+                proc.kill()
+                proc.wait()
+
+            checkpoint = load_find_image_checkpoint(path=checkpoint_path)
+            assert 0 < checkpoint.resume_internal_microseconds < 120_000_000
+            assert checkpoint.resume_internal_frame == round(
+                checkpoint.resume_internal_microseconds * 30 / 1_000_000
+            )
+
+            resumed_proc = subprocess.run(
+                find_image_command(
+                    video_path=video_path,
+                    reference_image_path=reference_image_path,
+                    checkpoint_path=checkpoint_path,
+                ),
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+                check=True,
+            )
+
+            # 再開後も、中断しなかった場合と同じ出力になる
+            assert len(full_proc.stdout.splitlines()) == 31
+            assert resumed_proc.stdout == full_proc.stdout
+            assert not checkpoint_path.exists()
@@ -0,0 +1,84 @@
+import re
+import subprocess
+import sys
+from typing import Dict
+from unittest import TestCase
+
+# aoirint_matvtool.cliのimportにかかる累積時間の上限（マイクロ秒）
+CLI_IMPORT_TIME_BUDGET_US = 100_000
+
+# 起動時にimportされてはいけない重いモジュール
+LAZY_MODULES = [
+    "pydantic",
+    "tqdm",
+    "aoirint_matvtool.chapters",
+    "aoirint_matvtool.checkpoint",
+    "aoirint_matvtool.crop_scale",
+    "aoirint_matvtool.encoders",
+    "aoirint_matvtool.extract_frames",
+    "aoirint_matvtool.fast_decode",
+    "aoirint_matvtool.find_audio",
+    "aoirint_matvtool.find_image",
+    "aoirint_matvtool.find_image_batch",
+    "aoirint_matvtool.find_image_cache",
+    "aoirint_matvtool.find_image_interval",
+    "aoirint_matvtool.find_template",
+    "aoirint_matvtool.fps",
+    "aoirint_matvtool.frame_bus",
+    "aoirint_matvtool.inputs",
+    "aoirint_matvtool.join",
+    "aoirint_matvtool.key_frames",
+    "aoirint_matvtool.matroska",
+    "aoirint_matvtool.prefetch",
+    "aoirint_matvtool.proxy",
+    "aoirint_matvtool.seek_index",
+    "aoirint_matvtool.select_audio",
+    "aoirint_matvtool.slice",
+    "aoirint_matvtool.stats",
+    "aoirint_matvtool.stream_io",
+    "aoirint_matvtool.util",
+    "aoirint_matvtool.verify",
+]
+
+
+def measure_import_time(module_name: str) -> Dict[str, int]:
+    """
+    python -X importtimeの出力から、モジュール名と累積import時間（マイクロ秒）の辞書を作成
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+
+    cumulative_times: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        # import time:       350 |        350 |   aoirint_matvtool.config
+        match = re.match(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(.+)$", line)
+        if not match:
+            continue
+
+        cumulative_times[match.group(3).strip()] = int(match.group(2))
+
+    return cumulative_times
+
+
+class TestCliImportTime(TestCase):
+    def test_cli_import_is_lazy(self) -> None:
+        cumulative_times = measure_import_time("aoirint_matvtool.cli")
+
+        for module_name in LAZY_MODULES:
+            assert (
+                module_name not in cumulative_times
+            ), f"{module_name} is imported at CLI startup"
+
+    def test_cli_import_time_budget(self) -> None:
+        # 1回目はバイトコードキャッシュの生成を含むため、2回目を計測
+        measure_import_time("aoirint_matvtool.cli")
+        cumulative_times = measure_import_time("aoirint_matvtool.cli")
+
+        cli_import_time = cumulative_times["aoirint_matvtool.cli"]
+        assert (
+            cli_import_time <= CLI_IMPORT_TIME_BUDGET_US
+        ), f"CLI import took {cli_import_time} us"
@@ -0,0 +1,106 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool import metrics
+from aoirint_matvtool.encoders import (
+    EncoderCalibration,
+    EncoderConfig,
+    calibrate_encoders,
+    load_encoder_capabilities,
+    parse_target_speed,
+    select_encoder,
+)
+
+
+class TestEncoders(TestCase):
+    def tearDown(self) -> None:
+        metrics.exporter = None
+
+    def test_select_encoder(self) -> None:
+        calibrations = [
+            EncoderCalibration(
+                config=EncoderConfig(encoder="libx264", preset="medium"), fps=40.0
+            ),
+            EncoderCalibration(
+                config=EncoderConfig(encoder="h264_nvenc", preset="p5"), fps=None
+            ),
+            EncoderCalibration(
+                config=EncoderConfig(encoder="libx264", preset="veryfast"), fps=90.0
+            ),
+            EncoderCalibration(
+                config=EncoderConfig(encoder="libx264", preset="ultrafast"), fps=150.0
+            ),
+        ]
+
+        # 目標を満たす候補のうち圧縮効率の高いもの、満たさなければ最も速いもの
+        assert select_encoder(calibrations=calibrations, target_fps=30.0).preset == (
+            "medium"
+        )
+        assert select_encoder(calibrations=calibrations, target_fps=60.0).preset == (
+            "veryfast"
+        )
+        assert select_encoder(calibrations=calibrations, target_fps=200.0).preset == (
+            "ultrafast"
+        )
+
+        with self.assertRaisesRegex(Exception, "No available encoder"):
+            select_encoder(calibrations=calibrations[1:2], target_fps=1.0)
+
+    def test_parse_target_speed(self) -> None:
+        assert parse_target_speed("2x") == 2.0
+        assert parse_target_speed("1.5") == 1.5
+        with self.assertRaises(ValueError):
+            parse_target_speed("0x")
+
+    def test_calibrate_encoders(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            cache_path = Path(tmpdir) / "matvtool" / "encoders.json"
+            prom_path = Path(tmpdir) / "matvtool.prom"
+            metrics.exporter = metrics.MetricsExporter(path=prom_path, interval=60)
+
+            capabilities = load_encoder_capabilities(cache_path=cache_path)
+            assert cache_path.exists()
+            assert "libx264" in capabilities.video_encoders
+
+            # GPUのない環境では、計測に失敗して候補から外れる
+            if "h264_nvenc" not in capabilities.video_encoders:
+                capabilities.video_encoders.append("h264_nvenc")
+
+            calibrations = calibrate_encoders(
+                capabilities=capabilities,
+                cache_path=cache_path,
+                input_description="testsrc2=size=320x180:rate=30",
+                input_opts=["-f", "lavfi", "-i", "testsrc2=size=320x180:rate=30"],
+                video_filters=["scale=160:-2"],
+                calibration_seconds=0.5,
+            )
+
+            # 2回目はキャッシュから読み込み、計測しない
+            cached_capabilities = load_encoder_capabilities(cache_path=cache_path)
+            cached_calibrations = calibrate_encoders(
+                capabilities=cached_capabilities,
+                cache_path=cache_path,
+                input_description="testsrc2=size=320x180:rate=30",
+                input_opts=[],
+                video_filters=["scale=160:-2"],
+                calibration_seconds=0.5,
+            )
+
+            metrics.exporter.stop()
+            samples = metrics.parse_prom_file(prom_path.read_text(encoding="utf-8"))
+
+        assert samples['matvtool_probe_cache_requests_total{result="miss"}'] == 2
+        assert samples['matvtool_probe_cache_requests_total{result="hit"}'] == 2
+
+        fps_by_config = {
+            calibration.config.describe(): calibration.fps
+            for calibration in calibrations
+        }
+        assert fps_by_config["libx264 ultrafast"] is not None
+        assert 0 < fps_by_config["libx264 ultrafast"]
+        # 一覧にあれば計測する（デバイスがなければNone）
+        assert "h264_nvenc p1" in fps_by_config
+
+        assert cached_capabilities.ffmpeg_version == capabilities.ffmpeg_version
+        assert cached_calibrations == calibrations
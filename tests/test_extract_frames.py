@@ -0,0 +1,287 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.extract_frames import (
+    ExtractFramesBatch,
+    ffmpeg_contact_sheet,
+    ffmpeg_extract_frames,
+    get_extract_frames_batches,
+    get_frame_target_microseconds,
+    get_select_expression,
+)
+from aoirint_matvtool.proxy import ffmpeg_first_frame_microseconds
+
+
+def create_extract_frames_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=10",
+            "-g",
+            "20",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def ffmpeg_frame_md5(video_path: Path, ss: str) -> bytes:
+    proc = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-ss",
+            ss,
+            "-i",
+            str(video_path),
+            "-frames:v",
+            "1",
+            "-pix_fmt",
+            "rgb24",
+            "-f",
+            "md5",
+            "-",
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+def ffmpeg_nth_frame_md5(video_path: Path, frame: int) -> bytes:
+    proc = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            str(video_path),
+            "-filter:v",
+            f"select=eq(n\\,{frame})",
+            "-frames:v",
+            "1",
+            "-an",
+            "-pix_fmt",
+            "rgb24",
+            "-f",
+            "md5",
+            "-",
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+def ffmpeg_image_md5(image_path: Path) -> bytes:
+    proc = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            str(image_path),
+            "-pix_fmt",
+            "rgb24",
+            "-f",
+            "md5",
+            "-",
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+class TestExtractFrames(TestCase):
+    def test_get_extract_frames_batches(self) -> None:
+        assert get_extract_frames_batches(
+            target_microseconds=[5_000_000, 1_000_000, 1_500_000, 1_000_000],
+            dense_gap_microseconds=2_000_000,
+            frame_microseconds=100_000,
+        ) == [
+            ExtractFramesBatch(
+                start_microseconds=1_000_000,
+                end_microseconds=1_600_000,
+                target_microseconds=[1_000_000, 1_500_000],
+            ),
+            ExtractFramesBatch(
+                start_microseconds=5_000_000,
+                end_microseconds=5_100_000,
+                target_microseconds=[5_000_000],
+            ),
+        ]
+
+    def test_get_select_expression(self) -> None:
+        assert (
+            get_select_expression(
+                target_microseconds=[1_000_000, 1_500_000],
+                start_microseconds=1_000_000,
+            )
+            == "gte(t,-0.000001)*not(gte(prev_t,-0.000001))+gte(t,0.499999)*not(gte(prev_t,0.499999))"  # noqa: B950
+        )
+
+    def test_extract_frames(self) -> None:
+        # 疎な時刻・密な時刻・重複する時刻・範囲外の時刻
+        target_times = ["0.55", "3", "3.1", "3.35", "8", "3", "60"]
+
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            create_extract_frames_test_video(video_path)
+
+            output_paths = [
+                Path(tmpdir) / "frames" / f"{index}.png"
+                for index in range(len(target_times))
+            ]
+            outputs = list(
+                ffmpeg_extract_frames(
+                    input_path=video_path,
+                    target_microseconds=[
+                        round(float(time) * 1_000_000) for time in target_times
+                    ],
+                    output_paths=output_paths,
+                    dense_gap_microseconds=2_000_000,
+                    frame_microseconds=100_000,
+                    inputs_per_process=2,
+                )
+            )
+
+            image_md5s = [ffmpeg_image_md5(path) for path in output_paths[:-1]]
+            expected_md5s = [
+                ffmpeg_frame_md5(video_path, ss=time) for time in target_times[:-1]
+            ]
+
+            contact_sheet_path = Path(tmpdir) / "sheet.png"
+            ffmpeg_contact_sheet(
+                image_paths=output_paths[:-1],
+                output_path=contact_sheet_path,
+                columns=4,
+                thumbnail_width=80,
+            )
+            proc = subprocess.run(
+                [
+                    "ffprobe",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-show_entries",
+                    "stream=width,height",
+                    "-of",
+                    "csv=p=0",
+                    str(contact_sheet_path),
+                ],
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+                check=True,
+            )
+            remaining_frame_paths = sorted((Path(tmpdir) / "frames").iterdir())
+
+        assert sorted(output.frame_microseconds for output in outputs) == [
+            600_000,
+            3_000_000,
+            3_000_000,
+            3_100_000,
+            3_400_000,
+            8_000_000,
+        ]
+        assert image_md5s == expected_md5s
+        assert remaining_frame_paths == sorted(output_paths[:-1])
+        # 4x2枚（80x45）と余白
+        assert proc.stdout.strip() == f"{4 * 80 + 5 * 4},{2 * 46 + 3 * 4}"
+
+    def test_extract_frames_by_frame_number(self) -> None:
+        # MKVの時刻はミリ秒単位（30fpsの1フレーム目は0.033秒、公称の時刻0.0333秒より前）
+        # AACの音声を含むMKVは、映像がコンテナの開始時刻（-0.023秒）より後から始まる
+        frames = [0, 1, 2, 3, 29, 30, 31, 100]
+
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            audio_video_path = Path(tmpdir) / "audio_video.mkv"
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "testsrc2=size=160x90:rate=30:duration=4",
+                    str(video_path),
+                ],
+                check=True,
+            )
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-i",
+                    str(video_path),
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "sine=duration=4",
+                    "-c:v",
+                    "copy",
+                    "-c:a",
+                    "aac",
+                    str(audio_video_path),
+                ],
+                check=True,
+            )
+
+            # 密な時刻（1回のデコード）・疎な時刻（時刻ごとのシーク）
+            results = []
+            for path in [video_path, audio_video_path]:
+                expected_md5s = [
+                    ffmpeg_nth_frame_md5(path, frame=frame) for frame in frames
+                ]
+                first_frame_microseconds = ffmpeg_first_frame_microseconds(path)
+                assert first_frame_microseconds is not None
+
+                for dense_gap_microseconds in [2_000_000, 0]:
+                    output_dir = (
+                        Path(tmpdir) / f"frames_{path.stem}_{dense_gap_microseconds}"
+                    )
+                    output_paths = [output_dir / f"{frame}.png" for frame in frames]
+                    list(
+                        ffmpeg_extract_frames(
+                            input_path=path,
+                            target_microseconds=[
+                                get_frame_target_microseconds(
+                                    frame=frame,
+                                    fps=30,
+                                    first_frame_microseconds=first_frame_microseconds,
+                                )
+                                for frame in frames
+                            ],
+                            output_paths=output_paths,
+                            dense_gap_microseconds=dense_gap_microseconds,
+                            frame_microseconds=round(1_000_000 / 30),
+                        )
+                    )
+                    results.append(
+                        (
+                            first_frame_microseconds,
+                            [ffmpeg_image_md5(path) for path in output_paths],
+                            expected_md5s,
+                        )
+                    )
+
+        assert [result[0] for result in results] == [0, 0, 23_000, 23_000]
+        for _, image_md5s, expected_md5s in results:
+            assert image_md5s == expected_md5s
@@ -0,0 +1,163 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+
+from aoirint_matvtool.fast_decode import (
+    ffprobe_video_stream_info,
+    get_fast_decode_input_opts,
+    get_lowres_size,
+)
+from aoirint_matvtool.find_image import (
+    FfmpegBlackframeEvent,
+    ffmpeg_find_image_event_generator,
+)
+from aoirint_matvtool.proxy import get_scaled_crop_and_scale
+
+from .test_find_image import create_test_video, extract_frame
+
+
+def find_blackframe_frames(
+    video_path: Path,
+    reference_image_path: Path,
+    fps: int,
+    fast_decode: bool,
+) -> List[int]:
+    return [
+        event.frame
+        for event in ffmpeg_find_image_event_generator(
+            input_video_ss=None,
+            input_video_to=None,
+            input_video_path=video_path,
+            input_video_crop=None,
+            reference_image_path=reference_image_path,
+            reference_image_crop=None,
+            fps=fps,
+            fast_decode=fast_decode,
+        )
+        if isinstance(event, FfmpegBlackframeEvent)
+    ]
+
+
+def create_mpeg4_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=320x180:rate=10:duration=4",
+            "-c:v",
+            "mpeg4",
+            "-q:v",
+            "2",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestFastDecode(TestCase):
+    def test_get_fast_decode_input_opts(self) -> None:
+        # フレームを間引かない場合は、参照されないフレームもデコードする
+        opts = get_fast_decode_input_opts(fps=None, lowres=0, skip_noref=True)
+        assert "-skip_loop_filter" in opts
+        assert "-skip_frame" not in opts
+        assert "-lowres" not in opts
+
+        opts = get_fast_decode_input_opts(fps=10, lowres=1, skip_noref=True)
+        assert opts[opts.index("-skip_frame") + 1] == "noref"
+        assert opts[opts.index("-lowres") + 1] == "1"
+
+        # Bフレームのない入力では、参照されないフレームを省略しない
+        opts = get_fast_decode_input_opts(fps=10, lowres=0, skip_noref=False)
+        assert "-skip_frame" not in opts
+
+    def test_ffprobe_video_stream_info(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            h264_video_path = Path(tmpdir) / "h264.mkv"
+            mpeg4_video_path = Path(tmpdir) / "mpeg4.mkv"
+
+            create_test_video(h264_video_path, duration=1, fps=10)
+            create_mpeg4_test_video(mpeg4_video_path)
+
+            h264_info = ffprobe_video_stream_info(input_path=h264_video_path)
+            mpeg4_info = ffprobe_video_stream_info(input_path=mpeg4_video_path)
+
+        assert (h264_info.codec_name, h264_info.width, h264_info.height) == (
+            "h264",
+            320,
+            180,
+        )
+        assert h264_info.has_b_frames != 0
+        # MPEG-4のエンコーダは、デフォルトではBフレームを使わない
+        assert mpeg4_info.has_b_frames == 0
+
+    def test_get_lowres_crop_and_scale(self) -> None:
+        # 奇数の解像度は切り上げ
+        assert get_lowres_size(width=1281, height=721, lowres=1) == (641, 361)
+
+        assert get_scaled_crop_and_scale(
+            input_video_crop="w=640:h=360:x=100:y=50",
+            source_width=1280,
+            source_height=720,
+            width=640,
+            height=360,
+        ) == ("w=320:h=180:x=50:y=24", "320:180")
+
+    def test_find_image_fast_decode(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_test_video(video_path, duration=4, fps=10)
+            extract_frame(video_path, seconds=3.0, image_path=reference_image_path)
+
+            frames = find_blackframe_frames(
+                video_path=video_path,
+                reference_image_path=reference_image_path,
+                fps=5,
+                fast_decode=False,
+            )
+            fast_decode_frames = find_blackframe_frames(
+                video_path=video_path,
+                reference_image_path=reference_image_path,
+                fps=5,
+                fast_decode=True,
+            )
+
+        assert 15 in frames
+        assert 15 in fast_decode_frames
+
+    def test_find_image_lowres(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_mpeg4_test_video(video_path)
+            extract_frame(video_path, seconds=3.0, image_path=reference_image_path)
+
+            # 160x90でデコードした動画の切り抜きと、縮小した参照画像の切り抜きを比較
+            events = list(
+                ffmpeg_find_image_event_generator(
+                    input_video_ss=None,
+                    input_video_to=None,
+                    input_video_path=video_path,
+                    input_video_crop="w=80:h=44:x=40:y=22",
+                    reference_image_path=reference_image_path,
+                    reference_image_crop="w=160:h=88:x=80:y=44",
+                    fps=None,
+                    reference_image_scale="80:44",
+                    fast_decode=True,
+                    lowres=1,
+                )
+            )
+
+        blackframe_frames = [
+            event.frame for event in events if isinstance(event, FfmpegBlackframeEvent)
+        ]
+        assert 30 in blackframe_frames
@@ -0,0 +1,144 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+from aoirint_matvtool.find_audio import (
+    AudioCorrelator,
+    FindAudioMatch,
+    PeakPicker,
+    ffmpeg_audio_samples,
+    ffmpeg_find_audio_generator,
+)
+
+
+class TestFindAudio(TestCase):
+    def test_audio_correlator(self) -> None:
+        random = np.random.default_rng(0)
+        reference = random.standard_normal(100).astype(np.float32)
+        samples = (random.standard_normal(1000) * 0.1).astype(np.float32)
+        samples[300:400] += reference * 2 + 0.5
+
+        correlator = AudioCorrelator(reference=reference, chunk_samples=1000)
+        scores = correlator.correlate(samples)
+
+        # 振幅・直流成分が異なっても一致する
+        assert len(scores) == 901
+        assert int(np.argmax(scores)) == 300
+        assert 0.99 < scores[300] <= 1.0 + 1e-9
+        assert float(np.max(np.abs(np.delete(scores, 300)))) < 0.5
+
+    def test_peak_picker(self) -> None:
+        peak_picker = PeakPicker(threshold=0.5, min_distance=10)
+
+        # チャンクをまたいで、min_distance以内で最も一致した位置を選ぶ
+        peaks = peak_picker.push(
+            scores=np.array([0.0, 0.6, 0.7, 0.0]), start_position=0
+        )
+        peaks += peak_picker.push(
+            scores=np.array([0.9, 0.0, 0.0, 0.0]), start_position=4
+        )
+        peaks += peak_picker.push(scores=np.array([0.8]), start_position=30)
+        peaks += peak_picker.flush()
+
+        assert peaks == [(4, 0.9), (30, 0.8)]
+
+    def test_find_audio(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            jingle_path = Path(tmpdir) / "jingle.wav"
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "aevalsrc='0.5*sin(2*PI*(400*t+600*t*t))':s=48000:d=1",
+                    str(jingle_path),
+                ],
+                check=True,
+            )
+
+            # オーディオトラック1（Game）の7.5秒・21秒にジングル
+            video_path = Path(tmpdir) / "video.mkv"
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "anoisesrc=color=pink:amplitude=0.2:d=30:r=48000:seed=1",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "anoisesrc=color=white:amplitude=0.3:d=30:r=48000:seed=2",
+                    "-i",
+                    str(jingle_path),
+                    "-i",
+                    str(jingle_path),
+                    "-filter_complex",
+                    "[2]adelay=7500[j1];[3]adelay=21000[j2];[1][j1][j2]amix=inputs=3:normalize=0:duration=first[game]",  # noqa: B950
+                    "-map",
+                    "0:a",
+                    "-map",
+                    "[game]",
+                    "-c:a",
+                    "pcm_s16le",
+                    str(video_path),
+                ],
+                check=True,
+            )
+
+            reference = ffmpeg_audio_samples(
+                input_path=jingle_path, audio_index=0, sample_rate=8000
+            )
+
+            # チャンクの境目（8秒）をまたぐジングルも検出する
+            matches = [
+                output
+                for output in ffmpeg_find_audio_generator(
+                    input_path=video_path,
+                    audio_index=1,
+                    reference=reference,
+                    chunk_seconds=2.0,
+                )
+                if isinstance(output, FindAudioMatch)
+            ]
+            other_track_matches = [
+                output
+                for output in ffmpeg_find_audio_generator(
+                    input_path=video_path,
+                    audio_index=0,
+                    reference=reference,
+                )
+                if isinstance(output, FindAudioMatch)
+            ]
+            sliced_matches = [
+                output
+                for output in ffmpeg_find_audio_generator(
+                    input_path=video_path,
+                    audio_index=1,
+                    reference=reference,
+                    ss="10",
+                    to="25",
+                )
+                if isinstance(output, FindAudioMatch)
+            ]
+
+        assert len(reference) == 8000
+        assert [match.internal_microseconds for match in matches] == [
+            7_500_000,
+            21_000_000,
+        ]
+        assert all(0.8 < match.score for match in matches)
+        assert other_track_matches == []
+        # シーク後のリサンプリングで、数サンプルずれることがある
+        assert len(sliced_matches) == 1
+        assert abs(sliced_matches[0].internal_microseconds - 11_000_000) < 1_000
@@ -0,0 +1,182 @@
+import subprocess
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Optional, Union
+from unittest import TestCase
+
+from aoirint_matvtool.find_image import (
+    FfmpegBlackframeEvent,
+    FfmpegProgressEvent,
+    ffmpeg_find_image_event_generator,
+)
+
+
+def create_test_video(video_path: Path, duration: int, fps: int) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size=320x180:rate={fps}:duration={duration}",
+            "-g",
+            str(fps),
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def extract_frame(video_path: Path, seconds: float, image_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-ss",
+            f"{seconds}",
+            "-i",
+            str(video_path),
+            "-frames:v",
+            "1",
+            str(image_path),
+        ],
+        check=True,
+    )
+
+
+def create_static_test_video(video_path: Path) -> None:
+    # 最初の1秒だけ画面が動き、1.3秒目から2.4秒目まで静止した画像が重なる
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=gray:size=320x180:rate=10:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=320x180:rate=10:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "mandelbrot=size=64x64",
+            "-filter_complex",
+            "[0:v][1:v]overlay=enable='lt(t,1)'[v];[2:v]trim=end_frame=1,loop=-1:1[icon];[v][icon]overlay=x=100:y=50:shortest=1:enable='between(t,1.25,2.45)'",  # noqa: B950
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def write_in_chunks(
+    source_path: Path, output_path: Path, num_chunks: int, interval: float
+) -> None:
+    data = source_path.read_bytes()
+    chunk_size = len(data) // num_chunks + 1
+
+    with output_path.open("wb") as fp:
+        for offset in range(0, len(data), chunk_size):
+            fp.write(data[offset : offset + chunk_size])
+            fp.flush()
+            time.sleep(interval)
+
+
+class TestFindImage(TestCase):
+    def test_find_image_follow(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            source_path = Path(tmpdir) / "source.mkv"
+            growing_path = Path(tmpdir) / "growing.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_test_video(source_path, duration=4, fps=10)
+            extract_frame(source_path, seconds=3.0, image_path=reference_image_path)
+
+            # 書き込み途中のファイルを模擬
+            growing_path.write_bytes(b"")
+            writer = threading.Thread(
+                target=write_in_chunks,
+                kwargs={
+                    "source_path": source_path,
+                    "output_path": growing_path,
+                    "num_chunks": 4,
+                    "interval": 0.5,
+                },
+            )
+            writer.start()
+
+            try:
+                events: List[Union[FfmpegBlackframeEvent, FfmpegProgressEvent]] = list(
+                    ffmpeg_find_image_event_generator(
+                        input_video_ss=None,
+                        input_video_to=None,
+                        input_video_path=growing_path,
+                        input_video_crop=None,
+                        reference_image_path=reference_image_path,
+                        reference_image_crop=None,
+                        fps=None,
+                        follow=True,
+                        follow_timeout=2.0,
+                    )
+                )
+            finally:
+                writer.join()
+
+        blackframe_frames = [
+            event.frame for event in events if isinstance(event, FfmpegBlackframeEvent)
+        ]
+        assert 30 in blackframe_frames
+
+        progress_frames = [
+            event.frame for event in events if isinstance(event, FfmpegProgressEvent)
+        ]
+        assert progress_frames[-1] == 40
+
+    def test_find_image_scene_threshold(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_static_test_video(video_path)
+            extract_frame(video_path, seconds=2.0, image_path=reference_image_path)
+
+            def find_blackframe_events(
+                scene_threshold: Optional[float],
+            ) -> List[FfmpegBlackframeEvent]:
+                return [
+                    event
+                    for event in ffmpeg_find_image_event_generator(
+                        input_video_ss=None,
+                        input_video_to=None,
+                        input_video_path=video_path,
+                        input_video_crop=None,
+                        reference_image_path=reference_image_path,
+                        reference_image_crop=None,
+                        fps=None,
+                        scene_threshold=scene_threshold,
+                    )
+                    if isinstance(event, FfmpegBlackframeEvent)
+                ]
+
+            events = find_blackframe_events(scene_threshold=None)
+            gated_events = find_blackframe_events(scene_threshold=0.001)
+
+        # 変化しなかったフレームにも結果を引き継ぎ、同じフレーム番号・時刻で検出する
+        assert [event.frame for event in events] == list(range(13, 25))
+        assert [(event.frame, event.t) for event in gated_events] == [
+            (event.frame, event.t) for event in events
+        ]
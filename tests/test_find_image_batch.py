@@ -0,0 +1,54 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.find_image_batch import (
+    expand_input_video_paths,
+    ffprobe_durations,
+    get_largest_first_order,
+)
+
+from .test_find_image import create_test_video
+
+
+class TestFindImageBatch(TestCase):
+    def test_expand_input_video_paths(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_dir = Path(tmpdir) / "videos"
+            (video_dir / "season2").mkdir(parents=True)
+
+            for name in ["b.mkv", "a.MP4", "notes.txt", "season2/c.webm"]:
+                (video_dir / name).write_bytes(b"")
+
+            other_path = Path(tmpdir) / "other.bin"
+
+            input_video_paths = expand_input_video_paths(
+                paths=[video_dir, other_path, video_dir / "b.mkv"]
+            )
+
+        # ディレクトリは動画の拡張子のファイルだけ、ファイルは拡張子を問わない
+        assert input_video_paths == [
+            video_dir / "a.MP4",
+            video_dir / "b.mkv",
+            video_dir / "season2" / "c.webm",
+            other_path,
+        ]
+
+    def test_get_largest_first_order(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            short_path = Path(tmpdir) / "short.mkv"
+            long_path = Path(tmpdir) / "long.mkv"
+            broken_path = Path(tmpdir) / "broken.mkv"
+
+            create_test_video(short_path, duration=1, fps=10)
+            create_test_video(long_path, duration=3, fps=10)
+            broken_path.write_bytes(b"")
+
+            input_video_paths = [broken_path, short_path, long_path]
+            durations = ffprobe_durations(input_video_paths=input_video_paths, jobs=2)
+
+        assert durations[broken_path] is None
+        assert get_largest_first_order(
+            input_video_paths=input_video_paths,
+            durations=durations,
+        ) == [long_path, short_path, broken_path]
@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest import TestCase
+
+from aoirint_matvtool.find_image_cache import (
+    FindImageCacheEntry,
+    FindImageCacheKey,
+    FindImageResultCache,
+)
+
+
+def create_cache_key(fps: Optional[int] = None) -> FindImageCacheKey:
+    return FindImageCacheKey(
+        video_identity="video",
+        reference_image_hash="reference",
+        input_video_crop=None,
+        reference_image_crop=None,
+        fps=fps,
+        blackframe_amount=98,
+        blackframe_threshold=32,
+    )
+
+
+def create_cache_entry(
+    key: FindImageCacheKey,
+    ss_microseconds: int,
+    to_microseconds: Optional[int],
+    num_detections: int = 1,
+) -> FindImageCacheEntry:
+    return FindImageCacheEntry(
+        key=key,
+        ss_microseconds=ss_microseconds,
+        to_microseconds=to_microseconds,
+        start_microseconds=ss_microseconds,
+        start_frame=0.0,
+        internal_microseconds=list(range(num_detections)),
+        internal_frames=list(range(num_detections)),
+    )
+
+
+class TestFindImageCache(TestCase):
+    def test_lookup_covering_range(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            cache = FindImageResultCache(cache_dir=Path(tmpdir), max_bytes=1024 * 1024)
+            key = create_cache_key()
+            cache.store(create_cache_entry(key, 10_000_000, 60_000_000))
+
+            # 同じ範囲・狭い範囲
+            assert cache.lookup(key, 10_000_000, 60_000_000) is not None
+            assert cache.lookup(key, 20_000_000, 30_000_000) is not None
+
+            # 範囲外・終了位置なし・異なる条件
+            assert cache.lookup(key, 5_000_000, 30_000_000) is None
+            assert cache.lookup(key, 20_000_000, 70_000_000) is None
+            assert cache.lookup(key, 20_000_000, None) is None
+            assert cache.lookup(create_cache_key(fps=10), 10_000_000, None) is None
+
+            # 同じ開始位置のエントリを優先
+            cache.store(create_cache_entry(key, 0, None))
+            entry = cache.lookup(key, 10_000_000, 30_000_000)
+            assert entry is not None
+            assert entry.ss_microseconds == 10_000_000
+
+    def test_lookup_fps_grid(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            cache = FindImageResultCache(cache_dir=Path(tmpdir), max_bytes=1024 * 1024)
+            key = create_cache_key(fps=10)
+            cache.store(create_cache_entry(key, 0, None))
+
+            # fpsフィルタの区切りが一致する開始位置のみ
+            assert cache.lookup(key, 2_500_000, None) is not None
+            assert cache.lookup(key, 2_550_000, None) is None
+
+    def test_evict_least_recently_used(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            cache_dir = Path(tmpdir)
+            key = create_cache_key()
+
+            cache = FindImageResultCache(cache_dir=cache_dir, max_bytes=1024 * 1024)
+            for index in range(3):
+                cache.store(create_cache_entry(key, index * 1_000_000, None, 100))
+
+            entry_size = max(path.stat().st_size for path in cache_dir.glob("*.json"))
+
+            # 使った時刻を古い順に並べ替え、最初のエントリを最後に使ったことにする
+            entry_paths = [
+                cache_dir / f"{cache.get_key_hash(key)}-{index * 1_000_000}-end.json"
+                for index in range(3)
+            ]
+            for index, path in enumerate(entry_paths):
+                os.utime(path, ns=(index * 1_000_000_000, index * 1_000_000_000))
+            assert cache.lookup(key, 0, None) is not None
+
+            cache.max_bytes = entry_size * 2
+            cache.evict()
+
+            assert [path.exists() for path in entry_paths] == [True, False, True]
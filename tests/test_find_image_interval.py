@@ -0,0 +1,133 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.find_image_interval import (
+    FindImageInterval,
+    ffmpeg_find_image_interval_generator,
+    get_find_image_intervals,
+)
+
+from .test_find_image import extract_frame
+
+
+def create_interval_test_video(video_path: Path, icon_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "mandelbrot=size=64x64",
+            "-frames:v",
+            "1",
+            str(icon_path),
+        ],
+        check=True,
+    )
+
+    # キーフレームは1秒ごと、アイコンは1.3秒目から3.5秒目まで（GOPの途中で切り替わる）
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=320x180:rate=10:duration=5",
+            "-i",
+            str(icon_path),
+            "-filter_complex",
+            "[0:v][1:v]overlay=x=100:y=50:enable='between(t,1.25,3.45)'",
+            "-g",
+            "10",
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestFindImageInterval(TestCase):
+    def test_get_find_image_intervals(self) -> None:
+        frame_states = {
+            0: False,
+            100: True,
+            200: True,
+            300: False,
+            400: True,
+            500: False,
+            600: True,
+        }
+
+        intervals = get_find_image_intervals(
+            frame_states=frame_states,
+            end_microseconds=700,
+        )
+        assert [
+            (interval.start_microseconds, interval.end_microseconds)
+            for interval in intervals
+        ] == [(100, 300), (400, 500), (600, 700)]
+
+        # 途切れが短い区間をつなげる
+        merged_intervals = get_find_image_intervals(
+            frame_states=frame_states,
+            end_microseconds=700,
+            merge_gap_microseconds=150,
+        )
+        assert [
+            (interval.start_microseconds, interval.end_microseconds)
+            for interval in merged_intervals
+        ] == [(100, 700)]
+
+    def test_find_image_interval(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            icon_path = Path(tmpdir) / "icon.png"
+            reference_image_path = Path(tmpdir) / "reference.png"
+
+            create_interval_test_video(video_path=video_path, icon_path=icon_path)
+            extract_frame(video_path, seconds=2.0, image_path=reference_image_path)
+
+            intervals = [
+                output
+                for output in ffmpeg_find_image_interval_generator(
+                    input_video_ss=None,
+                    input_video_to=None,
+                    input_video_path=video_path,
+                    input_video_crop="w=64:h=64:x=100:y=50",
+                    reference_image_path=reference_image_path,
+                    reference_image_crop="w=64:h=64:x=100:y=50",
+                    frame_microseconds=100_000,
+                )
+                if isinstance(output, FindImageInterval)
+            ]
+
+            # 範囲の途中から、区間の途中まで
+            sliced_intervals = [
+                output
+                for output in ffmpeg_find_image_interval_generator(
+                    input_video_ss="1.5",
+                    input_video_to="2.55",
+                    input_video_path=video_path,
+                    input_video_crop="w=64:h=64:x=100:y=50",
+                    reference_image_path=reference_image_path,
+                    reference_image_crop="w=64:h=64:x=100:y=50",
+                    frame_microseconds=100_000,
+                )
+                if isinstance(output, FindImageInterval)
+            ]
+
+        assert intervals == [
+            FindImageInterval(start_microseconds=1_300_000, end_microseconds=3_500_000)
+        ]
+        assert sliced_intervals == [
+            FindImageInterval(start_microseconds=1_500_000, end_microseconds=2_550_000)
+        ]
@@ -0,0 +1,106 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+from aoirint_matvtool.find_template import (
+    FindTemplateMatch,
+    TemplateMatcher,
+    ffmpeg_find_template_generator,
+)
+
+
+def create_overlay_test_video(video_path: Path, icon_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "mandelbrot=size=48x48",
+            "-frames:v",
+            "1",
+            str(icon_path),
+        ],
+        check=True,
+    )
+
+    # 1秒目から2秒目まで、アイコンを拡大して(200, 100)に重ねる
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=640x360:rate=10:duration=3",
+            "-i",
+            str(icon_path),
+            "-filter_complex",
+            "[1:v]scale=72:72[icon];[0:v][icon]overlay=x=200:y=100:enable='between(t,1,1.95)'",  # noqa: B950
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestFindTemplate(TestCase):
+    def test_template_matcher(self) -> None:
+        rng = np.random.default_rng(0)
+        frames = rng.integers(0, 256, size=(3, 40, 60), dtype=np.uint8)
+        template = frames[1, 5:20, 30:50].copy()
+
+        # 明るさ・コントラストが異なっても一致する（正規化相互相関）
+        frames[2, 20:35, 10:30] = template // 2 + 64
+
+        matcher = TemplateMatcher(frame_height=40, frame_width=60, templates=[template])
+        scores, xs, ys, template_indices = matcher.match(frames)
+
+        assert scores[0] < 0.5
+        assert abs(scores[1] - 1.0) < 1e-6
+        assert (xs[1], ys[1]) == (30, 5)
+        assert scores[2] > 0.99
+        assert (xs[2], ys[2]) == (10, 20)
+        assert list(template_indices) == [0, 0, 0]
+
+    def test_find_template(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            icon_path = Path(tmpdir) / "icon.png"
+
+            create_overlay_test_video(video_path=video_path, icon_path=icon_path)
+
+            matches = [
+                output
+                for output in ffmpeg_find_template_generator(
+                    input_video_ss=None,
+                    input_video_to=None,
+                    input_video_path=video_path,
+                    input_video_crop=None,
+                    reference_image_path=icon_path,
+                    reference_image_crop=None,
+                    fps=None,
+                    analysis_height=180,
+                    template_scales=[1.0, 1.5],
+                    batch_size=4,
+                )
+                if isinstance(output, FindTemplateMatch)
+            ]
+
+        assert [match.internal_microseconds for match in matches] == [
+            1_000_000 + index * 100_000 for index in range(10)
+        ]
+        for match in matches:
+            assert match.scale == 1.5
+            assert abs(match.x - 200) <= 2
+            assert abs(match.y - 100) <= 2
+            assert (match.width, match.height) == (72, 72)
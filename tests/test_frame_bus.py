@@ -0,0 +1,100 @@
+import json
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+from unittest import TestCase
+
+import numpy as np
+
+from aoirint_matvtool.frame_bus import (
+    BlackFrameAnalyzer,
+    FingerprintIndexAnalyzer,
+    FrameBusResult,
+    ImageMatchAnalyzer,
+    SceneChangeAnalyzer,
+    ffmpeg_frame_bus_generator,
+    get_difference_hash,
+)
+
+
+def create_black_then_pattern_test_video(video_path: Path) -> None:
+    # 最初の1秒は黒、次の1秒はテストパターン
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "color=c=black:size=160x90:rate=10:duration=1",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=1",
+            "-filter_complex",
+            "[0:v][1:v]concat=n=2:v=1:a=0",
+            "-pix_fmt",
+            "yuv420p",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestFrameBus(TestCase):
+    def test_get_difference_hash(self) -> None:
+        # 左から右へ明るくなる画像は、すべてのビットが1
+        gradient = np.tile(np.arange(0, 180, 2, dtype=np.uint8), (16, 1))
+        assert get_difference_hash(gradient) == 2**64 - 1
+        assert get_difference_hash(gradient[:, ::-1]) == 0
+
+    def test_ffmpeg_frame_bus_generator(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            fingerprint_path = Path(tmpdir) / "fingerprint.jsonl"
+            create_black_then_pattern_test_video(video_path)
+
+            # 背圧を確かめるため、スロットは解析の数より少なくする
+            results: Dict[str, List[FrameBusResult]] = {}
+            for output in ffmpeg_frame_bus_generator(
+                input_video_ss=None,
+                input_video_to=None,
+                input_video_path=video_path,
+                input_video_crop=None,
+                fps=None,
+                frame_width=80,
+                frame_height=45,
+                analyzers=[
+                    ImageMatchAnalyzer(
+                        name="find_image",
+                        reference_frame=np.zeros((45, 80), dtype=np.uint8),
+                    ),
+                    BlackFrameAnalyzer(name="black"),
+                    SceneChangeAnalyzer(name="scene", threshold=0.3),
+                    FingerprintIndexAnalyzer(
+                        name="fingerprint", output_path=fingerprint_path
+                    ),
+                ],
+                slot_count=2,
+            ):
+                if isinstance(output, FrameBusResult):
+                    results.setdefault(output.analyzer, []).append(output)
+
+            fingerprints = [
+                json.loads(line)
+                for line in fingerprint_path.read_text(encoding="utf-8").splitlines()
+            ]
+
+        for name in ["find_image", "black"]:
+            assert [result.frame for result in results[name]] == list(range(10))
+            assert results[name][-1].internal_microseconds == 900_000
+
+        assert [result.frame for result in results["scene"]] == [10]
+        assert "fingerprint" not in results
+
+        assert [fingerprint["frame"] for fingerprint in fingerprints] == list(range(20))
+        assert fingerprints[0]["dhash"] == "0000000000000000"
+        assert fingerprints[10]["internal_microseconds"] == 1_000_000
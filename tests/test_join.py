@@ -0,0 +1,134 @@
+import json
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.inputs import FfmpegTrack
+from aoirint_matvtool.join import (
+    FfmpegJoinResult,
+    JoinTrackLayout,
+    check_join_inputs,
+    ffmpeg_join,
+    get_join_track_layout,
+)
+
+
+def create_recording_test_video(video_path: Path, size: str = "160x90") -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size={size}:rate=10:duration=2",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=2",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=880:duration=2",
+            "-map",
+            "0",
+            "-map",
+            "1",
+            "-map",
+            "2",
+            "-metadata:s:a:0",
+            "title=Game",
+            "-metadata:s:a:1",
+            "title=Mic",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestJoin(TestCase):
+    def test_get_join_track_layout(self) -> None:
+        video_track = FfmpegTrack(
+            index=0,
+            type="Video",
+            text="h264 (High), yuv420p(tv, bt709, progressive), 1920x1080 [SAR 1:1 DAR 16:9], 60 fps, 60 tbr, 1k tbn (default)",  # noqa: B950
+            metadatas=[],
+        )
+        audio_track = FfmpegTrack(
+            index=1,
+            type="Audio",
+            text="aac (LC), 48000 Hz, stereo, fltp (default)",
+            metadatas=[],
+        )
+
+        assert get_join_track_layout(video_track) == JoinTrackLayout(
+            type="Video",
+            codec="h264",
+            width=1920,
+            height=1080,
+            pixel_format="yuv420p",
+        )
+        assert get_join_track_layout(audio_track) == JoinTrackLayout(
+            type="Audio",
+            codec="aac",
+            sample_rate=48000,
+            channel_layout="stereo",
+        )
+
+    def test_join(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_paths = [Path(tmpdir) / f"part{index}.mkv" for index in range(2)]
+            for input_path in input_paths:
+                create_recording_test_video(input_path)
+
+            other_size_path = Path(tmpdir) / "other_size.mkv"
+            create_recording_test_video(other_size_path, size="320x180")
+
+            incompatible_inputs = check_join_inputs(
+                input_paths=[*input_paths, other_size_path], jobs=2
+            )
+            assert check_join_inputs(input_paths=input_paths, jobs=2) == []
+
+            output_path = Path(tmpdir) / "joined.mkv"
+            results = [
+                output
+                for output in ffmpeg_join(
+                    input_paths=input_paths, output_path=output_path
+                )
+                if isinstance(output, FfmpegJoinResult)
+            ]
+
+            proc = subprocess.run(
+                [
+                    "ffprobe",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-show_entries",
+                    "format=duration:stream=index:stream_tags=title",
+                    "-of",
+                    "json",
+                    str(output_path),
+                ],
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            probe = json.loads(proc.stdout)
+            remaining_paths = sorted(Path(tmpdir).iterdir())
+
+        assert [
+            incompatible_input.input_path for incompatible_input in incompatible_inputs
+        ] == [other_size_path]
+        assert "320x180" in incompatible_inputs[0].reason
+
+        assert results == [FfmpegJoinResult(success=True, message=None)]
+        assert 3.9 < float(probe["format"]["duration"]) < 4.2
+        assert [stream.get("tags", {}).get("title") for stream in probe["streams"]] == [
+            None,
+            "Game",
+            "Mic",
+        ]
+        assert remaining_paths == sorted([*input_paths, other_size_path, output_path])
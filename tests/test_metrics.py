@@ -0,0 +1,58 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool import metrics
+
+
+class TestMetrics(TestCase):
+    def tearDown(self) -> None:
+        metrics.exporter = None
+
+    def test_metrics_job(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            prom_path = Path(tmpdir) / "matvtool.prom"
+
+            # 2回の実行（別プロセス相当）で、カウンタが加算されること
+            for _ in range(2):
+                metrics.exporter = metrics.MetricsExporter(path=prom_path, interval=60)
+                with metrics.metrics_job("slice"):
+                    metrics.observe_progress("00:00:10.00")
+                    metrics.observe_progress("00:00:30.50")
+                    metrics.count_subprocess_spawn(["/usr/bin/ffmpeg", "-i", "a.mkv"])
+                metrics.exporter.stop()
+
+            # 並行して処理する複数の入力は、入力ごとの処理済みの時間を合計する
+            metrics.exporter = metrics.MetricsExporter(path=prom_path, interval=60)
+            with metrics.metrics_job("find_image"):
+                metrics.observe_progress("00:00:10.00", key="a.mkv")
+                metrics.observe_progress("00:00:05.00", key="b.mkv")
+                metrics.observe_progress("00:00:20.00", key="a.mkv")
+                metrics.observe_progress("00:00:08.00", key="b.mkv")
+            metrics.exporter.stop()
+
+            metrics.exporter = metrics.MetricsExporter(path=prom_path, interval=60)
+            with self.assertRaises(RuntimeError):
+                with metrics.metrics_job("find_image"):
+                    raise RuntimeError()
+            metrics.exporter.stop()
+
+            samples = metrics.parse_prom_file(prom_path.read_text(encoding="utf-8"))
+
+        assert samples['matvtool_jobs_started_total{subcommand="slice"}'] == 2
+        assert samples['matvtool_jobs_succeeded_total{subcommand="slice"}'] == 2
+        assert samples['matvtool_jobs_failed_total{subcommand="find_image"}'] == 1
+        assert (
+            samples['matvtool_media_seconds_processed_total{subcommand="slice"}']
+            == 61.0
+        )
+        assert (
+            samples['matvtool_media_seconds_processed_total{subcommand="find_image"}']
+            == 28.0
+        )
+        assert samples['matvtool_subprocess_spawns_total{program="ffmpeg"}'] == 2
+        assert samples['matvtool_realtime_factor_count{subcommand="slice"}'] == 2
+        assert (
+            samples['matvtool_realtime_factor_bucket{subcommand="slice",le="+Inf"}']
+            == 2
+        )
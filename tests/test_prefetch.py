@@ -0,0 +1,89 @@
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+
+from aoirint_matvtool.prefetch import InputPrefetcher
+
+
+def create_input_files(tmpdir: str, size: int) -> List[Path]:
+    input_paths = []
+    for index in range(3):
+        input_path = Path(tmpdir) / f"input_{index}.mkv"
+        input_path.write_bytes(bytes([index]) * size)
+        input_paths.append(input_path)
+
+    return input_paths
+
+
+def wait_prefetched(prefetcher: InputPrefetcher, input_path: Path) -> None:
+    deadline = time.monotonic() + 10
+    while input_path not in prefetcher.local_paths:
+        assert time.monotonic() < deadline, f"{input_path} is not prefetched"
+        time.sleep(0.01)
+
+
+class TestPrefetch(TestCase):
+    def test_copy(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_paths = create_input_files(tmpdir, size=1000)
+            scratch_dir = Path(tmpdir) / "scratch"
+
+            with InputPrefetcher(
+                input_paths=input_paths,
+                depth=2,
+                mode="copy",
+                scratch_dir=scratch_dir,
+            ) as prefetcher:
+                prefetcher.acquire(input_paths[0])
+                wait_prefetched(prefetcher, input_paths[1])
+
+                local_path = prefetcher.acquire(input_paths[1])
+                assert local_path.parent == scratch_dir
+                assert local_path.read_bytes() == input_paths[1].read_bytes()
+
+                prefetcher.release(input_paths[1])
+                assert not local_path.exists()
+
+                prefetcher.release(input_paths[0])
+
+            assert list(scratch_dir.iterdir()) == []
+
+    def test_copy_over_max_bytes(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_paths = create_input_files(tmpdir, size=1000)
+
+            with InputPrefetcher(
+                input_paths=input_paths,
+                depth=3,
+                mode="copy",
+                max_bytes=500,
+            ) as prefetcher:
+                assert prefetcher.scratch_dir is not None
+                scratch_dir = prefetcher.scratch_dir
+
+                # コピーしなかった入力は、元のパスを返す
+                assert prefetcher.acquire(input_paths[0]) == input_paths[0]
+                prefetcher.thread.join(timeout=10)
+                assert not prefetcher.thread.is_alive()
+
+                for input_path in input_paths[1:]:
+                    assert prefetcher.acquire(input_path) == input_path
+                    prefetcher.release(input_path)
+                prefetcher.release(input_paths[0])
+
+            assert not scratch_dir.exists()
+
+    def test_cache(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_paths = create_input_files(tmpdir, size=1000)
+
+            with InputPrefetcher(
+                input_paths=input_paths, depth=1, mode="cache"
+            ) as prefetcher:
+                for input_path in input_paths:
+                    assert prefetcher.acquire(input_path) == input_path
+                    prefetcher.release(input_path)
+
+            assert not prefetcher.thread.is_alive()
@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool import profiling
+
+
+class TestProfiling(TestCase):
+    def tearDown(self) -> None:
+        profiling.profiler = None
+
+    def test_profile_span_disabled(self) -> None:
+        with profiling.profile_span("stage", key="value") as span_args:
+            span_args["extra"] = 1
+
+        assert profiling.profiler is None
+
+    def test_profile_span_write(self) -> None:
+        profiling.profiler = profiling.Profiler()
+
+        with profiling.profile_subprocess(["ffmpeg", "-i", "input.mkv"]) as span_args:
+            span_args["pipe_bytes"] += 10
+        profiling.profile_ffmpeg_speed("4.5x")
+        profiling.profile_ffmpeg_speed("N/A")
+
+        with TemporaryDirectory() as tmpdir:
+            trace_path = Path(tmpdir) / "trace.json"
+            profiling.profiler.write(trace_path)
+            events = json.loads(trace_path.read_text(encoding="utf-8"))["traceEvents"]
+
+            jsonl_path = Path(tmpdir) / "trace.jsonl"
+            profiling.profiler.write(jsonl_path)
+            lines = jsonl_path.read_text(encoding="utf-8").splitlines()
+
+        assert len(events) == 2
+        assert len(lines) == 2
+
+        span = events[0]
+        assert span["ph"] == "X"
+        assert span["cat"] == "subprocess"
+        assert span["name"] == "ffmpeg"
+        assert span["args"]["command"] == "ffmpeg -i input.mkv"
+        assert span["args"]["pipe_bytes"] == 10
+        assert "cpu_seconds" in span["args"]
+        assert "children_read_bytes" in span["args"]
+
+        counter = events[1]
+        assert counter["ph"] == "C"
+        assert counter["args"] == {"speed": 4.5}
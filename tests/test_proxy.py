@@ -0,0 +1,88 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.proxy import (
+    FfmpegProxyResult,
+    ProxyInfo,
+    ffmpeg_proxy,
+    find_proxy,
+    get_proxy_crop_and_scale,
+)
+
+from .test_find_image import create_test_video
+
+
+def create_proxy_info() -> ProxyInfo:
+    return ProxyInfo(
+        source_path="/input.mkv",
+        source_identity="identity",
+        source_width=2560,
+        source_height=1440,
+        width=854,
+        height=480,
+        gop=15,
+        timestamp_offset_microseconds=0,
+    )
+
+
+class TestProxy(TestCase):
+    def test_get_proxy_crop_and_scale(self) -> None:
+        info = create_proxy_info()
+
+        # 切り抜きなしでは、参照画像をプロキシの解像度に合わせる
+        assert get_proxy_crop_and_scale(info=info, input_video_crop=None) == (
+            None,
+            "854:480",
+        )
+
+        assert get_proxy_crop_and_scale(
+            info=info, input_video_crop="w=1600:h=900:x=0:y=0"
+        ) == ("w=534:h=300:x=0:y=0", "534:300")
+
+        assert get_proxy_crop_and_scale(
+            info=info, input_video_crop="1600:900:960:540"
+        ) == ("w=534:h=300:x=320:y=180", "534:300")
+
+        # x・yの省略（中央）
+        assert get_proxy_crop_and_scale(info=info, input_video_crop="1280:720") == (
+            "w=428:h=240:x=214:y=120",
+            "428:240",
+        )
+
+    def test_get_proxy_crop_and_scale_expression(self) -> None:
+        info = create_proxy_info()
+
+        with self.assertRaises(ValueError):
+            get_proxy_crop_and_scale(
+                info=info, input_video_crop="w=1600:h=900:x=iw-ow:y=ih-oh"
+            )
+
+    def test_ffmpeg_proxy(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            proxy_dir = Path(tmpdir) / "proxy"
+
+            create_test_video(video_path, duration=2, fps=10)
+
+            results = [
+                output
+                for output in ffmpeg_proxy(
+                    input_path=video_path,
+                    proxy_dir=proxy_dir,
+                    height=90,
+                    gop=5,
+                    video_codec="libx264",
+                    crf=23,
+                )
+                if isinstance(output, FfmpegProxyResult)
+            ]
+            assert [result.success for result in results] == [True]
+
+            proxy = find_proxy(proxy_dir=proxy_dir, input_path=video_path)
+            assert proxy is not None
+            proxy_path, info = proxy
+            assert proxy_path.exists()
+            assert (info.source_width, info.source_height) == (320, 180)
+            assert (info.width, info.height) == (160, 90)
+            assert info.timestamp_offset_microseconds == 0
@@ -0,0 +1,109 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest import TestCase
+
+from aoirint_matvtool.seek_index import (
+    check_seek_index,
+    get_output_container,
+    get_output_profile_options,
+)
+from aoirint_matvtool.select_audio import FfmpegSelectAudioResult, ffmpeg_select_audio
+
+
+def create_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=4",
+            "-map",
+            "0",
+            "-map",
+            "1",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def select_audio(
+    input_path: Path,
+    output_path: Path,
+    output_profile: str,
+) -> Optional[FfmpegSelectAudioResult]:
+    result: Optional[FfmpegSelectAudioResult] = None
+    for output in ffmpeg_select_audio(
+        input_path=input_path,
+        audio_indexes=[0],
+        output_path=output_path,
+        output_profile=output_profile,
+    ):
+        if isinstance(output, FfmpegSelectAudioResult):
+            result = output
+
+    return result
+
+
+class TestSeekIndex(TestCase):
+    def test_get_output_profile_options(self) -> None:
+        assert get_output_container("video.MP4", None) == "mp4"
+        assert get_output_container("video.mkv", None) == "matroska"
+        assert get_output_container("-", "mp4") == "mp4"
+        assert get_output_container("video.avi", None) is None
+
+        assert get_output_profile_options("video.mp4", None, "default") == []
+        assert get_output_profile_options("video.mp4", None, "seek") == [
+            "-movflags",
+            "+faststart",
+        ]
+        with self.assertRaisesRegex(ValueError, "requires a file output"):
+            get_output_profile_options("-", "mp4", "seek")
+        with self.assertRaisesRegex(ValueError, "MP4 or Matroska"):
+            get_output_profile_options("video.avi", None, "seek")
+
+    def test_seek_profile(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_path = Path(tmpdir) / "input.mkv"
+            create_test_video(input_path)
+
+            for suffix in (".mp4", ".mkv"):
+                output_path = Path(tmpdir) / f"seek{suffix}"
+                result = select_audio(
+                    input_path=input_path,
+                    output_path=output_path,
+                    output_profile="seek",
+                )
+                assert result is not None and result.success
+
+                check = check_seek_index(output_path=output_path, output_format=None)
+                assert check.ok, check.describe()
+
+    def test_default_mp4_index_at_end(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_path = Path(tmpdir) / "input.mkv"
+            create_test_video(input_path)
+
+            output_path = Path(tmpdir) / "default.mp4"
+            result = select_audio(
+                input_path=input_path,
+                output_path=output_path,
+                output_profile="default",
+            )
+            assert result is not None and result.success
+
+            check = check_seek_index(output_path=output_path, output_format=None)
+            assert not check.ok
+            assert check.index_position is not None
+            assert check.media_position is not None
+            assert check.media_position < check.index_position
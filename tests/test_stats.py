@@ -0,0 +1,114 @@
+import io
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+
+from aoirint_matvtool.stats import (
+    compute_packet_stats,
+    ffprobe_packet_stats,
+    read_packet_chunks,
+)
+from aoirint_matvtool.verify import ProbeStream
+
+
+def create_gap_test_video(video_path: Path) -> None:
+    # 8秒から10秒までのフレーム・音声を、時刻を詰めずに取り除く
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=20",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=20",
+            "-vf",
+            "select='not(between(t,8,9.95))'",
+            "-af",
+            "aselect='not(between(t,8,9.95))'",
+            "-fps_mode",
+            "passthrough",
+            "-g",
+            "20",
+            "-bf",
+            "3",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def create_packet_csv(pts_list: List[float]) -> bytes:
+    return "".join(
+        f"0,{pts:.6f},N/A,1.000000,100,{'K__' if index % 8 == 0 else '___'}\n"
+        for index, pts in enumerate(pts_list)
+    ).encode("utf-8")
+
+
+class TestStats(TestCase):
+    def test_ffprobe_packet_stats(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "gap.mkv"
+            create_gap_test_video(video_path)
+
+            result = ffprobe_packet_stats(input_path=video_path)
+
+            video, audio = result.streams
+            assert video.codec_type == "video"
+            assert video.gop_histogram == {20: 8}
+            assert video.packet_duration is not None
+            assert abs(video.packet_duration - 0.1) < 0.001
+            assert len(video.interval_bitrates) == 20
+
+            assert audio.codec_type == "audio"
+            assert audio.start_offset is not None
+            assert abs(audio.start_offset) < 0.1
+
+            for stream in result.streams:
+                assert stream.discontinuity_count == 1
+                discontinuity = stream.discontinuities[0]
+                assert abs(discontinuity.time - 10) < 0.1
+                assert abs(discontinuity.delta - 2) < 0.1
+
+    def test_compute_packet_stats_reorder(self) -> None:
+        # Bフレームの順（I P B B ...）で、チャンクの境目をまたいで時刻が入れ替わる
+        pts_list: List[float] = [0]
+        for index in range(1, 40, 3):
+            pts_list += [index + 2, index, index + 1]
+        stream = ProbeStream(index=0, codec_type="video", title=None)
+
+        result = compute_packet_stats(
+            streams=[stream],
+            chunks=read_packet_chunks(
+                io.BytesIO(create_packet_csv(pts_list)), chunk_packets=5
+            ),
+        )
+        assert result.streams[0].discontinuity_count == 0
+        assert result.streams[0].gop_histogram == {8: 4}
+
+        # 時刻が戻る（録画の再開など）・飛ぶ
+        result = compute_packet_stats(
+            streams=[stream],
+            chunks=read_packet_chunks(
+                io.BytesIO(
+                    create_packet_csv(
+                        pts_list
+                        + [float(pts) for pts in range(20)]
+                        + [float(pts) for pts in range(124, 128)]
+                    )
+                ),
+                chunk_packets=5,
+            ),
+        )
+        discontinuities = result.streams[0].discontinuities
+        assert [(item.time, item.delta) for item in discontinuities] == [
+            (0, -40),
+            (124, 104),
+        ]
@@ -0,0 +1,219 @@
+import functools
+import subprocess
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict
+from unittest import TestCase
+
+from aoirint_matvtool.select_audio import FfmpegSelectAudioResult, ffmpeg_select_audio
+from aoirint_matvtool.stream_io import (
+    get_ffmpeg_input_url,
+    get_ffmpeg_output_format_options,
+    get_ffmpeg_output_url,
+    is_url,
+)
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def create_multi_audio_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=4",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=880:duration=4",
+            "-map",
+            "0",
+            "-map",
+            "1",
+            "-map",
+            "2",
+            "-g",
+            "10",
+            "-c:a",
+            "aac",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+def ffprobe_packet_counts(video_path: Path) -> Dict[str, int]:
+    """
+    ストリームの種類 -> パケット数
+    """
+    proc = subprocess.run(
+        [
+            "ffprobe",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-count_packets",
+            "-show_entries",
+            "stream=codec_type,nb_read_packets",
+            "-of",
+            "csv=p=0",
+            str(video_path),
+        ],
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+
+    packet_counts: Dict[str, int] = {}
+    for line in proc.stdout.splitlines():
+        codec_type, count_string = line.strip().split(",")[:2]
+        packet_counts[codec_type] = packet_counts.get(codec_type, 0) + int(count_string)
+    return packet_counts
+
+
+def ffprobe_stream_types(video_path: Path) -> str:
+    proc = subprocess.run(
+        [
+            "ffprobe",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-show_entries",
+            "stream=codec_type",
+            "-of",
+            "csv=p=0",
+            str(video_path),
+        ],
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+    return ",".join(proc.stdout.split())
+
+
+class TestStreamIo(TestCase):
+    def test_get_ffmpeg_urls(self) -> None:
+        assert is_url("http://127.0.0.1:8000/video.mkv")
+        assert not is_url(Path("http://127.0.0.1:8000/video.mkv"))
+        assert not is_url("video.mkv")
+
+        assert get_ffmpeg_input_url("-") == "pipe:0"
+        assert get_ffmpeg_input_url(Path("-")) == "-"
+        assert get_ffmpeg_output_url("-") == "pipe:1"
+        assert get_ffmpeg_input_url("s3://bucket/video.mkv") == "s3://bucket/video.mkv"
+
+    def test_get_ffmpeg_output_format_options(self) -> None:
+        assert get_ffmpeg_output_format_options("out.mkv", None) == []
+        assert get_ffmpeg_output_format_options("-", None) == ["-f", "matroska"]
+        assert get_ffmpeg_output_format_options("-", "mp4") == [
+            "-f",
+            "mp4",
+            "-movflags",
+            "frag_keyframe+empty_moov+default_base_moof",
+        ]
+        with self.assertRaises(ValueError):
+            get_ffmpeg_output_format_options("-", "avi")
+
+    def test_url_input_and_pipe(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            create_multi_audio_test_video(video_path)
+
+            # オブジェクトストレージの代わりのHTTPサーバー
+            server = ThreadingHTTPServer(
+                ("127.0.0.1", 0),
+                functools.partial(QuietHTTPRequestHandler, directory=tmpdir),
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                url = f"http://127.0.0.1:{server.server_address[1]}/video.mkv"
+
+                selected_path = Path(tmpdir) / "selected.mkv"
+                results = [
+                    output
+                    for output in ffmpeg_select_audio(
+                        input_path=url,
+                        audio_indexes=[1],
+                        output_path=str(selected_path),
+                    )
+                    if isinstance(output, FfmpegSelectAudioResult)
+                ]
+            finally:
+                server.shutdown()
+                server.server_close()
+
+            # slice（標準入力から標準出力）| select_audio（標準入力からファイル）
+            piped_path = Path(tmpdir) / "piped.mp4"
+            with open(video_path, "rb") as fp:
+                slice_proc = subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-m",
+                        "aoirint_matvtool",
+                        "slice",
+                        "-ss",
+                        "1",
+                        "-to",
+                        "3",
+                        "-i",
+                        "-",
+                        "-p",
+                        "none",
+                        "-",
+                    ],
+                    stdin=fp,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                select_audio_proc = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "aoirint_matvtool",
+                        "select_audio",
+                        "-i",
+                        "-",
+                        "--audio_index",
+                        "0",
+                        "-p",
+                        "none",
+                        str(piped_path),
+                    ],
+                    stdin=slice_proc.stdout,
+                    stdout=subprocess.PIPE,
+                    encoding="utf-8",
+                    check=True,
+                )
+                assert slice_proc.stdout is not None
+                slice_proc.stdout.close()
+                _, slice_stderr = slice_proc.communicate()
+
+            selected_stream_types = ffprobe_stream_types(selected_path)
+            piped_stream_types = ffprobe_stream_types(piped_path)
+            piped_packet_counts = ffprobe_packet_counts(piped_path)
+
+        assert results == [FfmpegSelectAudioResult(success=True, message=None)]
+        assert selected_stream_types == "video,audio"
+        assert slice_proc.returncode == 0
+        assert b"Output | success=True" in slice_stderr
+        assert select_audio_proc.stdout.startswith("Output | success=True")
+        assert piped_stream_types == "video,audio"
+        # 標準入力から切り出したパケットがある（AACの音声は1秒あたり約43パケット）
+        assert piped_packet_counts["video"] >= 10
+        assert 80 <= piped_packet_counts["audio"] <= 90
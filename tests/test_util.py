@@ -0,0 +1,86 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.find_image import (
+    FfmpegBlackframeEvent,
+    FfmpegProgressEvent,
+    parse_ffmpeg_blackframe_line,
+    parse_ffmpeg_progress_line,
+)
+from aoirint_matvtool.util import (
+    format_microseconds_as_time_unit_syntax_string,
+    get_video_identity,
+    parse_ffmpeg_time_unit_syntax,
+    parse_ffmpeg_time_unit_syntax_to_microseconds,
+)
+
+
+class TestUtil(TestCase):
+    def test_parse_ffmpeg_time_unit_syntax_to_microseconds(self) -> None:
+        assert (
+            parse_ffmpeg_time_unit_syntax_to_microseconds("00:00:13.51") == 13_510_000
+        )
+        assert (
+            parse_ffmpeg_time_unit_syntax_to_microseconds("01:02:03") == 3_723_000_000
+        )
+        assert parse_ffmpeg_time_unit_syntax_to_microseconds("4") == 4_000_000
+        assert parse_ffmpeg_time_unit_syntax_to_microseconds("4.5") == 4_500_000
+        assert parse_ffmpeg_time_unit_syntax_to_microseconds("-00:00:00.02") == -20_000
+
+        with self.assertRaises(ValueError):
+            parse_ffmpeg_time_unit_syntax_to_microseconds("N/A")
+
+    def test_parse_ffmpeg_time_unit_syntax(self) -> None:
+        time = parse_ffmpeg_time_unit_syntax("01:02:03.5")
+        assert (time.hours, time.minutes, time.seconds, time.microseconds) == (
+            1,
+            2,
+            3,
+            500_000,
+        )
+
+    def test_format_microseconds_as_time_unit_syntax_string(self) -> None:
+        assert (
+            format_microseconds_as_time_unit_syntax_string(3_723_000_001)
+            == "01:02:03.000001"
+        )
+
+    def test_parse_ffmpeg_blackframe_line(self) -> None:
+        line = "[Parsed_blackframe_3 @ 0x5581] frame:810 pblack:99 pts:13516 t:13.516000 type:P last_keyframe:720\n"  # noqa: B950
+        assert parse_ffmpeg_blackframe_line(line) == FfmpegBlackframeEvent(
+            frame=810,
+            pblack=99,
+            pts=13516,
+            t=13.516,
+            type="P",
+            last_keyframe=720,
+        )
+        assert parse_ffmpeg_blackframe_line("frame=  810 fps=0.0") is None
+
+    def test_parse_ffmpeg_progress_line(self) -> None:
+        line = "frame=  810 fps=270 q=-0.0 size=N/A time=00:00:13.51 bitrate=N/A speed=4.5x"  # noqa: B950
+        assert parse_ffmpeg_progress_line(line) == FfmpegProgressEvent(
+            frame=810,
+            time="00:00:13.51",
+            speed="4.5x",
+        )
+
+    def test_get_video_identity(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            video_path = Path(tmpdir) / "video.mkv"
+            copied_video_path = Path(tmpdir) / "copied.mkv"
+
+            video_path.write_bytes(bytes(range(256)) * 16 * 1024)
+            copied_video_path.write_bytes(video_path.read_bytes())
+            identity = get_video_identity(video_path)
+
+            # 同じ内容なら、パスが異なっても同じ
+            assert get_video_identity(copied_video_path) == identity
+
+            with video_path.open("r+b") as fp:
+                fp.seek(-1, os.SEEK_END)
+                fp.write(b"\x00")
+
+            assert get_video_identity(video_path) != identity
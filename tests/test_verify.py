@@ -0,0 +1,138 @@
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from aoirint_matvtool.select_audio import FfmpegSelectAudioResult, ffmpeg_select_audio
+from aoirint_matvtool.slice import FfmpegSliceResult, ffmpeg_slice
+from aoirint_matvtool.verify import ffprobe_verify_output
+
+
+def create_titled_audio_test_video(video_path: Path) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=160x90:rate=10:duration=20",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=20",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=880:duration=20",
+            "-map",
+            "0",
+            "-map",
+            "1",
+            "-map",
+            "2",
+            "-g",
+            "20",
+            "-metadata:s:a:0",
+            "title=Game",
+            "-metadata:s:a:1",
+            "title=Mic",
+            str(video_path),
+        ],
+        check=True,
+    )
+
+
+class TestVerify(TestCase):
+    def test_verify_slice(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_path = Path(tmpdir) / "input.mkv"
+            create_titled_audio_test_video(input_path)
+
+            output_path = Path(tmpdir) / "slice.mkv"
+            results = [
+                output
+                for output in ffmpeg_slice(
+                    ss="5", to="15", input_path=input_path, output_path=output_path
+                )
+                if isinstance(output, FfmpegSliceResult)
+            ]
+            assert results[-1].success
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=output_path, ss="5", to="15"
+            )
+            assert result.success, result.mismatches
+            assert [stream.codec_type for stream in result.streams] == [
+                "video",
+                "audio",
+                "audio",
+            ]
+
+            # 末尾が欠けた出力
+            truncated_path = Path(tmpdir) / "truncated.mkv"
+            output_bytes = output_path.read_bytes()
+            truncated_path.write_bytes(output_bytes[: len(output_bytes) // 2])
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=truncated_path, ss="5", to="15"
+            )
+            assert not result.success
+            assert any("packets (expected" in line for line in result.mismatches)
+
+    def test_verify_slice_mp4(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_path = Path(tmpdir) / "input.mkv"
+            create_titled_audio_test_video(input_path)
+
+            # MP4には、オーディオトラックのタイトルが書き出されない
+            output_path = Path(tmpdir) / "slice.mp4"
+            results = [
+                output
+                for output in ffmpeg_slice(
+                    ss="5", to="15", input_path=input_path, output_path=output_path
+                )
+                if isinstance(output, FfmpegSliceResult)
+            ]
+            assert results[-1].success
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=output_path, ss="5", to="15"
+            )
+            assert result.success, result.mismatches
+            assert [stream.title for stream in result.streams] == [None, None, None]
+
+    def test_verify_select_audio(self) -> None:
+        with TemporaryDirectory() as tmpdir:
+            input_path = Path(tmpdir) / "input.mkv"
+            create_titled_audio_test_video(input_path)
+
+            output_path = Path(tmpdir) / "select_audio.mkv"
+            results = [
+                output
+                for output in ffmpeg_select_audio(
+                    input_path=input_path,
+                    audio_indexes=[1],
+                    output_path=output_path,
+                )
+                if isinstance(output, FfmpegSelectAudioResult)
+            ]
+            assert results[-1].success
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=output_path, audio_indexes=[1]
+            )
+            assert result.success, result.mismatches
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=output_path, audio_indexes=[0]
+            )
+            assert not result.success
+            assert "Stream 1 audio: title 'Mic' (expected 'Game')" in result.mismatches
+
+            result = ffprobe_verify_output(
+                input_path=input_path, output_path=output_path, audio_indexes=[0, 1]
+            )
+            assert "Audio track count 1 (expected 2)" in result.mismatches